@@ -0,0 +1,631 @@
+"""模拟ADB服务器
+
+实现 adb host 协议中本项目用到的部分（host:devices、host:track-devices、host:connect、host:transport、
+shell:/exec:（含管道、tar/gzip 和 exec 的标准输入）、sync: 的 RECV/SEND/STAT/LIST、screencap、reboot），设备响应可脚本化，并可配置每次往返的延迟和传输带宽，
+用于在没有真机的普通Linux机器上测量服务器本身的开销。
+
+单独运行时监听 5037 端口，可以直接让 MCP 服务器连接:
+
+    python benchmarks/fake_adb.py --devices 4 --latency-ms 5
+"""
+from typing import Callable, Dict, List, Optional, Tuple, Union
+import argparse
+import gzip
+import io
+import os
+import random
+import re
+import shlex
+import socket
+import socketserver
+import struct
+import tarfile
+import threading
+import time
+import uuid
+import zlib
+
+Response = Union[str, bytes, Callable[[str], Union[str, bytes]]]
+
+SYNC_CHUNK = 64 * 1024
+BOOT_ID_PATH = "/proc/sys/kernel/random/boot_id"
+
+
+def make_pixels(width: int, height: int, noise: float = 0.15, seed: int = 0) -> bytes:
+    """生成RGB像素数据，noise 控制每行随机像素的比例（决定PNG压缩后的大小，接近真实截图）"""
+    rng = random.Random(seed)
+    row_bytes = width * 3
+    noisy = int(row_bytes * noise)
+    base = bytes(row_bytes - noisy)
+    return b"".join(rng.randbytes(noisy) + base for _ in range(height))
+
+
+def make_png(width: int, height: int, noise: float = 0.15, seed: int = 0, pixels: Optional[bytes] = None,
+             channels: int = 3) -> bytes:
+    """生成一张有效的PNG（不使用行过滤）；pixels 为 RGB/RGBA 像素数据，未提供时随机生成"""
+    if pixels is None:
+        pixels, channels = make_pixels(width, height, noise, seed), 3
+    row_bytes = width * channels
+    raw = b"".join(b"\x00" + pixels[y * row_bytes:(y + 1) * row_bytes] for y in range(height))
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 6 if channels == 4 else 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw, 1)) + chunk(b"IEND", b"")
+
+
+def make_ui_xml(nodes: int = 150, width: int = 1080, height: int = 2400) -> str:
+    """生成与 uiautomator dump 格式一致的界面层次结构"""
+    lines = ["<?xml version='1.0' encoding='UTF-8' standalone='yes' ?><hierarchy rotation=\"0\">",
+             f'<node index="0" text="" resource-id="" class="android.widget.FrameLayout" package="com.example.app" '
+             f'content-desc="" clickable="false" enabled="true" focused="false" bounds="[0,0][{width},{height}]">']
+    row = max(1, height // max(nodes, 1))
+    for i in range(nodes):
+        top = i * row
+        lines.append(f'<node index="{i}" text="Item {i}" resource-id="com.example.app:id/item_{i}" '
+                     f'class="android.widget.TextView" package="com.example.app" content-desc="" '
+                     f'clickable="true" enabled="true" focused="false" bounds="[0,{top}][{width},{top + row}]" />')
+    lines.append("</node></hierarchy>")
+    return "".join(lines)
+
+
+class FakeDevice:
+    """模拟设备: 一个内存文件系统、一组系统属性和按正则匹配的脚本化响应"""
+
+    def __init__(self, serial: str, state: str = "device", screen_size: Tuple[int, int] = (1080, 2400),
+                 screenshot_noise: float = 0.15, ui_nodes: int = 150):
+        self.serial = serial
+        self.state = state
+        self.screen_size = screen_size
+        self.files: Dict[str, bytes] = {BOOT_ID_PATH: f"{uuid.uuid4()}\n".encode()}
+        self.properties = {
+            "ro.product.model": "FakePhone",
+            "ro.product.manufacturer": "Fake",
+            "ro.build.version.release": "13",
+            "ro.build.version.sdk": "33",
+            "ro.product.cpu.abi": "arm64-v8a",
+            "sys.boot_completed": "1",
+        }
+        self.directories = {"/", "/sdcard", "/data/local/tmp"}
+        # 设备上可用的压缩程序（command -v 可以找到的）
+        self.programs = {"gzip"}
+        self.rules: List[Tuple[re.Pattern, Response]] = []
+        self.commands: List[str] = []
+        # 模拟重启: 断开后多久重新出现在设备列表中、多久后 sys.boot_completed 变为1（秒）
+        self.reboot_offline_seconds = 0.5
+        self.reboot_boot_seconds = 1.0
+        self._screenshot = None
+        self._screenshot_noise = screenshot_noise
+        self._rgba: Optional[bytes] = None
+        self._ui_xml = make_ui_xml(ui_nodes, *screen_size)
+        self._lock = threading.Lock()
+
+    def set_screen(self, rgba: bytes):
+        """设置屏幕内容（screen_size 大小的RGBA像素），screencap 的PNG和原始帧都由它生成"""
+        width, height = self.screen_size
+        if len(rgba) != width * height * 4:
+            raise ValueError("像素数据与屏幕尺寸不一致")
+        self._rgba = bytes(rgba)
+        self._screenshot = make_png(width, height, pixels=self._rgba, channels=4)
+
+    @property
+    def raw_frame(self) -> bytes:
+        """screencap 不带 -p 时输出的原始帧: 宽、高、格式(RGBA_8888)、颜色空间，之后是RGBA像素"""
+        width, height = self.screen_size
+        if self._rgba is None:
+            rgb = make_pixels(width, height, self._screenshot_noise, hash(self.serial) & 0xFFFF)
+            rgba = bytearray(width * height * 4)
+            for channel in range(3):
+                rgba[channel::4] = rgb[channel::3]
+            rgba[3::4] = b"\xff" * (width * height)
+            self._rgba = bytes(rgba)
+        return struct.pack("<IIII", width, height, 1, 0) + self._rgba
+
+    @property
+    def screenshot(self) -> bytes:
+        if self._screenshot is None:
+            self._screenshot = make_png(*self.screen_size, noise=self._screenshot_noise,
+                                        seed=hash(self.serial) & 0xFFFF)
+        return self._screenshot
+
+    def script(self, pattern: str, response: Response):
+        """为匹配 pattern 的命令（按段匹配）指定响应，后添加的规则优先"""
+        self.rules.insert(0, (re.compile(pattern), response))
+
+    # 设备端shell
+    def run_shell(self, command: str, stdin: Optional[Callable[[], bytes]] = None) -> bytes:
+        """执行命令；stdin 为可选的回调，第一个读取标准输入的命令调用它取得全部输入"""
+        with self._lock:
+            self.commands.append(command)
+        output = bytearray()
+        status = 0
+        for operator, segment in _split_commands(command):
+            if (operator == "&&" and status != 0) or (operator == "||" and status == 0):
+                continue
+            data = None
+            for index, stage in enumerate(_split_pipeline(segment.replace("$?", str(status)))):
+                stage, redirect, stderr_redirected = _strip_redirects(stage)
+                stage_input = stdin if index == 0 else (lambda data=data: data)
+                result, status = self._run_segment(stage, stage_input)
+                if status != 0 and stderr_redirected:
+                    result = b""  # 失败命令的输出视为错误输出
+                if redirect is not None:
+                    if redirect != "/dev/null":
+                        self.files[redirect] = bytes(result)
+                    result = b""
+                data = result
+            output += data or b""
+        return bytes(output)
+
+    def _run_segment(self, segment: str, stdin: Optional[Callable[[], bytes]] = None) -> Tuple[bytes, int]:
+        for pattern, response in self.rules:
+            if pattern.search(segment):
+                value = response(segment) if callable(response) else response
+                return (value.encode("utf-8") if isinstance(value, str) else value), 0
+        try:
+            args = shlex.split(segment)
+        except ValueError:
+            args = segment.split()
+        if not args:
+            return b"", 0
+        return self._builtin(args, stdin or (lambda: b""))
+
+    def is_dir(self, path: str) -> bool:
+        path = path.rstrip("/") or "/"
+        prefix = path if path == "/" else path + "/"
+        return path in self.directories or any(name.startswith(prefix) for name in self.files)
+
+    def _tar(self, args: List[str], stdin: Callable[[], bytes]) -> Tuple[bytes, int]:
+        """tar -cf - -C DIR . 和 tar -xf - -C DIR（只支持普通文件和目录）"""
+        root = args[args.index("-C") + 1].rstrip("/") if "-C" in args else "/"
+        prefix = root + "/"
+        if "-cf" in args:
+            if not self.is_dir(root):
+                return b"", 1
+            buffer = io.BytesIO()
+            with tarfile.open(fileobj=buffer, mode="w") as tar:
+                for path in sorted(self.files):
+                    if path.startswith(prefix):
+                        info = tarfile.TarInfo("./" + path[len(prefix):])
+                        info.size = len(self.files[path])
+                        info.mtime = int(time.time())
+                        tar.addfile(info, io.BytesIO(self.files[path]))
+            return buffer.getvalue(), 0
+        try:
+            with tarfile.open(fileobj=io.BytesIO(stdin()), mode="r") as tar:
+                for member in tar:
+                    name = os.path.normpath(member.name)
+                    if member.isfile():
+                        self.files[prefix + name] = tar.extractfile(member).read()
+                    elif member.isdir() and name != ".":
+                        self.directories.add(prefix + name)
+        except tarfile.TarError as e:
+            return f"tar: {e}\n".encode(), 1
+        return b"", 0
+
+    def _builtin(self, args: List[str], stdin: Callable[[], bytes]) -> Tuple[bytes, int]:
+        cmd = os.path.basename(args[0])
+        if cmd == "test" and args[1:2] == ["-d"]:
+            return b"", 0 if len(args) > 2 and self.is_dir(args[2]) else 1
+        if cmd == "command" and args[1:2] == ["-v"]:
+            found = [name for name in args[2:] if name in self.programs or name in ("tar", "cat", "sh")]
+            return "".join(f"/system/bin/{name}\n" for name in found).encode(), 0 if found else 1
+        if cmd == "tar":
+            return self._tar(args, stdin)
+        if cmd == "gzip" and "gzip" in self.programs:
+            if "-d" in args or "-dc" in args:
+                try:
+                    return gzip.decompress(stdin()), 0
+                except (OSError, EOFError) as e:
+                    return f"gzip: {e}\n".encode(), 1
+            return gzip.compress(stdin(), compresslevel=1), 0
+        if cmd == "mkdir":
+            for path in args[1:]:
+                if not path.startswith("-"):
+                    self.directories.add(path.rstrip("/"))
+            return b"", 0
+        if cmd == "getprop":
+            if len(args) > 1:
+                return (self.properties.get(args[1], "") + "\n").encode(), 0
+            return "".join(f"[{k}]: [{v}]\n" for k, v in self.properties.items()).encode(), 0
+        if cmd == "wm" and args[1:2] == ["size"]:
+            return f"Physical size: {self.screen_size[0]}x{self.screen_size[1]}\n".encode(), 0
+        if cmd == "screencap":
+            paths = [a for a in args[1:] if not a.startswith("-")]
+            if paths:
+                self.files[paths[0]] = self.screenshot if "-p" in args or paths[0].endswith(".png") \
+                    else self.raw_frame
+                return b"", 0
+            return (self.screenshot if "-p" in args else self.raw_frame), 0
+        if cmd == "uiautomator" and args[1:2] == ["dump"]:
+            path = args[2] if len(args) > 2 else "/sdcard/window_dump.xml"
+            self.files[path] = self._ui_xml.encode("utf-8")
+            return f"UI hierchary dumped to: {path}\n".encode(), 0
+        if cmd == "cat":
+            out = bytearray()
+            for path in args[1:]:
+                if path not in self.files:
+                    return bytes(out) + f"cat: {path}: No such file or directory\n".encode(), 1
+                out += self.files[path]
+            return bytes(out), 0
+        if cmd == "rm":
+            for path in args[1:]:
+                if not path.startswith("-"):
+                    self.files.pop(path, None)
+            return b"", 0
+        if cmd == "ls":
+            prefix = next((a for a in args[1:] if not a.startswith("-")), "/").rstrip("/") + "/"
+            names = sorted({path[len(prefix):].split("/")[0] for path in self.files if path.startswith(prefix)})
+            return "".join(name + "\n" for name in names).encode(), 0
+        if cmd == "echo":
+            return (" ".join(args[1:]) + "\n").encode(), 0
+        if cmd == "sleep":
+            time.sleep(float(args[1]) if len(args) > 1 else 0)
+            return b"", 0
+        if cmd == "dumpsys" and args[1:2] == ["battery"]:
+            return (b"Current Battery Service state:\n  AC powered: false\n  USB powered: true\n"
+                    b"  status: 2\n  health: 2\n  present: true\n  level: 87\n  scale: 100\n"
+                    b"  voltage: 4123\n  temperature: 291\n  technology: Li-ion\n"), 0
+        if cmd == "dumpsys" and args[1:2] == ["window"]:
+            return b"  mCurrentFocus=Window{1a2b3c u0 com.example.app/com.example.app.MainActivity}\n", 0
+        if cmd == "pm" and args[1:3] == ["list", "packages"]:
+            return b"package:com.example.app\npackage:com.android.settings\n", 0
+        if cmd in ("input", "am", "true", "chmod", "sync"):
+            return b"", 0
+        return b"", 0
+
+
+def _split_commands(command: str) -> List[Tuple[str, str]]:
+    """按 ; && || 和换行切分命令（忽略引号内的分隔符），返回 (前置运算符, 命令段)"""
+    parts, current, operator = [], [], ";"
+    quote = None
+    i = 0
+    while i < len(command):
+        c = command[i]
+        if quote:
+            if c == quote:
+                quote = None
+            current.append(c)
+        elif c in "'\"":
+            quote = c
+            current.append(c)
+        elif command.startswith("&&", i) or command.startswith("||", i):
+            parts.append((operator, "".join(current).strip()))
+            operator, current = command[i:i + 2], []
+            i += 1
+        elif c in ";\n":
+            parts.append((operator, "".join(current).strip()))
+            operator, current = ";", []
+        else:
+            current.append(c)
+        i += 1
+    parts.append((operator, "".join(current).strip()))
+    return [(op, seg) for op, seg in parts if seg]
+
+
+def _split_pipeline(segment: str) -> List[str]:
+    """按管道符 | 切分命令段（忽略引号内的 |）"""
+    stages, current, quote = [], [], None
+    for c in segment:
+        if quote:
+            if c == quote:
+                quote = None
+        elif c in "'\"":
+            quote = c
+        elif c == "|":
+            stages.append("".join(current).strip())
+            current = []
+            continue
+        current.append(c)
+    stages.append("".join(current).strip())
+    return stages
+
+
+_REDIRECT = re.compile(r"\s*(\d?)>\s*(\S+)")
+
+
+def _strip_redirects(segment: str) -> Tuple[str, Optional[str], bool]:
+    """去掉重定向，返回 (命令, 标准输出重定向目标, 是否重定向了错误输出)"""
+    target, stderr_redirected = None, False
+    for fd, path in _REDIRECT.findall(segment):
+        if fd in ("", "1"):
+            target = path
+        elif fd == "2" and not path.startswith("&"):
+            stderr_redirected = True
+    return _REDIRECT.sub("", segment).strip(), target, stderr_redirected
+
+
+class FakeAdbServer:
+    """多线程的模拟ADB服务器
+
+    latency: 每次服务请求（shell/sync命令等）在响应前等待的秒数，模拟USB/网络往返
+    bandwidth: 可选，数据传输速率上限（字节/秒）
+    """
+
+    def __init__(self, devices: List[FakeDevice], host: str = "127.0.0.1", port: int = 0,
+                 latency: float = 0.0, bandwidth: Optional[float] = None):
+        self.devices = {device.serial: device for device in devices}
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.requests = 0
+        # 断开（set_state(serial, None)）的设备，可通过 host:connect 重新连接
+        self.detached: Dict[str, FakeDevice] = {}
+        self._changed = threading.Condition()
+        self._generation = 0
+        server = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                # 小块响应（sync的DATA/DONE头）不等待Nagle合并，避免与客户端的延迟确认叠加成40ms停顿
+                self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                try:
+                    _Session(server, self.request).run()
+                except (ConnectionError, OSError):
+                    pass
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self._server = socketserver.ThreadingTCPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self.host, self.port = self._server.server_address[:2]
+        self._thread = None
+
+    def start(self) -> "FakeAdbServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def set_state(self, serial: str, state: Optional[str]):
+        """修改设备状态（None表示断开），会通知 host:track-devices 的订阅者"""
+        with self._changed:
+            if state is None:
+                device = self.devices.pop(serial, None)
+                if device is not None:
+                    self.detached[serial] = device
+            else:
+                device = self.devices.get(serial) or self.detached.pop(serial, None) or FakeDevice(serial)
+                device.state = state
+                self.devices[serial] = device
+            self._generation += 1
+            self._changed.notify_all()
+
+    def reboot(self, serial: str):
+        """模拟重启: 设备先从列表中消失，之后以未完成启动的状态重新出现，最后 sys.boot_completed 变为1"""
+        device = self.devices[serial]
+
+        def run():
+            device.properties["sys.boot_completed"] = "0"
+            device.files[BOOT_ID_PATH] = f"{uuid.uuid4()}\n".encode()
+            self.set_state(serial, None)
+            time.sleep(device.reboot_offline_seconds)
+            self.set_state(serial, "device")
+            time.sleep(max(device.reboot_boot_seconds - device.reboot_offline_seconds, 0))
+            device.properties["sys.boot_completed"] = "1"
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def device_list(self) -> str:
+        return "".join(f"{serial}\t{device.state}\n" for serial, device in self.devices.items())
+
+
+class _Session:
+    def __init__(self, server: FakeAdbServer, sock: socket.socket):
+        self.server = server
+        self.sock = sock
+        self.device: Optional[FakeDevice] = None
+
+    def recv_exact(self, length: int) -> bytes:
+        data = bytearray()
+        while len(data) < length:
+            chunk = self.sock.recv(length - len(data))
+            if not chunk:
+                raise ConnectionError("client closed")
+            data += chunk
+        return bytes(data)
+
+    def read_until_eof(self) -> bytes:
+        """读取客户端写入的全部数据（exec 的标准输入），直到客户端关闭写方向"""
+        data = bytearray()
+        while True:
+            chunk = self.sock.recv(SYNC_CHUNK)
+            if not chunk:
+                return bytes(data)
+            data += chunk
+            if self.server.bandwidth:
+                time.sleep(len(chunk) / self.server.bandwidth)
+
+    def send(self, data: bytes):
+        if self.server.bandwidth:
+            for i in range(0, len(data), SYNC_CHUNK):
+                piece = data[i:i + SYNC_CHUNK]
+                self.sock.sendall(piece)
+                time.sleep(len(piece) / self.server.bandwidth)
+        else:
+            self.sock.sendall(data)
+
+    def okay(self, payload: Optional[str] = None):
+        data = b"OKAY"
+        if payload is not None:
+            encoded = payload.encode("utf-8")
+            data += f"{len(encoded):04x}".encode() + encoded
+        self.sock.sendall(data)
+
+    def fail(self, message: str):
+        encoded = message.encode("utf-8")
+        self.sock.sendall(b"FAIL" + f"{len(encoded):04x}".encode() + encoded)
+
+    def delay(self):
+        self.server.requests += 1
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+    def run(self):
+        while True:
+            length = int(self.recv_exact(4).decode(), 16)
+            request = self.recv_exact(length).decode("utf-8")
+            if not self.dispatch(request):
+                return
+
+    def dispatch(self, request: str) -> bool:
+        """处理一个请求，返回 False 表示连接应关闭"""
+        server = self.server
+        if request == "host:version":
+            self.okay("0029")
+            return False
+        if request in ("host:devices", "host:devices-l"):
+            self.okay(server.device_list())
+            return False
+        if request == "host:track-devices":
+            self.track_devices()
+            return False
+        if request.startswith("host:connect:"):
+            address = request[len("host:connect:"):]
+            if address in server.devices:
+                self.okay(f"already connected to {address}")
+            elif address in server.detached:
+                server.set_state(address, "device")
+                self.okay(f"connected to {address}")
+            else:
+                self.okay(f"failed to connect to {address}")
+            return False
+        if request.startswith("host:transport:") or request == "host:transport-any":
+            serial = request[len("host:transport:"):] if request.startswith("host:transport:") else None
+            device = server.devices.get(serial) if serial else next(iter(server.devices.values()), None)
+            if device is None or device.state != "device":
+                self.fail(f"device '{serial}' not found")
+                return False
+            self.device = device
+            self.okay()
+            return True
+        if request.startswith("host-serial:") and request.endswith(":get-state"):
+            serial = request[len("host-serial:"):-len(":get-state")]
+            device = server.devices.get(serial)
+            if device is None:
+                self.fail(f"device '{serial}' not found")
+            else:
+                self.okay(device.state)
+            return False
+        if self.device is None:
+            self.fail(f"unknown host service: {request}")
+            return False
+
+        if request.startswith(("shell:", "exec:")):
+            command = request.split(":", 1)[1]
+            self.delay()
+            self.okay()
+            if command.strip() == "reboot":
+                server.reboot(self.device.serial)
+                return False
+            stdin = self.read_until_eof if request.startswith("exec:") else None
+            self.send(self.device.run_shell(command, stdin))
+            return False
+        if request == "sync:":
+            self.okay()
+            self.sync()
+            return False
+        self.fail(f"unsupported service: {request}")
+        return False
+
+    def track_devices(self):
+        server = self.server
+        self.okay(server.device_list())
+        self.sock.settimeout(0.2)
+        generation = server._generation
+        while True:
+            with server._changed:
+                server._changed.wait_for(lambda: server._generation != generation, timeout=0.2)
+                changed = server._generation != generation
+                generation = server._generation
+                listing = server.device_list()
+            if changed:
+                encoded = listing.encode("utf-8")
+                self.sock.sendall(f"{len(encoded):04x}".encode() + encoded)
+            try:
+                if self.sock.recv(1) == b"":
+                    return
+            except socket.timeout:
+                continue
+
+    def sync(self):
+        device = self.device
+        while True:
+            header = self.recv_exact(8)
+            command, length = header[:4], struct.unpack("<I", header[4:])[0]
+            if command == b"QUIT":
+                return
+            path = self.recv_exact(length).decode("utf-8")
+            self.delay()
+            if command == b"RECV":
+                data = device.files.get(path)
+                if data is None:
+                    message = b"No such file or directory"
+                    self.sock.sendall(b"FAIL" + struct.pack("<I", len(message)) + message)
+                    return
+                for i in range(0, len(data), SYNC_CHUNK):
+                    piece = data[i:i + SYNC_CHUNK]
+                    self.send(b"DATA" + struct.pack("<I", len(piece)) + piece)
+                self.sock.sendall(b"DONE" + struct.pack("<I", 0))
+            elif command == b"SEND":
+                remote = path.rsplit(",", 1)[0]
+                buffer = bytearray()
+                while True:
+                    chunk_header = self.recv_exact(8)
+                    kind, size = chunk_header[:4], struct.unpack("<I", chunk_header[4:])[0]
+                    if kind == b"DATA":
+                        buffer += self.recv_exact(size)
+                    elif kind == b"DONE":
+                        break
+                    else:
+                        raise ConnectionError(f"unexpected sync chunk {kind!r}")
+                device.files[remote] = bytes(buffer)
+                self.sock.sendall(b"OKAY" + struct.pack("<I", 0))
+            elif command == b"STAT":
+                data = device.files.get(path)
+                if data is None:
+                    self.sock.sendall(b"STAT" + struct.pack("<III", 0, 0, 0))
+                else:
+                    self.sock.sendall(b"STAT" + struct.pack("<III", 0o100644, len(data), int(time.time())))
+            elif command == b"LIST":
+                prefix = path.rstrip("/") + "/"
+                for name in sorted({p[len(prefix):].split("/")[0] for p in device.files if p.startswith(prefix)}):
+                    size = len(device.files.get(prefix + name, b""))
+                    encoded = name.encode("utf-8")
+                    self.sock.sendall(b"DENT" + struct.pack("<IIII", 0o100644, size, int(time.time()), len(encoded)) + encoded)
+                self.sock.sendall(b"DONE" + struct.pack("<IIII", 0, 0, 0, 0))
+            else:
+                raise ConnectionError(f"unsupported sync command {command!r}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模拟ADB服务器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5037)
+    parser.add_argument("--devices", type=int, default=1, help="模拟设备数量")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="每次请求的模拟往返延迟（毫秒）")
+    parser.add_argument("--bandwidth-mbps", type=float, default=0.0, help="传输带宽上限（MB/s），0表示不限")
+    args = parser.parse_args()
+
+    devices = [FakeDevice(f"fake-{i}") for i in range(args.devices)]
+    server = FakeAdbServer(devices, args.host, args.port, args.latency_ms / 1000,
+                           args.bandwidth_mbps * 1024 * 1024 or None)
+    print(f"模拟ADB服务器监听 {server.host}:{server.port}，设备: {', '.join(server.devices)}")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+"""基于模拟ADB服务器的离线基准测试
+
+在本机启动 fake_adb.FakeAdbServer，把服务器指向它，逐项调用工具并报告吞吐量和 p50/p99 延迟，
+以及每次操作的ADB往返次数（来自 src.metrics）。用法:
+
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --devices 16 --latency-ms 5 --iterations 50
+    python benchmarks/run_benchmarks.py --devices 64 --endpoints 4 --only fleet_fanout
+    python benchmarks/run_benchmarks.py --only take_screenshot,file_pull --json results.json
+    python benchmarks/run_benchmarks.py --only dir_pull_per_file,dir_pull_tar --dir-files 1000
+"""
+from typing import Awaitable, Callable, Dict, List, Optional
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fake_adb import FakeAdbServer, FakeDevice  # noqa: E402
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = q * (len(ordered) - 1)
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+class Benchmark:
+    """一个基准项: run(i) 执行一次操作，返回工具输出；ops 为每次操作包含的工具调用数"""
+
+    def __init__(self, name: str, run: Callable[[int], Awaitable], ops: int = 1,
+                 payload_bytes: int = 0, max_iterations: Optional[int] = None, description: str = ""):
+        self.name = name
+        self.run = run
+        self.ops = ops
+        self.payload_bytes = payload_bytes
+        self.max_iterations = max_iterations
+        self.description = description
+
+
+def build_benchmarks(serials: List[str], file_size: int, workdir: str, dir_files: int = 200,
+                     dir_file_size: int = 4096) -> List[Benchmark]:
+    from src import adb_server, advanced_tools, file_tools
+
+    first = serials[0]
+    local_file = os.path.join(workdir, "payload.bin")
+    with open(local_file, "wb") as file:
+        file.write(os.urandom(file_size))
+    remote_file = "/sdcard/adb_mcp_bench.bin"
+    taps = json.dumps([{"x": 100 * i, "y": 200} for i in range(1, 4)])
+
+    # 目录传输: 很多小文件（类似测试产物、应用缓存），半可压缩的内容
+    local_tree = os.path.join(workdir, "tree")
+    tree_names = [f"case{i % 20}/result_{i}.log" for i in range(dir_files)]
+    for name in tree_names:
+        os.makedirs(os.path.dirname(os.path.join(local_tree, name)), exist_ok=True)
+        with open(os.path.join(local_tree, name), "wb") as file:
+            file.write(os.urandom(dir_file_size // 2) + b"PASS " * (dir_file_size // 10))
+    tree_bytes = sum(os.path.getsize(os.path.join(local_tree, name)) for name in tree_names)
+    remote_tree = "/sdcard/adb_mcp_bench_tree"
+    tree_ready = []
+
+    async def ensure_remote_tree():
+        if not tree_ready:
+            await file_tools.push_directory(local_tree, remote_tree, "none", first)
+            tree_ready.append(True)
+
+    async def screenshot(i):
+        return await adb_server.take_screenshot(device_id=first)
+
+    async def multi_tap(i):
+        return await adb_server.multi_tap(taps, first)
+
+    async def dump_ui(i):
+        return await advanced_tools.dump_ui_hierarchy(first)
+
+    async def push(i):
+        return await file_tools.push_file(local_file, remote_file, first)
+
+    async def pull(i):
+        return await file_tools.pull_file(remote_file, os.path.join(workdir, "pulled.bin"), first)
+
+    async def dir_push(i):
+        return await file_tools.push_directory(local_tree, remote_tree, "auto", first)
+
+    async def dir_pull_tar(i):
+        await ensure_remote_tree()
+        return await file_tools.pull_directory(remote_tree, os.path.join(workdir, f"pulled_tar_{i}"), "auto", first)
+
+    async def dir_pull_per_file(i):
+        # 对照: 逐个文件 pull_file，每个文件一次sync事务
+        await ensure_remote_tree()
+        target = os.path.join(workdir, f"pulled_files_{i}")
+        results = []
+        for name in tree_names:
+            os.makedirs(os.path.dirname(os.path.join(target, name)), exist_ok=True)
+            results.append(await file_tools.pull_file(f"{remote_tree}/{name}", os.path.join(target, name), first))
+        return next((result for result in results if "失败" in result), results[-1])
+
+    async def fleet(i):
+        results = await asyncio.gather(*(adb_server.get_battery_info(serial) for serial in serials))
+        return "\n".join(results)
+
+    return [
+        Benchmark("take_screenshot", screenshot, description="截图并编码"),
+        Benchmark("multi_tap", multi_tap, max_iterations=5, description="3个点击（含工具内的点击间隔）"),
+        Benchmark("dump_ui_hierarchy", dump_ui, description="uiautomator dump 并读取"),
+        Benchmark("file_push", push, payload_bytes=file_size, description=f"推送 {file_size // 1024}KB 文件"),
+        Benchmark("file_pull", pull, payload_bytes=file_size, description=f"拉取 {file_size // 1024}KB 文件"),
+        Benchmark("dir_push_tar", dir_push, payload_bytes=tree_bytes, max_iterations=5,
+                  description=f"push_directory 推送 {dir_files} 个小文件"),
+        Benchmark("dir_pull_tar", dir_pull_tar, payload_bytes=tree_bytes, max_iterations=5,
+                  description=f"pull_directory 拉取 {dir_files} 个小文件"),
+        Benchmark("dir_pull_per_file", dir_pull_per_file, payload_bytes=tree_bytes, max_iterations=5,
+                  description=f"逐个 pull_file 拉取 {dir_files} 个小文件"),
+        Benchmark("fleet_fanout", fleet, ops=len(serials), description=f"{len(serials)} 台设备并发 get_battery_info"),
+    ]
+
+
+async def run_benchmark(bench: Benchmark, iterations: int, warmup: int = 1, use_cache: bool = False) -> Dict:
+    from src import metrics, query_cache
+
+    iterations = min(iterations, bench.max_iterations or iterations)
+    for i in range(warmup):
+        await bench.run(i)
+    metrics.reset()
+
+    latencies, errors = [], 0
+    start = time.perf_counter()
+    for i in range(iterations):
+        if not use_cache:
+            # 默认测量未命中查询缓存时的真实开销
+            query_cache.invalidate()
+        op_start = time.perf_counter()
+        result = await bench.run(i)
+        latencies.append(time.perf_counter() - op_start)
+        if isinstance(result, str) and "失败" in result:
+            errors += 1
+    wall = time.perf_counter() - start
+
+    snapshot = metrics.snapshot()
+    roundtrips = sum(tool["adb_roundtrips"] for tool in snapshot["tools"].values())
+    result = {
+        "name": bench.name,
+        "description": bench.description,
+        "iterations": iterations,
+        "errors": errors,
+        "wall_seconds": round(wall, 4),
+        "ops_per_second": round(iterations * bench.ops / wall, 2) if wall else 0.0,
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 2),
+        "adb_roundtrips_per_op": round(roundtrips / (iterations * bench.ops), 2),
+    }
+    if bench.payload_bytes:
+        result["mb_per_second"] = round(bench.payload_bytes * iterations / wall / (1024 * 1024), 2)
+    return result
+
+
+def format_table(results: List[Dict]) -> str:
+    header = f"{'基准项':<20}{'次数':>6}{'错误':>6}{'ops/s':>10}{'p50(ms)':>10}{'p99(ms)':>10}{'ADB往返/次':>12}{'MB/s':>8}"
+    lines = [header, "-" * len(header)]
+    for r in results:
+        lines.append(f"{r['name']:<20}{r['iterations']:>6}{r['errors']:>6}{r['ops_per_second']:>10}"
+                     f"{r['p50_ms']:>10}{r['p99_ms']:>10}{r['adb_roundtrips_per_op']:>12}{r.get('mb_per_second', ''):>8}")
+    return "\n".join(lines)
+
+
+async def main_async(args) -> List[Dict]:
+    latency = args.latency_ms / 1000
+    bandwidth = args.bandwidth_mbps * 1024 * 1024 or None
+    servers = []
+    for index in range(args.endpoints):
+        devices = [FakeDevice(f"fake-{i}") for i in range(index, args.devices, args.endpoints)]
+        servers.append(FakeAdbServer(devices, latency=latency, bandwidth=bandwidth).start())
+    if args.endpoints > 1:
+        os.environ["ADB_ENDPOINTS"] = ",".join(f"hub{i}={s.host}:{s.port}" for i, s in enumerate(servers))
+        device_ids = [f"hub{i}:{serial}" for i, s in enumerate(servers) for serial in s.devices]
+    else:
+        os.environ["ADB_HOST"], os.environ["ADB_PORT"] = servers[0].host, str(servers[0].port)
+        device_ids = list(servers[0].devices)
+
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            benchmarks = build_benchmarks(device_ids, args.file_kb * 1024, workdir, args.dir_files)
+            selected = set(args.only.split(",")) if args.only else None
+            results = []
+            for bench in benchmarks:
+                if selected and bench.name not in selected:
+                    continue
+                results.append(await run_benchmark(bench, args.iterations, use_cache=args.cache))
+                print(f"完成 {bench.name}", file=sys.stderr)
+    finally:
+        for server in servers:
+            server.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ADB MCP 服务器离线基准测试")
+    parser.add_argument("--devices", type=int, default=4, help="模拟设备数量（用于 fleet_fanout）")
+    parser.add_argument("--endpoints", type=int, default=1, help="模拟ADB服务器数量，设备平均分布到各服务器")
+    parser.add_argument("--latency-ms", type=float, default=2.0, help="每次ADB请求的模拟往返延迟（毫秒）")
+    parser.add_argument("--bandwidth-mbps", type=float, default=0.0, help="模拟传输带宽（MB/s），0表示不限")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--file-kb", type=int, default=4096, help="文件传输基准的文件大小（KB）")
+    parser.add_argument("--dir-files", type=int, default=200, help="目录传输基准的文件数（每个4KB）")
+    parser.add_argument("--only", help="只运行指定的基准项，逗号分隔")
+    parser.add_argument("--cache", action="store_true", help="保留只读查询的结果缓存（默认每次操作前清空）")
+    parser.add_argument("--json", help="把结果写入JSON文件")
+    args = parser.parse_args()
+
+    results = asyncio.run(main_async(args))
+    print(format_table(results))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump({"config": vars(args), "results": results}, file, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""服务器启动基准测试
+
+分别测量三种启动方式下 `import src` 的耗时，以及从启动 `python -m src.adb_server` 到收到第一个
+tools/list 响应、到第一次工具调用返回的时间:
+
+    eager  关闭延迟加载（ADB_MCP_LAZY_TOOLS=0），启动时导入全部模块并生成全部工具定义
+    cold   工具清单不存在（首次启动），导入全部模块后写入清单
+    warm   工具清单有效，只发布清单中的工具定义，实现模块在第一次调用时导入
+
+服务器指向一个模拟ADB服务器，同时报告第一次工具调用之前服务器收到的ADB请求数（应为0）。用法:
+
+    python benchmarks/startup_benchmark.py
+    python benchmarks/startup_benchmark.py --runs 10 --json startup.json
+"""
+from typing import Dict, List
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fake_adb import FakeAdbServer, FakeDevice  # noqa: E402
+
+IMPORT_SCRIPT = "import time; start = time.perf_counter(); import src; print(time.perf_counter() - start)"
+
+
+def measure_import(env: Dict[str, str]) -> float:
+    output = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT], cwd=ROOT, env=env, check=True,
+                            capture_output=True, text=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+class StdioClient:
+    """最简单的 MCP stdio 客户端: 每行一个 JSON-RPC 消息"""
+
+    def __init__(self, env: Dict[str, str]):
+        self.process = subprocess.Popen([sys.executable, "-m", "src.adb_server"], cwd=ROOT, env=env,
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                        text=True, encoding="utf-8")
+        self._next_id = 0
+
+    def notify(self, method: str, params: Dict = None):
+        self._send({"jsonrpc": "2.0", "method": method, "params": params or {}})
+
+    def request(self, method: str, params: Dict = None) -> Dict:
+        self._next_id += 1
+        self._send({"jsonrpc": "2.0", "id": self._next_id, "method": method, "params": params or {}})
+        while True:
+            line = self.process.stdout.readline()
+            if not line:
+                raise RuntimeError(f"服务器在响应 {method} 之前退出")
+            message = json.loads(line)
+            if message.get("id") == self._next_id:
+                if "error" in message:
+                    raise RuntimeError(f"{method} 失败: {message['error']}")
+                return message["result"]
+
+    def _send(self, message: Dict):
+        self.process.stdin.write(json.dumps(message) + "\n")
+        self.process.stdin.flush()
+
+    def close(self):
+        self.process.stdin.close()
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+def measure_server(env: Dict[str, str], server: FakeAdbServer, device_id: str) -> Dict:
+    requests_before = server.requests
+    start = time.perf_counter()
+    client = StdioClient(env)
+    try:
+        client.request("initialize", {"protocolVersion": "2025-06-18", "capabilities": {},
+                                      "clientInfo": {"name": "startup-benchmark", "version": "1"}})
+        initialized = time.perf_counter()
+        client.notify("notifications/initialized")
+        tools = client.request("tools/list")["tools"]
+        listed = time.perf_counter()
+        adb_requests = server.requests - requests_before
+        # 第一次调用延迟加载模块（network_tools）中的工具，包含导入模块和连接ADB服务器的开销
+        client.request("tools/call", {"name": "get_ip_address", "arguments": {"device_id": device_id}})
+        called = time.perf_counter()
+    finally:
+        client.close()
+    return {
+        "initialize": initialized - start,
+        "tools_list": listed - start,
+        "first_call": called - listed,
+        "tools": len(tools),
+        "adb_requests_before_call": adb_requests,
+    }
+
+
+def summarize(samples: List[Dict], key: str) -> float:
+    return round(statistics.median(sample[key] for sample in samples) * 1000, 1)
+
+
+def run_mode(mode: str, runs: int, base_env: Dict[str, str], server: FakeAdbServer, device_id: str,
+             manifest: str) -> Dict:
+    env = dict(base_env, ADB_MCP_TOOL_MANIFEST=manifest, ADB_MCP_LAZY_TOOLS="0" if mode == "eager" else "1")
+    imports, starts = [], []
+    for _ in range(runs):
+        if mode == "cold" and os.path.exists(manifest):
+            os.remove(manifest)
+        imports.append(measure_import(env))
+        if mode == "cold" and os.path.exists(manifest):
+            os.remove(manifest)
+        starts.append(measure_server(env, server, device_id))
+    return {
+        "mode": mode,
+        "runs": runs,
+        "import_ms": round(statistics.median(imports) * 1000, 1),
+        "initialize_ms": summarize(starts, "initialize"),
+        "tools_list_ms": summarize(starts, "tools_list"),
+        "first_call_ms": summarize(starts, "first_call"),
+        "tools": starts[-1]["tools"],
+        "adb_requests_before_call": max(sample["adb_requests_before_call"] for sample in starts),
+    }
+
+
+def format_table(results: List[Dict]) -> str:
+    header = f"{'模式':<8}{'import(ms)':>12}{'initialize(ms)':>16}{'tools/list(ms)':>16}{'首次调用(ms)':>14}" \
+             f"{'工具数':>8}{'调用前ADB请求':>14}"
+    lines = [header, "-" * len(header)]
+    for r in results:
+        lines.append(f"{r['mode']:<8}{r['import_ms']:>12}{r['initialize_ms']:>16}{r['tools_list_ms']:>16}"
+                     f"{r['first_call_ms']:>14}{r['tools']:>8}{r['adb_requests_before_call']:>14}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ADB MCP 服务器启动基准测试")
+    parser.add_argument("--runs", type=int, default=5, help="每种模式的重复次数（取中位数）")
+    parser.add_argument("--modes", default="eager,cold,warm", help="要测量的模式，逗号分隔")
+    parser.add_argument("--json", help="把结果写入JSON文件")
+    args = parser.parse_args()
+
+    with FakeAdbServer([FakeDevice("fake-0")]) as server, tempfile.TemporaryDirectory() as workdir:
+        env = dict(os.environ, ADB_HOST=server.host, ADB_PORT=str(server.port))
+        env.pop("ADB_ENDPOINTS", None)
+        manifest = os.path.join(workdir, "tool_manifest.json")
+        results = []
+        for mode in args.modes.split(","):
+            if mode == "warm" and not os.path.exists(manifest):
+                # 先启动一次生成清单
+                measure_import(dict(env, ADB_MCP_TOOL_MANIFEST=manifest))
+            results.append(run_mode(mode, args.runs, env, server, "fake-0", manifest))
+            print(f"完成 {mode}", file=sys.stderr)
+
+    print(format_table(results))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump({"config": vars(args), "results": results}, file, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
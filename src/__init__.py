@@ -1,20 +1,25 @@
 # 导入所有功能模块
 from . import adb_server
-# 导入后续添加的模块，如果对应文件存在
-try:
-    from . import network_tools
-except ImportError:
-    pass
+from .lazy_tools import load_tool_modules
 
-try:
-    from . import file_tools
-except ImportError:
-    pass
-
-try:
-    from . import advanced_tools
-except ImportError:
-    pass
+# 后续添加的工具模块（对应文件不存在时跳过）。工具清单有效时这些模块只发布工具定义，
+# 第一次调用其中的工具时才导入，见 lazy_tools
+TOOL_MODULES = [
+    "network_tools",
+    "file_tools",
+    "package_tools",
+    "bugreport_tools",
+    "gesture_tools",
+    "input_record_tools",
+    "advanced_tools",
+    "artifact_tools",
+    "metrics_tools",
+    "scheduler_tools",
+    "health_tools",
+    "image_tools",
+    "navigation_tools",
+]
+load_tool_modules(adb_server.mcp, TOOL_MODULES)
 
 # 导出主模块
 from .adb_server import mcp
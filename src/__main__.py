@@ -0,0 +1,54 @@
+import argparse
+import os
+import sys
+from . import mcp
+
+TRANSPORTS = ("stdio", "streamable-http", "sse")
+
+_LOOPBACK_HOSTS = ("127.0.0.1", "localhost", "::1")
+
+
+def _parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="adb-mcp-server", description="Android ADB MCP 服务器")
+    parser.add_argument("--transport", choices=TRANSPORTS, default=os.environ.get("ADB_MCP_TRANSPORT", "stdio"),
+                        help="传输方式: stdio（默认，每个客户端启动一个进程）或 streamable-http/sse（多个客户端共享一个服务器）")
+    parser.add_argument("--host", default=os.environ.get("ADB_MCP_HOST", "127.0.0.1"), help="HTTP监听地址")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("ADB_MCP_PORT", "8000")), help="HTTP监听端口")
+    parser.add_argument("--path", default=os.environ.get("ADB_MCP_PATH", "/mcp"), help="streamable-http 的访问路径")
+    parser.add_argument("--allowed-hosts", default=os.environ.get("ADB_MCP_ALLOWED_HOSTS", ""),
+                        help="监听非本机地址时允许的 Host 请求头，逗号分隔，例如 \"192.168.1.10:*,devbox:*\"")
+    return parser.parse_args(argv)
+
+
+def _configure_http(args):
+    settings = mcp.settings
+    settings.host = args.host
+    settings.port = args.port
+    settings.streamable_http_path = args.path
+    if args.host in _LOOPBACK_HOSTS:
+        return
+    # 默认的 DNS 重绑定保护只允许本机地址，监听其他地址时改为允许指定的 Host
+    allowed = [host.strip() for host in args.allowed_hosts.split(",") if host.strip()]
+    if allowed:
+        from mcp.server.transport_security import TransportSecuritySettings
+        settings.transport_security = TransportSecuritySettings(enable_dns_rebinding_protection=True,
+                                                                allowed_hosts=allowed, allowed_origins=[])
+    else:
+        settings.transport_security = None
+        print(f"警告: 服务器监听 {args.host}:{args.port}，网络中的任何客户端都可以控制已连接的设备；"
+              f"可以用 --allowed-hosts 限制允许的 Host", file=sys.stderr)
+
+
+def main(argv=None):
+    """运行服务器: 默认 stdio；streamable-http/sse 模式下多个客户端会话共享设备连接、缓存和调度队列"""
+    args = _parse_args(argv)
+    if args.transport != "stdio":
+        _configure_http(args)
+        url = f"http://{args.host}:{args.port}{args.path if args.transport == 'streamable-http' else '/sse'}"
+        print(f"ADB MCP 服务器 ({args.transport}): {url}", file=sys.stderr)
+    mcp.run(transport=args.transport)
+
+
+# 运行服务器
+if __name__ == "__main__":
+    main()
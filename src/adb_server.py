@@ -1,123 +1,313 @@
 from typing import Any, List, Optional
 import os
 import time
+import asyncio
 import base64
 import tempfile
 import json
+import struct
+from concurrent.futures import ThreadPoolExecutor
 from ppadb.client import Client as AdbClient
-from mcp.server.fastmcp import FastMCP
+from urllib.parse import quote
+from mcp.types import (BlobResourceContents, EmbeddedResource, ImageContent, ResourceLink, TextContent,
+                       TextResourceContents)
+from . import device_health, endpoints, metrics, query_cache, scheduler, state_graph, text_input
+from .artifacts import Artifact, store as artifact_store
+from .lazy_tools import LazyFastMCP
 
-# 初始化 FastMCP 服务器
-mcp = FastMCP("android_adb")
-
-# ADB 常量
-ADB_HOST = "127.0.0.1"
-ADB_PORT = 5037
+if __name__ == "__main__":
+    # python -m src.adb_server 会先导入 src 包（其中已加载本模块并注册全部工具），
+    # 这里直接运行包里的服务器，避免以 __main__ 身份再执行一遍本模块、得到只有部分工具的第二个服务器
+    from .__main__ import main
+    main()
+    raise SystemExit(0)
+
+# 初始化 FastMCP 服务器，注册的每个工具都会记录延迟和ADB调用统计；
+# 只读查询经过单飞和短时缓存，可能修改设备状态的工具调用后使该设备的缓存失效；
+# 未命中缓存的调用进入所在设备的优先级队列，在工作线程中执行（见 scheduler）
+# 输入操作记录到设备的界面图中，用于 navigate_to 重放（见 state_graph）
+# 工具定义按清单延迟生成，见 lazy_tools
+mcp = metrics.instrument_server(LazyFastMCP("android_adb"), scheduler.wrap_tool, query_cache.wrap_tool,
+                                state_graph.wrap_tool)
+
+# ADB 常量（可通过环境变量 ADB_HOST / ADB_PORT 指定其他ADB服务器）
+ADB_HOST = os.environ.get("ADB_HOST", "127.0.0.1")
+ADB_PORT = int(os.environ.get("ADB_PORT", "5037"))
 
 # 辅助函数
+def get_adb_endpoints() -> List[endpoints.AdbEndpoint]:
+    """返回已配置的ADB服务器（环境变量 ADB_ENDPOINTS，未配置时为 ADB_HOST:ADB_PORT）
+
+    第一次调用时启动设备健康监视（见 device_health）
+    """
+    endpoint_list = endpoints.get_endpoints(ADB_HOST, ADB_PORT)
+    device_health.monitor.ensure_started(endpoint_list)
+    return endpoint_list
+
 def get_adb_client() -> AdbClient:
-    """初始化并返回ADB客户端"""
-    client = AdbClient(host=ADB_HOST, port=ADB_PORT)
-    return client
+    """返回默认（第一个）ADB服务器的客户端"""
+    return get_adb_endpoints()[0].client
 
 def get_device(device_id: Optional[str] = None):
-    """获取ADB设备，如果指定了device_id则返回该设备，否则返回第一个可用设备"""
-    client = get_adb_client()
-    devices = client.devices()
-    
-    if not devices:
-        raise ValueError("未找到连接的设备")
-    
+    """获取ADB设备，如果指定了device_id则返回该设备，否则返回第一个可用设备
+
+    配置多个ADB服务器时 device_id 为 "别名:序列号"，序列号在所有服务器中唯一时也可以直接使用。
+    已知离线、未授权、启动中或已熔断的设备直接抛出 DeviceUnavailable，不再等待ADB超时。
+    """
+    endpoint_list = get_adb_endpoints()
     if device_id:
-        for device in devices:
-            if device.serial == device_id:
-                return device
-        raise ValueError(f"未找到指定的设备: {device_id}")
-    
-    return devices[0]  # 返回第一个设备
+        device_health.monitor.check(device_id)
+    device = endpoints.resolve_device(endpoint_list, device_id)
+    device_health.monitor.check(device.device_id)
+    return metrics.instrument_device(device)
+
+def _read_exact(conn, length: int) -> bytes:
+    """从连接中读取恰好length字节"""
+    data = bytearray()
+    while len(data) < length:
+        chunk = conn.read(length - len(data))
+        if not chunk:
+            raise RuntimeError("ADB连接意外断开")
+        data += chunk
+    return bytes(data)
+
+def iter_pull(device, src: str):
+    """通过sync协议分块拉取文件，逐块产出数据，不经过本地临时文件"""
+    start = time.perf_counter()
+    conn = device.sync()
+    received = 0
+    with conn:
+        path = src.encode('utf-8')
+        conn.write(b"RECV" + struct.pack("<I", len(path)) + path)
+        while True:
+            flag = _read_exact(conn, 4)
+            if flag == b"DATA":
+                remaining = struct.unpack("<I", _read_exact(conn, 4))[0]
+                while remaining:
+                    chunk = conn.read(min(remaining, 65536))
+                    if not chunk:
+                        raise RuntimeError("ADB连接意外断开")
+                    remaining -= len(chunk)
+                    received += len(chunk)
+                    yield chunk
+            elif flag == b"DONE":
+                _read_exact(conn, 4)
+                metrics.record_adb("pull", time.perf_counter() - start, bytes_in=received)
+                return
+            elif flag == b"FAIL":
+                length = struct.unpack("<I", _read_exact(conn, 4))[0]
+                raise RuntimeError(_read_exact(conn, length).decode('utf-8', errors='ignore'))
+            else:
+                raise RuntimeError(f"未知的sync响应: {flag!r}")
+
+def pull_with_progress(device, src: str, dest: str, progress=None) -> int:
+    """通过sync协议分块拉取文件并边收边写入本地，返回接收的字节数
+
+    progress: 可选回调，每收到一块数据调用 progress(已接收字节数)
+    """
+    received = 0
+    with open(dest, 'wb') as stream:
+        for chunk in iter_pull(device, src):
+            stream.write(chunk)
+            received += len(chunk)
+            if progress:
+                progress(received)
+    return received
+
+def iter_exec_out(device, command: str):
+    """通过 exec: 服务执行命令，逐块产出输出（原始字节流，不经过终端的换行转换）"""
+    start = time.perf_counter()
+    received = 0
+    try:
+        with device.create_connection() as conn:
+            conn.send(f"exec:{command}")
+            while True:
+                chunk = conn.read(65536)
+                if not chunk:
+                    break
+                received += len(chunk)
+                yield chunk
+    except Exception:
+        metrics.record_adb("exec_out", time.perf_counter() - start, bytes_in=received, failed=True)
+        raise
+    metrics.record_adb("exec_out", time.perf_counter() - start, bytes_in=received)
+
+def exec_out(device, command: str) -> bytes:
+    """通过 exec: 服务执行命令并读取全部输出"""
+    return b"".join(iter_exec_out(device, command))
+
+def pull_bytes(device, src: str) -> bytes:
+    """把设备上的文件直接拉取到内存"""
+    return b"".join(iter_pull(device, src))
+
+def binary_content(data: bytes, mime_type: str, uri: str):
+    """把二进制数据包装为原生MCP内容: 图片为 ImageContent，文本为嵌入的文本资源，其他为嵌入的二进制资源
+
+    MCP 的 JSON 传输仍需要 base64，但只编码一次，不再额外拼接 data URI 字符串。
+    """
+    if mime_type.startswith("image/"):
+        with metrics.phase("base64_encode"):
+            encoded = base64.b64encode(data).decode('ascii')
+        return ImageContent(type="image", data=encoded, mimeType=mime_type)
+    if mime_type.startswith("text/"):
+        try:
+            return EmbeddedResource(type="resource", resource=TextResourceContents(
+                uri=uri, mimeType=mime_type, text=data.decode('utf-8')))
+        except UnicodeDecodeError:
+            pass
+    with metrics.phase("base64_encode"):
+        encoded = base64.b64encode(data).decode('ascii')
+    return EmbeddedResource(type="resource", resource=BlobResourceContents(uri=uri, mimeType=mime_type, blob=encoded))
+
+def device_uri(device, path: str) -> str:
+    """设备上文件的资源URI，用于嵌入资源的标识"""
+    return f"adb-mcp://{quote(device.serial, safe='')}{quote(path)}"
+
+def artifact_result(artifact: Artifact, duplicate: bool, data: Optional[bytes] = None, summary: str = "") -> List:
+    """产物类工具的返回内容: 带句柄的说明文字，加上内联内容（提供data时）或可按需读取的资源链接"""
+    note = f"{summary}产物句柄: {artifact.handle}（{artifact.size}字节"
+    if duplicate:
+        note += "，与已保存的产物内容相同"
+    note += "，可用 fetch_artifact 按字节范围读取）"
+    contents: List = [TextContent(type="text", text=note)]
+    if data is not None:
+        contents.append(binary_content(data, artifact.mime_type, artifact.uri))
+    else:
+        contents.append(ResourceLink(type="resource_link", uri=artifact.uri, name=artifact.handle,
+                                     mimeType=artifact.mime_type, size=artifact.size))
+    return contents
+
+def pull_artifact(device, remote_path: str, mime_type: str, kind: str, source: str, inline: bool) -> List:
+    """把设备文件拉取到产物存储；inline=False 时边收边写入磁盘，不在内存中保留完整内容"""
+    if inline:
+        data = pull_bytes(device, remote_path)
+        artifact, duplicate = artifact_store.put_bytes(data, mime_type, kind, device.serial, source)
+        return artifact_result(artifact, duplicate, data)
+    os.makedirs(artifact_store.root, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=artifact_store.root, suffix=".part", delete=False) as temp_file:
+        temp_path = temp_file.name
+    try:
+        pull_with_progress(device, remote_path, temp_path)
+        artifact, duplicate = artifact_store.put_file(temp_path, mime_type, kind, device.serial, source, move=True)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return artifact_result(artifact, duplicate)
 
 # 工具实现
 @mcp.tool()
 async def list_devices() -> str:
-    """列出所有连接的Android设备"""
-    client = get_adb_client()
-    devices = client.devices()
+    """列出所有连接的Android设备（配置多个ADB服务器时合并列出）"""
+    adb_endpoints = get_adb_endpoints()
+    devices = endpoints.discover_devices(adb_endpoints, refresh=True, include_offline=True)
     
     if not devices:
-        return "未找到连接的设备"
+        unavailable = [endpoint.describe() for endpoint in adb_endpoints if not endpoint.healthy]
+        return "未找到连接的设备" + ("\n" + "\n".join(unavailable) if unavailable else "")
     
-    device_info = []
-    for device in devices:
+    def describe(device) -> str:
+        header = f"设备ID: {device.device_id}"
+        if len(adb_endpoints) > 1:
+            header += f"\nADB服务器: {device.endpoint.alias} ({device.endpoint.address})"
+        if device.state != "device":
+            return f"{header}\n状态: {device.state}"
         try:
-            model = device.shell("getprop ro.product.model").strip()
-            android_version = device.shell("getprop ro.build.version.release").strip()
-            device_info.append(f"设备ID: {device.serial}\n型号: {model}\nAndroid版本: {android_version}")
+            lines = device.shell("getprop ro.product.model; getprop ro.build.version.release").split("\n") + [""]
+            return f"{header}\n型号: {lines[0].strip()}\nAndroid版本: {lines[1].strip()}"
         except Exception as e:
-            device_info.append(f"设备ID: {device.serial}\n获取详细信息时出错: {str(e)}")
+            return f"{header}\n获取详细信息时出错: {str(e)}"
+    
+    with ThreadPoolExecutor(max_workers=min(len(devices), 32)) as pool:
+        device_info = list(pool.map(describe, devices))
     
     return "\n\n".join(device_info)
 
 @mcp.tool()
-async def take_screenshot(device_id: Optional[str] = None) -> str:
-    """截取设备屏幕
+async def list_adb_endpoints(check: bool = True) -> str:
+    """列出已配置的ADB服务器及其健康状态、延迟和设备数
+
+    参数:
+        check: 是否先对所有ADB服务器做一次健康检查，默认是
+    """
+    adb_endpoints = get_adb_endpoints()
+    if check:
+        endpoints.health_report(adb_endpoints)
+        endpoints.discover_devices(adb_endpoints, refresh=True, include_offline=True)
+    return "\n".join(endpoint.describe() for endpoint in adb_endpoints)
+
+@mcp.tool()
+async def add_adb_endpoint(address: str, alias: Optional[str] = None) -> str:
+    """添加一个ADB服务器，其设备以 "别名:序列号" 的形式加入设备列表
+
+    参数:
+        address: ADB服务器地址，例如 192.168.1.20:5037（端口默认5037）
+        alias: 别名（可选，默认由地址生成）
+    """
+    try:
+        get_adb_endpoints()
+        (default_alias, host, port), = endpoints.parse_endpoints(address)
+        endpoint = endpoints.add_endpoint(alias or default_alias, host, port)
+        if not endpoint.check():
+            return f"已添加ADB服务器 {endpoint.alias}，但当前无法连接: {endpoint.last_error}"
+        count = len(endpoint.devices(refresh=True))
+        return f"已添加ADB服务器 {endpoint.alias} ({endpoint.address})，发现 {count} 台设备"
+    except Exception as e:
+        return f"添加ADB服务器失败: {str(e)}"
+
+@mcp.tool()
+async def remove_adb_endpoint(alias: str) -> str:
+    """移除一个ADB服务器
+
+    参数:
+        alias: ADB服务器别名（见 list_adb_endpoints）
+    """
+    try:
+        get_adb_endpoints()
+        endpoints.remove_endpoint(alias)
+        return f"已移除ADB服务器: {alias}"
+    except Exception as e:
+        return f"移除ADB服务器失败: {str(e)}"
+
+@mcp.tool()
+async def take_screenshot(inline: bool = True, device_id: Optional[str] = None) -> Any:
+    """截取设备屏幕，返回PNG图片，截图同时保存到产物存储（相同画面自动去重）
 
     参数:
+        inline: 是否直接返回图片内容，默认是；否则只返回产物句柄和资源链接，需要时再用 fetch_artifact 读取
         device_id: 设备ID（可选，如果未提供则使用第一个可用设备）
     """
     try:
         device = get_device(device_id)
         
-        # 创建临时文件存储截图
-        with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as temp_file:
-            temp_path = temp_file.name
+        # 截图数据直接通过一次 exec 调用返回到内存，不经过设备和本地的临时文件
+        data = device.screencap()
+        if not data.startswith(b"\x89PNG"):
+            return f"截图失败: {data[:200].decode('utf-8', errors='ignore').strip()}"
         
-        # 在设备上截图并保存到临时文件
-        device.shell("screencap -p /sdcard/screenshot.png")
-        device.pull("/sdcard/screenshot.png", temp_path)
-        device.shell("rm /sdcard/screenshot.png")
-        
-        # 将图片转换为base64
-        with open(temp_path, 'rb') as img_file:
-            base64_data = base64.b64encode(img_file.read()).decode('utf-8')
-        
-        # 删除临时文件
-        os.remove(temp_path)
-        
-        return f"data:image/png;base64,{base64_data}"
+        artifact, duplicate = artifact_store.put_bytes(data, "image/png", "screenshot", device.serial, "take_screenshot")
+        return artifact_result(artifact, duplicate, data if inline else None)
     except Exception as e:
         return f"截图失败: {str(e)}"
 
 @mcp.tool()
-async def record_screen(duration: int = 5, device_id: Optional[str] = None) -> str:
-    """录制设备屏幕
+async def record_screen(duration: int = 5, inline: bool = False, device_id: Optional[str] = None) -> Any:
+    """录制设备屏幕，视频保存到产物存储并返回句柄
 
     参数:
         duration: 录制时长（秒），默认5秒
+        inline: 是否同时内联返回视频内容，默认否（通过资源链接或 fetch_artifact 按需读取）
         device_id: 设备ID（可选，如果未提供则使用第一个可用设备）
     """
     try:
         device = get_device(device_id)
         
-        # 创建临时文件存储视频
-        with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as temp_file:
-            temp_path = temp_file.name
-        
         # 在设备上录制屏幕
         device.shell(f"screenrecord --time-limit {duration} /sdcard/screenrecord.mp4")
-        time.sleep(duration + 1)  # 等待录制完成
+        scheduler.sleep(duration + 1)  # 等待录制完成
         
-        # 将视频拉到本地
-        device.pull("/sdcard/screenrecord.mp4", temp_path)
+        result = pull_artifact(device, "/sdcard/screenrecord.mp4", "video/mp4", "recording", "record_screen", inline)
         device.shell("rm /sdcard/screenrecord.mp4")
-        
-        # 将视频转换为base64
-        with open(temp_path, 'rb') as video_file:
-            base64_data = base64.b64encode(video_file.read()).decode('utf-8')
-        
-        # 删除临时文件
-        os.remove(temp_path)
-        
-        return f"data:video/mp4;base64,{base64_data}"
+        return result
     except Exception as e:
         return f"录屏失败: {str(e)}"
 
@@ -235,19 +425,32 @@ async def swipe_right(start_x: int, start_y: int, end_x: int, duration: int = 30
         return f"滑动失败: {str(e)}"
 
 @mcp.tool()
-async def input_text(text: str, device_id: Optional[str] = None) -> str:
-    """输入文本
+async def input_text(text: str, method: str = "auto", verify: bool = False,
+                     device_id: Optional[str] = None) -> str:
+    """在当前焦点输入框中输入文本（支持中文等非ASCII字符和长文本）
+
+    auto 时在一次设备调用中选择输入方式: 已启用 ADBKeyBoard 输入法时通过广播提交整段文本；
+    否则非ASCII或较长的文本通过 Clipper 设置剪贴板后粘贴；短的ASCII文本使用 input text。
+    一条命令放不下的长文本自动分段，并合并为尽量少的设备调用。
 
     参数:
         text: 要输入的文本
+        method: 输入方式: auto（默认）、adbkeyboard、clipboard、input
+        verify: 输入后是否读取焦点输入框的内容进行校验（多一次界面读取）
         device_id: 设备ID（可选，如果未提供则使用第一个可用设备）
     """
     try:
         device = get_device(device_id)
-        # 转义特殊字符
-        escaped_text = text.replace("'", "\\'").replace('"', '\\"').replace(" ", "%s")
-        device.shell(f"input text '{escaped_text}'")
-        return f"成功输入文本: {text}"
+        start = time.perf_counter()
+        used, calls = text_input.enter_text(device, text, method)
+        elapsed = (time.perf_counter() - start) * 1000
+        preview = text if len(text) <= 50 else text[:50] + "..."
+        result = (f"成功输入文本: {preview}（{len(text)}个字符，{text_input.METHOD_NAMES[used]}，"
+                  f"{calls}次设备调用，{elapsed:.0f}ms）")
+        if verify:
+            problem = text_input.verify_text(device, text)
+            result += "，校验通过" if problem is None else f"\n校验失败: {problem}"
+        return result
     except Exception as e:
         return f"输入文本失败: {str(e)}"
 
@@ -387,17 +590,26 @@ async def get_device_info(device_id: Optional[str] = None) -> str:
         return f"获取设备信息失败: {str(e)}"
 
 @mcp.tool()
-async def list_installed_packages(device_id: Optional[str] = None) -> str:
+async def list_installed_packages(filter_type: str = "all", show_versions: bool = False, device_id: Optional[str] = None) -> str:
     """列出设备上已安装的所有应用包
 
     参数:
+        filter_type: 应用类型，all（全部，默认）、third_party（第三方）或 system（系统）
+        show_versions: 是否同时显示版本号和UID，默认False
         device_id: 设备ID（可选，如果未提供则使用第一个可用设备）
     """
     try:
+        from .package_tools import get_package_catalog
+
         device = get_device(device_id)
-        output = device.shell("pm list packages")
-        packages = [line.replace("package:", "").strip() for line in output.splitlines() if line]
-        return "\n".join(packages)
+        catalog = get_package_catalog(device)
+        names = catalog.names(filter_type)
+        if show_versions:
+            return "\n".join(
+                f"{name}  versionCode={catalog.packages[name].version_code}  uid={catalog.packages[name].uid}"
+                for name in names
+            )
+        return "\n".join(names)
     except Exception as e:
         return f"获取应用列表失败: {str(e)}"
 
@@ -460,53 +672,50 @@ async def get_battery_info(device_id: Optional[str] = None) -> str:
         return f"获取电池信息失败: {str(e)}"
 
 @mcp.tool()
-async def take_bugreport(device_id: Optional[str] = None) -> str:
-    """获取系统Bug报告
-
-    参数:
-        device_id: 设备ID（可选，如果未提供则使用第一个可用设备）
-    """
-    try:
-        device = get_device(device_id)
-        device.shell("bugreport > /sdcard/bugreport.txt")
-        
-        # 创建临时文件
-        with tempfile.NamedTemporaryFile(suffix='.txt', delete=False) as temp_file:
-            temp_path = temp_file.name
-        
-        # 拉取报告
-        device.pull("/sdcard/bugreport.txt", temp_path)
-        device.shell("rm /sdcard/bugreport.txt")
-        
-        # 读取报告内容
-        with open(temp_path, 'r', errors='ignore') as file:
-            content = file.read()
-        
-        # 删除临时文件
-        os.remove(temp_path)
-        
-        # 如果报告过长，只返回前面部分
-        if len(content) > 10000:
-            content = content[:10000] + "...\n[Bug报告太长，只显示前面部分]"
-        
-        return content
-    except Exception as e:
-        return f"获取Bug报告失败: {str(e)}"
-
-@mcp.tool()
-async def reboot_device(device_id: Optional[str] = None) -> str:
-    """重启设备
+async def reboot_device(wait: bool = True, timeout: int = 180, device_id: Optional[str] = None) -> str:
+    """重启设备，默认等待系统启动完成（sys.boot_completed=1）
 
     参数:
+        wait: 是否等待启动完成，默认是
+        timeout: 等待启动完成的最长时间（秒），默认180
         device_id: 设备ID（可选，如果未提供则使用第一个可用设备）
     """
     try:
         device = get_device(device_id)
-        device.shell("reboot")
-        return "设备正在重启..."
+        # boot_id 每次启动都会变化，用它判断设备确实完成了一次重启（重启很快时轮询可能看不到断开）
+        boot_id_command = "cat /proc/sys/kernel/random/boot_id"
+        old_boot_id = device.shell(boot_id_command).strip()
+        device_health.monitor.mark_rebooting(device.serial)
+        try:
+            device.shell("reboot")
+        except Exception:
+            pass  # 设备断开时连接可能被直接关闭
+        if not wait:
+            return "设备正在重启..."
+
+        start = time.time()
+        went_down = False
+        while time.time() - start < timeout:
+            await asyncio.sleep(device_health.BOOT_POLL_INTERVAL)
+            if scheduler.cancelled():
+                return "重启设备失败: 调用已取消（设备仍在重启）"
+            try:
+                current = endpoints.resolve_device(get_adb_endpoints(), device.serial)
+                output = current.shell(f"getprop sys.boot_completed; {boot_id_command}",
+                                       timeout=device_health.PING_TIMEOUT).split()
+            except Exception:
+                went_down = True
+                continue
+            completed = output[:1] == ["1"]
+            if len(output) > 1 and old_boot_id and output[1] != old_boot_id:
+                went_down = True
+            elif not completed:
+                went_down = True
+            if completed and went_down:
+                device_health.monitor.mark_online(device.serial)
+                return f"设备已重启并完成启动，用时 {time.time() - start:.1f}秒"
+        if not went_down:
+            return f"重启设备失败: {timeout}秒内未检测到设备重启"
+        return f"重启设备失败: 等待启动完成超时（{timeout}秒）"
     except Exception as e:
         return f"重启设备失败: {str(e)}"
-
-# 运行服务器
-if __name__ == "__main__":
-    mcp.run(transport='stdio') 
\ No newline at end of file
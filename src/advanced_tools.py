@@ -1,22 +1,32 @@
-from typing import Optional
-import tempfile
+from typing import Any, Optional
 import time
-import os
-import base64
+import asyncio
 from mcp.server.fastmcp import FastMCP
-from .adb_server import get_device, mcp
+from . import device_conditions, perfetto_trace, scheduler
+from .adb_server import artifact_store, get_device, mcp, pull_artifact
+from .jobs import get_job, list_jobs, start_job
+from .package_tools import get_package_catalog, invalidate_package_catalog
+from .ui_hierarchy import dump_hierarchy_xml
+from .ui_script import ScriptRunner, compile_script
 
 @mcp.tool()
-async def install_apk(apk_path: str, device_id: Optional[str] = None) -> str:
+async def install_apk(apk_path: str, package_name: Optional[str] = None, version_code: Optional[int] = None, device_id: Optional[str] = None) -> str:
     """安装APK文件
 
     参数:
         apk_path: 本地APK文件路径
+        package_name: APK的包名（可选，与version_code一起提供时，设备上已安装相同或更高版本则跳过安装）
+        version_code: APK的版本号（可选）
         device_id: 设备ID（可选，如果未提供则使用第一个可用设备）
     """
     try:
         device = get_device(device_id)
+        if package_name and version_code is not None:
+            installed = get_package_catalog(device).get(package_name)
+            if installed and installed.version_code is not None and installed.version_code >= version_code:
+                return f"已安装 {package_name} (versionCode={installed.version_code})，跳过安装: {apk_path}"
         device.install(apk_path)
+        invalidate_package_catalog(device.serial)
         return f"成功安装APK: {apk_path}"
     except Exception as e:
         return f"安装APK失败: {str(e)}"
@@ -32,6 +42,7 @@ async def uninstall_app(package_name: str, device_id: Optional[str] = None) -> s
     try:
         device = get_device(device_id)
         device.uninstall(package_name)
+        invalidate_package_catalog(device.serial)
         return f"成功卸载应用: {package_name}"
     except Exception as e:
         return f"卸载应用失败: {str(e)}"
@@ -45,103 +56,50 @@ async def dump_ui_hierarchy(device_id: Optional[str] = None) -> str:
     """
     try:
         device = get_device(device_id)
-        device.shell("uiautomator dump /sdcard/ui_hierarchy.xml")
         
-        # 创建临时文件
-        with tempfile.NamedTemporaryFile(suffix='.xml', delete=False) as temp_file:
-            temp_path = temp_file.name
-            
-        # 拉取文件
-        device.pull("/sdcard/ui_hierarchy.xml", temp_path)
-        device.shell("rm /sdcard/ui_hierarchy.xml")
+        # dump、读取和清理在一次shell调用中完成
+        content = dump_hierarchy_xml(device)
         
-        # 读取内容
-        with open(temp_path, 'r', errors='ignore') as file:
-            content = file.read()
-            
-        # 删除临时文件
-        os.remove(temp_path)
+        # 完整内容保存到产物存储，界面未变化时不会重复保存
+        artifact, _ = artifact_store.put_bytes(content.encode('utf-8'), "text/xml", "ui_dump", device.serial,
+                                               "dump_ui_hierarchy")
         
         # 如果内容太长，只返回部分
         if len(content) > 10000:
-            content = content[:10000] + "...\n[UI层次结构太长，只显示前面部分]"
+            content = (content[:10000] + "...\n[UI层次结构太长，只显示前面部分，"
+                       f"完整内容可用 fetch_artifact 读取产物 {artifact.handle}]")
             
         return content
     except Exception as e:
         return f"获取UI层次结构失败: {str(e)}"
 
 @mcp.tool()
-async def run_ui_test(test_steps: str, device_id: Optional[str] = None) -> str:
+async def run_ui_test(test_steps: str, step_delay: float = 0.0, device_id: Optional[str] = None) -> str:
     """执行UI测试步骤
 
+    脚本会先整体编译，连续的输入步骤合并为一次设备端调用执行，并报告每步/每批次耗时。
+
     参数:
         test_steps: UI测试步骤，格式为每行一个命令，支持的命令有:
                   tap x y - 点击坐标
+                  tap text="OK" - 点击匹配选择器的元素（选择器: text, text_contains, id, desc, desc_contains, class, index）
                   swipe x1 y1 x2 y2 [duration] - 滑动
                   text "content" - 输入文本
                   wait seconds - 等待秒数
+                  wait_for id=com.app:id/title [timeout=10] - 等待元素出现
+                  wait_gone text="加载中" [timeout=10] - 等待元素消失
+                  assert_exists text="完成" - 断言元素存在
                   press keycode - 按下按键
                   home - 按Home键
                   back - 按返回键
+                  repeat N ... end - 重复执行N次
+        step_delay: 每个输入步骤后在设备端额外等待的秒数，默认0
         device_id: 设备ID（可选，如果未提供则使用第一个可用设备）
     """
     try:
         device = get_device(device_id)
-        results = []
-        
-        lines = test_steps.strip().split('\n')
-        for line in lines:
-            line = line.strip()
-            if not line or line.startswith('#'):
-                continue
-                
-            parts = line.split()
-            cmd = parts[0].lower()
-            
-            if cmd == 'tap' and len(parts) >= 3:
-                x, y = int(parts[1]), int(parts[2])
-                device.shell(f"input tap {x} {y}")
-                results.append(f"点击 ({x}, {y})")
-                
-            elif cmd == 'swipe' and len(parts) >= 5:
-                x1, y1, x2, y2 = int(parts[1]), int(parts[2]), int(parts[3]), int(parts[4])
-                duration = parts[5] if len(parts) >= 6 else "300"
-                device.shell(f"input swipe {x1} {y1} {x2} {y2} {duration}")
-                results.append(f"滑动 ({x1}, {y1}) 到 ({x2}, {y2})")
-                
-            elif cmd == 'text' and len(parts) >= 2:
-                text = ' '.join(parts[1:])
-                if text.startswith('"') and text.endswith('"'):
-                    text = text[1:-1]
-                escaped_text = text.replace("'", "\\'").replace('"', '\\"').replace(" ", "%s")
-                device.shell(f"input text '{escaped_text}'")
-                results.append(f"输入文本: {text}")
-                
-            elif cmd == 'wait' and len(parts) >= 2:
-                seconds = float(parts[1])
-                time.sleep(seconds)
-                results.append(f"等待 {seconds} 秒")
-                
-            elif cmd == 'press' and len(parts) >= 2:
-                keycode = parts[1]
-                device.shell(f"input keyevent {keycode}")
-                results.append(f"按下按键 {keycode}")
-                
-            elif cmd == 'home':
-                device.shell("input keyevent 3")
-                results.append("按下Home键")
-                
-            elif cmd == 'back':
-                device.shell("input keyevent 4")
-                results.append("按下返回键")
-                
-            else:
-                results.append(f"未识别的命令: {line}")
-                
-            # 每个操作后短暂等待
-            time.sleep(0.5)
-        
-        return "执行结果:\n" + "\n".join(results)
+        steps = compile_script(test_steps)
+        return ScriptRunner(device, step_delay=step_delay).run(steps)
     except Exception as e:
         return f"执行UI测试失败: {str(e)}"
 
@@ -232,7 +190,7 @@ async def collect_device_logs(duration: int = 10, device_id: Optional[str] = Non
         
         # 收集指定时长的日志
         print(f"正在收集 {duration} 秒的设备日志...")
-        time.sleep(duration)
+        scheduler.sleep(duration)
         
         # 获取日志
         logs = device.shell(f"logcat -d -v threadtime")
@@ -246,24 +204,33 @@ async def collect_device_logs(duration: int = 10, device_id: Optional[str] = Non
         return f"收集设备日志失败: {str(e)}"
 
 @mcp.tool()
-async def analyze_performance(package_name: str, duration: int = 10, device_id: Optional[str] = None) -> str:
+async def analyze_performance(package_name: str, duration: int = 10, wait_for_cool: bool = False,
+                              device_id: Optional[str] = None) -> str:
     """分析应用性能
 
+    每个采样点同时记录设备温度、热状态、CPU频率上限和功耗，采样期间发生降频或热节流时在结果开头标出。
+
     参数:
         package_name: 应用包名
         duration: 分析时长（秒），默认10秒
+        wait_for_cool: 开始前是否等待设备冷却和空闲（见 wait_for_device_ready），默认否
         device_id: 设备ID（可选，如果未提供则使用第一个可用设备）
     """
     try:
         device = get_device(device_id)
+        gate = ""
+        if wait_for_cool:
+            ready, waited, detail = device_conditions.wait_until_ready(device, sleep=scheduler.sleep)
+            gate = f"{'设备已就绪' if ready else '等待冷却超时，仍然开始分析'}（等待 {waited:.0f}秒）: {detail}\n"
         
         # 启动应用
         device.shell(f"monkey -p {package_name} -c android.intent.category.LAUNCHER 1")
-        time.sleep(2)  # 等待应用启动
+        scheduler.sleep(2)  # 等待应用启动
         
         # 收集性能数据
         print(f"正在收集 {duration} 秒的性能数据...")
         performance_data = []
+        conditions = device_conditions.ConditionSampler(device.serial, 1.0)
         
         start_time = time.time()
         while time.time() - start_time < duration:
@@ -273,26 +240,208 @@ async def analyze_performance(package_name: str, duration: int = 10, device_id:
             # 获取CPU使用
             cpu_info = device.shell(f"top -n 1 | grep {package_name}")
             
-            # 获取电池消耗
-            battery_info = device.shell("dumpsys battery | grep level")
+            # 获取温度、频率、热状态和电池状态（一次shell调用）
+            try:
+                reading = conditions.sample(device)
+                state = reading.describe(conditions.previous)
+                reasons = reading.throttle_reasons()
+                if reasons:
+                    state += f"\n  [降频] {'；'.join(reasons)}"
+            except Exception as e:
+                state = f"无法读取（{e}）"
             
             performance_data.append(f"时间点: {time.time() - start_time:.2f}秒\n"
                                   f"CPU: {cpu_info.strip()}\n"
-                                  f"电池: {battery_info.strip()}\n"
+                                  f"设备状态: {state}\n"
                                   f"内存摘要: {' '.join(mem_info.split()[:20]) if mem_info else '无法获取'}")
             
-            time.sleep(1)
+            scheduler.sleep(1)
         
-        return "性能分析结果:\n\n" + "\n\n".join(performance_data)
+        return (f"性能分析结果:\n{gate}{conditions.throttle_summary()}\n\n" + "\n\n".join(performance_data)
+                + "\n\n设备状态汇总:\n" + conditions.report())
     except Exception as e:
         return f"分析应用性能失败: {str(e)}"
 
+_condition_samplers = {}
+
+
+def _prune_condition_samplers():
+    alive = {job.id for job in list_jobs("condition_sampler")}
+    for sampler_id in [key for key in _condition_samplers if key not in alive]:
+        del _condition_samplers[sampler_id]
+
+@mcp.tool()
+async def start_condition_sampler(interval: float = 2.0, duration: int = 600, device_id: Optional[str] = None) -> str:
+    """在后台采样设备温度、各核心CPU频率、电池电流电压和系统热状态，立即返回采样器ID
+
+    每次采样只用一次shell调用。用 get_device_conditions 查看统计和降频情况，用 stop_condition_sampler 停止。
+
+    参数:
+        interval: 采样间隔（秒），默认2.0
+        duration: 采样时长（秒），默认600，0表示一直采样直到停止
+        device_id: 设备ID（可选，如果未提供则使用第一个可用设备）
+    """
+    try:
+        device = get_device(device_id)
+        sampler = device_conditions.ConditionSampler(device.serial, interval)
+        job = start_job("condition_sampler", device.serial, device_conditions.run_sampler, device, sampler, duration)
+        _prune_condition_samplers()
+        _condition_samplers[job.id] = sampler
+        return (f"已开始采样设备状态，采样器ID: {job.id}（间隔 {sampler.interval:.1f}秒）\n"
+                f"使用 get_device_conditions 查看统计")
+    except Exception as e:
+        return f"启动设备状态采样失败: {str(e)}"
+
+@mcp.tool()
+async def get_device_conditions(sampler_id: Optional[str] = None, window: int = 0,
+                                device_id: Optional[str] = None) -> str:
+    """查看设备的温度、CPU频率、功耗和热状态，以及是否处于降频或热节流状态
+
+    参数:
+        sampler_id: 采样器ID（可选，提供时返回该采样器的统计；不提供时读取一次设备当前状态）
+        window: 只统计最近多少秒（默认0，统计全部采样）
+        device_id: 设备ID（可选，如果未提供则使用第一个可用设备）
+    """
+    try:
+        if sampler_id:
+            job = get_job(sampler_id, kind="condition_sampler")
+            sampler = _condition_samplers.get(sampler_id)
+            if sampler is None:
+                return job.describe()
+            return job.describe() + "\n\n" + sampler.report(window)
+        device = get_device(device_id)
+        reading = device_conditions.read_conditions(device)
+        lines = [reading.describe()]
+        reasons = reading.throttle_reasons()
+        lines.append("降频或热节流: " + "；".join(reasons) if reasons else "未检测到降频或热节流")
+        hottest = sorted(reading.temps.items(), key=lambda item: item[1], reverse=True)[:8]
+        if hottest:
+            lines.append("温度最高的温区: " + "，".join(f"{name} {value:.1f}°C" for name, value in hottest))
+        if reading.freqs:
+            lines.append("核心频率(MHz) 当前/上限/最高: " + "，".join(
+                f"{core} {current // 1000}/{limit // 1000}/{maximum // 1000}"
+                for core, (current, maximum, limit) in reading.freqs.items()))
+        samplers = list_jobs("condition_sampler")
+        if samplers:
+            lines.append("\n采样器: " + "，".join(f"{job.id}（{job.status}）" for job in samplers))
+        return "\n".join(lines)
+    except Exception as e:
+        return f"获取设备状态失败: {str(e)}"
+
 @mcp.tool()
-async def take_screen_recording(duration: int = 10, device_id: Optional[str] = None) -> str:
-    """录制设备屏幕视频
+async def stop_condition_sampler(sampler_id: str) -> str:
+    """停止设备状态采样器并返回最终统计（统计结果保留，之后仍可用 get_device_conditions 查看）
+
+    参数:
+        sampler_id: 采样器ID
+    """
+    try:
+        job = get_job(sampler_id, kind="condition_sampler")
+        job.cancel()
+        while not job.finished:
+            await asyncio.sleep(0.1)
+        sampler = _condition_samplers.get(sampler_id)
+        report = sampler.report() if sampler is not None else ""
+        return f"已停止设备状态采样器 {sampler_id}\n\n{report}".rstrip()
+    except Exception as e:
+        return f"停止设备状态采样失败: {str(e)}"
+
+@mcp.tool()
+async def wait_for_device_ready(max_temp: float = device_conditions.COOL_TEMP,
+                                max_cpu_busy: float = device_conditions.IDLE_CPU_BUSY, timeout: int = 300,
+                                device_id: Optional[str] = None) -> str:
+    """性能测试前的冷却门控: 等待设备冷却、空闲且没有降频
+
+    每2秒采样一次，温度不超过 max_temp、CPU占用不超过 max_cpu_busy、系统热状态为 none 且各核心频率上限未被压低，
+    连续3次满足时返回。
+
+    参数:
+        max_temp: 设备温度上限（°C，CPU/SoC/机身/电池温区的最高值），默认42
+        max_cpu_busy: CPU占用上限（%），默认25
+        timeout: 最长等待时间（秒），默认300
+        device_id: 设备ID（可选，如果未提供则使用第一个可用设备）
+    """
+    try:
+        device = get_device(device_id)
+        ready, waited, detail = device_conditions.wait_until_ready(device, max_temp, max_cpu_busy, timeout,
+                                                                   sleep=scheduler.sleep)
+        if ready:
+            return f"设备已就绪（等待 {waited:.0f}秒）: {detail}"
+        return f"等待设备冷却失败: {timeout}秒后仍未就绪，{detail}"
+    except Exception as e:
+        return f"等待设备冷却失败: {str(e)}"
+
+def _describe_trace(result: dict) -> str:
+    note = "（已提前停止）" if result["stopped_early"] else ""
+    return (f"trace采集完成{note}，产物句柄: {result['handle']}（{result['size']}字节，"
+            f"本地文件 {result['path']}，可在 https://ui.perfetto.dev 打开）\n\n{result['summary']}")
+
+@mcp.tool()
+async def capture_trace(package_name: Optional[str] = None, duration: int = 10,
+                        categories: str = perfetto_trace.DEFAULT_CATEGORIES, buffer_mb: int = 64,
+                        wait: bool = True, device_id: Optional[str] = None) -> str:
+    """用perfetto采集系统trace（调度、CPU频率、binder、atrace分类和应用切片），在主机上流式解析并汇总
+
+    汇总包括: 各进程和线程的CPU时间、主线程最长的切片、binder同步调用耗时、各CPU的频率驻留。
+    trace文件保存到产物存储，可在 Perfetto UI 中打开查看细节。采集期间请在设备上操作要分析的场景。
+
+    参数:
+        package_name: 要分析的应用包名（可选，提供时启用该应用的切片并只汇总它的线程）
+        duration: 采集时长（秒），默认10秒
+        categories: atrace分类，逗号分隔
+        buffer_mb: trace缓冲区大小（MB），默认64
+        wait: 是否等待采集完成后返回汇总，默认是；否则立即返回任务ID，用 get_trace_status 查看
+        device_id: 设备ID（可选，如果未提供则使用第一个可用设备）
+    """
+    try:
+        device = get_device(device_id)
+        # 等待结果时本调用一直占用设备的后台执行位置；不等待时任务单独排队
+        job = start_job("trace", device.serial, perfetto_trace.run_capture, device, package_name, duration,
+                        categories, buffer_mb, device_lane=not wait)
+        if not wait:
+            return f"已开始采集trace，任务ID: {job.id}\n使用 get_trace_status 查看进度和汇总"
+        while not job.finished:
+            if scheduler.cancelled():
+                # 调用被取消或超过截止时间，提前结束采集（已采集的部分仍会汇总）
+                job.cancel()
+            await asyncio.sleep(0.5)
+        if job.status == "failed" or job.result is None:
+            return f"采集trace失败: {job.error or job.status}"
+        return _describe_trace(job.result)
+    except Exception as e:
+        return f"采集trace失败: {str(e)}"
+
+@mcp.tool()
+async def get_trace_status(trace_id: Optional[str] = None, stop: bool = False) -> str:
+    """查看trace采集任务的进度；完成后返回汇总
+
+    参数:
+        trace_id: 任务ID（可选，不提供时列出所有trace任务）
+        stop: 是否提前结束采集（已采集的部分仍会拉取并汇总）
+    """
+    try:
+        if not trace_id:
+            jobs = list_jobs("trace")
+            if not jobs:
+                return "没有trace任务"
+            return "\n\n".join(job.describe() for job in jobs)
+        job = get_job(trace_id, kind="trace")
+        if stop and not job.finished:
+            job.cancel()
+            return job.describe() + "\n已请求停止采集，稍后再次查看汇总"
+        if job.finished and job.result is not None:
+            return job.describe() + "\n\n" + _describe_trace(job.result)
+        return job.describe()
+    except Exception as e:
+        return f"获取trace状态失败: {str(e)}"
+
+@mcp.tool()
+async def take_screen_recording(duration: int = 10, inline: bool = False, device_id: Optional[str] = None) -> Any:
+    """录制设备屏幕视频，视频保存到产物存储并返回句柄
 
     参数:
         duration: 录制时长（秒），默认10秒
+        inline: 是否同时内联返回视频内容，默认否（通过资源链接或 fetch_artifact 按需读取）
         device_id: 设备ID（可选，如果未提供则使用第一个可用设备）
     """
     try:
@@ -303,24 +452,13 @@ async def take_screen_recording(duration: int = 10, device_id: Optional[str] = N
         print(f"正在录制视频，持续 {duration} 秒...")
         
         # 等待录制完成（额外多等待一秒以确保录制完成）
-        time.sleep(duration + 1)
+        scheduler.sleep(duration + 1)
         
-        # 创建临时文件
-        with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as temp_file:
-            temp_path = temp_file.name
-            
-        # 从设备拉取视频文件
-        device.pull("/sdcard/screen_recording.mp4", temp_path)
+        # 从设备拉取视频到产物存储
+        result = pull_artifact(device, "/sdcard/screen_recording.mp4", "video/mp4", "recording",
+                               "take_screen_recording", inline)
         device.shell("rm /sdcard/screen_recording.mp4")
-        
-        # 转换为base64
-        with open(temp_path, 'rb') as file:
-            base64_data = base64.b64encode(file.read()).decode('utf-8')
-            
-        # 删除临时文件
-        os.remove(temp_path)
-        
-        return f"data:video/mp4;base64,{base64_data}"
+        return result
     except Exception as e:
         return f"录制屏幕视频失败: {str(e)}"
 
@@ -371,8 +509,15 @@ async def enhanced_start_app(package_name: str, activity_name: Optional[str] = N
         if not success:
             try:
                 result += "尝试查找可能的启动Activity...\n"
+                # 优先使用应用目录中解析出的启动Activity（按版本缓存）
+                common_activities = []
+                catalog = get_package_catalog(device)
+                if catalog.get(package_name):
+                    launcher = catalog.launch_activity(device, package_name)
+                    if launcher:
+                        common_activities.append(launcher)
                 # 尝试常见的启动活动名称
-                common_activities = [
+                common_activities += [
                     f"{package_name}.SplashActivity",
                     f"{package_name}.MainActivity", 
                     f"{package_name}.StartActivity",
@@ -0,0 +1,295 @@
+from typing import Dict, List, Optional, Tuple
+import csv
+import hashlib
+import io
+import json
+import os
+import re
+import shlex
+import sqlite3
+import tempfile
+import threading
+import xml.etree.ElementTree as ET
+from .adb_server import iter_exec_out
+
+# 在主机上查询时，数据库副本的缓存目录
+CACHE_DIR = os.path.join(tempfile.gettempdir(), "adb_mcp_app_db")
+
+METHODS = ("auto", "sqlite3", "pull")
+
+# 单次返回的最大行数
+MAX_LIMIT = 1000
+
+# 退回CSV格式时 sqlite3 命令行中 NULL 的输出
+_NULL = "\\N"
+
+# 单次shell调用中分隔多个SharedPreferences文件的标记
+_PREFS_MARKER = "__ADB_MCP_PREFS__ "
+
+_PACKAGE_NAME = re.compile(r"^[A-Za-z0-9_.]+$")
+
+# 每台设备上是否有 sqlite3 命令，以及它是否支持 -quote 输出模式
+_device_sqlite3: Dict[str, bool] = {}
+_device_quote_mode: Dict[str, bool] = {}
+
+# -quote 模式的字段: '字符串'（'' 转义）、X'十六进制' BLOB、NULL 或数字
+_QUOTED_VALUE = re.compile(r"'((?:[^']|'')*)'|[Xx]'([0-9A-Fa-f]*)'|(NULL|[-+0-9.eE]+|[-+]?Inf)")
+_REPLACE_ARGS = re.compile(r",'((?:[^']|'')*)',char\((\d+)\)\)")
+
+
+class _CachedDatabase:
+    """设备数据库在主机上的副本，按设备上数据库文件和WAL文件的 (大小, 修改时间) 判断是否过期"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.signature: Optional[str] = None
+        self.lock = threading.Lock()
+
+
+_cache: Dict[Tuple[str, str, str], _CachedDatabase] = {}
+_cache_lock = threading.Lock()
+
+
+def _check_package(package_name: str):
+    if not _PACKAGE_NAME.match(package_name):
+        raise ValueError(f"无效的包名: {package_name}")
+
+
+def _run_as(package_name: str, command: str) -> str:
+    return f"run-as {package_name} {command}"
+
+
+def _raise_run_as_error(output: str):
+    """run-as 失败（应用不可调试、包不存在）时输出以 "run-as:" 开头"""
+    for line in output.splitlines():
+        if line.startswith("run-as:"):
+            raise RuntimeError(f"{line.strip()}（只能读取可调试（debuggable）应用的数据）")
+
+
+def database_path(database: str) -> str:
+    """数据库名（databases/ 目录下）或应用数据目录下的相对路径"""
+    if "/" in database:
+        return database
+    return f"databases/{database}"
+
+
+def paged_sql(sql: str, limit: int, offset: int) -> Tuple[str, bool]:
+    """查询语句外包一层 LIMIT/OFFSET（多取一行用于判断是否还有更多），其他语句（PRAGMA 等）原样执行"""
+    statement = sql.strip().rstrip(";").strip()
+    if re.match(r"(?is)^(select|with)\b", statement):
+        return f"SELECT * FROM ({statement}) LIMIT {limit + 1} OFFSET {offset}", True
+    return statement, False
+
+
+def _has_sqlite3(device) -> bool:
+    if device.serial not in _device_sqlite3:
+        _device_sqlite3[device.serial] = "sqlite3" in device.shell("command -v sqlite3")
+    return _device_sqlite3[device.serial]
+
+
+def _query_on_device(device, package_name: str, path: str, sql: str) -> Tuple[List[str], List[list]]:
+    """在设备上用 run-as + sqlite3 以只读方式执行查询
+
+    用 -quote 模式输出（字符串带引号，数字、NULL、BLOB 按字面量），还原出与主机端查询一致的类型；
+    不支持 -quote 的旧版 sqlite3 退回CSV格式，值都作为字符串返回（不猜测类型，避免 "007" 之类的文本变成数字）。
+    """
+    quote = _device_quote_mode.get(device.serial, True)
+    mode = "-quote" if quote else f"-csv -nullvalue {shlex.quote(_NULL)}"
+    output = device.shell(_run_as(package_name, f"sqlite3 -readonly {mode} -header {shlex.quote(path)} {shlex.quote(sql)}"))
+    _raise_run_as_error(output)
+    if quote and "unknown option: -quote" in output:
+        _device_quote_mode[device.serial] = False
+        return _query_on_device(device, package_name, path, sql)
+    if output.startswith(("Error:", "Parse error", "Runtime error")):
+        raise RuntimeError(output.strip()[:500])
+    if quote:
+        rows = parse_quoted_rows(output)
+    else:
+        rows = [[None if value == _NULL else value for value in row] for row in csv.reader(io.StringIO(output)) if row]
+    if not rows:
+        return [], []
+    return [str(column) for column in rows[0]], rows[1:]
+
+
+def _quoted_value(text: str, pos: int):
+    """解析 -quote 输出中的一个值，返回 (值, 结束位置)"""
+    if text.startswith("replace(", pos):
+        # 新版 sqlite3 把字符串中的换行输出为 replace('a\nb','\n',char(10))
+        inner, pos = _quoted_value(text, pos + len("replace("))
+        match = _REPLACE_ARGS.match(text, pos)
+        if not match or not isinstance(inner, str):
+            raise ValueError(f"无法解析 sqlite3 输出: {text[pos:pos + 50]}")
+        return inner.replace(match.group(1).replace("''", "'"), chr(int(match.group(2)))), match.end()
+    match = _QUOTED_VALUE.match(text, pos)
+    if not match or match.end() == pos:
+        raise ValueError(f"无法解析 sqlite3 输出: {text[pos:pos + 50]}")
+    string, blob, literal = match.groups()
+    if string is not None:
+        return string.replace("''", "'"), match.end()
+    if blob is not None:
+        return f"<BLOB {len(blob) // 2}字节>", match.end()
+    if literal == "NULL":
+        return None, match.end()
+    try:
+        return int(literal), match.end()
+    except ValueError:
+        return float(literal), match.end()
+
+
+def parse_quoted_rows(output: str) -> List[list]:
+    """解析 sqlite3 -quote 模式的输出（逗号分隔字段，换行分隔行；字符串内可以包含逗号和换行）"""
+    rows: List[list] = []
+    row: list = []
+    pos, end = 0, len(output.rstrip("\r\n"))
+    while pos < end:
+        value, pos = _quoted_value(output, pos)
+        row.append(value)
+        if output.startswith(",", pos):
+            pos += 1
+            continue
+        rows.append(row)
+        row = []
+        pos += 2 if output.startswith("\r\n", pos) else 1
+    return rows
+
+
+def _stat(device, package_name: str, paths: List[str]) -> Dict[str, str]:
+    quoted = " ".join(shlex.quote(path) for path in paths)
+    output = device.shell(_run_as(package_name, f"stat -c '%n %s %Y' {quoted}") + " 2>&1")
+    _raise_run_as_error(output)
+    result = {}
+    for line in output.splitlines():
+        for path in paths:
+            if line.startswith(path + " "):
+                result[path] = line[len(path) + 1:].strip()
+    return result
+
+
+def _pull_to(device, package_name: str, path: str, local_path: str) -> int:
+    size = 0
+    with open(local_path, "wb") as file:
+        for chunk in iter_exec_out(device, _run_as(package_name, f"cat {shlex.quote(path)}") + " 2>/dev/null"):
+            file.write(chunk)
+            size += len(chunk)
+    return size
+
+
+def cached_database(device, package_name: str, path: str) -> Tuple[str, bool]:
+    """返回数据库在主机上的最新副本路径，以及这次是否重新拉取了文件
+
+    每次只用一次shell调用检查设备上数据库和WAL文件的大小与修改时间，没有变化时直接使用缓存的副本。
+    """
+    key = (device.serial, package_name, path)
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is None:
+            digest = hashlib.sha1("\0".join(key).encode("utf-8")).hexdigest()[:16]
+            entry = _cache[key] = _CachedDatabase(os.path.join(CACHE_DIR, digest, "db.sqlite"))
+
+    with entry.lock:
+        wal = path + "-wal"
+        stats = _stat(device, package_name, [path, wal])
+        if path not in stats:
+            raise RuntimeError(f"应用 {package_name} 中没有数据库文件: {path}")
+        signature = f"{stats[path]}|{stats.get(wal, '')}"
+        if signature == entry.signature and os.path.exists(entry.path):
+            return entry.path, False
+
+        os.makedirs(os.path.dirname(entry.path), exist_ok=True)
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(entry.path + suffix):
+                os.remove(entry.path + suffix)
+        expected = int(stats[path].split()[0])
+        if _pull_to(device, package_name, path, entry.path) != expected:
+            raise RuntimeError(f"读取数据库文件不完整: {path}（数据库可能正在被写入，请重试）")
+        if wal in stats:
+            # 最近的修改可能还在WAL文件中，一起拉取，主机上打开时自动合并
+            _pull_to(device, package_name, wal, entry.path + "-wal")
+        entry.signature = signature
+        return entry.path, True
+
+
+def _query_on_host(local_path: str, sql: str) -> Tuple[List[str], List[list]]:
+    connection = sqlite3.connect(local_path)
+    try:
+        # 副本只用于查询，修改语句不能让它与设备上的数据库不一致
+        connection.execute("PRAGMA query_only = ON")
+        cursor = connection.execute(sql)
+        columns = [column[0] for column in cursor.description or []]
+        rows = [[_jsonable(value) for value in row] for row in cursor.fetchall()]
+        return columns, rows
+    finally:
+        connection.close()
+
+
+def _jsonable(value):
+    if isinstance(value, bytes):
+        return f"<BLOB {len(value)}字节>"
+    return value
+
+
+def query_database(device, package_name: str, database: str, sql: str, limit: int = 100, offset: int = 0,
+                   method: str = "auto") -> dict:
+    """查询应用的SQLite数据库，返回 {"columns", "rows", "offset", "has_more", "source"}"""
+    _check_package(package_name)
+    if method not in METHODS:
+        raise ValueError(f"无效的查询方式: {method}（可选: {', '.join(METHODS)}）")
+    limit = max(1, min(limit, MAX_LIMIT))
+    path = database_path(database)
+    statement, paged = paged_sql(sql, limit, max(offset, 0))
+    if method == "sqlite3" or (method == "auto" and _has_sqlite3(device)):
+        columns, rows = _query_on_device(device, package_name, path, statement)
+        source = "设备端 sqlite3"
+    else:
+        local_path, pulled = cached_database(device, package_name, path)
+        columns, rows = _query_on_host(local_path, statement)
+        source = "主机缓存（已重新拉取数据库）" if pulled else "主机缓存（数据库未变化）"
+    has_more = paged and len(rows) > limit
+    return {"columns": columns, "rows": rows[:limit], "offset": max(offset, 0), "has_more": has_more,
+            "source": source}
+
+
+def _pref_value(element: ET.Element):
+    tag = element.tag
+    if tag == "string":
+        return element.text or ""
+    if tag == "set":
+        return [child.text or "" for child in element]
+    value = element.get("value")
+    if tag in ("int", "long"):
+        return int(value)
+    if tag == "float":
+        return float(value)
+    if tag == "boolean":
+        return value == "true"
+    return value
+
+
+def parse_shared_prefs(xml: str) -> Dict[str, object]:
+    root = ET.fromstring(xml)
+    return {element.get("name"): _pref_value(element) for element in root if element.get("name") is not None}
+
+
+def read_shared_prefs(device, package_name: str, name: Optional[str] = None) -> Dict[str, Dict[str, object]]:
+    """一次shell调用读取应用的一个或全部SharedPreferences文件，返回 {文件名: {键: 值}}"""
+    _check_package(package_name)
+    pattern = f"shared_prefs/{shlex.quote(name if name.endswith('.xml') else name + '.xml')}" if name \
+        else "shared_prefs/*.xml"
+    script = f'for f in {pattern}; do [ -f "$f" ] && echo "{_PREFS_MARKER}$f" && cat "$f"; done'
+    output = device.shell(_run_as(package_name, f"sh -c {shlex.quote(script)}") + " 2>&1")
+    _raise_run_as_error(output)
+    result = {}
+    for block in output.split(_PREFS_MARKER)[1:]:
+        file_name, _, content = block.partition("\n")
+        file_name = os.path.basename(file_name.strip())[:-len(".xml")]
+        try:
+            result[file_name] = parse_shared_prefs(content.strip())
+        except ET.ParseError as e:
+            result[file_name] = {"<解析失败>": str(e)}
+    if name and not result:
+        raise RuntimeError(f"应用 {package_name} 中没有SharedPreferences文件: {name}")
+    return result
+
+
+def to_json(value, indent: Optional[int] = None) -> str:
+    return json.dumps(value, ensure_ascii=False, indent=indent)
@@ -0,0 +1,74 @@
+from typing import Any, Optional
+from .adb_server import binary_content, mcp
+from .artifacts import store
+
+# fetch_artifact 单次返回的默认/最大字节数
+DEFAULT_FETCH_BYTES = 4 * 1024 * 1024
+MAX_FETCH_BYTES = 32 * 1024 * 1024
+
+
+@mcp.resource("artifact://{handle}", name="artifact", mime_type="application/octet-stream",
+              description="产物存储中的截图、录屏、界面层次结构、Bug报告等，按内容哈希句柄读取")
+def read_artifact(handle: str) -> bytes:
+    _, data = store.read(handle)
+    return data
+
+
+@mcp.tool()
+async def fetch_artifact(handle: str, offset: int = 0, length: Optional[int] = None) -> Any:
+    """读取产物存储中的内容，支持按字节范围读取（内存映射，不整体加载大文件）
+
+    参数:
+        handle: 产物句柄（take_screenshot、record_screen、dump_ui_hierarchy 等返回），也接受 artifact:// URI
+        offset: 起始字节偏移，默认0
+        length: 读取的字节数（可选，默认4MB，单次最多32MB）
+    """
+    try:
+        length = min(length if length is not None else DEFAULT_FETCH_BYTES, MAX_FETCH_BYTES)
+        artifact, data = store.read(handle, offset, length)
+        end = offset + len(data)
+        if offset == 0 and end == artifact.size:
+            return binary_content(data, artifact.mime_type, artifact.uri)
+        # 部分内容不是完整的图片，按普通二进制/文本返回
+        mime_type = artifact.mime_type if artifact.mime_type.startswith("text/") else "application/octet-stream"
+        note = f"产物 {artifact.handle} 字节 {offset}-{end}（共 {artifact.size} 字节）"
+        if end < artifact.size:
+            note += f"，继续读取请使用 offset={end}"
+        return [note, binary_content(data, mime_type, f"{artifact.uri}?offset={offset}&length={len(data)}")]
+    except Exception as e:
+        return f"读取产物失败: {str(e)}"
+
+
+@mcp.tool()
+async def list_artifacts(kind: Optional[str] = None, device_id: Optional[str] = None, limit: int = 20) -> str:
+    """列出产物存储中的内容（最新的在前）
+
+    参数:
+        kind: 按类型筛选（可选）: screenshot、recording、ui_dump、file、bugreport
+        device_id: 按设备筛选（可选）
+        limit: 最多列出的数量，默认20
+    """
+    try:
+        artifacts = store.list(kind, device_id)
+        stats = store.stats()
+        header = (f"产物存储: {stats['count']} 个产物，{stats['bytes'] / 1024 / 1024:.1f}MB / "
+                  f"{stats['max_bytes'] / 1024 / 1024:.0f}MB（{stats['root']}）")
+        if not artifacts:
+            return header + "\n没有匹配的产物"
+        return header + "\n" + "\n".join(artifact.describe() for artifact in artifacts[:limit])
+    except Exception as e:
+        return f"列出产物失败: {str(e)}"
+
+
+@mcp.tool()
+async def delete_artifact(handle: str) -> str:
+    """从产物存储中删除一个产物
+
+    参数:
+        handle: 产物句柄
+    """
+    try:
+        store.delete(handle)
+        return f"已删除产物: {handle}"
+    except Exception as e:
+        return f"删除产物失败: {str(e)}"
@@ -0,0 +1,238 @@
+from typing import Dict, List, Optional, Tuple
+import hashlib
+import mmap
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+# 产物存储目录、每个进程的总大小上限（字节）和最长保留时间（秒），可通过环境变量调整
+ARTIFACT_DIR = os.environ.get("ADB_MCP_ARTIFACT_DIR", os.path.join(tempfile.gettempdir(), "adb_mcp_artifacts"))
+MAX_TOTAL_BYTES = int(os.environ.get("ADB_MCP_ARTIFACT_MAX_BYTES", str(2 * 1024 ** 3)))
+MAX_AGE = float(os.environ.get("ADB_MCP_ARTIFACT_MAX_AGE", str(24 * 3600)))
+
+# 句柄为内容SHA-256的前16个十六进制字符
+HANDLE_LENGTH = 16
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+class Artifact:
+    """存储中的一个产物（按内容寻址，相同内容只保存一份）"""
+
+    __slots__ = ("digest", "size", "mime_type", "kind", "device", "source", "created", "last_access", "hits")
+
+    def __init__(self, digest: str, size: int, mime_type: str, kind: str, device: Optional[str] = None,
+                 source: Optional[str] = None, created: Optional[float] = None,
+                 last_access: Optional[float] = None, hits: int = 0):
+        self.digest = digest
+        self.size = size
+        self.mime_type = mime_type
+        self.kind = kind
+        self.device = device
+        self.source = source
+        self.created = created or time.time()
+        self.last_access = last_access or self.created
+        self.hits = hits
+
+    @property
+    def handle(self) -> str:
+        return self.digest[:HANDLE_LENGTH]
+
+    @property
+    def uri(self) -> str:
+        return f"artifact://{self.handle}"
+
+    def describe(self) -> str:
+        created = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.created))
+        parts = [self.handle, self.kind, self.mime_type, f"{self.size}字节", created]
+        if self.device:
+            parts.append(f"设备={self.device}")
+        if self.source:
+            parts.append(f"来源={self.source}")
+        return "  ".join(parts)
+
+
+class ArtifactStore:
+    """按内容哈希寻址的磁盘产物存储，超过大小或时间限制时按最近最少使用淘汰
+
+    stdio 模式下每个客户端启动自己的服务器进程，它们共享同一个存储目录；每个进程使用以进程号命名的子目录，
+    索引只保存在内存中，进程之间不会覆盖或淘汰彼此的产物。已退出进程留下的子目录在下次加载时清理。
+    """
+
+    def __init__(self, root: str = ARTIFACT_DIR, max_bytes: int = MAX_TOTAL_BYTES, max_age: float = MAX_AGE):
+        self.base = root
+        self.root = os.path.join(root, str(os.getpid()))
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._entries: Dict[str, Artifact] = {}
+        self._lock = threading.RLock()
+        self._loaded = False
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        os.makedirs(self.root, exist_ok=True)
+        self._remove_orphans()
+
+    def _remove_orphans(self):
+        """删除已退出进程的子目录；Windows 上无法安全检查进程是否存在，改为按最后修改时间清理"""
+        now = time.time()
+        try:
+            names = os.listdir(self.base)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.base, name)
+            if not name.isdigit() or path == self.root or not os.path.isdir(path):
+                continue
+            try:
+                orphan = now - os.path.getmtime(path) > self.max_age if os.name == "nt" else not _process_alive(int(name))
+            except OSError:
+                continue
+            if orphan:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest)
+
+    # 写入
+    def _register(self, digest: str, size: int, mime_type: str, kind: str, device: Optional[str],
+                  source: Optional[str]) -> Tuple[Artifact, bool]:
+        existing = self._entries.get(digest)
+        if existing is not None:
+            existing.last_access = time.time()
+            existing.hits += 1
+            return existing, True
+        artifact = Artifact(digest, size, mime_type, kind, device, source)
+        self._entries[digest] = artifact
+        self._evict(keep=digest)
+        return artifact, False
+
+    def put_bytes(self, data: bytes, mime_type: str, kind: str, device: Optional[str] = None,
+                  source: Optional[str] = None) -> Tuple[Artifact, bool]:
+        """保存数据，返回 (产物, 是否与已有产物重复)"""
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            self._load()
+            if digest not in self._entries:
+                path = self._path(digest)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path + ".tmp", "wb") as file:
+                    file.write(data)
+                os.replace(path + ".tmp", path)
+            return self._register(digest, len(data), mime_type, kind, device, source)
+
+    def put_file(self, src: str, mime_type: str, kind: str, device: Optional[str] = None,
+                 source: Optional[str] = None, move: bool = False) -> Tuple[Artifact, bool]:
+        """保存本地文件（分块计算哈希，不整体读入内存）；move=False 时优先使用硬链接避免复制"""
+        hasher = hashlib.sha256()
+        with open(src, "rb") as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                hasher.update(chunk)
+        digest = hasher.hexdigest()
+        with self._lock:
+            self._load()
+            path = self._path(digest)
+            if digest not in self._entries or not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                if move:
+                    shutil.move(src, path)
+                else:
+                    try:
+                        os.link(src, path)
+                    except OSError:
+                        shutil.copyfile(src, path)
+            elif move:
+                os.remove(src)
+            return self._register(digest, os.path.getsize(path), mime_type, kind, device, source)
+
+    # 读取
+    def get(self, handle: str) -> Artifact:
+        handle = handle.strip()
+        if handle.startswith("artifact://"):
+            handle = handle[len("artifact://"):]
+        with self._lock:
+            self._load()
+            matches = [artifact for digest, artifact in self._entries.items() if digest.startswith(handle)]
+            if not matches or len(handle) < 6:
+                raise ValueError(f"未找到产物: {handle}")
+            if len(matches) > 1:
+                raise ValueError(f"产物句柄不唯一: {handle}")
+            artifact = matches[0]
+            artifact.last_access = time.time()
+            return artifact
+
+    def path(self, artifact: Artifact) -> str:
+        return self._path(artifact.digest)
+
+    def read(self, handle: str, offset: int = 0, length: Optional[int] = None) -> Tuple[Artifact, bytes]:
+        """通过内存映射读取产物的一段字节（length 为空时读到末尾）"""
+        artifact = self.get(handle)
+        if offset < 0 or offset > artifact.size:
+            raise ValueError(f"偏移量超出范围: {offset}（大小 {artifact.size}）")
+        end = artifact.size if length is None else min(artifact.size, offset + max(length, 0))
+        if artifact.size == 0 or end == offset:
+            return artifact, b""
+        with open(self._path(artifact.digest), "rb") as file, \
+                mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return artifact, mapped[offset:end]
+
+    def list(self, kind: Optional[str] = None, device: Optional[str] = None) -> List[Artifact]:
+        with self._lock:
+            self._load()
+            self._evict()
+            artifacts = [a for a in self._entries.values()
+                         if (kind is None or a.kind == kind) and (device is None or a.device == device)]
+        return sorted(artifacts, key=lambda artifact: artifact.created, reverse=True)
+
+    def delete(self, handle: str):
+        with self._lock:
+            self._remove(self.get(handle))
+
+    # 淘汰
+    def _remove(self, artifact: Artifact):
+        self._entries.pop(artifact.digest, None)
+        try:
+            os.remove(self._path(artifact.digest))
+        except OSError:
+            pass
+
+    def _evict(self, keep: Optional[str] = None):
+        now = time.time()
+        for artifact in list(self._entries.values()):
+            if artifact.digest != keep and now - artifact.last_access > self.max_age:
+                self._remove(artifact)
+        total = sum(artifact.size for artifact in self._entries.values())
+        if total > self.max_bytes:
+            for artifact in sorted(self._entries.values(), key=lambda a: a.last_access):
+                if total <= self.max_bytes:
+                    break
+                if artifact.digest == keep:
+                    continue
+                total -= artifact.size
+                self._remove(artifact)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            self._load()
+            return {
+                "count": len(self._entries),
+                "bytes": sum(artifact.size for artifact in self._entries.values()),
+                "max_bytes": self.max_bytes,
+                "max_age": self.max_age,
+                "root": self.root,
+            }
+
+
+store = ArtifactStore()
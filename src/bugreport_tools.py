@@ -0,0 +1,380 @@
+from typing import Dict, List, Optional
+import asyncio
+import bisect
+import json
+import mmap
+import os
+import re
+import shutil
+import tempfile
+import time
+import zipfile
+from . import scheduler
+from .adb_server import artifact_store, get_device, mcp, pull_with_progress
+from .jobs import get_job, list_jobs, start_job
+
+# 本地保存bug报告及其索引的目录
+BUGREPORT_DIR = os.path.join(tempfile.gettempdir(), "adb_mcp_bugreports")
+
+# 本地报告（zip、解出的主报告和索引）的总大小上限（字节）和最长保留时间（秒），可通过环境变量调整
+MAX_TOTAL_BYTES = int(os.environ.get("ADB_MCP_BUGREPORT_MAX_BYTES", str(2 * 1024 ** 3)))
+MAX_AGE = float(os.environ.get("ADB_MCP_BUGREPORT_MAX_AGE", str(24 * 3600)))
+
+# 主报告中的分段标题，例如 "------ SYSTEM LOG (logcat -v threadtime -v printable -d *:v) ------"
+_SECTION_PATTERN = re.compile(rb"^------ (.+?) ------\r?$", re.M)
+# dumpsys 内部的服务分段，例如 "DUMP OF SERVICE activity:"
+_SERVICE_PATTERN = re.compile(rb"^DUMP OF SERVICE (?:[A-Z]+ )?(\S+?):\r?$", re.M)
+
+# 单次查询最多返回的正则匹配行数
+MAX_MATCHES = 200
+
+
+def index_bugreport(txt_path: str) -> List[Dict]:
+    """扫描主报告，生成分段偏移表 [{name, start, end}]
+
+    通过mmap扫描，不需要把整个报告读入内存。dumpsys下的各服务会作为独立分段加入，
+    名称形如 "DUMP OF SERVICE activity"。
+    """
+    if os.path.getsize(txt_path) == 0:
+        return []
+
+    with open(txt_path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        headers = []
+        for match in _SECTION_PATTERN.finditer(mm):
+            title = match.group(1).decode('utf-8', errors='ignore')
+            # 跳过 "------ 0.012s was the duration of 'X' ------" 这类结束标记
+            if "was the duration of" in title:
+                continue
+            headers.append((match.start(), title, False))
+        for match in _SERVICE_PATTERN.finditer(mm):
+            headers.append((match.start(), "DUMP OF SERVICE " + match.group(1).decode('utf-8', errors='ignore'), True))
+        size = len(mm)
+
+    headers.sort()
+    all_starts = [start for start, _, _ in headers]
+    top_starts = [start for start, _, nested in headers if not nested]
+    sections = []
+    for start, title, nested in headers:
+        # 顶层分段延伸到下一个顶层分段，服务分段延伸到下一个任意分段
+        starts = all_starts if nested else top_starts
+        i = bisect.bisect_right(starts, start)
+        end = starts[i] if i < len(starts) else size
+        sections.append({"name": title, "start": start, "end": end})
+    return sections
+
+
+def _report_paths(report_id: str) -> Dict[str, str]:
+    base = os.path.join(BUGREPORT_DIR, report_id)
+    return {"zip": base + ".zip", "txt": base + ".txt", "index": base + ".json"}
+
+
+def evict_reports(keep: Optional[str] = None):
+    """删除超过保留时间的报告；总大小超过上限时按最近使用时间从旧到新删除。正在生成的报告不删除"""
+    try:
+        names = os.listdir(BUGREPORT_DIR)
+    except OSError:
+        return
+    reports: Dict[str, List] = {}  # 报告ID -> [最近使用时间, 总大小, 文件列表]
+    for name in names:
+        path = os.path.join(BUGREPORT_DIR, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entry = reports.setdefault(os.path.splitext(name)[0], [0.0, 0, []])
+        entry[0] = max(entry[0], stat.st_mtime)
+        entry[1] += stat.st_size
+        entry[2].append(path)
+    running = {job.id for job in list_jobs("bugreport") if not job.finished}
+    total = sum(entry[1] for entry in reports.values())
+    now = time.time()
+    for report_id, (last_used, size, paths) in sorted(reports.items(), key=lambda item: item[1][0]):
+        if now - last_used <= MAX_AGE and total <= MAX_TOTAL_BYTES:
+            break
+        if report_id == keep or report_id in running:
+            continue
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        total -= size
+
+
+def _extract_main_entry(zip_path: str, txt_path: str):
+    """从bugreportz生成的zip中流式解出主报告文本"""
+    with zipfile.ZipFile(zip_path) as archive:
+        names = archive.namelist()
+        main_entry = None
+        if "main_entry.txt" in names:
+            main_entry = archive.read("main_entry.txt").decode('utf-8', errors='ignore').strip()
+        if main_entry not in names:
+            candidates = [info for info in archive.infolist()
+                          if info.filename.startswith("bugreport") and info.filename.endswith(".txt")]
+            if not candidates:
+                raise RuntimeError("zip中未找到主报告文件")
+            main_entry = max(candidates, key=lambda info: info.file_size).filename
+        with archive.open(main_entry) as source, open(txt_path, 'wb') as target:
+            shutil.copyfileobj(source, target, 1024 * 1024)
+
+
+def _run_bugreport(job, device) -> Dict:
+    """后台任务: 用bugreportz生成报告，分块拉取zip，解出主报告并建立分段索引"""
+    os.makedirs(BUGREPORT_DIR, exist_ok=True)
+    evict_reports(keep=job.id)
+    paths = _report_paths(job.id)
+    state = {"remote": None, "failure": None}
+
+    def handle_line(raw: bytes):
+        line = raw.decode('utf-8', errors='ignore').strip()
+        if line.startswith("PROGRESS:"):
+            done, _, total = line[len("PROGRESS:"):].partition("/")
+            if total.strip().isdigit() and int(total) > 0:
+                job.set_progress(f"生成报告 {int(done) * 100 // int(total)}%")
+        elif line.startswith("OK:"):
+            state["remote"] = line[len("OK:"):]
+        elif line.startswith("FAIL:"):
+            state["failure"] = line[len("FAIL:"):]
+
+    def handle_stream(conn):
+        buffer = b""
+        try:
+            while not job.cancel_event.is_set():
+                chunk = conn.read(4096)
+                if not chunk:
+                    # 最后一行（OK:/FAIL:）可能没有换行符
+                    if buffer:
+                        handle_line(buffer)
+                    break
+                buffer += chunk
+                *lines, buffer = buffer.split(b"\n")
+                for raw in lines:
+                    handle_line(raw)
+        finally:
+            conn.close()
+
+    job.set_progress("生成报告 0%")
+    device.shell("bugreportz -p", handler=handle_stream)
+    if job.cancel_event.is_set():
+        return {}
+    if state["failure"]:
+        raise RuntimeError(f"bugreportz失败: {state['failure']}")
+
+    if state["remote"]:
+        def on_chunk(received):
+            if job.cancel_event.is_set():
+                raise RuntimeError("任务已取消")
+            job.set_progress(f"拉取zip {received / 1024 / 1024:.1f}MB")
+
+        pull_with_progress(device, state["remote"], paths["zip"], progress=on_chunk)
+        device.shell(f"rm -f {state['remote']}")
+        job.set_progress("解压主报告")
+        _extract_main_entry(paths["zip"], paths["txt"])
+    else:
+        # 旧设备（Android 7以下）没有bugreportz，退回到文本版bugreport
+        job.set_progress("生成报告（旧版bugreport）")
+        device.shell("bugreport > /sdcard/bugreport.txt")
+        pull_with_progress(device, "/sdcard/bugreport.txt", paths["txt"])
+        device.shell("rm /sdcard/bugreport.txt")
+        paths["zip"] = None
+
+    job.set_progress("建立分段索引")
+    sections = index_bugreport(paths["txt"])
+    # zip（或旧版文本报告）登记到产物存储，优先硬链接，不额外占用空间
+    artifact, _ = artifact_store.put_file(paths["zip"] or paths["txt"],
+                                          "application/zip" if paths["zip"] else "text/plain",
+                                          "bugreport", device.serial, f"bugreport {job.id}")
+    report = {
+        "id": job.id,
+        "serial": device.serial,
+        "artifact": artifact.handle,
+        "zip": paths["zip"],
+        "txt": paths["txt"],
+        "size": os.path.getsize(paths["txt"]),
+        "sections": sections,
+    }
+    # 产物句柄只在本进程内有效，不写入磁盘索引，避免重启后返回已失效的句柄
+    with open(paths["index"], 'w') as file:
+        json.dump({key: value for key, value in report.items() if key != "artifact"}, file)
+    evict_reports(keep=job.id)
+    job.set_progress("完成")
+    return report
+
+
+def load_report(report_id: str) -> Dict:
+    """按ID加载已完成报告的索引（服务器重启后仍可从磁盘读取）"""
+    index_path = _report_paths(report_id)["index"]
+    if os.path.exists(index_path):
+        # 索引文件的修改时间记为最近使用时间，淘汰时优先保留最近查询过的报告
+        os.utime(index_path)
+    try:
+        job = get_job(report_id, kind="bugreport")
+        if job.status == "done" and job.result:
+            return job.result
+        if not job.finished:
+            raise ValueError(f"报告仍在生成中: {job.progress}")
+        raise ValueError(f"报告任务未成功完成: {job.status} {job.error or ''}")
+    except ValueError:
+        if not os.path.exists(index_path):
+            raise
+        with open(index_path) as file:
+            return json.load(file)
+
+
+def _format_size(size: int) -> str:
+    if size >= 1024 * 1024:
+        return f"{size / 1024 / 1024:.1f}MB"
+    if size >= 1024:
+        return f"{size / 1024:.1f}KB"
+    return f"{size}B"
+
+
+def _summarize_report(report: Dict, limit: int = 60) -> str:
+    sections = report["sections"]
+    lines = [
+        f"报告ID: {report['id']}",
+        f"主报告大小: {_format_size(report['size'])}",
+        f"分段数量: {len(sections)}",
+    ]
+    if report.get("artifact"):
+        lines.append(f"产物句柄: {report['artifact']}")
+    lines += [
+        "",
+        "主要分段（按大小排序）:",
+    ]
+    for section in sorted(sections, key=lambda s: s["end"] - s["start"], reverse=True)[:limit]:
+        lines.append(f"  {section['name']}  ({_format_size(section['end'] - section['start'])})")
+    lines.append("")
+    lines.append("使用 query_bugreport 按分段名称或正则表达式查询完整内容")
+    return "\n".join(lines)
+
+
+def _find_sections(report: Dict, name: str) -> List[Dict]:
+    needle = name.lower()
+    exact = [s for s in report["sections"] if s["name"].lower() == needle]
+    if exact:
+        return exact
+    return [s for s in report["sections"] if needle in s["name"].lower()]
+
+
+@mcp.tool()
+async def start_bugreport(device_id: Optional[str] = None) -> str:
+    """在后台生成bug报告（bugreportz），立即返回任务ID
+
+    参数:
+        device_id: 设备ID（可选，如果未提供则使用第一个可用设备）
+    """
+    try:
+        device = get_device(device_id)
+        job = start_job("bugreport", device.serial, _run_bugreport, device, device_lane=True)
+        return f"已开始生成bug报告，任务ID: {job.id}\n使用 get_bugreport_status 查看进度"
+    except Exception as e:
+        return f"启动bug报告失败: {str(e)}"
+
+
+@mcp.tool()
+async def get_bugreport_status(report_id: Optional[str] = None) -> str:
+    """查看bug报告任务的进度；完成后返回分段目录
+
+    参数:
+        report_id: 报告任务ID（可选，不提供时列出所有bug报告任务）
+    """
+    try:
+        if not report_id:
+            jobs = list_jobs("bugreport")
+            if not jobs:
+                return "没有bug报告任务"
+            return "\n\n".join(job.describe() for job in jobs)
+
+        job = get_job(report_id, kind="bugreport")
+        if job.status == "done":
+            return job.describe() + "\n\n" + _summarize_report(job.result)
+        return job.describe()
+    except Exception as e:
+        return f"获取bug报告状态失败: {str(e)}"
+
+
+@mcp.tool()
+async def query_bugreport(report_id: str, section: Optional[str] = None, pattern: Optional[str] = None, offset: int = 0, max_chars: int = 10000) -> str:
+    """查询已生成的bug报告：按分段读取内容，或用正则表达式搜索匹配行
+
+    参数:
+        report_id: 报告任务ID
+        section: 分段名称（不区分大小写的子串），例如 "SYSTEM LOG"、"DUMP OF SERVICE activity"
+        pattern: 正则表达式；与section同时提供时只在该分段内搜索
+        offset: 读取分段时的起始偏移（字节），用于分页
+        max_chars: 最多返回的字符数，默认10000
+    """
+    try:
+        report = load_report(report_id)
+        if not section and not pattern:
+            return _summarize_report(report, limit=len(report["sections"]))
+
+        ranges = [(0, report["size"])]
+        if section:
+            matched = _find_sections(report, section)
+            if not matched:
+                return f"未找到分段: {section}"
+            ranges = [(s["start"], s["end"]) for s in matched]
+
+        if not os.path.exists(report["txt"]):
+            return "查询bug报告失败: 报告文件已被清理（超过保留时间或总大小上限），请重新生成"
+        with open(report["txt"], 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if not pattern:
+                start, end = ranges[0]
+                begin = start + max(0, offset)
+                stop = min(end, begin + max_chars)
+                content = mm[begin:stop].decode('utf-8', errors='ignore')
+                header = f"[{matched[0]['name']}] 字节 {begin - start}-{stop - start} / {end - start}"
+                if stop < end:
+                    header += f"（继续读取请使用 offset={stop - start}）"
+                return header + "\n" + content
+
+            regex = re.compile(pattern.encode('utf-8'), re.M)
+            results = []
+            total = 0
+            for start, end in ranges:
+                for match in regex.finditer(mm, start, end):
+                    line_start = mm.rfind(b"\n", start, match.start()) + 1
+                    line_end = mm.find(b"\n", match.end(), end)
+                    line_end = end if line_end == -1 else line_end
+                    line = mm[max(line_start, start):line_end].decode('utf-8', errors='ignore')
+                    results.append(f"@{line_start}: {line}")
+                    total += len(line)
+                    if len(results) >= MAX_MATCHES or total >= max_chars:
+                        break
+                if len(results) >= MAX_MATCHES or total >= max_chars:
+                    results.append("[匹配结果过多，只显示前面部分]")
+                    break
+
+        if not results:
+            return f"未找到匹配 '{pattern}' 的内容"
+        return "\n".join(results)
+    except Exception as e:
+        return f"查询bug报告失败: {str(e)}"
+
+
+@mcp.tool()
+async def take_bugreport(device_id: Optional[str] = None) -> str:
+    """获取系统Bug报告
+
+    在后台生成并拉取完整报告，等待完成后返回分段目录，
+    之后可使用 query_bugreport 查询任意分段。
+
+    参数:
+        device_id: 设备ID（可选，如果未提供则使用第一个可用设备）
+    """
+    try:
+        device = get_device(device_id)
+        # 等待期间本调用一直占用设备的后台执行位置，任务不再单独排队
+        job = start_job("bugreport", device.serial, _run_bugreport, device)
+        while not job.finished:
+            if scheduler.cancelled():
+                # 调用被取消或超过截止时间，同时停止后台生成
+                job.cancel()
+            await asyncio.sleep(1)
+        if job.status != "done":
+            return f"获取Bug报告失败: {job.error or job.status}"
+        return _summarize_report(job.result)
+    except Exception as e:
+        return f"获取Bug报告失败: {str(e)}"
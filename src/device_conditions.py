@@ -0,0 +1,390 @@
+from typing import Callable, Dict, List, Optional, Tuple
+from array import array
+import math
+import os
+import re
+import threading
+import time
+
+# 每个序列最多保留的采样点数，超出后丢弃最早的采样
+MAX_SAMPLES = int(os.environ.get("ADB_MCP_CONDITION_MAX_SAMPLES", "3600"))
+
+# 最小采样间隔（秒）
+MIN_INTERVAL = 0.5
+
+# 连续采样失败达到该次数时停止采样
+MAX_CONSECUTIVE_ERRORS = 5
+
+# 判断设备温度时使用的温区（CPU、SoC、GPU、机身表面和电池），其他温区（充电芯片、射频等）不参与
+DEVICE_ZONES = re.compile(r"cpu|soc|gpu|skin|battery|tsens|apc|cluster|big|little|mid", re.I)
+
+# 频率上限低于硬件最高频率的该比例时视为被限频
+FREQ_CAP_RATIO = 0.95
+
+# 冷却门控的默认条件: 设备温度（°C）、CPU占用（%），以及需要连续满足的采样次数
+COOL_TEMP = float(os.environ.get("ADB_MCP_COOL_TEMP", "42"))
+IDLE_CPU_BUSY = float(os.environ.get("ADB_MCP_IDLE_CPU_BUSY", "25"))
+SETTLED_SAMPLES = 3
+GATE_INTERVAL = 2.0
+
+# Android 热状态（PowerManager.THERMAL_STATUS_*）
+THERMAL_STATUS = ("none", "light", "moderate", "severe", "critical", "emergency", "shutdown")
+
+# 单次shell调用中分隔各部分输出的标记
+_MARKER = "__ADB_MCP_COND__ "
+
+_HAL_TEMPERATURE = re.compile(r"Temperature\{mValue=(-?[\d.]+),.*?mName=([^,}]+)")
+_THERMAL_STATUS_LINE = re.compile(r"Thermal Status:\s*(\d+)")
+
+
+def _command() -> str:
+    """一次shell调用读取温区、各核心频率、电池电流电压和系统热状态"""
+    return "; ".join([
+        f"echo '{_MARKER}thermal'",
+        'for z in /sys/class/thermal/thermal_zone*; do echo "$(cat $z/type 2>/dev/null) $(cat $z/temp 2>/dev/null)"; done',
+        f"echo '{_MARKER}cpufreq'",
+        'for c in /sys/devices/system/cpu/cpu[0-9]*; do f=$c/cpufreq; '
+        'echo "${c##*/} $(cat $f/scaling_cur_freq $f/cpuinfo_max_freq $f/scaling_max_freq 2>/dev/null | tr \'\\n\' \' \')"; done',
+        f"echo '{_MARKER}battery'",
+        'for f in capacity current_now voltage_now temp; do echo "$f $(cat /sys/class/power_supply/battery/$f 2>/dev/null)"; done',
+        f"echo '{_MARKER}thermalservice'",
+        "dumpsys thermalservice 2>/dev/null | grep -E 'Thermal Status|Temperature\\{' | head -n 80",
+        f"echo '{_MARKER}stat'",
+        "head -n 1 /proc/stat",
+    ])
+
+
+def _number(value: str) -> Optional[float]:
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def _celsius(value: float) -> float:
+    """温区温度多为千分之一度，少数设备直接以度为单位"""
+    return value / 1000 if abs(value) >= 500 else value
+
+
+class ConditionReading:
+    """一次采样: 温度（°C）、各核心频率（kHz）、电池读数和热状态"""
+
+    __slots__ = ("timestamp", "temps", "freqs", "battery", "thermal_status", "cpu_times")
+
+    def __init__(self, timestamp: float):
+        self.timestamp = timestamp
+        self.temps: Dict[str, float] = {}
+        # 核心 -> (当前频率, 硬件最高频率, 当前频率上限)；离线核心不记录
+        self.freqs: Dict[str, Tuple[int, int, int]] = {}
+        self.battery: Dict[str, float] = {}
+        self.thermal_status: Optional[int] = None
+        # /proc/stat 的 (忙碌, 总计) 时钟数
+        self.cpu_times: Optional[Tuple[int, int]] = None
+
+    @property
+    def device_temp(self) -> Optional[float]:
+        """CPU/SoC/机身/电池温区中的最高温度，没有这些温区时使用电池温度"""
+        values = [value for name, value in self.temps.items() if DEVICE_ZONES.search(name) and 0 < value < 150]
+        if values:
+            return max(values)
+        return self.battery.get("temp")
+
+    @property
+    def current_ma(self) -> Optional[float]:
+        return self.battery.get("current_ma")
+
+    @property
+    def power_mw(self) -> Optional[float]:
+        if "current_ma" not in self.battery or "voltage_mv" not in self.battery:
+            return None
+        return abs(self.battery["current_ma"] * self.battery["voltage_mv"]) / 1000
+
+    def freq_cap(self) -> Optional[float]:
+        """各核心当前频率上限与硬件最高频率之比的最小值"""
+        ratios = [limit / maximum for _, maximum, limit in self.freqs.values() if maximum > 0 and limit > 0]
+        return min(ratios) if ratios else None
+
+    def cpu_busy(self, previous: Optional["ConditionReading"]) -> Optional[float]:
+        if previous is None or previous.cpu_times is None or self.cpu_times is None:
+            return None
+        busy = self.cpu_times[0] - previous.cpu_times[0]
+        total = self.cpu_times[1] - previous.cpu_times[1]
+        return 100.0 * busy / total if total > 0 else None
+
+    def throttle_reasons(self) -> List[str]:
+        """降频或热节流的迹象: 系统热状态不为 none，或有核心的频率上限被压低"""
+        reasons = []
+        if self.thermal_status:
+            reasons.append(f"热状态 {thermal_status_name(self.thermal_status)}")
+        capped = [f"{core} {limit // 1000}/{maximum // 1000}MHz" for core, (_, maximum, limit) in self.freqs.items()
+                  if maximum > 0 and 0 < limit < maximum * FREQ_CAP_RATIO]
+        if capped:
+            reasons.append("频率上限被压低: " + ", ".join(capped))
+        return reasons
+
+    def describe(self, previous: Optional["ConditionReading"] = None) -> str:
+        parts = []
+        temp = self.device_temp
+        if temp is not None:
+            parts.append(f"温度 {temp:.1f}°C")
+        if self.thermal_status is not None:
+            parts.append(f"热状态 {thermal_status_name(self.thermal_status)}")
+        busy = self.cpu_busy(previous)
+        if busy is not None:
+            parts.append(f"CPU占用 {busy:.0f}%")
+        if self.freqs:
+            top = max(current for current, _, _ in self.freqs.values())
+            parts.append(f"最高核心频率 {top // 1000}MHz")
+        cap = self.freq_cap()
+        if cap is not None and cap < FREQ_CAP_RATIO:
+            parts.append(f"频率上限 {cap * 100:.0f}%")
+        if self.current_ma is not None:
+            power = self.power_mw
+            parts.append(f"电流 {self.current_ma:.0f}mA" + (f" ({power:.0f}mW)" if power is not None else ""))
+        if "capacity" in self.battery:
+            parts.append(f"电量 {self.battery['capacity']:.0f}%")
+        return "，".join(parts) if parts else "无法读取设备状态"
+
+
+def thermal_status_name(status: int) -> str:
+    return THERMAL_STATUS[status] if 0 <= status < len(THERMAL_STATUS) else str(status)
+
+
+def parse_conditions(output: str, timestamp: Optional[float] = None) -> ConditionReading:
+    reading = ConditionReading(timestamp if timestamp is not None else time.monotonic())
+    sections = {}
+    for block in output.split(_MARKER)[1:]:
+        name, _, content = block.partition("\n")
+        sections[name.strip()] = content
+
+    for line in sections.get("thermal", "").splitlines():
+        name, _, value = line.strip().rpartition(" ")
+        number = _number(value)
+        if name and number is not None:
+            # 同名温区（例如多个 cpu-0-0）加序号区分
+            key, index = name, 1
+            while key in reading.temps:
+                index += 1
+                key = f"{name}#{index}"
+            reading.temps[key] = _celsius(number)
+
+    for line in sections.get("cpufreq", "").splitlines():
+        fields = line.split()
+        if len(fields) >= 4 and all(field.isdigit() for field in fields[1:4]):
+            reading.freqs[fields[0]] = (int(fields[1]), int(fields[2]), int(fields[3]))
+
+    for line in sections.get("battery", "").splitlines():
+        name, _, value = line.strip().partition(" ")
+        number = _number(value)
+        if number is None:
+            continue
+        if name == "current_now":
+            # 微安；部分设备以毫安为单位
+            reading.battery["current_ma"] = number / 1000 if abs(number) >= 20000 else number
+        elif name == "voltage_now":
+            reading.battery["voltage_mv"] = number / 1000 if number >= 100000 else number
+        elif name == "temp":
+            reading.battery["temp"] = number / 10
+        elif name == "capacity":
+            reading.battery["capacity"] = number
+
+    service = sections.get("thermalservice", "")
+    status = _THERMAL_STATUS_LINE.search(service)
+    if status:
+        reading.thermal_status = int(status.group(1))
+    for value, name in _HAL_TEMPERATURE.findall(service):
+        reading.temps.setdefault(f"hal:{name.strip()}", float(value))
+
+    fields = sections.get("stat", "").split()
+    if len(fields) >= 5 and fields[0] == "cpu":
+        ticks = [int(field) for field in fields[1:8] if field.isdigit()]
+        idle = ticks[3] + (ticks[4] if len(ticks) > 4 else 0)
+        reading.cpu_times = (sum(ticks) - idle, sum(ticks))
+    return reading
+
+
+def read_conditions(device) -> ConditionReading:
+    output = device.shell(_command())
+    reading = parse_conditions(output)
+    if not reading.temps and not reading.freqs and not reading.battery and reading.cpu_times is None:
+        raise RuntimeError(f"无法读取设备状态: {output.strip()[:200]}")
+    return reading
+
+
+class ConditionSeries:
+    """设备状态的时间序列
+
+    采样时间共用一个 array，每个指标一个与之对齐的 float32 array（缺失记为NaN），超出 MAX_SAMPLES 后丢弃最早的采样。
+    """
+
+    def __init__(self, max_samples: int = MAX_SAMPLES):
+        self.max_samples = max_samples
+        self.times = array("d")
+        self.values: Dict[str, array] = {}
+
+    def add(self, timestamp: float, values: Dict[str, Optional[float]]):
+        count = len(self.times)
+        self.times.append(timestamp)
+        for key, value in values.items():
+            if value is None:
+                continue
+            if key not in self.values:
+                self.values[key] = array("f", [math.nan]) * count
+            self.values[key].append(value)
+        for series in self.values.values():
+            if len(series) == count:
+                series.append(math.nan)
+        excess = len(self.times) - self.max_samples
+        if excess > 0:
+            del self.times[:excess]
+            for series in self.values.values():
+                del series[:excess]
+
+    def summarize(self, window: float = 0) -> Dict[str, Tuple[float, float, float, float]]:
+        """每个指标在窗口内的 (最近值, 最小值, 平均值, 最大值)"""
+        if not self.times:
+            return {}
+        start = 0
+        if window > 0:
+            cutoff = self.times[-1] - window
+            start = next((i for i, t in enumerate(self.times) if t > cutoff), len(self.times))
+        result = {}
+        for key, series in self.values.items():
+            values = [value for value in series[start:] if not math.isnan(value)]
+            if values:
+                result[key] = (values[-1], min(values), sum(values) / len(values), max(values))
+        return result
+
+
+class ConditionSampler:
+    """后台设备状态采样器: 每次采样一次shell调用，记录温度、频率、功耗和热状态，统计降频的采样"""
+
+    def __init__(self, serial: str, interval: float):
+        self.serial = serial
+        self.interval = max(interval, MIN_INTERVAL)
+        self.series = ConditionSeries()
+        self.samples = 0
+        self.throttled_samples = 0
+        self.throttle_reasons: Dict[str, int] = {}
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.last_error: Optional[str] = None
+        self.last: Optional[ConditionReading] = None
+        self.previous: Optional[ConditionReading] = None
+        self._lock = threading.Lock()
+
+    def sample(self, device) -> ConditionReading:
+        reading = read_conditions(device)
+        self.add(reading)
+        return reading
+
+    def add(self, reading: ConditionReading):
+        values = {
+            "temp": reading.device_temp,
+            "thermal_status": reading.thermal_status,
+            "cpu_busy": reading.cpu_busy(self.last),
+            "freq_cap": None if reading.freq_cap() is None else reading.freq_cap() * 100,
+            "current_ma": reading.current_ma,
+            "power_mw": reading.power_mw,
+            "battery_temp": reading.battery.get("temp"),
+        }
+        for core, (current, _, _) in reading.freqs.items():
+            values[f"freq:{core}"] = current / 1000
+        reasons = reading.throttle_reasons()
+        with self._lock:
+            self.series.add(reading.timestamp, values)
+            self.samples += 1
+            if reasons:
+                self.throttled_samples += 1
+                for reason in reasons:
+                    kind = reason.split(":")[0]
+                    self.throttle_reasons[kind] = self.throttle_reasons.get(kind, 0) + 1
+            self.previous, self.last = self.last, reading
+
+    def record_error(self, error: Exception):
+        self.errors += 1
+        self.consecutive_errors += 1
+        self.last_error = str(error)
+
+    @property
+    def throttled(self) -> bool:
+        return self.throttled_samples > 0
+
+    def progress(self) -> str:
+        current = self.last.describe(self.previous) if self.last is not None else "等待第一次采样"
+        return f"已采样 {self.samples} 次，降频 {self.throttled_samples} 次；{current}"
+
+    def throttle_summary(self) -> str:
+        if not self.samples:
+            return "没有采样"
+        if not self.throttled:
+            return f"未检测到降频或热节流（{self.samples} 次采样）"
+        reasons = "，".join(f"{reason} {count}次" for reason, count in self.throttle_reasons.items())
+        return f"警告: {self.throttled_samples}/{self.samples} 次采样时设备处于降频或热节流状态（{reasons}），性能数据可能偏低"
+
+    def report(self, window: float = 0) -> str:
+        with self._lock:
+            summary = self.series.summarize(window)
+            lines = [self.throttle_summary()]
+        labels = [("temp", "设备温度", "°C"), ("battery_temp", "电池温度", "°C"), ("thermal_status", "热状态", ""),
+                  ("cpu_busy", "CPU占用", "%"), ("freq_cap", "频率上限", "%"), ("current_ma", "电池电流", "mA"),
+                  ("power_mw", "功耗", "mW")]
+        for key, label, unit in labels:
+            if key in summary:
+                last, low, mean, high = summary[key]
+                lines.append(f"{label}{f'({unit})' if unit else ''}: 最近 {last:.1f}，最小 {low:.1f}，平均 {mean:.1f}，最大 {high:.1f}")
+        cores = sorted((key for key in summary if key.startswith("freq:")), key=lambda k: int(re.sub(r"\D", "", k) or 0))
+        if cores:
+            lines.append("核心频率(MHz) 平均/最大: " + "，".join(
+                f"{key[5:]} {summary[key][2]:.0f}/{summary[key][3]:.0f}" for key in cores))
+        if self.last_error:
+            lines.append(f"采样失败 {self.errors} 次，最近一次: {self.last_error}")
+        return "\n".join(lines)
+
+
+def run_sampler(job, device, sampler: ConditionSampler, duration: float) -> ConditionSampler:
+    """后台任务: 按间隔采样直到时长结束或任务被取消（duration 为0时一直采样）"""
+    deadline = time.monotonic() + duration if duration > 0 else None
+    while not job.cancel_event.is_set() and (deadline is None or time.monotonic() < deadline):
+        tick = time.monotonic()
+        try:
+            sampler.sample(device)
+            sampler.consecutive_errors = 0
+        except Exception as e:
+            sampler.record_error(e)
+            if sampler.consecutive_errors >= MAX_CONSECUTIVE_ERRORS:
+                raise RuntimeError(f"连续 {sampler.consecutive_errors} 次采样失败: {e}")
+        job.set_progress(sampler.progress())
+        job.cancel_event.wait(max(0.0, sampler.interval - (time.monotonic() - tick)))
+    return sampler
+
+
+def wait_until_ready(device, max_temp: float = COOL_TEMP, max_cpu_busy: float = IDLE_CPU_BUSY,
+                     timeout: float = 300, sleep: Callable[[float], None] = time.sleep) -> Tuple[bool, float, str]:
+    """冷却门控: 等待设备温度不超过 max_temp、CPU占用不超过 max_cpu_busy、没有降频和热节流，
+    且连续 SETTLED_SAMPLES 次采样都满足；返回 (是否就绪, 等待秒数, 最后的设备状态)
+
+    sleep 为可被取消的等待函数（例如 scheduler.sleep）。
+    """
+    sampler = ConditionSampler(device.serial, GATE_INTERVAL)
+    start = time.monotonic()
+    settled = 0
+    while True:
+        reading = sampler.sample(device)
+        temp = reading.device_temp
+        busy = reading.cpu_busy(sampler.previous)
+        ready = ((temp is None or temp <= max_temp) and busy is not None and busy <= max_cpu_busy
+                 and not reading.throttle_reasons())
+        settled = settled + 1 if ready else 0
+        waited = time.monotonic() - start
+        if settled >= SETTLED_SAMPLES:
+            return True, waited, reading.describe(sampler.previous)
+        if waited >= timeout:
+            problems = reading.throttle_reasons()
+            if temp is not None and temp > max_temp:
+                problems.append(f"温度 {temp:.1f}°C 高于 {max_temp:g}°C")
+            if busy is not None and busy > max_cpu_busy:
+                problems.append(f"CPU占用 {busy:.0f}% 高于 {max_cpu_busy:g}%")
+            detail = reading.describe(sampler.previous)
+            return False, waited, detail + (f"（{'；'.join(problems)}）" if problems else "")
+        sleep(GATE_INTERVAL)
@@ -0,0 +1,408 @@
+from typing import Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+import os
+import re
+import socket
+import threading
+import time
+from . import metrics, query_cache
+
+# 设为 0 时不启动后台健康监视（熔断仍按工具调用的失败统计）
+MONITOR_ENABLED = os.environ.get("ADB_MCP_HEALTH_MONITOR", "1") != "0"
+# 在线设备的Ping间隔、启动中设备的检查间隔和Ping超时（秒）
+PING_INTERVAL = float(os.environ.get("ADB_MCP_PING_INTERVAL", "15"))
+BOOT_POLL_INTERVAL = 2.0
+PING_TIMEOUT = 5.0
+# 连续多少次ADB调用失败后Ping确认，确认无响应则熔断；熔断后首次重试前的等待时间按次数指数增长（秒）
+BREAKER_THRESHOLD = 3
+BREAKER_COOLDOWN_MIN = 2.0
+BREAKER_COOLDOWN_MAX = 60.0
+# 网络（adb connect）设备断开后的重连间隔，按次数指数增长（秒）
+RECONNECT_MIN = 2.0
+RECONNECT_MAX = 120.0
+# host:track-devices 连接的读超时（秒），超时后检查ADB服务器是否仍在配置中
+TRACK_READ_TIMEOUT = 30.0
+
+# adb 设备状态 -> 健康状态
+_STATE_MAP = {"device": "online", "unauthorized": "unauthorized", "recovery": "recovery",
+              "sideload": "recovery", "bootloader": "bootloader"}
+_STATE_NAMES = {"online": "在线", "offline": "离线", "unauthorized": "未授权", "booting": "启动中",
+                "disconnected": "已断开", "recovery": "恢复模式", "bootloader": "引导模式"}
+_TCP_SERIAL = re.compile(r"^(?P<host>[\w.\-\[\]:]+):(?P<port>\d+)$")
+
+
+class DeviceUnavailable(Exception):
+    pass
+
+
+class DeviceHealth:
+    """一台设备的健康状态和熔断器"""
+
+    def __init__(self, endpoint, serial: str, state: str):
+        self.endpoint = endpoint
+        self.serial = serial
+        self.state = state
+        self.since = time.time()
+        self.last_ping: Optional[float] = None
+        self.ping_latency: Optional[float] = None
+        self.next_ping = 0.0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+        # 熔断器: closed（正常）、open（熔断，快速失败）、half_open（放行一次试探调用）
+        self.breaker = "closed"
+        self.opened_at = 0.0
+        self.cooldown = BREAKER_COOLDOWN_MIN
+        self.trial_running = False
+        self.suspect = False
+        self.reconnect_attempts = 0
+        self.next_reconnect = 0.0
+        # 重启中: 看到设备断开或 sys.boot_completed=0 之后，Ping 才会把设备标记为在线
+        self.rebooting = False
+        self.reboot_seen = False
+
+    @property
+    def device_id(self) -> str:
+        return self.endpoint.device_id(self.serial)
+
+    @property
+    def tcp_address(self) -> Optional[Tuple[str, int]]:
+        match = _TCP_SERIAL.match(self.serial)
+        return (match.group("host"), int(match.group("port"))) if match else None
+
+    def set_state(self, state: str):
+        if state != self.state:
+            self.state = state
+            self.since = time.time()
+            metrics.record_device_event(self.device_id, f"state_{state}")
+            query_cache.invalidate(self.device_id)
+        if state == "online":
+            self.reconnect_attempts = 0
+
+    def unavailable_reason(self) -> Optional[str]:
+        now = time.time()
+        if self.state != "online":
+            reason = f"设备 {self.device_id} {_STATE_NAMES.get(self.state, self.state)}（{now - self.since:.0f}秒）"
+            if self.state in ("offline", "disconnected") and self.tcp_address:
+                reason += f"，正在自动重连（第{self.reconnect_attempts}次）"
+            elif self.state == "unauthorized":
+                reason += "，请在设备上确认USB调试授权"
+            return reason
+        if self.breaker == "open":
+            remaining = self.opened_at + self.cooldown - now
+            if remaining > 0:
+                return (f"设备 {self.device_id} 连续无响应，已熔断（{remaining:.0f}秒后重试）"
+                        + (f": {self.last_error}" if self.last_error else ""))
+        if self.breaker == "half_open" and self.trial_running:
+            return f"设备 {self.device_id} 正在恢复检测，请稍后重试"
+        return None
+
+    def describe(self) -> str:
+        parts = [f"{self.device_id}: {_STATE_NAMES.get(self.state, self.state)}"]
+        if self.breaker != "closed":
+            parts.append(f"熔断器={self.breaker}")
+        if self.ping_latency is not None:
+            parts.append(f"Ping {self.ping_latency * 1000:.1f}ms（{time.time() - self.last_ping:.0f}秒前）")
+        if self.failures:
+            parts.append(f"连续失败{self.failures}次")
+        if self.tcp_address and self.reconnect_attempts:
+            parts.append(f"重连{self.reconnect_attempts}次")
+        if self.last_error:
+            parts.append(f"最近错误: {self.last_error}")
+        return "  ".join(parts)
+
+
+class HealthMonitor:
+    """设备健康监视
+
+    每个ADB服务器一个 host:track-devices 长连接实时跟踪设备状态；后台线程定期 Ping 在线设备
+    （getprop sys.boot_completed，同时识别启动中的设备），为断开的网络设备按指数退避执行 adb connect。
+    工具的ADB调用连续失败时 Ping 确认，确认无响应后熔断该设备，之后的调用直接失败，冷却后放行一次试探调用。
+    """
+
+    def __init__(self):
+        self._devices: Dict[Tuple[str, str], DeviceHealth] = {}
+        self._by_id: Dict[str, DeviceHealth] = {}
+        self._trackers: Dict[str, object] = {}
+        self._endpoints: List = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pinger: Optional[threading.Thread] = None
+        metrics.adb_listeners.append(self.record_result)
+
+    # 启动
+    def ensure_started(self, endpoint_list: List):
+        if not MONITOR_ENABLED:
+            return
+        with self._lock:
+            if endpoint_list != self._endpoints:
+                self._endpoints = list(endpoint_list)
+                # 增加ADB服务器后设备ID可能改为带前缀的形式
+                self._by_id = {health.device_id: health for health in self._devices.values()}
+            for endpoint in endpoint_list:
+                if self._trackers.get(endpoint.alias) is not endpoint:
+                    self._trackers[endpoint.alias] = endpoint
+                    threading.Thread(target=self._track, args=(endpoint,), name=f"adb-track-{endpoint.alias}",
+                                     daemon=True).start()
+            if self._pinger is None:
+                self._pinger = threading.Thread(target=self._ping_loop, name="adb-health", daemon=True)
+                self._pinger.start()
+
+    def _tracking(self, endpoint) -> bool:
+        return self._trackers.get(endpoint.alias) is endpoint and endpoint in self._endpoints
+
+    # 设备跟踪
+    def _track(self, endpoint):
+        from .adb_server import _read_exact
+        backoff = RECONNECT_MIN
+        first = True
+        while self._tracking(endpoint):
+            conn = None
+            try:
+                conn = endpoint.client.create_connection(timeout=TRACK_READ_TIMEOUT)
+                conn.send("host:track-devices")
+                backoff = RECONNECT_MIN
+                while self._tracking(endpoint):
+                    try:
+                        length = int(_read_exact(conn, 4).decode("ascii"), 16)
+                    except socket.timeout:
+                        continue
+                    self._apply_listing(endpoint, _read_exact(conn, length).decode("utf-8"), first)
+                    first = False
+            except Exception as e:
+                self._endpoint_lost(endpoint, e)
+                time.sleep(backoff)
+                backoff = min(backoff * 2, RECONNECT_MAX)
+            finally:
+                if conn is not None:
+                    conn.close()
+        with self._lock:
+            for key in [key for key, health in self._devices.items() if health.endpoint is endpoint]:
+                self._forget(key)
+
+    def _apply_listing(self, endpoint, listing: str, initial: bool):
+        seen = {}
+        for line in listing.splitlines():
+            tokens = line.split()
+            if len(tokens) >= 2:
+                seen[tokens[0]] = tokens[1]
+        with self._lock:
+            for serial, adb_state in seen.items():
+                state = _STATE_MAP.get(adb_state, "offline")
+                health = self._devices.get((endpoint.alias, serial))
+                if health is None:
+                    # 启动监视时已在线的设备视为已完成启动，之后新出现的设备先确认启动完成
+                    initial_state = "booting" if state == "online" and not initial else state
+                    health = self._devices[(endpoint.alias, serial)] = DeviceHealth(endpoint, serial, initial_state)
+                elif state == "online" and health.state != "online":
+                    health.set_state("booting")
+                elif state != "online":
+                    health.set_state(state)
+                if health.state == "booting":
+                    health.next_ping = 0.0
+                self._by_id[health.device_id] = health
+            for key, health in self._devices.items():
+                if key[0] == endpoint.alias and key[1] not in seen and health.state != "disconnected":
+                    if health.rebooting:
+                        health.reboot_seen = True
+                    if health.rebooting and not health.tcp_address:
+                        continue  # USB设备重启时会暂时从列表中消失，保持"启动中"
+                    health.set_state("disconnected")
+                    health.next_reconnect = time.time() + RECONNECT_MIN
+        endpoint._devices_at = 0.0
+        self._wake.set()
+
+    def _endpoint_lost(self, endpoint, error: Exception):
+        with self._lock:
+            for key, health in self._devices.items():
+                if key[0] == endpoint.alias and health.state != "disconnected":
+                    health.last_error = f"ADB服务器 {endpoint.alias} 不可用: {error}"
+                    health.set_state("disconnected")
+
+    def _forget(self, key: Tuple[str, str]):
+        health = self._devices.pop(key)
+        if self._by_id.get(health.device_id) is health:
+            del self._by_id[health.device_id]
+
+    # 熔断
+    def lookup(self, device_id: str) -> Optional[DeviceHealth]:
+        health = self._by_id.get(device_id)
+        if health is None:
+            matches = [h for h in self._devices.values() if h.serial == device_id]
+            health = matches[0] if len(matches) == 1 else None
+        return health
+
+    def check(self, device_id: str):
+        """设备不可用或已熔断时抛出 DeviceUnavailable；冷却结束后放行一次试探调用"""
+        with self._lock:
+            health = self.lookup(device_id)
+            if health is None:
+                return
+            if health.state == "online" and health.breaker == "open" \
+                    and time.time() >= health.opened_at + health.cooldown:
+                health.breaker = "half_open"
+                health.trial_running = False
+            reason = health.unavailable_reason()
+            if reason:
+                metrics.record_device_event(health.device_id, "fast_fail")
+                raise DeviceUnavailable(reason)
+            if health.breaker == "half_open":
+                health.trial_running = True
+
+    def record_result(self, device_id: str, failed: bool):
+        health = self._by_id.get(device_id)
+        if health is None:
+            return
+        with self._lock:
+            if not failed:
+                health.failures = 0
+                if health.breaker != "closed":
+                    self._close_breaker(health)
+                return
+            health.failures += 1
+            if health.breaker == "half_open":
+                self._open_breaker(health, "试探调用失败")
+            elif health.breaker == "closed" and health.failures >= BREAKER_THRESHOLD and not health.suspect:
+                # 失败也可能来自命令本身（例如文件不存在），先 Ping 确认设备确实无响应再熔断
+                health.suspect = True
+                self._wake.set()
+
+    def _open_breaker(self, health: DeviceHealth, error: str):
+        if health.breaker == "closed":
+            health.cooldown = BREAKER_COOLDOWN_MIN
+            metrics.record_device_event(health.device_id, "breaker_open")
+        else:
+            # 冷却后的试探仍然失败，冷却时间加倍
+            health.cooldown = min(health.cooldown * 2, BREAKER_COOLDOWN_MAX)
+        health.breaker = "open"
+        health.opened_at = time.time()
+        health.trial_running = False
+        health.last_error = error
+
+    def _close_breaker(self, health: DeviceHealth):
+        health.breaker = "closed"
+        health.trial_running = False
+        health.cooldown = BREAKER_COOLDOWN_MIN
+        health.last_error = None
+        metrics.record_device_event(health.device_id, "breaker_closed")
+
+    def reset(self, device_id: str) -> bool:
+        with self._lock:
+            health = self.lookup(device_id)
+            if health is None:
+                return False
+            health.failures = 0
+            health.suspect = False
+            if health.breaker != "closed":
+                self._close_breaker(health)
+            health.next_ping = 0.0
+        self._wake.set()
+        return True
+
+    # 重启
+    def mark_rebooting(self, device_id: str):
+        with self._lock:
+            health = self.lookup(device_id)
+            if health is not None:
+                health.rebooting, health.reboot_seen = True, False
+                health.set_state("booting")
+                health.next_ping = time.time() + BOOT_POLL_INTERVAL
+
+    def mark_online(self, device_id: str):
+        with self._lock:
+            health = self.lookup(device_id)
+            if health is not None:
+                health.rebooting = health.reboot_seen = False
+                health.set_state("online")
+                health.failures = 0
+                if health.breaker != "closed":
+                    self._close_breaker(health)
+
+    # Ping 和重连
+    def ping(self, health: DeviceHealth) -> bool:
+        from .endpoints import EndpointDevice
+        device = EndpointDevice(health.endpoint.client, health.serial, health.device_id)
+        start = time.perf_counter()
+        try:
+            completed = device.shell("getprop sys.boot_completed", timeout=PING_TIMEOUT).strip() == "1"
+        except Exception as e:
+            with self._lock:
+                health.suspect = False
+                health.reboot_seen = health.reboot_seen or health.rebooting
+                if health.state == "online":
+                    self._open_breaker(health, f"Ping失败: {e}")
+            return False
+        with self._lock:
+            health.last_ping = time.time()
+            health.ping_latency = time.perf_counter() - start
+            health.suspect = False
+            health.failures = 0
+            if health.rebooting:
+                if not completed:
+                    health.reboot_seen = True
+                elif health.reboot_seen:
+                    health.rebooting = health.reboot_seen = False
+                else:
+                    completed = False  # 重启命令尚未生效
+            if health.state in ("online", "booting"):
+                health.set_state("online" if completed else "booting")
+            if health.breaker != "closed" and completed:
+                self._close_breaker(health)
+        return True
+
+    def _reconnect(self, health: DeviceHealth):
+        host, port = health.tcp_address
+        try:
+            connected = health.endpoint.client.remote_connect(host, port)
+            error = None if connected else "adb connect 未成功"
+        except Exception as e:
+            connected, error = False, str(e)
+        with self._lock:
+            health.reconnect_attempts += 1
+            metrics.record_device_event(health.device_id, "reconnect" if connected else "reconnect_failed")
+            if error:
+                health.last_error = f"重连失败: {error}"
+            delay = min(RECONNECT_MIN * 2 ** health.reconnect_attempts, RECONNECT_MAX)
+            health.next_reconnect = time.time() + delay
+        health.endpoint._devices_at = 0.0
+
+    def _due_work(self, now: float) -> Tuple[List[DeviceHealth], List[DeviceHealth], float]:
+        pings, reconnects = [], []
+        next_due = now + PING_INTERVAL
+        with self._lock:
+            for health in self._devices.values():
+                if health.state in ("online", "booting"):
+                    due = now if health.suspect or (health.breaker == "open" and
+                                                    now >= health.opened_at + health.cooldown) else health.next_ping
+                    if due <= now:
+                        pings.append(health)
+                        interval = BOOT_POLL_INTERVAL if health.state == "booting" else PING_INTERVAL
+                        health.next_ping = now + interval
+                        due = health.next_ping
+                    next_due = min(next_due, due)
+                elif health.state in ("offline", "disconnected") and health.tcp_address:
+                    if health.next_reconnect <= now:
+                        reconnects.append(health)
+                    else:
+                        next_due = min(next_due, health.next_reconnect)
+        return pings, reconnects, next_due
+
+    def _ping_loop(self):
+        with ThreadPoolExecutor(max_workers=8, thread_name_prefix="adb-ping") as pool:
+            while True:
+                now = time.time()
+                pings, reconnects, next_due = self._due_work(now)
+                list(pool.map(self.ping, pings))
+                list(pool.map(self._reconnect, reconnects))
+                if not pings and not reconnects:
+                    self._wake.wait(max(next_due - time.time(), 0.05))
+                    self._wake.clear()
+
+    def report(self, device_id: Optional[str] = None) -> List[DeviceHealth]:
+        with self._lock:
+            if device_id:
+                health = self.lookup(device_id)
+                return [health] if health else []
+            return sorted(self._devices.values(), key=lambda health: health.device_id)
+
+
+monitor = HealthMonitor()
@@ -0,0 +1,288 @@
+from typing import Callable, Optional, Set
+import gzip
+import io
+import os
+import shlex
+import socket
+import tarfile
+import time
+import uuid
+from . import metrics
+
+try:
+    import zstandard
+except ImportError:  # 可选依赖: 未安装时不使用zstd压缩
+    zstandard = None
+
+# 可选的压缩方式；auto 优先使用zstd（设备和主机都支持时），其次gzip
+COMPRESSIONS = ("auto", "zstd", "gzip", "none")
+
+# 传输瓶颈通常在USB/网络，使用较低的压缩级别，避免设备CPU成为瓶颈
+GZIP_LEVEL = 1
+ZSTD_LEVEL = 3
+
+# 流式读写的缓冲区大小
+STREAM_BUFFER = 256 * 1024
+
+# 推送时设备端解包的状态和输出文件前缀
+REMOTE_STATUS_PREFIX = "/data/local/tmp/adb_mcp_untar_"
+
+# 设备端解包完成的最长等待时间（秒）
+UNPACK_WAIT = 30.0
+
+_DEVICE_COMPRESS = {"gzip": f"gzip -c -{GZIP_LEVEL}", "zstd": f"zstd -c -q -{ZSTD_LEVEL}"}
+_DEVICE_DECOMPRESS = {"gzip": "gzip -dc", "zstd": "zstd -dcq"}
+
+
+class TransferStats:
+    """一次目录传输的统计: 文件数、解包后的字节数、实际传输的字节数和耗时"""
+
+    def __init__(self, compression: str):
+        self.compression = compression
+        self.files = 0
+        self.directories = 0
+        self.bytes = 0
+        self.wire_bytes = 0
+        self.skipped = 0
+        self.elapsed = 0.0
+
+    def describe(self) -> str:
+        mb = self.bytes / 1024 / 1024
+        text = f"{self.files}个文件、{self.directories}个目录，共{mb:.2f}MB"
+        if self.compression != "none":
+            text += f"（{self.compression}压缩后传输{self.wire_bytes / 1024 / 1024:.2f}MB）"
+        text += f"，用时{self.elapsed:.2f}秒"
+        if self.elapsed > 0:
+            text += f"，{mb / self.elapsed:.1f}MB/s"
+        if self.skipped:
+            text += f"；跳过{self.skipped}个不安全的条目（绝对路径或指向目录外的链接）"
+        return text
+
+
+class _SocketReader(io.RawIOBase):
+    """把ADB连接包装为可读的文件对象，并统计接收的字节数"""
+
+    def __init__(self, sock: socket.socket, on_read: Optional[Callable[[], None]] = None):
+        self._sock = sock
+        self._on_read = on_read
+        self.received = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if self._on_read:
+            self._on_read()
+        count = self._sock.recv_into(buffer)
+        self.received += count
+        return count
+
+
+class _SocketWriter(io.RawIOBase):
+    """把ADB连接包装为可写的文件对象，并统计发送的字节数"""
+
+    def __init__(self, sock: socket.socket, on_write: Optional[Callable[[], None]] = None):
+        self._sock = sock
+        self._on_write = on_write
+        self.sent = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        if self._on_write:
+            self._on_write()
+        self._sock.sendall(data)
+        self.sent += len(data)
+        return len(data)
+
+
+def probe(device, device_path: str) -> Set[str]:
+    """一次shell调用检查设备路径是否为目录，以及设备上可用的压缩程序
+
+    返回集合中包含 "dir"（路径是目录时）和可用的压缩程序名。
+    """
+    quoted = shlex.quote(device_path)
+    output = device.shell(f"test -d {quoted} && echo dir; command -v zstd; command -v gzip")
+    found = set()
+    for line in output.splitlines():
+        name = os.path.basename(line.strip())
+        if name in ("dir", "zstd", "gzip"):
+            found.add(name)
+    return found
+
+
+def choose_compression(requested: str, available: Set[str]) -> str:
+    if requested not in COMPRESSIONS:
+        raise ValueError(f"无效的压缩方式: {requested}（可选: {', '.join(COMPRESSIONS)}）")
+    if requested == "auto":
+        if "zstd" in available and zstandard is not None:
+            return "zstd"
+        return "gzip" if "gzip" in available else "none"
+    if requested == "zstd" and zstandard is None:
+        raise RuntimeError("主机未安装 zstandard 模块，无法使用zstd压缩（pip install zstandard）")
+    if requested != "none" and requested not in available:
+        raise RuntimeError(f"设备上没有 {requested} 命令")
+    return requested
+
+
+def _open_exec(device, command: str):
+    """打开一个 exec: 连接（原始字节流，不经过终端转换）"""
+    conn = device.create_connection()
+    try:
+        conn.send(f"exec:{command}")
+    except Exception:
+        conn.close()
+        raise
+    return conn
+
+
+def _safe_extract(tar: tarfile.TarFile, member: tarfile.TarInfo, local_dir: str) -> bool:
+    """解包一个条目；拒绝绝对路径和指向目标目录之外的条目，返回是否已解包"""
+    if hasattr(tarfile, "data_filter"):
+        try:
+            tar.extract(member, local_dir, filter="data")
+            return True
+        except tarfile.FilterError:
+            return False
+    target = os.path.realpath(os.path.join(local_dir, member.name))
+    root = os.path.realpath(local_dir)
+    if os.path.isabs(member.name) or not (target == root or target.startswith(root + os.sep)) \
+            or member.issym() or member.islnk() or not (member.isfile() or member.isdir()):
+        return False
+    tar.extract(member, local_dir)
+    return True
+
+
+def pull_directory(device, device_path: str, local_dir: str, compression: str = "auto",
+                   check_cancelled: Optional[Callable[[], bool]] = None) -> TransferStats:
+    """把设备目录的内容打包为一个tar流，通过一次 exec 连接传输，在主机上边收边解包到 local_dir"""
+    available = probe(device, device_path)
+    if "dir" not in available:
+        raise RuntimeError(f"设备上的目录不存在: {device_path}")
+    compression = choose_compression(compression, available)
+    stats = TransferStats(compression)
+
+    command = f"tar -cf - -C {shlex.quote(device_path)} . 2>/dev/null"
+    if compression != "none":
+        command += f" | {_DEVICE_COMPRESS[compression]}"
+
+    def on_read():
+        if check_cancelled and check_cancelled():
+            raise RuntimeError("调用已取消")
+
+    os.makedirs(local_dir, exist_ok=True)
+    start = time.perf_counter()
+    conn = _open_exec(device, command)
+    reader = _SocketReader(conn.socket, on_read)
+    failed = True
+    try:
+        stream = io.BufferedReader(reader, STREAM_BUFFER)
+        if compression == "gzip":
+            stream = gzip.GzipFile(fileobj=stream, mode="rb")
+        elif compression == "zstd":
+            stream = zstandard.ZstdDecompressor().stream_reader(stream, read_size=STREAM_BUFFER)
+        try:
+            with tarfile.open(fileobj=stream, mode="r|", bufsize=STREAM_BUFFER) as tar:
+                for member in tar:
+                    if member.name in (".", "./"):
+                        continue
+                    if not _safe_extract(tar, member, local_dir):
+                        stats.skipped += 1
+                    elif member.isdir():
+                        stats.directories += 1
+                    else:
+                        stats.files += 1
+                        stats.bytes += member.size
+        except (tarfile.TarError, EOFError, gzip.BadGzipFile) as e:
+            if reader.received == 0:
+                raise RuntimeError("设备没有返回数据（可能没有读取权限，或设备不支持 exec/tar）") from e
+            raise RuntimeError(f"tar数据流不完整: {e}") from e
+        failed = False
+    finally:
+        conn.close()
+        stats.elapsed = time.perf_counter() - start
+        stats.wire_bytes = reader.received
+        metrics.record_adb("exec_out", stats.elapsed, bytes_in=reader.received, failed=failed)
+    return stats
+
+
+def push_directory(device, local_dir: str, device_path: str, compression: str = "auto",
+                   check_cancelled: Optional[Callable[[], bool]] = None,
+                   wait: Callable[[float], None] = time.sleep) -> TransferStats:
+    """把本地目录的内容打包为一个tar流，通过一次 exec 连接写入设备端 tar 的标准输入，在设备上边收边解包
+
+    exec 连接关闭标准输入后不再返回输出，设备端的退出码和错误输出写入临时文件，传输结束后读取。
+    """
+    if not os.path.isdir(local_dir):
+        raise RuntimeError(f"本地目录不存在: {local_dir}")
+    compression = choose_compression(compression, probe(device, "/") if compression != "none" else set())
+    stats = TransferStats(compression)
+
+    quoted = shlex.quote(device_path)
+    status_prefix = f"{REMOTE_STATUS_PREFIX}{uuid.uuid4().hex[:8]}"
+    status, log = f"{status_prefix}.status", f"{status_prefix}.log"
+    untar = f"tar -xf - -C {quoted}"
+    if compression != "none":
+        untar = f"{_DEVICE_DECOMPRESS[compression]} | {untar}"
+    command = f"mkdir -p {quoted} && {untar} >{log} 2>&1; echo $? >{status}"
+
+    def on_write():
+        if check_cancelled and check_cancelled():
+            raise RuntimeError("调用已取消")
+
+    def count(member: tarfile.TarInfo) -> tarfile.TarInfo:
+        if member.isdir():
+            if member.name != ".":
+                stats.directories += 1
+        elif member.isfile():
+            stats.files += 1
+            stats.bytes += member.size
+        return member
+
+    start = time.perf_counter()
+    conn = _open_exec(device, command)
+    writer = _SocketWriter(conn.socket, on_write)
+    failed = True
+    try:
+        buffered = io.BufferedWriter(writer, STREAM_BUFFER)
+        if compression == "gzip":
+            stream = gzip.GzipFile(fileobj=buffered, mode="wb", compresslevel=GZIP_LEVEL)
+        elif compression == "zstd":
+            stream = zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(buffered, closefd=False)
+        else:
+            stream = buffered
+        with tarfile.open(fileobj=stream, mode="w|", bufsize=STREAM_BUFFER) as tar:
+            tar.add(local_dir, arcname=".", filter=count)
+        if stream is not buffered:
+            stream.close()
+        buffered.flush()
+        conn.socket.shutdown(socket.SHUT_WR)
+        # 等待设备读完数据流并关闭连接（超时后直接轮询状态文件）
+        conn.socket.settimeout(UNPACK_WAIT)
+        try:
+            while conn.socket.recv(4096):
+                pass
+        except socket.timeout:
+            pass
+        failed = False
+    finally:
+        conn.close()
+        metrics.record_adb("exec_in", time.perf_counter() - start, bytes_out=writer.sent, failed=failed)
+    stats.wire_bytes = writer.sent
+
+    # 设备端 tar 可能在连接关闭后还在写最后几个文件，轮询状态文件
+    deadline = time.time() + UNPACK_WAIT
+    while True:
+        output = device.shell(f"cat {status} 2>/dev/null && cat {log} && rm -f {status} {log}")
+        if output.strip() or time.time() >= deadline:
+            break
+        wait(0.1)
+    stats.elapsed = time.perf_counter() - start
+    lines = output.strip().splitlines()
+    if not lines:
+        raise RuntimeError(f"{UNPACK_WAIT:.0f}秒内未等到设备端解包完成")
+    if lines[0].strip() != "0":
+        detail = "\n".join(lines[1:]).strip() or f"退出码 {lines[0].strip()}"
+        raise RuntimeError(f"设备端解包失败: {detail}")
+    return stats
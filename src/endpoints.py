@@ -0,0 +1,285 @@
+from typing import Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+import time
+from ppadb.client import Client as AdbClient
+from ppadb.connection import Connection
+from ppadb.device import Device
+
+# 设备列表缓存时间（秒），避免每次工具调用都向所有ADB服务器查询 host:devices
+DEVICE_LIST_TTL = 2.0
+
+# 不可用的ADB服务器重新检查前的最短/最长等待时间（秒），按连续失败次数指数增长
+HEALTH_RETRY_MIN = 2.0
+HEALTH_RETRY_MAX = 60.0
+
+# 每个ADB服务器同时打开的最大连接数，以及等待空闲连接的超时（秒）
+MAX_CONNECTIONS = int(os.environ.get("ADB_MAX_CONNECTIONS", "32"))
+CONNECTION_WAIT_TIMEOUT = 30.0
+
+# 健康检查和设备发现的连接超时（秒）
+DISCOVERY_TIMEOUT = 5.0
+
+
+class _PooledConnection(Connection):
+    """关闭时归还所属ADB服务器连接配额的连接"""
+
+    def __init__(self, host, port, timeout, slots: threading.BoundedSemaphore):
+        super().__init__(host, port, timeout)
+        self._slots = slots
+        self._released = False
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            if not self._released:
+                self._released = True
+                self._slots.release()
+
+    def __del__(self):
+        # 流式处理器可能没有显式关闭连接，对象回收时兜底归还配额
+        if not self._released:
+            self.close()
+
+
+class EndpointClient(AdbClient):
+    def __init__(self, endpoint: "AdbEndpoint"):
+        super().__init__(host=endpoint.host, port=endpoint.port)
+        self.endpoint = endpoint
+
+    def create_connection(self, timeout=None):
+        if not self.endpoint.slots.acquire(timeout=CONNECTION_WAIT_TIMEOUT):
+            raise RuntimeError(f"ADB服务器 {self.endpoint.alias} 的连接数已达上限 {MAX_CONNECTIONS}")
+        conn = _PooledConnection(self.host, self.port, timeout, self.endpoint.slots)
+        try:
+            conn.connect()
+        except Exception as e:
+            conn.close()
+            self.endpoint.mark_failure(e)
+            raise
+        return conn
+
+
+class EndpointDevice(Device):
+    """某个ADB服务器上的设备；serial 是ADB服务器内的序列号，device_id 是合并命名空间中的ID"""
+
+    def __init__(self, client: EndpointClient, serial: str, device_id: str, state: str = "device"):
+        super().__init__(client, serial)
+        self.device_id = device_id
+        self.state = state
+
+    @property
+    def endpoint(self) -> "AdbEndpoint":
+        return self.client.endpoint
+
+
+class AdbEndpoint:
+    """一个ADB服务器（host:port），带设备列表缓存、连接配额和健康状态"""
+
+    def __init__(self, alias: str, host: str, port: int, prefix_ids: bool = True):
+        self.alias = alias
+        self.host = host
+        self.port = port
+        self.prefix_ids = prefix_ids
+        self.client = EndpointClient(self)
+        self.slots = threading.BoundedSemaphore(MAX_CONNECTIONS)
+        self.healthy = True
+        self.failures = 0
+        self.last_error: Optional[str] = None
+        self.last_check = 0.0
+        self.latency: Optional[float] = None
+        self._devices: List[EndpointDevice] = []
+        self._devices_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def address(self) -> str:
+        return f"{self.host}:{self.port}"
+
+    def device_id(self, serial: str) -> str:
+        return f"{self.alias}:{serial}" if self.prefix_ids else serial
+
+    def mark_failure(self, error: Exception):
+        self.healthy = False
+        self.failures += 1
+        self.last_error = str(error)
+        self.last_check = time.time()
+        self._devices_at = 0.0
+
+    def mark_ok(self, latency: float):
+        self.healthy = True
+        self.failures = 0
+        self.last_error = None
+        self.last_check = time.time()
+        self.latency = latency
+
+    def should_skip(self) -> bool:
+        """不可用的ADB服务器在退避时间内不再尝试"""
+        if self.healthy:
+            return False
+        backoff = min(HEALTH_RETRY_MIN * 2 ** (self.failures - 1), HEALTH_RETRY_MAX)
+        return time.time() - self.last_check < backoff
+
+    def check(self) -> bool:
+        """健康检查: 查询 host:version 并记录往返延迟"""
+        start = time.perf_counter()
+        try:
+            with self.client.create_connection(timeout=DISCOVERY_TIMEOUT) as conn:
+                conn.send("host:version")
+                conn.receive()
+        except Exception as e:
+            if self.healthy:
+                self.mark_failure(e)
+            return False
+        self.mark_ok(time.perf_counter() - start)
+        return True
+
+    def devices(self, refresh: bool = False, include_offline: bool = False) -> List[EndpointDevice]:
+        with self._lock:
+            if refresh or time.time() - self._devices_at > DEVICE_LIST_TTL:
+                start = time.perf_counter()
+                try:
+                    with self.client.create_connection(timeout=DISCOVERY_TIMEOUT) as conn:
+                        conn.send("host:devices")
+                        listing = conn.receive()
+                except Exception as e:
+                    # 连接失败时 create_connection 已经记录过
+                    if self.healthy:
+                        self.mark_failure(e)
+                    raise
+                self.mark_ok(time.perf_counter() - start)
+                devices = []
+                for line in listing.splitlines():
+                    tokens = line.split()
+                    if len(tokens) >= 2:
+                        devices.append(EndpointDevice(self.client, tokens[0], self.device_id(tokens[0]), tokens[1]))
+                self._devices = devices
+                self._devices_at = time.time()
+            devices = self._devices
+        return devices if include_offline else [device for device in devices if device.state == "device"]
+
+    def describe(self) -> str:
+        status = "正常" if self.healthy else f"不可用（连续失败{self.failures}次: {self.last_error}）"
+        latency = f"{self.latency * 1000:.1f}ms" if self.latency is not None else "-"
+        return f"{self.alias} ({self.address}): {status}, 延迟 {latency}, 设备数 {len(self._devices)}"
+
+
+def parse_endpoints(spec: str) -> List[Tuple[str, str, int]]:
+    """解析 ADB_ENDPOINTS，例如 "hub1=10.0.0.2:5037,hub2=10.0.0.3,127.0.0.1:5037" """
+    result = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        alias, sep, address = item.partition("=")
+        if not sep:
+            alias, address = "", item
+        host, _, port = address.strip().partition(":")
+        port_number = int(port) if port else 5037
+        result.append((alias.strip() or f"{host}_{port_number}", host, port_number))
+    return result
+
+
+_endpoints: Optional[List[AdbEndpoint]] = None
+_endpoints_lock = threading.Lock()
+
+
+def get_endpoints(default_host: str = "127.0.0.1", default_port: int = 5037) -> List[AdbEndpoint]:
+    """返回已配置的ADB服务器列表
+
+    未设置 ADB_ENDPOINTS 时只使用默认ADB服务器，设备ID保持原样；配置多个ADB服务器时，
+    设备ID统一为 "别名:序列号"。
+    """
+    global _endpoints
+    with _endpoints_lock:
+        if _endpoints is None:
+            spec = os.environ.get("ADB_ENDPOINTS", "").strip()
+            if spec:
+                _endpoints = [AdbEndpoint(alias, host, port) for alias, host, port in parse_endpoints(spec)]
+            else:
+                _endpoints = [AdbEndpoint("local", default_host, default_port, prefix_ids=False)]
+        return list(_endpoints)
+
+
+def add_endpoint(alias: str, host: str, port: int) -> AdbEndpoint:
+    global _endpoints
+    with _endpoints_lock:
+        current = _endpoints or []
+        if any(endpoint.alias == alias for endpoint in current):
+            raise ValueError(f"ADB服务器别名已存在: {alias}")
+        # 加入第二个ADB服务器后，原来不带前缀的默认服务器也改为带前缀的设备ID
+        for endpoint in current:
+            endpoint.prefix_ids = True
+            endpoint._devices_at = 0.0
+        endpoint = AdbEndpoint(alias, host, port)
+        _endpoints = current + [endpoint]
+        return endpoint
+
+
+def remove_endpoint(alias: str):
+    global _endpoints
+    with _endpoints_lock:
+        remaining = [endpoint for endpoint in (_endpoints or []) if endpoint.alias != alias]
+        if len(remaining) == len(_endpoints or []):
+            raise ValueError(f"未找到ADB服务器: {alias}")
+        if not remaining:
+            raise ValueError("至少需要保留一个ADB服务器")
+        _endpoints = remaining
+
+
+def discover_devices(endpoints: List[AdbEndpoint], refresh: bool = False,
+                     include_offline: bool = False) -> List[EndpointDevice]:
+    """并发查询所有ADB服务器的设备列表，按ADB服务器配置顺序合并；不可用的服务器在退避期内跳过"""
+    active = [endpoint for endpoint in endpoints if not endpoint.should_skip()]
+
+    def fetch(endpoint: AdbEndpoint) -> List[EndpointDevice]:
+        try:
+            return endpoint.devices(refresh, include_offline)
+        except Exception:
+            return []
+
+    if len(active) <= 1:
+        results = [fetch(endpoint) for endpoint in active]
+    else:
+        with ThreadPoolExecutor(max_workers=min(len(active), 32)) as pool:
+            results = list(pool.map(fetch, active))
+    return [device for devices in results for device in devices]
+
+
+def _split_device_id(endpoints: List[AdbEndpoint], device_id: str) -> Tuple[Optional[AdbEndpoint], str]:
+    for endpoint in endpoints:
+        if endpoint.prefix_ids and device_id.startswith(endpoint.alias + ":"):
+            return endpoint, device_id[len(endpoint.alias) + 1:]
+    return None, device_id
+
+
+def resolve_device(endpoints: List[AdbEndpoint], device_id: Optional[str] = None) -> EndpointDevice:
+    """按合并命名空间中的设备ID查找设备；也接受不带前缀的序列号（在所有ADB服务器中唯一时）"""
+    if not device_id:
+        devices = discover_devices(endpoints)
+        if not devices:
+            errors = [f"{e.alias}: {e.last_error}" for e in endpoints if not e.healthy]
+            raise ValueError("未找到连接的设备" + (f"（不可用的ADB服务器: {'; '.join(errors)}）" if errors else ""))
+        return devices[0]
+
+    endpoint, serial = _split_device_id(endpoints, device_id)
+    for refresh in (False, True):
+        if endpoint is not None:
+            devices = endpoint.devices(refresh)
+        else:
+            devices = discover_devices(endpoints, refresh)
+        matches = [device for device in devices if device.serial == serial or device.device_id == device_id]
+        if len(matches) > 1:
+            raise ValueError(f"设备序列号 {serial} 在多个ADB服务器上存在，请使用 "
+                             f"{' / '.join(device.device_id for device in matches)}")
+        if matches:
+            return matches[0]
+    raise ValueError(f"未找到指定的设备: {device_id}")
+
+
+def health_report(endpoints: List[AdbEndpoint]) -> Dict[str, bool]:
+    """并发检查所有ADB服务器，返回 {别名: 是否可用}"""
+    with ThreadPoolExecutor(max_workers=min(max(len(endpoints), 1), 32)) as pool:
+        return dict(zip((endpoint.alias for endpoint in endpoints), pool.map(AdbEndpoint.check, endpoints)))
@@ -0,0 +1,204 @@
+from typing import Callable, List, Optional
+import hashlib
+import json
+import re
+import shlex
+import socket
+import time
+
+# 每个文件最多返回的匹配行数（避免一个大文件占满结果）
+MAX_MATCHES_PER_FILE = 20
+
+# 匹配行在设备端截断到的长度（字符）
+MAX_LINE_CHARS = 300
+
+# 搜索的最长时间（秒），超时后返回已收到的结果
+SEARCH_TIMEOUT = 120.0
+
+FILE_TYPES = {"any": "", "file": "-type f", "dir": "-type d"}
+
+_GREP_LINE = re.compile(r"^(.*?):(\d+):(.*)$")
+_S_IFMT, _S_IFDIR = 0o170000, 0o040000
+
+
+class SearchQuery:
+    """search_files 的查询条件，生成设备端命令，并用于校验分页游标"""
+
+    def __init__(self, root: str, name: Optional[str] = None, pattern: Optional[str] = None,
+                 file_type: str = "any", min_size: Optional[int] = None, max_size: Optional[int] = None,
+                 modified_within: Optional[int] = None, max_depth: Optional[int] = None,
+                 ignore_case: bool = False):
+        if file_type not in FILE_TYPES:
+            raise ValueError(f"无效的文件类型: {file_type}（可选: {', '.join(FILE_TYPES)}）")
+        self.root = root
+        self.name = name
+        self.pattern = pattern
+        # 搜索内容时只搜索普通文件
+        self.file_type = "file" if pattern else file_type
+        self.min_size = min_size
+        self.max_size = max_size
+        self.modified_within = modified_within
+        self.max_depth = max_depth
+        self.ignore_case = ignore_case
+
+    def fingerprint(self) -> str:
+        return hashlib.sha1(json.dumps(vars(self), sort_keys=True).encode("utf-8")).hexdigest()[:8]
+
+    def predicates(self) -> List[str]:
+        parts = []
+        if self.max_depth is not None:
+            parts.append(f"-maxdepth {int(self.max_depth)}")
+        if FILE_TYPES[self.file_type]:
+            parts.append(FILE_TYPES[self.file_type])
+        if self.name:
+            parts.append(f"{'-iname' if self.ignore_case else '-name'} {shlex.quote(self.name)}")
+        if self.min_size is not None:
+            parts.append(f"-size +{max(int(self.min_size) - 1, 0)}c")
+        if self.max_size is not None:
+            parts.append(f"-size -{int(self.max_size) + 1}c")
+        if self.modified_within is not None:
+            parts.append(f"-mmin -{int(self.modified_within)}")
+        return parts
+
+    def command(self, offset: int, limit: int) -> str:
+        """一条设备端命令: find 按条件筛选，按需 grep 内容；只输出第 offset 条起的 limit+1 条结果
+
+        head 读够行数后退出，find/grep 随之结束，超出部分不会在设备上继续遍历，也不会传回主机。
+        -H 让起点是符号链接时（例如 /sdcard）进入它指向的目录，遍历中遇到的符号链接仍不跟随。
+        """
+        find = f"find -H {shlex.quote(self.root)} {' '.join(self.predicates())}".rstrip()
+        if self.pattern:
+            flags = "-nHE" + ("i" if self.ignore_case else "")
+            action = f"-exec grep {flags} -m {MAX_MATCHES_PER_FILE} -e {shlex.quote(self.pattern)} {{}} +"
+        else:
+            action = "-exec stat -c '%s %Y %f %n' {} +"
+        skip = f" | tail -n +{offset + 1}" if offset else ""
+        # 只截断 grep 的匹配行（可能是很长的单行文件），文件列表中的路径保持完整
+        cut = f" | cut -c 1-{MAX_LINE_CHARS}" if self.pattern else ""
+        return f"{find} {action} 2>/dev/null{skip} | head -n {limit + 1}{cut}"
+
+
+class SearchResult:
+    """逐行解析搜索输出；达到条数或字符数上限后停止"""
+
+    def __init__(self, query: SearchQuery, limit: int, max_chars: int):
+        self.query = query
+        self.limit = limit
+        self.max_chars = max_chars
+        self.lines: List[str] = []
+        self.chars = 0
+        self.has_more = False
+        self.truncated_by_chars = False
+        self.timed_out = False
+
+    @property
+    def full(self) -> bool:
+        return self.has_more or self.truncated_by_chars
+
+    def feed(self, raw: str):
+        """处理一行输出，返回是否还需要更多行"""
+        if self.full:
+            return False
+        if not raw.strip():
+            return True
+        if len(self.lines) >= self.limit:
+            self.has_more = True
+            return False
+        line = self._format(raw)
+        if self.lines and self.chars + len(line) > self.max_chars:
+            self.truncated_by_chars = True
+            return False
+        self.lines.append(line)
+        self.chars += len(line) + 1
+        return True
+
+    def _format(self, raw: str) -> str:
+        if self.query.pattern:
+            match = _GREP_LINE.match(raw)
+            if match:
+                return f"{match.group(1)}:{match.group(2)}: {match.group(3).strip()}"
+            return raw.strip()  # 例如 "Binary file x matches"
+        parts = raw.split(" ", 3)
+        if len(parts) < 4 or not parts[0].isdigit():
+            return raw.strip()
+        size, mtime, mode, path = parts
+        try:
+            is_dir = int(mode, 16) & _S_IFMT == _S_IFDIR
+        except ValueError:
+            is_dir = False
+        modified = time.strftime("%Y-%m-%d %H:%M", time.localtime(int(mtime))) if mtime.isdigit() else mtime
+        if is_dir:
+            return f"{path}/  目录  {modified}"
+        return f"{path}  {_format_size(int(size))}  {modified}"
+
+
+def _format_size(size: int) -> str:
+    if size >= 1024 * 1024:
+        return f"{size / 1024 / 1024:.1f}MB"
+    if size >= 1024:
+        return f"{size / 1024:.1f}KB"
+    return f"{size}B"
+
+
+def make_cursor(query: SearchQuery, offset: int) -> str:
+    return f"{offset}.{query.fingerprint()}"
+
+
+def parse_cursor(query: SearchQuery, cursor: Optional[str]) -> int:
+    if not cursor:
+        return 0
+    offset, _, fingerprint = cursor.partition(".")
+    if not offset.isdigit() or fingerprint != query.fingerprint():
+        raise ValueError("游标无效或与当前的查询条件不匹配（翻页时请保持其他参数不变）")
+    return int(offset)
+
+
+def run_search(device, query: SearchQuery, offset: int, limit: int, max_chars: int,
+               check_cancelled: Optional[Callable[[], bool]] = None) -> SearchResult:
+    """执行搜索并流式读取结果，收满后立即关闭连接"""
+    result = SearchResult(query, limit, max_chars)
+
+    def handle_stream(conn):
+        conn.socket.settimeout(0.5)
+        deadline = time.monotonic() + SEARCH_TIMEOUT
+        buffer = b""
+        try:
+            while True:
+                if time.monotonic() >= deadline or (check_cancelled and check_cancelled()):
+                    result.timed_out = True
+                    break
+                try:
+                    chunk = conn.read(65536)
+                except socket.timeout:
+                    continue
+                if not chunk:
+                    if buffer:
+                        result.feed(buffer.decode("utf-8", errors="replace"))
+                    break
+                buffer += chunk
+                *lines, buffer = buffer.split(b"\n")
+                if not all(result.feed(raw.decode("utf-8", errors="replace")) for raw in lines):
+                    break
+        finally:
+            conn.close()
+
+    device.shell(query.command(offset, limit), handler=handle_stream)
+    return result
+
+
+def describe(result: SearchResult, offset: int) -> str:
+    query = result.query
+    kind = "匹配行" if query.pattern else "文件"
+    if not result.lines:
+        if offset:
+            return f"没有更多{kind}（已到结果末尾）"
+        note = "（搜索超时或被取消）" if result.timed_out else ""
+        return f"在 {query.root} 下没有找到匹配的{kind}{note}"
+    end = offset + len(result.lines)
+    lines = [f"第 {offset + 1}-{end} 条{kind}:"]
+    lines.extend(result.lines)
+    if result.full:
+        lines.append(f"\n还有更多结果，继续查看请使用 cursor=\"{make_cursor(query, end)}\"")
+    elif result.timed_out:
+        lines.append("\n搜索超时或被取消，结果可能不完整")
+    return "\n".join(lines)
@@ -1,9 +1,9 @@
-from typing import Optional
+from typing import Any, Optional
 import os
 import tempfile
-import base64
 from mcp.server.fastmcp import FastMCP
-from .adb_server import get_device, mcp
+from . import app_data, dir_transfer, file_search, scheduler
+from .adb_server import get_device, mcp, pull_artifact
 
 @mcp.tool()
 async def list_files(dir_path: str = "/sdcard", device_id: Optional[str] = None) -> str:
@@ -52,6 +52,45 @@ async def pull_file(device_path: str, local_path: str, device_id: Optional[str]
     except Exception as e:
         return f"拉取文件失败: {str(e)}"
 
+@mcp.tool()
+async def pull_directory(device_path: str, local_dir: str, compression: str = "auto",
+                         device_id: Optional[str] = None) -> str:
+    """从设备拉取整个目录: 设备端打包为一个tar流（可选压缩）一次传输，在本地边收边解包
+
+    适合包含大量小文件的目录（应用缓存、测试产物、DCIM等），比逐个文件拉取快得多。
+
+    参数:
+        device_path: 设备上的目录路径，目录中的内容解包到 local_dir
+        local_dir: 本地目标目录，不存在时自动创建
+        compression: 压缩方式: auto（默认，优先zstd，其次gzip）、zstd、gzip 或 none
+        device_id: 设备ID（可选，如果未提供则使用第一个可用设备）
+    """
+    try:
+        device = get_device(device_id)
+        stats = dir_transfer.pull_directory(device, device_path, local_dir, compression, scheduler.cancelled)
+        return f"成功将设备目录 {device_path} 拉取到本地 {local_dir}: {stats.describe()}"
+    except Exception as e:
+        return f"拉取目录失败: {str(e)}"
+
+@mcp.tool()
+async def push_directory(local_dir: str, device_path: str, compression: str = "auto",
+                         device_id: Optional[str] = None) -> str:
+    """把整个本地目录推送到设备: 本地打包为一个tar流（可选压缩）一次传输，在设备端边收边解包
+
+    参数:
+        local_dir: 本地目录路径，目录中的内容解包到 device_path
+        device_path: 设备上的目标目录，不存在时自动创建
+        compression: 压缩方式: auto（默认，优先zstd，其次gzip）、zstd、gzip 或 none
+        device_id: 设备ID（可选，如果未提供则使用第一个可用设备）
+    """
+    try:
+        device = get_device(device_id)
+        stats = dir_transfer.push_directory(device, local_dir, device_path, compression, scheduler.cancelled,
+                                            scheduler.sleep)
+        return f"成功将本地目录 {local_dir} 推送到设备 {device_path}: {stats.describe()}"
+    except Exception as e:
+        return f"推送目录失败: {str(e)}"
+
 @mcp.tool()
 async def read_text_file(device_path: str, device_id: Optional[str] = None) -> str:
     """读取设备上的文本文件
@@ -72,11 +111,94 @@ async def read_text_file(device_path: str, device_id: Optional[str] = None) -> s
         return f"读取文件失败: {str(e)}"
 
 @mcp.tool()
-async def download_file(device_path: str, device_id: Optional[str] = None) -> str:
-    """下载设备上的文件并转换为base64
+async def search_files(root: str = "/sdcard", name: Optional[str] = None, pattern: Optional[str] = None,
+                       file_type: str = "any", min_size: Optional[int] = None, max_size: Optional[int] = None,
+                       modified_within: Optional[int] = None, max_depth: Optional[int] = None,
+                       ignore_case: bool = False, max_results: int = 100, cursor: Optional[str] = None,
+                       device_id: Optional[str] = None) -> str:
+    """在设备上按条件查找文件，或搜索文件内容（一次设备调用，结果数在设备端限制，支持翻页）
+
+    不提供 pattern 时返回匹配的文件及其大小和修改时间；提供 pattern 时在匹配的文件中搜索内容，返回 "路径:行号: 内容"。
+
+    参数:
+        root: 搜索的根目录，默认为/sdcard
+        name: 文件名通配符，例如 "*.log"（可选）
+        pattern: 要搜索的文件内容（扩展正则表达式，可选）
+        file_type: 文件类型: any（默认）、file、dir
+        min_size: 最小文件大小（字节，可选）
+        max_size: 最大文件大小（字节，可选）
+        modified_within: 只查找最近多少分钟内修改过的文件（可选）
+        max_depth: 最大搜索深度（可选）
+        ignore_case: 文件名和内容是否忽略大小写，默认否
+        max_results: 每页最多返回的结果数，默认100
+        cursor: 上一页结果末尾给出的游标，用于继续查看后面的结果
+        device_id: 设备ID（可选，如果未提供则使用第一个可用设备）
+    """
+    try:
+        query = file_search.SearchQuery(root, name, pattern, file_type, min_size, max_size, modified_within,
+                                        max_depth, ignore_case)
+        offset = file_search.parse_cursor(query, cursor)
+        device = get_device(device_id)
+        result = file_search.run_search(device, query, offset, max(1, max_results), 10000, scheduler.cancelled)
+        return file_search.describe(result, offset)
+    except Exception as e:
+        return f"搜索文件失败: {str(e)}"
+
+@mcp.tool()
+async def query_app_database(package_name: str, database: str, query: str, limit: int = 100, offset: int = 0,
+                             method: str = "auto", device_id: Optional[str] = None) -> str:
+    """以只读方式查询应用的SQLite数据库，返回JSON格式的列名和行（只支持可调试的应用）
+
+    设备上有 sqlite3 时通过 run-as 在设备上执行查询，只传回结果；否则把数据库拉取到主机缓存后查询，
+    之后每次查询只检查一次文件大小和修改时间，数据库没有变化时不再重新拉取。
+
+    参数:
+        package_name: 应用包名
+        database: 数据库名（databases/ 目录下），或应用数据目录下的相对路径
+        query: SQL语句（SELECT 语句自动按 limit/offset 分页）
+        limit: 最多返回的行数，默认100
+        offset: 跳过的行数，用于翻页
+        method: 查询方式: auto（默认）、sqlite3（设备端）、pull（主机缓存）
+        device_id: 设备ID（可选，如果未提供则使用第一个可用设备）
+    """
+    try:
+        device = get_device(device_id)
+        result = app_data.query_database(device, package_name, database, query, limit, offset, method)
+        return app_data.to_json(result)
+    except Exception as e:
+        return f"查询应用数据库失败: {str(e)}"
+
+@mcp.tool()
+async def read_shared_prefs(package_name: str, name: Optional[str] = None, key: Optional[str] = None,
+                            device_id: Optional[str] = None) -> str:
+    """读取应用的SharedPreferences，返回JSON格式的键值（只支持可调试的应用）
+
+    参数:
+        package_name: 应用包名
+        name: SharedPreferences文件名（不含 .xml，可选，默认读取全部文件）
+        key: 只返回这个键的值（可选）
+        device_id: 设备ID（可选，如果未提供则使用第一个可用设备）
+    """
+    try:
+        device = get_device(device_id)
+        prefs = app_data.read_shared_prefs(device, package_name, name)
+        if not prefs:
+            return f"应用 {package_name} 没有SharedPreferences文件"
+        if key is not None:
+            prefs = {file_name: {key: values[key]} for file_name, values in prefs.items() if key in values}
+            if not prefs:
+                return f"未找到键: {key}"
+        return app_data.to_json(prefs, indent=1)
+    except Exception as e:
+        return f"读取SharedPreferences失败: {str(e)}"
+
+@mcp.tool()
+async def download_file(device_path: str, inline: bool = True, device_id: Optional[str] = None) -> Any:
+    """下载设备上的文件，图片以图片内容返回，其他文件以嵌入资源返回，同时保存到产物存储
 
     参数:
         device_path: 设备上的文件路径
+        inline: 是否直接返回文件内容，默认是；大文件可设为否，只返回产物句柄，再用 fetch_artifact 分段读取
         device_id: 设备ID（可选，如果未提供则使用第一个可用设备）
     """
     try:
@@ -85,35 +207,26 @@ async def download_file(device_path: str, device_id: Optional[str] = None) -> st
         # 获取文件扩展名
         _, ext = os.path.splitext(device_path)
         
-        # 创建临时文件
-        with tempfile.NamedTemporaryFile(suffix=ext, delete=False) as temp_file:
-            temp_path = temp_file.name
-            
-        # 拉取文件
-        device.pull(device_path, temp_path)
-        
-        # 将文件转换为base64
-        with open(temp_path, 'rb') as file:
-            base64_data = base64.b64encode(file.read()).decode('utf-8')
-            
-        # 删除临时文件
-        os.remove(temp_path)
-        
         # 根据文件类型设置MIME类型
         mime_types = {
             '.png': 'image/png',
             '.jpg': 'image/jpeg',
             '.jpeg': 'image/jpeg',
             '.gif': 'image/gif',
+            '.webp': 'image/webp',
             '.pdf': 'application/pdf',
             '.mp4': 'video/mp4',
             '.mp3': 'audio/mpeg',
-            '.txt': 'text/plain'
+            '.txt': 'text/plain',
+            '.log': 'text/plain',
+            '.xml': 'text/xml',
+            '.json': 'application/json'
         }
         
         mime_type = mime_types.get(ext.lower(), 'application/octet-stream')
         
-        return f"data:{mime_type};base64,{base64_data}"
+        # 直接拉取到产物存储（inline时同时保留在内存中返回），不经过额外的临时文件
+        return pull_artifact(device, device_path, mime_type, "file", device_path, inline)
     except Exception as e:
         return f"下载文件失败: {str(e)}"
 
@@ -0,0 +1,420 @@
+from typing import Dict, List, Optional, Tuple
+import json
+import math
+import re
+import time
+from .adb_server import get_device, mcp
+from .input_events import (ABS_MT_POSITION_X, ABS_MT_POSITION_Y, ABS_MT_PRESSURE, ABS_MT_SLOT,
+                           ABS_MT_TOUCH_MAJOR, ABS_MT_TRACKING_ID, BTN_TOUCH, EV_ABS, EV_KEY, EV_SYN,
+                           REPLAY_FAILED_MARKER, SYN_REPORT, InputEvent, get_event_size, stream_events)
+
+# 手势插值的采样频率（Hz）
+FRAME_RATE = 120
+
+_DISCOVERY_MARKER = "__ADB_MCP_GESTURE_SPLIT__"
+_ABS_PATTERN = re.compile(r"([0-9a-fA-F]{4})\s*:\s*value\s+(-?\d+),\s*min\s+(-?\d+),\s*max\s+(-?\d+)")
+_SECTION_PATTERN = re.compile(r"^\s*(\w+)\s+\(([0-9a-fA-F]{4})\):(.*)$")
+_SIZE_PATTERN = re.compile(r"(\d+)x(\d+)")
+_ORIENTATION_PATTERN = re.compile(r"(?:SurfaceOrientation:\s*|orientation=)(\d)")
+
+
+class GestureUnsupported(RuntimeError):
+    """设备不支持直接写入触摸事件（没有多点触控设备或没有写权限）"""
+
+
+class TouchScreen:
+    """触摸屏输入设备的多点触控参数（来自 getevent -p）"""
+
+    def __init__(self, path: str, abs_ranges: Dict[int, Tuple[int, int]], keys: set, direct: bool):
+        self.path = path
+        self.abs_ranges = abs_ranges
+        self.keys = keys
+        self.direct = direct
+
+    @property
+    def slots(self) -> int:
+        low, high = self.abs_ranges.get(ABS_MT_SLOT, (0, 0))
+        return high - low + 1
+
+    def supports(self, code: int) -> bool:
+        return code in self.abs_ranges
+
+
+def parse_input_devices(output: str) -> List[TouchScreen]:
+    """从 getevent -p 输出中找出支持多点触控（协议B）的输入设备"""
+    screens = []
+    path, abs_ranges, keys, direct, section = None, {}, set(), False, None
+
+    def finish():
+        if path and ABS_MT_POSITION_X in abs_ranges and ABS_MT_POSITION_Y in abs_ranges and ABS_MT_SLOT in abs_ranges:
+            screens.append(TouchScreen(path, abs_ranges, keys, direct))
+
+    for line in output.splitlines():
+        if line.startswith("add device"):
+            finish()
+            path = line.split(":", 1)[1].strip()
+            abs_ranges, keys, direct, section = {}, set(), False, None
+            continue
+        if "INPUT_PROP_DIRECT" in line:
+            direct = True
+        match = _SECTION_PATTERN.match(line)
+        if match:
+            section = match.group(1)
+            line = match.group(3)
+        elif line.strip().endswith(":"):
+            section = None
+            continue
+        if section == "ABS":
+            for code, _, low, high in _ABS_PATTERN.findall(line):
+                abs_ranges[int(code, 16)] = (int(low), int(high))
+        elif section == "KEY":
+            keys.update(int(token, 16) for token in re.findall(r"\b[0-9a-fA-F]{4}\b", line))
+    finish()
+    # 优先选择直接触控设备（触摸屏），而不是触控板
+    screens.sort(key=lambda screen: not screen.direct)
+    return screens
+
+
+# 缓存的屏幕旋转方向的有效期（秒）；手势的起止点超出该方向的屏幕范围时也会立即重新读取
+ROTATION_TTL = 10.0
+
+_ORIENTATION_COMMAND = "dumpsys input | grep -m 2 -E 'SurfaceOrientation|orientation='"
+
+_touchscreens: Dict[str, Tuple[TouchScreen, Tuple[int, int]]] = {}
+# 序列号 -> (屏幕旋转, 读取时间)
+_rotations: Dict[str, Tuple[int, float]] = {}
+# 已确认无法使用手势引擎的设备
+_unsupported: Dict[str, str] = {}
+
+
+def _parse_rotation(device, output: str) -> int:
+    match = _ORIENTATION_PATTERN.search(output)
+    rotation = int(match.group(1)) if match else 0
+    _rotations[device.serial] = (rotation, time.monotonic())
+    return rotation
+
+
+def _get_touchscreen(device) -> Tuple[TouchScreen, Tuple[int, int]]:
+    """返回触摸屏参数和自然方向的屏幕尺寸；按序列号缓存，首次查询时顺便读取屏幕旋转"""
+    cached = _touchscreens.get(device.serial)
+    if cached is None:
+        output = device.shell(f"getevent -p; echo {_DISCOVERY_MARKER}; wm size; echo {_DISCOVERY_MARKER}; {_ORIENTATION_COMMAND}")
+        devices_part, size_part, orientation_part = (output.split(_DISCOVERY_MARKER) + ["", ""])[:3]
+        screens = parse_input_devices(devices_part)
+        if not screens:
+            raise GestureUnsupported("未找到支持多点触控的触摸屏")
+        # "Physical size" 是自然方向的尺寸，存在 "Override size" 时以物理尺寸为准
+        sizes = _SIZE_PATTERN.findall(size_part)
+        if not sizes:
+            raise RuntimeError(f"无法获取屏幕尺寸: {size_part.strip()}")
+        cached = _touchscreens[device.serial] = (screens[0], tuple(map(int, sizes[0])))
+        _parse_rotation(device, orientation_part)
+    return cached
+
+
+def _get_rotation(device, refresh: bool = False) -> int:
+    """当前屏幕旋转（0-3），在 ROTATION_TTL 内复用缓存"""
+    cached = _rotations.get(device.serial)
+    if refresh or cached is None or time.monotonic() - cached[1] > ROTATION_TTL:
+        return _parse_rotation(device, device.shell(_ORIENTATION_COMMAND))
+    return cached[0]
+
+
+def _fits(pointers: List["Pointer"], size: Tuple[int, int], rotation: int) -> bool:
+    """各手指轨迹的起止点是否都在该旋转方向的屏幕范围内（贝塞尔控制点可以在屏幕外）"""
+    width, height = size if rotation in (0, 2) else (size[1], size[0])
+    return all(0 <= x < width and 0 <= y < height
+               for pointer in pointers for x, y in (pointer.path[0], pointer.path[-1]))
+
+
+def _to_touch(screen: TouchScreen, size: Tuple[int, int], rotation: int, x: float, y: float) -> Tuple[int, int]:
+    """把当前屏幕方向下的像素坐标换算成触摸屏原始坐标（InputReader坐标变换的逆变换）"""
+    width, height = size
+    if rotation == 1:
+        x, y = width - y, x
+    elif rotation == 2:
+        x, y = width - x, height - y
+    elif rotation == 3:
+        x, y = y, height - x
+    x_low, x_high = screen.abs_ranges[ABS_MT_POSITION_X]
+    y_low, y_high = screen.abs_ranges[ABS_MT_POSITION_Y]
+    raw_x = x_low + x * (x_high - x_low + 1) / width
+    raw_y = y_low + y * (y_high - y_low + 1) / height
+    return int(min(max(raw_x, x_low), x_high)), int(min(max(raw_y, y_low), y_high))
+
+
+# 路径插值
+
+def _bezier(points: List[Tuple[float, float]], t: float) -> Tuple[float, float]:
+    """任意阶贝塞尔曲线（de Casteljau）"""
+    current = list(points)
+    while len(current) > 1:
+        current = [((1 - t) * a[0] + t * b[0], (1 - t) * a[1] + t * b[1]) for a, b in zip(current, current[1:])]
+    return current[0]
+
+
+def _polyline(points: List[Tuple[float, float]], t: float) -> Tuple[float, float]:
+    """按弧长匀速经过折线上的各点"""
+    if len(points) == 1:
+        return points[0]
+    lengths = [math.dist(a, b) for a, b in zip(points, points[1:])]
+    total = sum(lengths)
+    if total == 0:
+        return points[0]
+    target = t * total
+    for (a, b), length in zip(zip(points, points[1:]), lengths):
+        if target <= length and length > 0:
+            ratio = target / length
+            return a[0] + (b[0] - a[0]) * ratio, a[1] + (b[1] - a[1]) * ratio
+        target -= length
+    return points[-1]
+
+
+def _ease(t: float, easing: str) -> float:
+    if easing == "ease_in_out":
+        return t * t * (3 - 2 * t)
+    if easing == "ease_in":
+        return t * t
+    if easing == "ease_out":
+        return 1 - (1 - t) * (1 - t)
+    return t
+
+
+class Pointer:
+    """一根手指的运动轨迹"""
+
+    def __init__(self, path, curve: str = "linear", start: float = 0, duration: float = 300, easing: str = "linear"):
+        self.path = [(float(x), float(y)) for x, y in path]
+        if not self.path:
+            raise ValueError("手指轨迹至少需要一个点")
+        self.curve = curve
+        self.start = float(start) / 1000
+        self.duration = max(float(duration), 0.0) / 1000
+        self.easing = easing
+
+    @property
+    def end(self) -> float:
+        return self.start + self.duration
+
+    def position(self, t: float) -> Tuple[float, float]:
+        progress = 1.0 if self.duration == 0 else min(max((t - self.start) / self.duration, 0.0), 1.0)
+        progress = _ease(progress, self.easing)
+        if self.curve == "bezier":
+            return _bezier(self.path, progress)
+        return _polyline(self.path, progress)
+
+
+def build_touch_events(pointers: List[Pointer], screen: TouchScreen, size: Tuple[int, int],
+                       rotation: int, frame_rate: int = FRAME_RATE) -> List[InputEvent]:
+    """在主机端把手指轨迹插值成按时间排列的多点触控（协议B）事件流"""
+    if len(pointers) > screen.slots:
+        raise ValueError(f"触摸屏最多支持 {screen.slots} 个触点")
+
+    end = max(pointer.end for pointer in pointers)
+    tick = 1.0 / frame_rate
+    times = {round(i * tick, 6) for i in range(int(end / tick) + 1)}
+    for pointer in pointers:
+        times.update((round(pointer.start, 6), round(pointer.end, 6)))
+    # 最后一个触点抬起需要额外一帧
+    times.add(round(end + tick, 6))
+
+    events: List[InputEvent] = []
+    path = screen.path
+    state = ["idle"] * len(pointers)  # idle -> down -> ending -> up
+    last_position: List[Optional[Tuple[int, int]]] = [None] * len(pointers)
+    touching = False
+
+    def add(t, type_, code, value):
+        events.append(InputEvent(t, path, type_, code, value))
+
+    for t in sorted(times):
+        frame_start = len(events)
+        for i, pointer in enumerate(pointers):
+            if state[i] == "up" or t < pointer.start - 1e-9:
+                continue
+            if state[i] == "ending":
+                add(t, EV_ABS, ABS_MT_SLOT, i)
+                add(t, EV_ABS, ABS_MT_TRACKING_ID, -1)
+                state[i] = "up"
+                continue
+            position = _to_touch(screen, size, rotation, *pointer.position(t))
+            if state[i] == "idle":
+                add(t, EV_ABS, ABS_MT_SLOT, i)
+                add(t, EV_ABS, ABS_MT_TRACKING_ID, 0x100 + i)
+                if screen.supports(ABS_MT_TOUCH_MAJOR):
+                    add(t, EV_ABS, ABS_MT_TOUCH_MAJOR, max(screen.abs_ranges[ABS_MT_TOUCH_MAJOR][1] // 16, 1))
+                if screen.supports(ABS_MT_PRESSURE):
+                    add(t, EV_ABS, ABS_MT_PRESSURE, max(screen.abs_ranges[ABS_MT_PRESSURE][1] // 2, 1))
+                add(t, EV_ABS, ABS_MT_POSITION_X, position[0])
+                add(t, EV_ABS, ABS_MT_POSITION_Y, position[1])
+                state[i] = "down"
+            elif position != last_position[i]:
+                add(t, EV_ABS, ABS_MT_SLOT, i)
+                if position[0] != last_position[i][0]:
+                    add(t, EV_ABS, ABS_MT_POSITION_X, position[0])
+                if position[1] != last_position[i][1]:
+                    add(t, EV_ABS, ABS_MT_POSITION_Y, position[1])
+            last_position[i] = position
+            if t >= pointer.end - 1e-9:
+                state[i] = "ending"
+
+        if len(events) == frame_start:
+            continue
+        now_touching = any(s in ("down", "ending") for s in state)
+        if BTN_TOUCH in screen.keys and now_touching != touching:
+            add(t, EV_KEY, BTN_TOUCH, 1 if now_touching else 0)
+        touching = now_touching
+        add(t, EV_SYN, SYN_REPORT, 0)
+    return events
+
+
+def perform_gesture(device, pointers: List[Pointer]) -> Tuple[int, float]:
+    """执行手势，返回 (事件数, 写入耗时秒)；事件数为0表示这次退回了 input swipe
+
+    只有找不到触摸屏或触摸屏不可写时才记为设备不支持；其他写入失败只影响这一次调用。
+    """
+    reason = _unsupported.get(device.serial)
+    if reason:
+        raise GestureUnsupported(reason)
+    try:
+        screen, size = _get_touchscreen(device)
+    except GestureUnsupported as e:
+        _unsupported[device.serial] = str(e)
+        raise
+    rotation = _get_rotation(device)
+    if not _fits(pointers, size, rotation):
+        # 坐标超出缓存方向的屏幕范围，屏幕可能已经旋转
+        rotation = _get_rotation(device, refresh=True)
+    events = build_touch_events(pointers, screen, size, rotation)
+    start = time.perf_counter()
+    try:
+        output = stream_events(device, events, get_event_size(device))
+    except Exception:
+        _rotations.pop(device.serial, None)
+        raise
+    if REPLAY_FAILED_MARKER not in output:
+        return len(events), time.perf_counter() - start
+    if "writable" not in device.shell(f"test -w {screen.path} && echo writable"):
+        _unsupported[device.serial] = f"无法写入触摸屏 {screen.path}"
+        raise GestureUnsupported(_unsupported[device.serial])
+    if len(pointers) != 1:
+        raise RuntimeError(f"写入触摸屏 {screen.path} 失败，请重试")
+    # 单指手势退回 input swipe（只经过起点和终点）
+    pointer = pointers[0]
+    (start_x, start_y), (end_x, end_y) = pointer.path[0], pointer.path[-1]
+    device.shell(f"input swipe {start_x:.0f} {start_y:.0f} {end_x:.0f} {end_y:.0f} {pointer.duration * 1000:.0f}")
+    return 0, time.perf_counter() - start
+
+
+def _describe_result(count: int, elapsed: float) -> str:
+    if count == 0:
+        return f"写入触摸屏失败，已用 input swipe 代替，耗时 {elapsed * 1000:.0f}ms"
+    return f"{count} "
+
+
+def _circle_point(cx: float, cy: float, radius: float, degrees: float) -> Tuple[float, float]:
+    radians = math.radians(degrees)
+    return cx + radius * math.cos(radians), cy + radius * math.sin(radians)
+
+
+@mcp.tool()
+async def perform_touch_gesture(pointers: str, device_id: Optional[str] = None) -> str:
+    """执行任意多指手势，所有触点轨迹在主机端插值后一次性发送到设备
+
+    参数:
+        pointers: 手指轨迹列表，JSON字符串，每个元素包含:
+                  path - 坐标点列表，例如 [[100, 800], [300, 400], [600, 800]]
+                  curve - linear（折线，默认）或 bezier（把path作为贝塞尔曲线控制点）
+                  start - 相对手势开始的按下时间（毫秒），默认0
+                  duration - 移动时长（毫秒），默认300
+                  easing - linear、ease_in、ease_out 或 ease_in_out
+        device_id: 设备ID（可选，如果未提供则使用第一个可用设备）
+    """
+    try:
+        device = get_device(device_id)
+        specs = json.loads(pointers)
+        if isinstance(specs, dict):
+            specs = [specs]
+        fingers = [Pointer(spec["path"], spec.get("curve", "linear"), spec.get("start", 0),
+                           spec.get("duration", 300), spec.get("easing", "linear")) for spec in specs]
+        count, elapsed = perform_gesture(device, fingers)
+        return f"成功执行 {len(fingers)} 指手势: " + _describe_result(count, elapsed)
+    except Exception as e:
+        return f"执行手势失败: {str(e)}"
+
+
+@mcp.tool()
+async def swipe_path(points: str, duration: int = 500, curve: str = "bezier", easing: str = "ease_in_out", device_id: Optional[str] = None) -> str:
+    """沿曲线或折线单指滑动
+
+    参数:
+        points: 坐标点列表，JSON字符串，例如 [[200, 1500], [900, 1200], [200, 600]]
+        duration: 滑动时长（毫秒），默认500
+        curve: bezier（贝塞尔曲线，默认）或 linear（折线）
+        easing: 速度曲线，linear、ease_in、ease_out 或 ease_in_out（默认）
+        device_id: 设备ID（可选，如果未提供则使用第一个可用设备）
+    """
+    try:
+        device = get_device(device_id)
+        count, elapsed = perform_gesture(device, [Pointer(json.loads(points), curve, 0, duration, easing)])
+        return f"成功沿 {curve} 路径滑动: " + _describe_result(count, elapsed)
+    except Exception as e:
+        return f"滑动失败: {str(e)}"
+
+
+@mcp.tool()
+async def pinch(center_x: int, center_y: int, start_distance: int, end_distance: int, fingers: int = 2, angle: float = 0, duration: int = 400, device_id: Optional[str] = None) -> str:
+    """多指捏合/张开（缩放）手势
+
+    参数:
+        center_x: 中心点横坐标
+        center_y: 中心点纵坐标
+        start_distance: 起始时各手指到中心的距离（像素）
+        end_distance: 结束时各手指到中心的距离（像素），大于起始距离为放大，小于为缩小
+        fingers: 手指数量，默认2
+        angle: 第一根手指所在方向的角度（度），默认0（水平）
+        duration: 手势时长（毫秒），默认400
+        device_id: 设备ID（可选，如果未提供则使用第一个可用设备）
+    """
+    try:
+        device = get_device(device_id)
+        pointers = []
+        for i in range(fingers):
+            direction = angle + 360.0 * i / fingers
+            path = [_circle_point(center_x, center_y, start_distance, direction),
+                    _circle_point(center_x, center_y, end_distance, direction)]
+            pointers.append(Pointer(path, duration=duration, easing="ease_in_out"))
+        count, elapsed = perform_gesture(device, pointers)
+        action = "张开" if end_distance > start_distance else "捏合"
+        return f"成功执行 {fingers} 指{action}: " + _describe_result(count, elapsed)
+    except Exception as e:
+        return f"缩放手势失败: {str(e)}"
+
+
+@mcp.tool()
+async def rotate_gesture(center_x: int, center_y: int, radius: int, degrees: float = 90, fingers: int = 2, start_angle: float = 0, duration: int = 500, device_id: Optional[str] = None) -> str:
+    """多指绕中心旋转手势
+
+    参数:
+        center_x: 中心点横坐标
+        center_y: 中心点纵坐标
+        radius: 手指到中心的距离（像素）
+        degrees: 旋转角度，正数为顺时针，默认90
+        fingers: 手指数量，默认2
+        start_angle: 第一根手指的起始角度（度），默认0
+        duration: 手势时长（毫秒），默认500
+        device_id: 设备ID（可选，如果未提供则使用第一个可用设备）
+    """
+    try:
+        device = get_device(device_id)
+        # 每根手指沿圆弧采样，按弧长匀速移动
+        steps = max(int(abs(degrees) / 5), 2)
+        pointers = []
+        for i in range(fingers):
+            base = start_angle + 360.0 * i / fingers
+            path = [_circle_point(center_x, center_y, radius, base + degrees * k / steps) for k in range(steps + 1)]
+            pointers.append(Pointer(path, duration=duration))
+        count, elapsed = perform_gesture(device, pointers)
+        return f"成功执行 {fingers} 指旋转 {degrees} 度: " + _describe_result(count, elapsed)
+    except Exception as e:
+        return f"旋转手势失败: {str(e)}"
@@ -0,0 +1,41 @@
+from typing import Optional
+from . import device_health
+from .adb_server import get_adb_endpoints, mcp
+
+
+@mcp.tool()
+async def get_device_health(ping: bool = False, device_id: Optional[str] = None) -> str:
+    """查看设备健康状态：在线/离线/未授权/启动中、Ping延迟、连续失败次数、熔断器和重连状态
+
+    参数:
+        ping: 是否立即Ping一次（默认使用后台监视的最近结果）
+        device_id: 设备ID（可选，默认显示所有设备）
+    """
+    try:
+        get_adb_endpoints()
+        devices = device_health.monitor.report(device_id)
+        if not devices:
+            if device_id:
+                return f"未找到设备的健康记录: {device_id}"
+            if not device_health.MONITOR_ENABLED:
+                return "设备健康监视已关闭（ADB_MCP_HEALTH_MONITOR=0）"
+            return "尚未发现设备"
+        if ping:
+            for health in devices:
+                if health.state in ("online", "booting"):
+                    device_health.monitor.ping(health)
+        return "\n".join(health.describe() for health in devices)
+    except Exception as e:
+        return f"获取设备健康状态失败: {str(e)}"
+
+
+@mcp.tool()
+async def reset_circuit_breaker(device_id: str) -> str:
+    """手动关闭设备的熔断器并清除失败计数（设备已恢复但尚未到重试时间时使用）
+
+    参数:
+        device_id: 设备ID
+    """
+    if device_health.monitor.reset(device_id):
+        return f"已重置设备 {device_id} 的熔断器"
+    return f"重置熔断器失败: 未找到设备 {device_id}"
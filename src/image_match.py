@@ -0,0 +1,435 @@
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+import os
+import struct
+import threading
+import zlib
+
+try:
+    import numpy as np
+except ImportError:  # 可选依赖: 未安装时图像匹配工具返回提示
+    np = None
+
+# 金字塔最粗一层上模板的最短边至少保留的像素数，以及最多缩小的层数（每层缩小一半）
+MIN_TEMPLATE_SIDE = 12
+MAX_PYRAMID_LEVEL = 3
+
+# 粗匹配阶段每缩小一层阈值降低多少（缩小后的图像相关性偏低）
+COARSE_MARGIN = 0.15
+
+# 只使用模板在半个像素块错位时仍然保持这个自相关系数的金字塔层；纹理很细的模板缩小后
+# 会因为与截图的网格对不齐而失去相关性，此时在更精细的层上匹配
+MIN_SHIFT_CORRELATION = 0.7
+
+# 解码后保留的模板数量
+TEMPLATE_CACHE_SIZE = 32
+
+# 灰度转换系数（ITU-R BT.601）
+_GRAY_WEIGHTS = (0.299, 0.587, 0.114)
+
+# raw screencap 的像素格式: 1=RGBA_8888, 2=RGBX_8888, 5=BGRA_8888
+_RGBA_FORMATS = (1, 2)
+_BGRA_FORMATS = (5,)
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+_PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+
+def require_numpy():
+    if np is None:
+        raise RuntimeError("图像匹配需要安装 numpy（pip install numpy）")
+
+
+class Match:
+    """一个匹配结果: 左上角坐标、宽高、相关系数（0~1）和与模板的平均颜色差（0~255）"""
+
+    __slots__ = ("x", "y", "width", "height", "score", "color_distance")
+
+    def __init__(self, x: int, y: int, width: int, height: int, score: float, color_distance: float = 0.0):
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.score = score
+        self.color_distance = color_distance
+
+    @property
+    def center(self) -> Tuple[int, int]:
+        return self.x + self.width // 2, self.y + self.height // 2
+
+    def overlaps(self, other: "Match", ratio: float = 0.3) -> bool:
+        width = min(self.x + self.width, other.x + other.width) - max(self.x, other.x)
+        height = min(self.y + self.height, other.y + other.height) - max(self.y, other.y)
+        if width <= 0 or height <= 0:
+            return False
+        return width * height > ratio * min(self.width * self.height, other.width * other.height)
+
+    def describe(self) -> str:
+        x, y = self.center
+        return (f"[{self.x},{self.y}][{self.x + self.width},{self.y + self.height}] 中心 ({x}, {y}) "
+                f"相似度 {self.score:.3f} 颜色差 {self.color_distance:.1f}")
+
+
+# 图像解码
+def decode_png(data: bytes) -> "np.ndarray":
+    """解码8位非隔行PNG，返回 (高, 宽, 通道) 的 uint8 数组（灰度/RGB/RGBA，调色板图像转为RGB）"""
+    require_numpy()
+    if not data.startswith(_PNG_SIGNATURE):
+        raise ValueError("不是PNG文件")
+    offset = len(_PNG_SIGNATURE)
+    idat, palette, header = [], None, None
+    while offset + 8 <= len(data):
+        length, tag = struct.unpack(">I4s", data[offset:offset + 8])
+        body = data[offset + 8:offset + 8 + length]
+        offset += 12 + length
+        if tag == b"IHDR":
+            header = struct.unpack(">IIBBBBB", body)
+        elif tag == b"PLTE":
+            palette = np.frombuffer(body, dtype=np.uint8).reshape(-1, 3)
+        elif tag == b"IDAT":
+            idat.append(body)
+        elif tag == b"IEND":
+            break
+    if header is None:
+        raise ValueError("PNG缺少IHDR")
+    width, height, depth, color_type, _, _, interlace = header
+    if depth != 8 or interlace or color_type not in _PNG_CHANNELS:
+        raise ValueError(f"不支持的PNG格式（位深 {depth}，颜色类型 {color_type}，隔行 {interlace}），请使用8位非隔行PNG")
+    channels = _PNG_CHANNELS[color_type]
+    stride = width * channels
+    raw = zlib.decompress(b"".join(idat))
+    if len(raw) < height * (stride + 1):
+        raise ValueError("PNG数据不完整")
+    rows = np.frombuffer(raw, dtype=np.uint8, count=height * (stride + 1)).reshape(height, stride + 1)
+    pixels = np.empty((height, stride), dtype=np.uint8)
+    previous = np.zeros(stride, dtype=np.uint8)
+    for y in range(height):
+        kind, line = rows[y, 0], rows[y, 1:]
+        if kind == 0:
+            current = line
+        elif kind == 1:
+            # Sub: 按通道累加，uint8 溢出回绕正好是模256
+            current = np.cumsum(line.reshape(-1, channels), axis=0, dtype=np.uint8).reshape(-1)
+        elif kind == 2:
+            current = line + previous
+        elif kind in (3, 4):
+            current = np.frombuffer(_unfilter_sequential(kind, line.tobytes(), previous.tobytes(), channels),
+                                    dtype=np.uint8)
+        else:
+            raise ValueError(f"无效的PNG行过滤类型: {kind}")
+        pixels[y] = current
+        previous = pixels[y]
+    image = pixels.reshape(height, width, channels)
+    if color_type == 3:
+        if palette is None:
+            raise ValueError("调色板PNG缺少PLTE")
+        image = palette[image[:, :, 0]]
+    return image
+
+
+def _unfilter_sequential(kind: int, line: bytes, previous: bytes, channels: int) -> bytes:
+    """Average/Paeth 过滤依赖同一行左侧已还原的像素，只能逐字节计算（模板通常很小）"""
+    out = bytearray(line)
+    for i in range(len(out)):
+        left = out[i - channels] if i >= channels else 0
+        up = previous[i]
+        if kind == 3:
+            out[i] = (out[i] + ((left + up) >> 1)) & 0xFF
+        else:
+            upper_left = previous[i - channels] if i >= channels else 0
+            p = left + up - upper_left
+            pa, pb, pc = abs(p - left), abs(p - up), abs(p - upper_left)
+            predictor = left if pa <= pb and pa <= pc else (up if pb <= pc else upper_left)
+            out[i] = (out[i] + predictor) & 0xFF
+    return bytes(out)
+
+
+def encode_png(image: "np.ndarray") -> bytes:
+    """把 (高, 宽, 3或4) 的 uint8 数组编码为PNG（不使用行过滤）"""
+    height, width, channels = image.shape
+    color_type = 6 if channels == 4 else 2
+    rows = np.zeros((height, width * channels + 1), dtype=np.uint8)
+    rows[:, 1:] = image.reshape(height, -1)
+
+    def chunk(tag: bytes, body: bytes) -> bytes:
+        return struct.pack(">I", len(body)) + tag + body + struct.pack(">I", zlib.crc32(tag + body) & 0xFFFFFFFF)
+
+    header = struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0)
+    return (_PNG_SIGNATURE + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(rows.tobytes(), 6))
+            + chunk(b"IEND", b""))
+
+
+def decode_raw_screencap(data: bytes) -> "np.ndarray":
+    """解析 screencap（不带 -p）输出的原始帧，返回 (高, 宽, 3) 的RGB数组
+
+    头部为宽、高、像素格式（Android 9起还有颜色空间），各4字节小端整数。
+    """
+    require_numpy()
+    if len(data) < 12:
+        raise ValueError("截图数据为空")
+    width, height, pixel_format = struct.unpack("<III", data[:12])
+    header = len(data) - width * height * 4
+    if header not in (12, 16):
+        raise ValueError(f"无法识别的原始截图格式（{width}x{height}，{len(data)}字节）")
+    pixels = np.frombuffer(data, dtype=np.uint8, offset=header).reshape(height, width, 4)
+    if pixel_format in _RGBA_FORMATS:
+        return pixels[:, :, :3]
+    if pixel_format in _BGRA_FORMATS:
+        return pixels[:, :, 2::-1]
+    raise ValueError(f"不支持的像素格式: {pixel_format}")
+
+
+def to_gray(image: "np.ndarray") -> "np.ndarray":
+    if image.ndim == 2:
+        return image.astype(np.float32)
+    if image.shape[2] < 3:
+        return image[:, :, 0].astype(np.float32)
+    r, g, b = _GRAY_WEIGHTS
+    return image[:, :, 0] * np.float32(r) + image[:, :, 1] * np.float32(g) + image[:, :, 2] * np.float32(b)
+
+
+def downscale(gray: "np.ndarray") -> "np.ndarray":
+    """2x2 取平均缩小一半"""
+    height, width = gray.shape[0] // 2 * 2, gray.shape[1] // 2 * 2
+    view = gray[:height, :width]
+    return (view[0::2, 0::2] + view[1::2, 0::2] + view[0::2, 1::2] + view[1::2, 1::2]) * np.float32(0.25)
+
+
+def dhash(gray: "np.ndarray", size: int = 16) -> int:
+    """差值感知哈希: 把灰度图按块平均缩小到 size x (size+1)，比较水平相邻块的亮度，返回 size*size 位整数"""
+    height, width = gray.shape
+    rows = np.arange(size) * height // size
+    cols = np.arange(size + 1) * width // (size + 1)
+    sums = np.add.reduceat(np.add.reduceat(gray, rows, axis=0), cols, axis=1)
+    counts = np.outer(np.diff(np.append(rows, height)), np.diff(np.append(cols, width)))
+    blocks = sums / counts
+    bits = np.packbits((blocks[:, 1:] > blocks[:, :-1]).ravel())
+    return int.from_bytes(bits.tobytes(), "big")
+
+
+# 模板
+class Template:
+    """解码后的模板: RGB 像素和各金字塔层的灰度图"""
+
+    def __init__(self, image: "np.ndarray", name: str = ""):
+        if image.ndim == 2:
+            image = image[:, :, None].repeat(3, axis=2)
+        elif image.shape[2] in (1, 2):
+            image = image[:, :, :1].repeat(3, axis=2)
+        self.name = name
+        self.rgb = np.ascontiguousarray(image[:, :, :3])
+        self.height, self.width = self.rgb.shape[:2]
+        self.levels = [to_gray(self.rgb)]
+        while len(self.levels) <= MAX_PYRAMID_LEVEL \
+                and min(self.levels[-1].shape) // 2 >= MIN_TEMPLATE_SIDE \
+                and _shift_correlation(self.levels[0], 2 ** len(self.levels) // 2) >= MIN_SHIFT_CORRELATION:
+            self.levels.append(downscale(self.levels[-1]))
+        self.mean_color = self.rgb.reshape(-1, 3).mean(axis=0)
+
+
+def _shift_correlation(gray: "np.ndarray", shift: int) -> float:
+    """图像与自身沿对角线错开 shift 像素后的相关系数"""
+    a, b = gray[shift:, shift:], gray[:-shift, :-shift]
+    a, b = a - a.mean(), b - b.mean()
+    denominator = float(np.sqrt(np.square(a, dtype=np.float64).sum() * np.square(b, dtype=np.float64).sum()))
+    return float((a * b).sum(dtype=np.float64)) / denominator if denominator else 0.0
+
+
+_template_cache: "OrderedDict[Tuple[str, int, int], Template]" = OrderedDict()
+_template_lock = threading.Lock()
+
+
+def load_template(path: str) -> Template:
+    """读取并解码PNG模板；按路径、修改时间和大小缓存，文件不变时不再重复解码"""
+    require_numpy()
+    path = os.path.abspath(os.path.expanduser(path))
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    with _template_lock:
+        template = _template_cache.get(key)
+        if template is not None:
+            _template_cache.move_to_end(key)
+            return template
+    with open(path, "rb") as file:
+        template = Template(decode_png(file.read()), os.path.basename(path))
+    with _template_lock:
+        _template_cache[key] = template
+        while len(_template_cache) > TEMPLATE_CACHE_SIZE:
+            _template_cache.popitem(last=False)
+    return template
+
+
+# 归一化互相关
+def _window_sums(image: "np.ndarray", height: int, width: int) -> Tuple["np.ndarray", "np.ndarray"]:
+    """用积分图计算每个 height x width 窗口的像素和与平方和"""
+    padded = np.zeros((image.shape[0] + 1, image.shape[1] + 1), dtype=np.float64)
+    padded[1:, 1:] = image
+    integral = padded.cumsum(0).cumsum(1)
+    padded[1:, 1:] = np.square(image)
+    integral_sq = padded.cumsum(0).cumsum(1)
+
+    def window(table):
+        return table[height:, width:] - table[:-height, width:] - table[height:, :-width] + table[:-height, :-width]
+
+    return window(integral), window(integral_sq)
+
+
+def ncc_map(image: "np.ndarray", template: "np.ndarray") -> "np.ndarray":
+    """归一化互相关: 分子用FFT计算，窗口的均值和方差用积分图计算；返回 (H-h+1, W-w+1) 的相关系数"""
+    height, width = template.shape
+    count = height * width
+    zero_mean = template.astype(np.float64) - template.mean(dtype=np.float64)
+    template_energy = float(np.square(zero_mean).sum())
+    shape = image.shape
+    if template_energy <= 0:
+        return np.zeros((shape[0] - height + 1, shape[1] - width + 1))
+    # 模板已去均值，图像减去常数不改变分子，但能减小FFT和积分图的舍入误差
+    centered = image.astype(np.float64) - image.mean(dtype=np.float64)
+    spectrum = np.fft.rfft2(centered) * np.conj(np.fft.rfft2(zero_mean, shape))
+    numerator = np.fft.irfft2(spectrum, shape)[:shape[0] - height + 1, :shape[1] - width + 1]
+    sums, sums_sq = _window_sums(centered, height, width)
+    variance = np.maximum(sums_sq - sums * sums / count, 0.0)
+    # 几乎平坦的区域（对比度不到模板的十分之一）没有可比较的结构，相关系数记为0
+    scores = np.where(variance > template_energy * 0.01,
+                      numerator / np.sqrt(np.maximum(variance, 1e-12) * template_energy), 0.0)
+    return np.clip(scores, -1.0, 1.0)
+
+
+def _peaks(scores: "np.ndarray", threshold: float, limit: int, height: int, width: int) -> List[Tuple[int, int, float]]:
+    """依次取最大值并抑制其邻域，返回不重叠的峰值 (y, x, 相关系数)"""
+    scores = scores.copy()
+    peaks = []
+    while len(peaks) < limit:
+        index = int(np.argmax(scores))
+        y, x = divmod(index, scores.shape[1])
+        score = float(scores[y, x])
+        if score < threshold:
+            break
+        peaks.append((y, x, score))
+        scores[max(0, y - height // 2):y + height // 2 + 1, max(0, x - width // 2):x + width // 2 + 1] = -1.0
+    return peaks
+
+
+def find_template(screen: "np.ndarray", template: Template, threshold: float = 0.85, max_results: int = 5,
+                  region: Optional[Tuple[int, int, int, int]] = None,
+                  color_tolerance: Optional[float] = 40.0) -> List[Match]:
+    """在截图（RGB数组）中查找模板
+
+    先在缩小的金字塔层上用FFT计算整幅图的相关系数找出候选位置，再在原始分辨率下只对候选附近的小窗口
+    精确计算；color_tolerance 不为 None 时排除平均颜色差超过该值的匹配（形状相同、颜色不同的元素）。
+    region: (x1, y1, x2, y2)，只在该区域内查找
+    """
+    require_numpy()
+    left, top = 0, 0
+    if region:
+        x1, y1, x2, y2 = region
+        left, top = max(0, x1), max(0, y1)
+        screen = screen[top:max(top, y2), left:max(left, x2)]
+    if screen.shape[0] < template.height or screen.shape[1] < template.width:
+        return []
+
+    gray = to_gray(screen)
+    level = len(template.levels) - 1
+    scaled = gray
+    for _ in range(level):
+        scaled = downscale(scaled)
+    small = template.levels[level]
+    if scaled.shape[0] < small.shape[0] or scaled.shape[1] < small.shape[1]:
+        level, scaled, small = 0, gray, template.levels[0]
+    coarse = ncc_map(scaled, small)
+    candidates = _peaks(coarse, max(threshold - COARSE_MARGIN * level, 0.0), max_results * 2,
+                        small.shape[0], small.shape[1])
+
+    factor = 2 ** level
+    radius = factor + 1 if level else 0
+    full = template.levels[0]
+    matches: List[Match] = []
+    for y, x, score in candidates:
+        if level:
+            # 在原始分辨率下，于候选位置附近重新计算，得到精确位置和相关系数
+            y0, x0 = max(0, y * factor - radius), max(0, x * factor - radius)
+            y1 = min(gray.shape[0], y * factor + radius + template.height)
+            x1 = min(gray.shape[1], x * factor + radius + template.width)
+            window = gray[y0:y1, x0:x1]
+            if window.shape[0] < template.height or window.shape[1] < template.width:
+                continue
+            refined = ncc_map(window, full)
+            dy, dx = np.unravel_index(int(np.argmax(refined)), refined.shape)
+            y, x, score = y0 + int(dy), x0 + int(dx), float(refined[dy, dx])
+        if score < threshold:
+            continue
+        patch = screen[y:y + template.height, x:x + template.width, :3]
+        distance = float(np.abs(patch.reshape(-1, 3).mean(axis=0) - template.mean_color).mean())
+        if color_tolerance is not None and distance > color_tolerance:
+            continue
+        match = Match(left + x, top + y, template.width, template.height, score, distance)
+        if not any(match.overlaps(other) for other in matches):
+            matches.append(match)
+    matches.sort(key=lambda match: (-match.score, match.color_distance))
+    return matches[:max_results]
+
+
+# 颜色匹配
+def parse_color(color: str) -> Tuple[int, int, int]:
+    """解析 "#RRGGBB"、"RRGGBB" 或 "r,g,b" 形式的颜色"""
+    text = color.strip().lstrip("#")
+    if "," in text:
+        values = tuple(int(part) for part in text.split(","))
+    elif len(text) == 6:
+        values = tuple(int(text[i:i + 2], 16) for i in (0, 2, 4))
+    else:
+        values = ()
+    if len(values) != 3 or not all(0 <= value <= 255 for value in values):
+        raise ValueError(f"无效的颜色: {color}（格式: #RRGGBB 或 r,g,b）")
+    return values
+
+
+def find_color(screen: "np.ndarray", color: Tuple[int, int, int], tolerance: int = 16, min_pixels: int = 20,
+               max_results: int = 10, region: Optional[Tuple[int, int, int, int]] = None,
+               cell: int = 8) -> List[Tuple[int, int, int, int, int]]:
+    """查找与指定颜色接近（每个通道差不超过 tolerance）的区域
+
+    按 cell x cell 的网格合并相邻的匹配像素，返回按像素数从多到少排序的 (x1, y1, x2, y2, 像素数)。
+    """
+    require_numpy()
+    left, top = 0, 0
+    if region:
+        x1, y1, x2, y2 = region
+        left, top = max(0, x1), max(0, y1)
+        screen = screen[top:max(top, y2), left:max(left, x2)]
+    mask = np.ones(screen.shape[:2], dtype=bool)
+    for channel, value in enumerate(color):
+        plane = screen[:, :, channel]
+        mask &= (plane >= max(0, value - tolerance)) & (plane <= min(255, value + tolerance))
+    if not mask.any():
+        return []
+    height, width = mask.shape
+    grid_h, grid_w = -(-height // cell), -(-width // cell)
+    padded = np.zeros((grid_h * cell, grid_w * cell), dtype=bool)
+    padded[:height, :width] = mask
+    counts = padded.reshape(grid_h, cell, grid_w, cell).sum(axis=(1, 3))
+
+    # 网格上的连通区域（4邻接），网格很小，直接用栈遍历
+    labels = np.zeros(counts.shape, dtype=np.int32)
+    regions = []
+    for start in zip(*np.nonzero(counts)):
+        if labels[start]:
+            continue
+        label = len(regions) + 1
+        labels[start] = label
+        stack, cells = [start], []
+        while stack:
+            gy, gx = stack.pop()
+            cells.append((gy, gx))
+            for ny, nx in ((gy - 1, gx), (gy + 1, gx), (gy, gx - 1), (gy, gx + 1)):
+                if 0 <= ny < grid_h and 0 <= nx < grid_w and counts[ny, nx] and not labels[ny, nx]:
+                    labels[ny, nx] = label
+                    stack.append((ny, nx))
+        rows, cols = zip(*cells)
+        y1, y2, x1, x2 = min(rows) * cell, (max(rows) + 1) * cell, min(cols) * cell, (max(cols) + 1) * cell
+        ys, xs = np.nonzero(mask[y1:y2, x1:x2])
+        regions.append((left + x1 + int(xs.min()), top + y1 + int(ys.min()),
+                        left + x1 + int(xs.max()) + 1, top + y1 + int(ys.max()) + 1, int(len(xs))))
+    regions = [r for r in regions if r[4] >= min_pixels]
+    regions.sort(key=lambda r: r[4], reverse=True)
+    return regions[:max_results]
@@ -0,0 +1,148 @@
+from typing import Optional, Tuple
+import os
+import time
+from . import image_match, metrics
+from .adb_server import exec_out, get_device, mcp
+
+
+def _parse_region(region: Optional[str]) -> Optional[Tuple[int, int, int, int]]:
+    if not region:
+        return None
+    values = [int(value) for value in region.replace("[", ",").replace("]", ",").split(",") if value.strip()]
+    if len(values) != 4 or values[0] >= values[2] or values[1] >= values[3]:
+        raise ValueError(f"无效的区域: {region}（格式: x1,y1,x2,y2）")
+    return values[0], values[1], values[2], values[3]
+
+
+def capture_screen(device):
+    """截取原始帧（screencap 不带 -p，不经过PNG编码和解码），返回 (RGB数组, 耗时秒数)"""
+    image_match.require_numpy()
+    start = time.perf_counter()
+    data = exec_out(device, "screencap")
+    with metrics.phase("decode_frame"):
+        screen = image_match.decode_raw_screencap(data)
+    return screen, time.perf_counter() - start
+
+
+def _locate(template_path: str, threshold: float, max_results: int, region: Optional[str], match_color: bool,
+            device):
+    template = image_match.load_template(template_path)
+    screen, capture_time = capture_screen(device)
+    start = time.perf_counter()
+    with metrics.phase("template_match"):
+        matches = image_match.find_template(screen, template, threshold, max_results, _parse_region(region),
+                                            40.0 if match_color else None)
+    timing = f"截图 {capture_time * 1000:.0f}ms，匹配 {(time.perf_counter() - start) * 1000:.0f}ms"
+    return template, matches, timing
+
+
+@mcp.tool()
+async def find_image(template_path: str, threshold: float = 0.85, max_results: int = 5,
+                     region: Optional[str] = None, match_color: bool = True,
+                     device_id: Optional[str] = None) -> str:
+    """在当前屏幕上查找与模板图片相似的区域（不依赖 uiautomator，适用于游戏、WebView、Flutter 等界面）
+
+    使用图像金字塔上的归一化互相关匹配，返回每个匹配的位置、中心点和相似度。模板按文件缓存，只解码一次。
+    模板应从同一分辨率的截图中裁剪（可用 capture_template 生成）。需要安装 numpy。
+
+    参数:
+        template_path: 本地模板图片路径（PNG）
+        threshold: 相似度阈值（0~1），默认0.85
+        max_results: 最多返回的匹配数，默认5
+        region: 只在该区域内查找，格式 "x1,y1,x2,y2"（可选）
+        match_color: 是否同时比较颜色（排除形状相同但颜色不同的元素），默认是
+        device_id: 设备ID（可选，如果未提供则使用第一个可用设备）
+    """
+    try:
+        device = get_device(device_id)
+        template, matches, timing = _locate(template_path, threshold, max_results, region, match_color, device)
+        if not matches:
+            return f"未找到与模板 {template.name} 匹配的区域（阈值 {threshold}，{timing}）"
+        lines = [f"找到 {len(matches)} 个匹配（模板 {template.width}x{template.height}，{timing}）:"]
+        lines.extend(f"{index}. {match.describe()}" for index, match in enumerate(matches, 1))
+        return "\n".join(lines)
+    except Exception as e:
+        return f"查找图片失败: {str(e)}"
+
+
+@mcp.tool()
+async def tap_image(template_path: str, threshold: float = 0.85, region: Optional[str] = None,
+                    match_color: bool = True, device_id: Optional[str] = None) -> str:
+    """在当前屏幕上查找模板图片，点击相似度最高的匹配的中心点
+
+    参数:
+        template_path: 本地模板图片路径（PNG）
+        threshold: 相似度阈值（0~1），默认0.85
+        region: 只在该区域内查找，格式 "x1,y1,x2,y2"（可选）
+        match_color: 是否同时比较颜色，默认是
+        device_id: 设备ID（可选，如果未提供则使用第一个可用设备）
+    """
+    try:
+        device = get_device(device_id)
+        template, matches, timing = _locate(template_path, threshold, 1, region, match_color, device)
+        if not matches:
+            return f"点击图片失败: 未找到与模板 {template.name} 匹配的区域（阈值 {threshold}，{timing}）"
+        x, y = matches[0].center
+        device.shell(f"input tap {x} {y}")
+        return f"已点击图片 {template.name}，坐标: ({x}, {y})，相似度 {matches[0].score:.3f}（{timing}）"
+    except Exception as e:
+        return f"点击图片失败: {str(e)}"
+
+
+@mcp.tool()
+async def find_color(color: str, tolerance: int = 16, region: Optional[str] = None, max_results: int = 10,
+                     device_id: Optional[str] = None) -> str:
+    """在当前屏幕上查找指定颜色的区域，返回每个区域的边界和中心点
+
+    参数:
+        color: 颜色，格式 "#RRGGBB" 或 "r,g,b"
+        tolerance: 每个颜色通道允许的差值（0~255），默认16
+        region: 只在该区域内查找，格式 "x1,y1,x2,y2"（可选）
+        max_results: 最多返回的区域数，默认10
+        device_id: 设备ID（可选，如果未提供则使用第一个可用设备）
+    """
+    try:
+        target = image_match.parse_color(color)
+        device = get_device(device_id)
+        screen, capture_time = capture_screen(device)
+        start = time.perf_counter()
+        with metrics.phase("color_match"):
+            regions = image_match.find_color(screen, target, tolerance, max_results=max_results,
+                                             region=_parse_region(region))
+        timing = f"截图 {capture_time * 1000:.0f}ms，匹配 {(time.perf_counter() - start) * 1000:.0f}ms"
+        if not regions:
+            return f"未找到颜色 {color} 的区域（容差 {tolerance}，{timing}）"
+        lines = [f"找到 {len(regions)} 个颜色 {color} 的区域（{timing}）:"]
+        for index, (x1, y1, x2, y2, pixels) in enumerate(regions, 1):
+            lines.append(f"{index}. [{x1},{y1}][{x2},{y2}] 中心 ({(x1 + x2) // 2}, {(y1 + y2) // 2}) {pixels}个像素")
+        return "\n".join(lines)
+    except Exception as e:
+        return f"查找颜色失败: {str(e)}"
+
+
+@mcp.tool()
+async def capture_template(x1: int, y1: int, x2: int, y2: int, save_path: str,
+                           device_id: Optional[str] = None) -> str:
+    """从当前屏幕裁剪一块区域保存为PNG模板，供 find_image / tap_image 使用
+
+    参数:
+        x1: 左上角横坐标
+        y1: 左上角纵坐标
+        x2: 右下角横坐标
+        y2: 右下角纵坐标
+        save_path: 本地保存路径（.png）
+        device_id: 设备ID（可选，如果未提供则使用第一个可用设备）
+    """
+    try:
+        device = get_device(device_id)
+        screen, _ = capture_screen(device)
+        crop = screen[max(0, y1):y2, max(0, x1):x2]
+        if crop.size == 0:
+            return f"保存模板失败: 区域 [{x1},{y1}][{x2},{y2}] 超出屏幕（{screen.shape[1]}x{screen.shape[0]}）"
+        directory = os.path.dirname(os.path.abspath(save_path))
+        os.makedirs(directory, exist_ok=True)
+        with open(save_path, "wb") as file:
+            file.write(image_match.encode_png(crop))
+        return f"成功保存模板 {save_path}（{crop.shape[1]}x{crop.shape[0]}）"
+    except Exception as e:
+        return f"保存模板失败: {str(e)}"
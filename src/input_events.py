@@ -0,0 +1,258 @@
+from typing import Dict, List, Optional, Tuple
+import hashlib
+import os
+import re
+import struct
+import tempfile
+import time
+from . import metrics
+
+# 设备上回放脚本和事件数据的路径前缀
+REMOTE_REPLAY_PREFIX = "/data/local/tmp/adb_mcp_replay_"
+
+# 写入输入设备失败时脚本输出的标记（通常是没有权限）
+REPLAY_FAILED_MARKER = "__ADB_MCP_REPLAY_FAILED__"
+
+# 事件类型/代码（linux/input-event-codes.h）
+EV_SYN, EV_KEY, EV_ABS = 0x00, 0x01, 0x03
+SYN_REPORT = 0x00
+BTN_TOUCH = 0x14a
+ABS_MT_SLOT = 0x2f
+ABS_MT_TOUCH_MAJOR = 0x30
+ABS_MT_POSITION_X = 0x35
+ABS_MT_POSITION_Y = 0x36
+ABS_MT_TRACKING_ID = 0x39
+ABS_MT_PRESSURE = 0x3a
+
+# 间隔小于该值（秒）的相邻帧合并为一次写入，避免频繁启动进程
+MIN_SLEEP = 0.004
+
+# 录制日志格式: 头部 + 设备路径表 + 定长事件记录（相对起点的微秒偏移、设备序号、type、code、value）
+_LOG_MAGIC = b"AMIR"
+_LOG_VERSION = 1
+_LOG_RECORD = struct.Struct("<IBHHi")
+
+_GETEVENT_PATTERN = re.compile(
+    r"^\[\s*(\d+)\.(\d+)\]\s+(/dev/input/event\d+):\s+([0-9a-fA-F]{4})\s+([0-9a-fA-F]{4})\s+([0-9a-fA-F]{8})"
+)
+
+_event_sizes: Dict[str, int] = {}
+
+
+class InputEvent:
+    __slots__ = ("time", "device", "type", "code", "value")
+
+    def __init__(self, time: float, device: str, type_: int, code: int, value: int):
+        self.time = time
+        self.device = device
+        self.type = type_
+        self.code = code
+        self.value = value
+
+
+def parse_getevent_line(line: str) -> Optional[InputEvent]:
+    """解析 `getevent -t` 的一行，例如 [   5034.312598] /dev/input/event2: 0003 0035 000001a4"""
+    match = _GETEVENT_PATTERN.match(line.strip())
+    if not match:
+        return None
+    sec, frac, device, type_hex, code_hex, value_hex = match.groups()
+    value = int(value_hex, 16)
+    if value >= 0x80000000:
+        value -= 0x100000000
+    return InputEvent(int(sec) + int(frac) / (10 ** len(frac)), device, int(type_hex, 16), int(code_hex, 16), value)
+
+
+def encode_event_log(events: List[InputEvent]) -> bytes:
+    """把事件序列压缩为二进制日志（每个事件13字节）"""
+    devices = sorted({event.device for event in events})
+    index = {device: i for i, device in enumerate(devices)}
+    start = events[0].time if events else 0.0
+    parts = [_LOG_MAGIC, struct.pack("<BB", _LOG_VERSION, len(devices))]
+    for device in devices:
+        encoded = device.encode("utf-8")
+        parts.append(struct.pack("<B", len(encoded)) + encoded)
+    parts.append(struct.pack("<I", len(events)))
+    for event in events:
+        offset_us = int(round((event.time - start) * 1_000_000))
+        parts.append(_LOG_RECORD.pack(offset_us, index[event.device], event.type, event.code, event.value))
+    return b"".join(parts)
+
+
+def decode_event_log(data: bytes) -> List[InputEvent]:
+    if data[:4] != _LOG_MAGIC:
+        raise ValueError("不是有效的输入事件日志")
+    version, device_count = struct.unpack_from("<BB", data, 4)
+    if version != _LOG_VERSION:
+        raise ValueError(f"不支持的事件日志版本: {version}")
+    pos = 6
+    devices = []
+    for _ in range(device_count):
+        length = data[pos]
+        devices.append(data[pos + 1:pos + 1 + length].decode("utf-8"))
+        pos += 1 + length
+    (count,) = struct.unpack_from("<I", data, pos)
+    pos += 4
+    events = []
+    for offset_us, device_index, type_, code, value in _LOG_RECORD.iter_unpack(data[pos:pos + count * _LOG_RECORD.size]):
+        events.append(InputEvent(offset_us / 1_000_000, devices[device_index], type_, code, value))
+    return events
+
+
+def get_event_size(device) -> int:
+    """内核input_event结构大小：64位用户态为24字节，32位为16字节"""
+    size = _event_sizes.get(device.serial)
+    if size is None:
+        abi = device.shell("getprop ro.product.cpu.abi").strip()
+        size = _event_sizes[device.serial] = 24 if "64" in abi else 16
+    return size
+
+
+def pack_event(type_: int, code: int, value: int, event_size: int) -> bytes:
+    # 时间戳填0，写入evdev时内核会使用当前时间
+    if event_size == 24:
+        return struct.pack("<qqHHi", 0, 0, type_, code, value)
+    return struct.pack("<iiHHi", 0, 0, type_, code, value)
+
+
+def _frames(events: List[InputEvent]) -> List[Tuple[float, str, List[InputEvent]]]:
+    """按SYN_REPORT切分为帧（同一设备同一时刻需要原子写入的事件组）"""
+    frames = []
+    current: Dict[str, List[InputEvent]] = {}
+    for event in events:
+        current.setdefault(event.device, []).append(event)
+        if event.type == EV_SYN and event.code == SYN_REPORT:
+            group = current.pop(event.device)
+            frames.append((group[0].time, event.device, group))
+    for device, group in current.items():
+        frames.append((group[0].time, device, group))
+    frames.sort(key=lambda frame: frame[0])
+    return frames
+
+
+# 回放脚本头部: w 按相对起点的微秒偏移等待（$1），用 shell 内置的 EPOCHREALTIME 扣除 dd/sleep 进程启动
+# 已经消耗的时间，误差不会逐帧累积；shell 不支持 EPOCHREALTIME 时退回按名义间隔（$2 秒）sleep
+_REPLAY_HEADER = """t=$EPOCHREALTIME; s0=${t%.*}; u0=1${t#*.}
+w() {
+  t=$EPOCHREALTIME
+  if [ -z "$t" ]; then sleep $2; return; fi
+  r=$(( $1 - (${t%.*} - s0) * 1000000 - 1${t#*.} + u0 ))
+  if [ $r -le 0 ]; then return; fi
+  f=00000$(( r % 1000000 )); f=${f#"${f%??????}"}
+  sleep $(( r / 1000000 )).$f
+}
+"""
+
+
+def build_replay(events: List[InputEvent], event_size: int, speed: float = 1.0) -> Tuple[str, bytes, str]:
+    """生成设备端回放脚本及事件数据
+
+    返回 (脚本文本模板, 事件数据, 内容哈希)，脚本中以 {data} 表示事件数据文件。
+    所有输入设备的事件按帧顺序写入同一个数据文件；每帧用一次 dd 写入对应的
+    /dev/input/eventX，帧间等待到该帧相对起点的时间点（而不是固定 sleep 帧间隔），
+    进程启动的开销不会拉长回放，整个回放在设备上由一条命令执行。
+    """
+    blob = bytearray()
+    count = 0
+    lines = []
+    first_time = last_time = None
+    pending = None  # (device, skip, count)
+
+    def emit_pending():
+        if pending:
+            device, skip, length = pending
+            lines.append(f"dd if={{data}} of={device} bs={event_size} skip={skip} count={length} 2>/dev/null"
+                         f" || echo {REPLAY_FAILED_MARKER} {device}")
+
+    for frame_time, device, group in _frames(events):
+        if first_time is None:
+            first_time = last_time = frame_time
+        # 相对上一次等待的时间点计算间隔，被合并掉的小间隔会累计到下一次等待
+        gap = (frame_time - last_time) / speed
+        if gap >= MIN_SLEEP:
+            emit_pending()
+            pending = None
+            offset_us = int(round((frame_time - first_time) / speed * 1_000_000))
+            lines.append(f"w {offset_us} {gap:.4f}")
+            last_time = frame_time
+        elif pending and pending[0] != device:
+            emit_pending()
+            pending = None
+
+        for event in group:
+            blob += pack_event(event.type, event.code, event.value, event_size)
+        if pending:
+            pending = (device, pending[1], pending[2] + len(group))
+        else:
+            pending = (device, count, len(group))
+        count += len(group)
+    emit_pending()
+
+    script = _REPLAY_HEADER + "\n".join(lines) + "\n"
+    digest = hashlib.sha1(script.encode("utf-8") + bytes(blob)).hexdigest()[:16]
+    return script, bytes(blob), digest
+
+
+def run_replay(device, script: str, blob: bytes, digest: str, keep: bool = True) -> str:
+    """在设备上执行回放，返回设备输出
+
+    keep=True 时回放文件保留在设备上，相同内容再次回放只需一条shell命令；
+    keep=False 时执行后立即删除回放文件。
+    """
+    remote_base = f"{REMOTE_REPLAY_PREFIX}{digest}"
+    remote_script, remote_data = remote_base + ".sh", remote_base + ".bin"
+    if keep:
+        marker = "__ADB_MCP_REPLAY_MISSING__"
+        output = device.shell(f"if [ -f {remote_script} ]; then sh {remote_script}; else echo {marker}; fi")
+        if marker not in output:
+            return output
+
+    with tempfile.TemporaryDirectory() as local_dir:
+        local_data = os.path.join(local_dir, "events.bin")
+        with open(local_data, "wb") as file:
+            file.write(blob)
+        device.push(local_data, remote_data)
+        local_script = os.path.join(local_dir, "replay.sh")
+        with open(local_script, "w") as file:
+            file.write(script.replace("{data}", remote_data))
+        # 脚本最后推送，保证存在脚本时数据一定完整
+        device.push(local_script, remote_script)
+    cleanup = "" if keep else f"; rm -f {remote_script} {remote_data}"
+    return device.shell(f"sh {remote_script}{cleanup}")
+
+
+def stream_events(device, events: List[InputEvent], event_size: int) -> str:
+    """通过一条 exec: 连接把事件按时间点写入一个输入设备，返回设备输出
+
+    设备端只有一个 dd 进程写 /dev/input/eventX，主机按每帧相对起点的时间把整帧事件写入连接的标准输入；
+    不推送文件，也不为每帧启动进程。用于只写一个输入设备的短手势（触摸屏手势）。
+    """
+    frames = _frames(events)
+    path = frames[0][1]
+    chunks = [(frame_time, b"".join(pack_event(event.type, event.code, event.value, event_size) for event in group))
+              for frame_time, _, group in frames]
+    total = sum(len(data) for _, data in chunks)
+    # 管道里一次读到的数据不一定以事件为边界；ibs 与 obs 不同时 dd 把输入重新分块，
+    # 凑满 obs 字节才写出，每次 write() 恰好是一个完整事件
+    command = (f"head -c {total} | dd of={path} ibs=4096 obs={event_size} 2>/dev/null"
+               f" || echo {REPLAY_FAILED_MARKER} {path}")
+    output = []
+    start = time.perf_counter()
+    try:
+        with device.create_connection() as conn:
+            conn.send(f"exec:{command}")
+            first = chunks[0][0]
+            for frame_time, data in chunks:
+                delay = start + (frame_time - first) - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                conn.socket.sendall(data)
+            while True:
+                chunk = conn.read(4096)
+                if not chunk:
+                    break
+                output.append(chunk)
+    except Exception:
+        metrics.record_adb("exec_in", time.perf_counter() - start, bytes_out=total, failed=True)
+        raise
+    metrics.record_adb("exec_in", time.perf_counter() - start, bytes_out=total)
+    return b"".join(output).decode("utf-8", "replace")
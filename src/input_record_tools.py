@@ -0,0 +1,146 @@
+from typing import Optional
+import asyncio
+import os
+import socket
+import tempfile
+import time
+from .adb_server import get_device, mcp
+from .input_events import (REPLAY_FAILED_MARKER, build_replay, decode_event_log, encode_event_log,
+                           get_event_size, parse_getevent_line, run_replay)
+from .jobs import start_job
+
+# 本地保存录制日志的目录
+RECORDING_DIR = os.path.join(tempfile.gettempdir(), "adb_mcp_recordings")
+
+
+def _recording_path(recording_id: str) -> str:
+    return os.path.join(RECORDING_DIR, f"{recording_id}.evlog")
+
+
+def _record(job, device, duration: float) -> dict:
+    """后台任务: 流式读取 getevent -t 输出直到时长结束，保存为二进制事件日志"""
+    events = []
+
+    def handle_stream(conn):
+        conn.socket.settimeout(0.2)
+        deadline = time.time() + duration
+        buffer = b""
+        try:
+            while time.time() < deadline and not job.cancel_event.is_set():
+                try:
+                    chunk = conn.read(4096)
+                except socket.timeout:
+                    continue
+                if not chunk:
+                    break
+                buffer += chunk
+                *lines, buffer = buffer.split(b"\n")
+                for raw in lines:
+                    event = parse_getevent_line(raw.decode("utf-8", errors="ignore"))
+                    if event is not None:
+                        events.append(event)
+                job.set_progress(f"已录制 {len(events)} 个事件")
+        finally:
+            conn.close()
+
+    device.shell("getevent -t", handler=handle_stream)
+
+    os.makedirs(RECORDING_DIR, exist_ok=True)
+    data = encode_event_log(events)
+    with open(_recording_path(job.id), "wb") as file:
+        file.write(data)
+    return {
+        "id": job.id,
+        "events": len(events),
+        "devices": sorted({event.device for event in events}),
+        "duration": events[-1].time - events[0].time if events else 0.0,
+        "bytes": len(data),
+    }
+
+
+@mcp.tool()
+async def record_input(duration: int = 10, device_id: Optional[str] = None) -> str:
+    """录制设备上的触摸/按键输入，保存为紧凑的二进制事件日志
+
+    录制期间请直接在设备上操作，结束后可用 replay_input 按原始节奏回放。
+
+    参数:
+        duration: 录制时长（秒），默认10秒
+        device_id: 设备ID（可选，如果未提供则使用第一个可用设备）
+    """
+    try:
+        device = get_device(device_id)
+        job = start_job("record_input", device.serial, _record, device, duration)
+        while not job.finished:
+            await asyncio.sleep(0.5)
+        if job.status != "done":
+            return f"录制输入失败: {job.error or job.status}"
+        result = job.result
+        if not result["events"]:
+            return f"录制结束，但没有捕获到输入事件（录制ID: {result['id']}）"
+        return (f"录制完成，录制ID: {result['id']}\n"
+                f"事件数: {result['events']}\n"
+                f"有效时长: {result['duration']:.2f}秒\n"
+                f"输入设备: {', '.join(result['devices'])}\n"
+                f"日志大小: {result['bytes']}字节")
+    except Exception as e:
+        return f"录制输入失败: {str(e)}"
+
+
+@mcp.tool()
+async def replay_input(recording_id: str, speed: float = 1.0, device_id: Optional[str] = None) -> str:
+    """在设备上回放录制的输入事件
+
+    事件在设备端由单条命令按原始时间间隔写入输入设备，回放过程中没有主机往返；
+    同一录制第二次回放时无需重新推送数据。
+
+    参数:
+        recording_id: record_input 返回的录制ID
+        speed: 回放速度倍率，默认1.0（原速），2.0为两倍速
+        device_id: 设备ID（可选，如果未提供则使用第一个可用设备）
+    """
+    try:
+        path = _recording_path(recording_id)
+        if not os.path.exists(path):
+            return f"未找到录制: {recording_id}"
+        if speed <= 0:
+            return "回放速度必须大于0"
+        with open(path, "rb") as file:
+            events = decode_event_log(file.read())
+        if not events:
+            return f"录制 {recording_id} 中没有事件"
+
+        device = get_device(device_id)
+        script, blob, digest = build_replay(events, get_event_size(device), speed)
+        start = time.perf_counter()
+        output = run_replay(device, script, blob, digest)
+        elapsed = time.perf_counter() - start
+        if REPLAY_FAILED_MARKER in output:
+            return f"回放输入失败: 无法写入输入设备\n{output.strip()[:500]}"
+        result = (f"回放完成: {len(events)} 个事件，录制时长 {events[-1].time / speed:.2f}秒，"
+                  f"实际耗时 {elapsed:.2f}秒")
+        if output.strip():
+            result += f"\n设备输出: {output.strip()[:500]}"
+        return result
+    except Exception as e:
+        return f"回放输入失败: {str(e)}"
+
+
+@mcp.tool()
+async def list_input_recordings() -> str:
+    """列出本地保存的输入录制"""
+    try:
+        if not os.path.isdir(RECORDING_DIR):
+            return "没有输入录制"
+        lines = []
+        for name in sorted(os.listdir(RECORDING_DIR)):
+            if not name.endswith(".evlog"):
+                continue
+            path = os.path.join(RECORDING_DIR, name)
+            with open(path, "rb") as file:
+                events = decode_event_log(file.read())
+            duration = events[-1].time if events else 0.0
+            lines.append(f"{name[:-len('.evlog')]}  事件数={len(events)}  时长={duration:.2f}秒")
+        return "\n".join(lines) if lines else "没有输入录制"
+    except Exception as e:
+        return f"列出输入录制失败: {str(e)}"
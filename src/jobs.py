@@ -0,0 +1,112 @@
+from typing import Any, Callable, Dict, List, Optional
+import threading
+import time
+import uuid
+from . import scheduler
+
+# 已结束的任务最多保留的数量，超出后丢弃最早的记录
+MAX_FINISHED_JOBS = 100
+
+
+class BackgroundJob:
+    """在后台线程中运行的长耗时设备任务（bugreport、trace采集等）"""
+
+    def __init__(self, kind: str, serial: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.serial = serial
+        self.status = "running"
+        self.progress = ""
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.cancel_event = threading.Event()
+        self.done_event = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.done_event.is_set()
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished_at or time.time()) - self.started_at
+
+    def set_progress(self, progress: str):
+        self.progress = progress
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def describe(self) -> str:
+        lines = [
+            f"任务ID: {self.id}",
+            f"类型: {self.kind}",
+            f"设备: {self.serial}",
+            f"状态: {self.status}",
+            f"耗时: {self.elapsed:.1f}秒",
+        ]
+        if self.progress:
+            lines.append(f"进度: {self.progress}")
+        if self.error:
+            lines.append(f"错误: {self.error}")
+        return "\n".join(lines)
+
+
+_jobs: Dict[str, BackgroundJob] = {}
+_jobs_lock = threading.Lock()
+
+
+def start_job(kind: str, serial: str, target: Callable[..., Any], *args, device_lane: bool = False) -> BackgroundJob:
+    """启动后台任务，target(job, *args) 的返回值保存为 job.result
+
+    device_lane 为 True 时任务与后台类工具一样排队: 遵守其他会话的设备锁定，执行期间占用设备的后台执行位置。
+    """
+    job = BackgroundJob(kind, serial)
+    owner = scheduler.session_key() if device_lane else None
+
+    def execute():
+        job.set_progress("")
+        return target(job, *args)
+
+    def run():
+        try:
+            if device_lane:
+                job.set_progress("等待设备空闲")
+                job.result = scheduler.run_in_lane(kind, scheduler.device_key(serial), execute, job.cancel_event, owner)
+            else:
+                job.result = target(job, *args)
+            job.status = "cancelled" if job.cancel_event.is_set() else "done"
+        except scheduler.CallCancelled:
+            job.status = "cancelled"
+        except Exception as e:
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.finished_at = time.time()
+            job.done_event.set()
+
+    with _jobs_lock:
+        _jobs[job.id] = job
+        _prune_finished()
+    job.thread = threading.Thread(target=run, name=f"{kind}-{job.id}", daemon=True)
+    job.thread.start()
+    return job
+
+
+def get_job(job_id: str, kind: Optional[str] = None) -> BackgroundJob:
+    job = _jobs.get(job_id)
+    if job is None or (kind and job.kind != kind):
+        raise ValueError(f"未找到任务: {job_id}")
+    return job
+
+
+def list_jobs(kind: Optional[str] = None) -> List[BackgroundJob]:
+    return [job for job in list(_jobs.values()) if not kind or job.kind == kind]
+
+
+def _prune_finished():
+    finished = [job for job in _jobs.values() if job.finished]
+    for job in sorted(finished, key=lambda j: j.finished_at)[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+        del _jobs[job.id]
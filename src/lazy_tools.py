@@ -0,0 +1,203 @@
+from typing import Any, Dict, List, Optional, Tuple
+import hashlib
+import importlib
+import importlib.metadata
+import json
+import os
+import sys
+import tempfile
+from mcp.server.fastmcp import FastMCP
+from mcp.types import Tool as MCPTool, ToolAnnotations
+
+
+
+def _user_cache_dir() -> str:
+    if os.name == "nt":
+        base = os.environ.get("LOCALAPPDATA")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    if base and os.path.isabs(base):
+        return os.path.join(base, "adb_mcp")
+    # 没有可用的用户目录时退回临时目录，文件名带上用户ID，避免与其他用户共用
+    user = str(os.getuid()) if hasattr(os, "getuid") else os.environ.get("USERNAME", "user")
+    return os.path.join(tempfile.gettempdir(), f"adb_mcp_{user}")
+
+
+# 工具清单缓存文件: 保存各模块的工具定义（JSON Schema），启动时据此发布工具列表而不必导入实现模块、生成参数模型
+MANIFEST_PATH = os.environ.get("ADB_MCP_TOOL_MANIFEST", os.path.join(_user_cache_dir(), "tool_manifest.json"))
+# 设为 0 时关闭延迟加载，启动时导入全部模块
+LAZY_TOOLS = os.environ.get("ADB_MCP_LAZY_TOOLS", "1") != "0"
+
+_PACKAGE = __name__.rpartition(".")[0]
+_PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _module_name(fn) -> str:
+    return getattr(fn, "__module__", "").rpartition(".")[2]
+
+
+def _source_hash(module: str) -> Optional[str]:
+    try:
+        with open(os.path.join(_PACKAGE_DIR, module + ".py"), "rb") as file:
+            return hashlib.sha256(file.read()).hexdigest()
+    except OSError:
+        return None
+
+
+def _package_version(name: str) -> str:
+    try:
+        return importlib.metadata.version(name)
+    except importlib.metadata.PackageNotFoundError:
+        return ""
+
+
+def _package_fingerprint() -> str:
+    """包内所有源码文件的修改时间和大小，共用的辅助模块变化也会使清单失效"""
+    digest = hashlib.sha256()
+    try:
+        names = sorted(name for name in os.listdir(_PACKAGE_DIR) if name.endswith(".py"))
+    except OSError:
+        return ""
+    for name in names:
+        try:
+            stat = os.stat(os.path.join(_PACKAGE_DIR, name))
+        except OSError:
+            continue
+        digest.update(f"{name}:{stat.st_mtime_ns}:{stat.st_size};".encode())
+    return digest.hexdigest()
+
+
+def _manifest_key() -> str:
+    # Python、mcp 或 pydantic 升级都可能改变生成的 JSON Schema
+    return "|".join([sys.version, _package_version("mcp"), _package_version("pydantic"), _package_fingerprint()])
+
+
+class LazyFastMCP(FastMCP):
+    """按工具清单延迟注册工具的 FastMCP
+
+    清单中模块源码未变化的工具先只发布清单里的定义: 已导入模块的工具推迟到第一次调用时才生成参数模型，
+    未导入模块的工具在第一次调用时才导入实现模块。
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._manifest_tools: Dict[str, Dict[str, Any]] = {}
+        self._manifest_modules: Dict[str, str] = {}
+        self._eager_modules: List[str] = []
+        self._deferred: Dict[str, Tuple[Any, Dict[str, Any]]] = {}
+        if LAZY_TOOLS:
+            self._load_manifest()
+
+    # 清单
+    def _load_manifest(self):
+        try:
+            with open(MANIFEST_PATH, encoding="utf-8") as file:
+                manifest = json.load(file)
+        except (OSError, ValueError):
+            return
+        if manifest.get("key") != _manifest_key():
+            return
+        valid = {module for module, digest in manifest.get("modules", {}).items() if _source_hash(module) == digest}
+        self._manifest_modules = {module: manifest["modules"][module] for module in valid}
+        self._eager_modules = [module for module in manifest.get("eager_modules", []) if module in valid]
+        self._manifest_tools = {spec["name"]: spec for spec in manifest.get("tools", []) if spec["module"] in valid}
+
+    def manifest_modules(self) -> List[str]:
+        """清单有效（源码未变化）的模块"""
+        return list(self._manifest_modules)
+
+    def write_manifest(self):
+        """根据当前已注册的工具更新清单；清单中仍有效但尚未导入的模块保留原来的定义"""
+        tools = {name: spec for name, spec in self._manifest_tools.items()}
+        modules = dict(self._manifest_modules)
+        for tool in self._tool_manager.list_tools():
+            module = _module_name(tool.fn)
+            modules.setdefault(module, _source_hash(module))
+            tools[tool.name] = {
+                "name": tool.name,
+                "module": module,
+                "title": tool.title,
+                "description": tool.description,
+                "inputSchema": tool.parameters,
+                "outputSchema": tool.output_schema,
+                "annotations": tool.annotations.model_dump(exclude_none=True) if tool.annotations else None,
+            }
+        # 注册了资源的模块需要在启动时导入，资源模板才会出现在资源列表中
+        eager = set(self._eager_modules)
+        for template in self._resource_manager.list_templates():
+            eager.add(_module_name(template.fn))
+        for resource in self._resource_manager.list_resources():
+            eager.add(_module_name(getattr(resource, "fn", None)))
+        manifest = {
+            "key": _manifest_key(),
+            "modules": {module: digest for module, digest in modules.items() if digest},
+            "eager_modules": sorted(module for module in eager if module),
+            "tools": list(tools.values()),
+        }
+        try:
+            os.makedirs(os.path.dirname(MANIFEST_PATH) or ".", mode=0o700, exist_ok=True)
+            with open(MANIFEST_PATH + ".tmp", "w", encoding="utf-8") as file:
+                json.dump(manifest, file, ensure_ascii=False)
+            os.replace(MANIFEST_PATH + ".tmp", MANIFEST_PATH)
+        except OSError:
+            pass
+        self._manifest_tools = {name: spec for name, spec in tools.items() if spec["module"] in manifest["modules"]}
+        self._manifest_modules = manifest["modules"]
+        self._eager_modules = manifest["eager_modules"]
+
+    # 注册
+    def add_tool(self, fn, name: Optional[str] = None, **kwargs):
+        tool_name = name or fn.__name__
+        spec = self._manifest_tools.get(tool_name)
+        if spec is not None and spec["module"] == _module_name(fn) and not self._tool_manager.get_tool(tool_name):
+            self._deferred[tool_name] = (fn, kwargs)
+            return None
+        return super().add_tool(fn, name=name, **kwargs)
+
+    def _materialize(self, name: str):
+        if name not in self._deferred and not self._tool_manager.get_tool(name) and name in self._manifest_tools:
+            importlib.import_module(f"{_PACKAGE}.{self._manifest_tools[name]['module']}")
+        deferred = self._deferred.pop(name, None)
+        if deferred is not None:
+            fn, kwargs = deferred
+            super().add_tool(fn, name=name, **kwargs)
+
+    # MCP 请求
+    async def list_tools(self) -> List[MCPTool]:
+        tools = await super().list_tools()
+        listed = {tool.name for tool in tools}
+        for name, spec in self._manifest_tools.items():
+            if name in listed:
+                continue
+            annotations = spec.get("annotations")
+            tools.append(MCPTool(
+                name=name,
+                title=spec.get("title"),
+                description=spec.get("description"),
+                inputSchema=spec["inputSchema"],
+                outputSchema=spec.get("outputSchema"),
+                annotations=ToolAnnotations(**annotations) if annotations else None,
+            ))
+        return tools
+
+    async def call_tool(self, name: str, arguments: Dict[str, Any]):
+        if not self._tool_manager.get_tool(name):
+            self._materialize(name)
+        return await super().call_tool(name, arguments)
+
+
+def load_tool_modules(server: LazyFastMCP, modules: List[str]):
+    """导入工具模块: 清单有效的模块推迟到第一次调用其工具时导入，其余模块立即导入并更新清单"""
+    valid = set(server.manifest_modules())
+    lazy = valid - set(server._eager_modules) if LAZY_TOOLS else set()
+    for module in modules:
+        if module in lazy:
+            continue
+        try:
+            importlib.import_module(f"{_PACKAGE}.{module}")
+        except ImportError:
+            pass
+    # 有工具所在模块不在清单中（首次启动或源码已修改）时重新生成清单
+    stale = any(_module_name(tool.fn) not in valid for tool in server._tool_manager.list_tools())
+    if LAZY_TOOLS and stale:
+        server.write_manifest()
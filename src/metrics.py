@@ -0,0 +1,485 @@
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import bisect
+import contextlib
+import contextvars
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import random
+import threading
+import time
+
+# 延迟直方图的桶上界（秒）
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+# 慢调用剖析: 采样比例、慢调用阈值（秒）和保留的剖析结果数量
+profile_sample_rate = float(os.environ.get("ADB_MCP_PROFILE_SAMPLE_RATE", "0"))
+slow_call_threshold = float(os.environ.get("ADB_MCP_SLOW_CALL_SECONDS", "1.0"))
+MAX_SLOW_PROFILES = 20
+
+
+class Histogram:
+    """固定桶的延迟直方图"""
+
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """按桶内线性插值估算分位数"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if seen + n >= rank and n:
+                low = LATENCY_BUCKETS[i - 1] if i > 0 else 0.0
+                high = LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else self.max
+                return min(low + (high - low) * (rank - seen) / n, self.max)
+            seen += n
+        return self.max
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "sum": round(self.total, 6),
+            "max": round(self.max, 6),
+            "p50": round(self.quantile(0.5), 6),
+            "p90": round(self.quantile(0.9), 6),
+            "p99": round(self.quantile(0.99), 6),
+        }
+
+
+class CallStats:
+    """一次工具调用期间累计的ADB统计"""
+
+    __slots__ = ("tool", "device", "adb_calls", "adb_time", "bytes_in", "bytes_out", "errors", "sampled", "profiler")
+
+    def __init__(self, tool: str, device: str, sampled: bool = False):
+        self.tool = tool
+        self.device = device
+        self.adb_calls = 0
+        self.adb_time = 0.0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.errors = 0
+        # 是否被采样剖析；剖析结果由执行工具的线程挂到 profiler 上
+        self.sampled = sampled
+        self.profiler: Optional[cProfile.Profile] = None
+
+
+_current_call: contextvars.ContextVar[Optional[CallStats]] = contextvars.ContextVar("adb_mcp_current_call", default=None)
+_lock = threading.Lock()
+_started_at = time.time()
+
+tool_latency: Dict[str, Histogram] = {}
+device_latency: Dict[str, Histogram] = {}
+adb_latency: Dict[str, Histogram] = {}
+phase_latency: Dict[str, Histogram] = {}
+# (tool, device) -> 计数
+tool_calls: Dict[Tuple[str, str], int] = {}
+tool_errors: Dict[Tuple[str, str], int] = {}
+adb_roundtrips: Dict[Tuple[str, str], int] = {}
+bytes_received: Dict[Tuple[str, str], int] = {}
+bytes_sent: Dict[Tuple[str, str], int] = {}
+# (tool, event) -> 计数
+cache_events: Dict[Tuple[str, str], int] = {}
+# 调度器: 按优先级的排队等待时间，(device, priority) -> 当前排队数，(priority, event) -> 计数
+queue_wait: Dict[str, Histogram] = {}
+queue_depth: Dict[Tuple[str, str], int] = {}
+scheduler_events: Dict[Tuple[str, str], int] = {}
+# (device, event) -> 计数: 设备状态变化、熔断、重连等
+device_events: Dict[Tuple[str, str], int] = {}
+# 每次ADB往返后调用 listener(设备ID, 是否失败)，供设备健康监视统计连续失败
+adb_listeners: List[Callable[[str, bool], None]] = []
+slow_profiles: List[Dict[str, Any]] = []
+_profiling = threading.Lock()
+
+
+def _observe(table: Dict[str, Histogram], key: str, value: float):
+    histogram = table.get(key)
+    if histogram is None:
+        histogram = table[key] = Histogram()
+    histogram.observe(value)
+
+
+def _increment(table: Dict[Tuple[str, str], int], key: Tuple[str, str], amount: int = 1):
+    table[key] = table.get(key, 0) + amount
+
+
+def _labels() -> Tuple[str, str]:
+    call = _current_call.get()
+    if call is None:
+        return "-", "-"
+    return call.tool, call.device
+
+
+def record_adb(op: str, elapsed: float, bytes_in: int = 0, bytes_out: int = 0, failed: bool = False):
+    """记录一次ADB往返（shell、pull、push等）"""
+    call = _current_call.get()
+    if call is not None:
+        call.adb_calls += 1
+        call.adb_time += elapsed
+        call.bytes_in += bytes_in
+        call.bytes_out += bytes_out
+        call.errors += int(failed)
+    labels = _labels()
+    if call is not None:
+        for listener in adb_listeners:
+            listener(call.device, failed)
+    with _lock:
+        _observe(adb_latency, op, elapsed)
+        _increment(adb_roundtrips, (labels[0], op))
+        if bytes_in:
+            _increment(bytes_received, labels, bytes_in)
+        if bytes_out:
+            _increment(bytes_sent, labels, bytes_out)
+
+
+def current_call() -> Optional[CallStats]:
+    return _current_call.get()
+
+
+def record_cache(tool: str, event: str):
+    """记录查询缓存事件: hit（命中）、miss（未命中）、coalesced（合并到进行中的请求）"""
+    with _lock:
+        _increment(cache_events, (tool, event))
+
+
+def record_queue_wait(priority: str, wait: float):
+    with _lock:
+        _observe(queue_wait, priority, wait)
+
+
+def set_queue_depth(device: str, priority: str, depth: int):
+    with _lock:
+        queue_depth[(device, priority)] = depth
+
+
+def record_scheduler_event(priority: str, event: str):
+    """记录调度事件: cancelled（取消）、deadline（超过截止时间）、promoted（等待过久提升优先级）"""
+    with _lock:
+        _increment(scheduler_events, (priority, event))
+
+
+def record_device_event(device: str, event: str):
+    with _lock:
+        _increment(device_events, (device, event))
+
+
+def set_call_device(serial: str):
+    call = _current_call.get()
+    if call is not None:
+        call.device = serial
+
+
+@contextlib.contextmanager
+def phase(name: str):
+    """记录工具内部某个阶段（编码、解析等）的耗时"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        with _lock:
+            _observe(phase_latency, name, elapsed)
+
+
+class InstrumentedDevice:
+    """包装ppadb设备对象，统计每次ADB往返的耗时和传输字节数
+
+    serial 为合并命名空间中的设备ID（多ADB服务器时带有服务器别名前缀）。
+    """
+
+    def __init__(self, device):
+        self._device = device
+        self.serial = getattr(device, "device_id", device.serial)
+
+    def __getattr__(self, name):
+        return getattr(self._device, name)
+
+    def _timed(self, op: str, func: Callable, *args, bytes_out: int = 0, **kwargs):
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            record_adb(op, time.perf_counter() - start, bytes_out=bytes_out, failed=True)
+            raise
+        size = len(result) if isinstance(result, (str, bytes, bytearray)) else 0
+        record_adb(op, time.perf_counter() - start, bytes_in=size, bytes_out=bytes_out)
+        return result
+
+    def shell(self, cmd, handler=None, timeout=None):
+        return self._timed("shell", self._device.shell, cmd, handler=handler, timeout=timeout)
+
+    def screencap(self):
+        return self._timed("screencap", self._device.screencap)
+
+    def push(self, src, dest, *args, **kwargs):
+        size = os.path.getsize(src) if os.path.isfile(src) else 0
+        return self._timed("push", self._device.push, src, dest, *args, bytes_out=size, **kwargs)
+
+    def pull(self, src, dest):
+        start = time.perf_counter()
+        try:
+            result = self._device.pull(src, dest)
+        except Exception:
+            record_adb("pull", time.perf_counter() - start, failed=True)
+            raise
+        size = os.path.getsize(dest) if os.path.exists(dest) else 0
+        record_adb("pull", time.perf_counter() - start, bytes_in=size)
+        return result
+
+    def install(self, path, *args, **kwargs):
+        size = os.path.getsize(path) if os.path.isfile(path) else 0
+        return self._timed("install", self._device.install, path, *args, bytes_out=size, **kwargs)
+
+    def uninstall(self, package):
+        return self._timed("uninstall", self._device.uninstall, package)
+
+
+def instrument_device(device):
+    wrapped = InstrumentedDevice(device)
+    set_call_device(wrapped.serial)
+    return wrapped
+
+
+def is_error_result(result) -> bool:
+    # 工具约定以 "xxx失败: 原因" 的形式返回错误
+    return isinstance(result, str) and "失败: " in result[:80]
+
+
+def _finish_call(call: CallStats, elapsed: float, failed: bool):
+    key = (call.tool, call.device)
+    with _lock:
+        _observe(tool_latency, call.tool, elapsed)
+        _observe(device_latency, call.device, elapsed)
+        _increment(tool_calls, key)
+        if failed or call.errors:
+            _increment(tool_errors, key)
+
+
+def _save_profile(call: CallStats, elapsed: float, profiler: cProfile.Profile):
+    stream = io.StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(25)
+    entry = {
+        "tool": call.tool,
+        "device": call.device,
+        "seconds": round(elapsed, 4),
+        "adb_calls": call.adb_calls,
+        "adb_seconds": round(call.adb_time, 4),
+        "at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "profile": stream.getvalue(),
+    }
+    with _lock:
+        slow_profiles.append(entry)
+        del slow_profiles[:-MAX_SLOW_PROFILES]
+
+
+@contextlib.contextmanager
+def profiled():
+    """在执行工具函数的线程中剖析当前调用（调用被采样时），结果挂到调用的 CallStats 上
+
+    工具在调度器的工作线程中执行时由调度器包在事件循环外层；同时只剖析一个调用。
+    """
+    call = _current_call.get()
+    if call is None or not call.sampled or call.profiler is not None or not _profiling.acquire(blocking=False):
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        _profiling.release()
+        call.profiler = profiler
+
+
+def instrument_tool(fn: Callable, name: str) -> Callable:
+    """包装异步工具函数：记录延迟、ADB往返、传输字节和错误，并按比例采样剖析慢调用（见 profiled）"""
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        sampled = profile_sample_rate > 0 and random.random() < profile_sample_rate
+        call = CallStats(name, kwargs.get("device_id") or "default", sampled)
+        token = _current_call.set(call)
+        start = time.perf_counter()
+        failed = False
+        try:
+            result = await fn(*args, **kwargs)
+            failed = is_error_result(result)
+            return result
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            if call.profiler is not None and elapsed >= slow_call_threshold:
+                _save_profile(call, elapsed, call.profiler)
+            _current_call.reset(token)
+            _finish_call(call, elapsed, failed)
+
+    return wrapper
+
+
+def instrument_server(server, *wrappers: Callable[[Callable, str], Callable]):
+    """替换 server.tool，使之后注册的每个工具都经过 instrument_tool 包装
+
+    wrappers: 额外的包装函数 wrapper(fn, 工具名)，按顺序套在工具函数外层、指标统计内层
+    """
+    register_tool = server.tool
+
+    def tool(name: Optional[str] = None, *args, **kwargs):
+        register = register_tool(name, *args, **kwargs)
+
+        def decorator(fn):
+            tool_name = name or fn.__name__
+            for wrapper in wrappers:
+                fn = wrapper(fn, tool_name)
+            wrapped = instrument_tool(fn, tool_name)
+            register(wrapped)
+            return wrapped
+
+        return decorator
+
+    server.tool = tool
+    return server
+
+
+def snapshot() -> Dict[str, Any]:
+    with _lock:
+        return {
+            "uptime_seconds": round(time.time() - _started_at, 1),
+            "tools": {
+                tool: dict(histogram.to_dict(),
+                           errors=sum(n for (t, _), n in tool_errors.items() if t == tool),
+                           adb_roundtrips=sum(n for (t, _), n in adb_roundtrips.items() if t == tool))
+                for tool, histogram in tool_latency.items()
+            },
+            "devices": {device: histogram.to_dict() for device, histogram in device_latency.items()},
+            "adb_ops": {op: histogram.to_dict() for op, histogram in adb_latency.items()},
+            "phases": {name: histogram.to_dict() for name, histogram in phase_latency.items()},
+            "bytes_received": {f"{t}|{d}": n for (t, d), n in bytes_received.items()},
+            "bytes_sent": {f"{t}|{d}": n for (t, d), n in bytes_sent.items()},
+            "errors": {f"{t}|{d}": n for (t, d), n in tool_errors.items()},
+            "cache": {f"{t}|{e}": n for (t, e), n in cache_events.items()},
+            "queue_wait": {priority: histogram.to_dict() for priority, histogram in queue_wait.items()},
+            "queue_depth": {f"{d}|{p}": n for (d, p), n in queue_depth.items() if n},
+            "scheduler": {f"{p}|{e}": n for (p, e), n in scheduler_events.items()},
+            "device_events": {f"{d}|{e}": n for (d, e), n in device_events.items()},
+        }
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _prometheus_histogram(lines: List[str], metric: str, label: str, table: Dict[str, Histogram]):
+    lines.append(f"# TYPE {metric} histogram")
+    for key, histogram in sorted(table.items()):
+        cumulative = 0
+        for bound, n in zip(LATENCY_BUCKETS + (float("inf"),), histogram.counts):
+            cumulative += n
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f'{metric}_bucket{{{label}="{_escape(key)}",le="{le}"}} {cumulative}')
+        lines.append(f'{metric}_sum{{{label}="{_escape(key)}"}} {histogram.total:.6f}')
+        lines.append(f'{metric}_count{{{label}="{_escape(key)}"}} {histogram.count}')
+
+
+def _prometheus_counter(lines: List[str], metric: str, labels: Tuple[str, str], table: Dict[Tuple[str, str], int]):
+    lines.append(f"# TYPE {metric} counter")
+    for (a, b), n in sorted(table.items()):
+        lines.append(f'{metric}{{{labels[0]}="{_escape(a)}",{labels[1]}="{_escape(b)}"}} {n}')
+
+
+def render_prometheus() -> str:
+    lines: List[str] = []
+    with _lock:
+        _prometheus_histogram(lines, "adb_mcp_tool_latency_seconds", "tool", tool_latency)
+        _prometheus_histogram(lines, "adb_mcp_device_latency_seconds", "device", device_latency)
+        _prometheus_histogram(lines, "adb_mcp_adb_latency_seconds", "op", adb_latency)
+        _prometheus_histogram(lines, "adb_mcp_phase_latency_seconds", "phase", phase_latency)
+        _prometheus_counter(lines, "adb_mcp_tool_calls_total", ("tool", "device"), tool_calls)
+        _prometheus_counter(lines, "adb_mcp_tool_errors_total", ("tool", "device"), tool_errors)
+        _prometheus_counter(lines, "adb_mcp_adb_roundtrips_total", ("tool", "op"), adb_roundtrips)
+        _prometheus_counter(lines, "adb_mcp_bytes_received_total", ("tool", "device"), bytes_received)
+        _prometheus_counter(lines, "adb_mcp_bytes_sent_total", ("tool", "device"), bytes_sent)
+        _prometheus_counter(lines, "adb_mcp_cache_events_total", ("tool", "event"), cache_events)
+        _prometheus_histogram(lines, "adb_mcp_queue_wait_seconds", "priority", queue_wait)
+        lines.append("# TYPE adb_mcp_queue_depth gauge")
+        for (device, priority), n in sorted(queue_depth.items()):
+            lines.append(f'adb_mcp_queue_depth{{device="{_escape(device)}",priority="{_escape(priority)}"}} {n}')
+        _prometheus_counter(lines, "adb_mcp_scheduler_events_total", ("priority", "event"), scheduler_events)
+        _prometheus_counter(lines, "adb_mcp_device_events_total", ("device", "event"), device_events)
+    return "\n".join(lines) + "\n"
+
+
+def render_text() -> str:
+    data = snapshot()
+    lines = [f"运行时长: {data['uptime_seconds']}秒", "", "工具延迟（秒）:"]
+    for tool, stats in sorted(data["tools"].items(), key=lambda item: -item[1]["sum"]):
+        lines.append(f"  {tool}: 次数={stats['count']} p50={stats['p50']} p99={stats['p99']} max={stats['max']} "
+                     f"ADB往返={stats['adb_roundtrips']} 错误={stats['errors']}")
+    if data["devices"]:
+        lines += ["", "设备延迟（秒）:"]
+        for device, stats in sorted(data["devices"].items()):
+            lines.append(f"  {device}: 次数={stats['count']} p50={stats['p50']} p99={stats['p99']}")
+    if data["adb_ops"]:
+        lines += ["", "ADB操作延迟（秒）:"]
+        for op, stats in sorted(data["adb_ops"].items()):
+            lines.append(f"  {op}: 次数={stats['count']} p50={stats['p50']} p99={stats['p99']} 总计={stats['sum']}")
+    if data["phases"]:
+        lines += ["", "内部阶段耗时（秒）:"]
+        for name, stats in sorted(data["phases"].items()):
+            lines.append(f"  {name}: 次数={stats['count']} p50={stats['p50']} 总计={stats['sum']}")
+    if data["cache"]:
+        lines += ["", "查询缓存:"]
+        for key, count in sorted(data["cache"].items()):
+            tool, _, event = key.partition("|")
+            lines.append(f"  {tool} {event}: {count}")
+    if data["queue_wait"]:
+        lines += ["", "调度排队等待（秒）:"]
+        for priority, stats in sorted(data["queue_wait"].items()):
+            lines.append(f"  {priority}: 次数={stats['count']} p50={stats['p50']} p99={stats['p99']} max={stats['max']}")
+    if data["queue_depth"]:
+        lines.append("  当前排队: " + ", ".join(f"{key}={n}" for key, n in sorted(data["queue_depth"].items())))
+    if data["scheduler"]:
+        lines.append("  调度事件: " + ", ".join(f"{key}={n}" for key, n in sorted(data["scheduler"].items())))
+    if data["device_events"]:
+        lines += ["", "设备事件:"]
+        lines.append("  " + ", ".join(f"{key}={n}" for key, n in sorted(data["device_events"].items())))
+    received = sum(data["bytes_received"].values())
+    sent = sum(data["bytes_sent"].values())
+    lines += ["", f"接收字节: {received}  发送字节: {sent}"]
+    return "\n".join(lines)
+
+
+def reset():
+    with _lock:
+        for table in (tool_latency, device_latency, adb_latency, phase_latency, tool_calls, tool_errors,
+                      adb_roundtrips, bytes_received, bytes_sent, cache_events, queue_wait, scheduler_events,
+                      device_events):
+            table.clear()
+        slow_profiles.clear()
+
+
+def render(fmt: str) -> str:
+    if fmt == "json":
+        return json.dumps(snapshot(), ensure_ascii=False, indent=2)
+    if fmt == "prometheus":
+        return render_prometheus()
+    return render_text()
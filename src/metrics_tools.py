@@ -0,0 +1,60 @@
+from typing import Optional
+from . import metrics
+from .adb_server import mcp
+
+
+@mcp.tool()
+async def get_server_metrics(format: str = "text", reset: bool = False, path: Optional[str] = None) -> str:
+    """获取服务器运行指标：每个工具/设备的延迟分布、ADB往返次数、传输字节数和错误数
+
+    参数:
+        format: 输出格式，text（默认，易读摘要）、json 或 prometheus（Prometheus文本格式）
+        reset: 输出后是否清空已有统计
+        path: 可选，同时把输出写入该本地文件（例如供 node_exporter 的 textfile collector 采集）
+    """
+    try:
+        if format not in ("text", "json", "prometheus"):
+            return f"不支持的格式: {format}，可选 text、json、prometheus"
+        output = metrics.render(format)
+        if path:
+            with open(path, "w", encoding="utf-8") as file:
+                file.write(output)
+        if reset:
+            metrics.reset()
+        return output
+    except Exception as e:
+        return f"获取服务器指标失败: {str(e)}"
+
+
+@mcp.tool()
+async def configure_profiling(sample_rate: float = 0.0, slow_call_seconds: float = 1.0) -> str:
+    """配置慢调用剖析：按比例对工具调用启用cProfile，耗时超过阈值的调用保留剖析结果
+
+    参数:
+        sample_rate: 采样比例 0~1，0表示关闭（默认）
+        slow_call_seconds: 慢调用阈值（秒），默认1.0
+    """
+    if not 0 <= sample_rate <= 1:
+        return "采样比例必须在0到1之间"
+    metrics.profile_sample_rate = sample_rate
+    metrics.slow_call_threshold = slow_call_seconds
+    if not sample_rate:
+        return "已关闭慢调用剖析"
+    return f"已启用慢调用剖析: 采样比例 {sample_rate}，慢调用阈值 {slow_call_seconds}秒"
+
+
+@mcp.tool()
+async def get_slow_call_profiles(limit: int = 3) -> str:
+    """查看最近采样到的慢调用剖析结果（按累计耗时排序的热点函数）
+
+    参数:
+        limit: 返回的剖析结果数量，默认3
+    """
+    profiles = metrics.slow_profiles[-limit:] if limit > 0 else []
+    if not profiles:
+        return "没有慢调用剖析结果（可通过 configure_profiling 启用采样）"
+    sections = []
+    for entry in reversed(profiles):
+        sections.append(f"{entry['at']} {entry['tool']} 设备={entry['device']} 耗时={entry['seconds']}秒 "
+                        f"ADB调用={entry['adb_calls']}次/{entry['adb_seconds']}秒\n{entry['profile'].strip()}")
+    return "\n\n".join(sections)
@@ -0,0 +1,201 @@
+from typing import Optional, Tuple
+import time
+from . import image_match, metrics, scheduler, state_graph
+from .adb_server import exec_out, get_device, mcp
+from .ui_hierarchy import UiSnapshot
+from .ui_script import ScriptRunner, compile_script
+
+# 计算感知哈希时忽略的屏幕顶部比例（状态栏的时钟和通知图标）
+STATUS_BAR_FRACTION = 0.04
+
+# navigate_to 每一步等待到达目标界面的时间（秒）和截图轮询间隔
+STEP_TIMEOUT = 5.0
+POLL_INTERVAL = 0.3
+
+# 连续两次截图的感知哈希相差不超过该位数时，认为界面已稳定
+SETTLED_BITS = 2
+
+# navigate_to 偏离路线后最多重新规划的次数
+MAX_REPLANS = 3
+
+
+def _activity(device) -> str:
+    return state_graph.parse_activity(device.shell("dumpsys window windows | grep -E 'mCurrentFocus|mFocusedApp'"))
+
+
+def _screen_phash(device) -> Optional[int]:
+    """截取原始帧并计算感知哈希；未安装 numpy 时返回 None（只按界面层次识别）"""
+    if image_match.np is None:
+        return None
+    data = exec_out(device, "screencap")
+    with metrics.phase("screen_phash"):
+        gray = image_match.to_gray(image_match.decode_raw_screencap(data))
+        return image_match.dhash(gray[int(gray.shape[0] * STATUS_BAR_FRACTION):])
+
+
+def _identify(device, graph: state_graph.DeviceGraph, activity: str, phash: Optional[int],
+              refresh: bool = False) -> Tuple[state_graph.ScreenState, str]:
+    """识别当前界面: 截图指纹与已知界面相近时直接复用缓存，否则dump界面层次按结构哈希查找或新建"""
+    if phash is not None and not refresh:
+        state = graph.match_phash(activity, phash)
+        if state is not None:
+            return state, "截图指纹匹配，复用缓存的界面层次"
+    snapshot = UiSnapshot.capture(device)
+    known = len(graph.states)
+    state = graph.add(activity, state_graph.structure_hash(snapshot.xml), phash, snapshot)
+    return state, "新界面" if len(graph.states) > known else "界面层次匹配，已更新缓存"
+
+
+def observe_screen(device, refresh: bool = False) -> Tuple[state_graph.ScreenState, str]:
+    graph = state_graph.graph(device.serial)
+    state, source = _identify(device, graph, _activity(device), _screen_phash(device), refresh)
+    graph.observe(state)
+    return state, source
+
+
+def _wait_for_state(device, graph: state_graph.DeviceGraph, target: str) -> state_graph.ScreenState:
+    """等待界面稳定: 截图指纹匹配到目标界面时立即返回；界面停止变化或超时后dump界面层次识别"""
+    deadline = time.monotonic() + STEP_TIMEOUT
+    activity, phash = _activity(device), _screen_phash(device)
+    while phash is not None and time.monotonic() < deadline:
+        state = graph.match_phash(activity, phash)
+        if state is not None and state.id == target:
+            break
+        scheduler.sleep(POLL_INTERVAL)
+        previous, activity, phash = phash, _activity(device), _screen_phash(device)
+        if state_graph.hamming(previous, phash) <= SETTLED_BITS:
+            state = graph.match_phash(activity, phash)
+            break
+    else:
+        state = None
+    if state is None or state.id != target:
+        state, _ = _identify(device, graph, activity, phash)
+    graph.observe(state)
+    return state
+
+
+def _describe_state(graph: state_graph.DeviceGraph, state: state_graph.ScreenState, max_elements: int) -> str:
+    lines = [f"Activity: {state.activity}", f"访问 {state.visits} 次，已缓存 {len(state.phashes)} 个截图指纹"]
+    edges = graph.edges.get(state.id, {})
+    if edges:
+        lines.append("已知的出路:")
+        for target, edge in edges.items():
+            label = graph.states[target].label if target in graph.states else target
+            lines.append(f"  -> {target} {label}: {' ; '.join(edge.script)}")
+    elements = state.elements()
+    lines.append(f"元素（共 {len(elements)} 个" + (f"，显示前 {max_elements} 个）:" if len(elements) > max_elements else "）:"))
+    for node in elements[:max_elements]:
+        flags = " 可点击" if node.clickable else ""
+        resource = f" id={node.resource_id}" if node.resource_id else ""
+        lines.append(f"  {node.describe()}{resource}{flags}")
+    return "\n".join(lines)
+
+
+@mcp.tool()
+async def get_screen_state(refresh: bool = False, max_elements: int = 50, device_id: Optional[str] = None) -> str:
+    """识别当前界面，返回界面ID、已知的出路和界面元素
+
+    界面指纹由前台Activity、界面层次的结构哈希和截图的感知哈希组成。截图与见过的界面相近时直接复用缓存的
+    界面层次和元素索引，不再dump界面；新界面会加入设备的界面图。两次识别之间执行的点击、滑动、输入等操作
+    记为连接两个界面的路径，之后可以用 navigate_to 回到任意见过的界面。感知哈希需要安装 numpy。
+
+    参数:
+        refresh: 是否强制重新dump界面层次（界面内容变化后更新缓存）
+        max_elements: 最多列出的元素数，默认50
+        device_id: 设备ID（可选，如果未提供则使用第一个可用设备）
+    """
+    try:
+        device = get_device(device_id)
+        start = time.perf_counter()
+        state, source = observe_screen(device, refresh)
+        graph = state_graph.graph(device.serial)
+        return (f"界面 {state.id}（{source}，{(time.perf_counter() - start) * 1000:.0f}ms）\n"
+                + _describe_state(graph, state, max_elements))
+    except Exception as e:
+        return f"识别界面失败: {str(e)}"
+
+
+@mcp.tool()
+async def list_screen_states(device_id: Optional[str] = None) -> str:
+    """列出设备上见过的界面和它们之间已知的路径
+
+    参数:
+        device_id: 设备ID（可选，如果未提供则使用第一个可用设备）
+    """
+    try:
+        device = get_device(device_id)
+        graph = state_graph.graph(device.serial)
+        if not graph.states:
+            return "还没有记录界面，请先调用 get_screen_state"
+        lines = [f"共 {len(graph.states)} 个界面，{sum(len(t) for t in graph.edges.values())} 条已知路径:"]
+        for state in sorted(graph.states.values(), key=lambda s: s.last_seen, reverse=True):
+            marker = " <- 当前" if state.id == graph.current else ""
+            targets = ", ".join(graph.edges.get(state.id, {}))
+            lines.append(f"{state.id} {state.label} [{state.activity}] 访问{state.visits}次{marker}")
+            if targets:
+                lines.append(f"    -> {targets}")
+        return "\n".join(lines)
+    except Exception as e:
+        return f"列出界面失败: {str(e)}"
+
+
+@mcp.tool()
+async def navigate_to(state_id: str, device_id: Optional[str] = None) -> str:
+    """沿已知的最短路径回到之前见过的界面
+
+    先识别当前界面，在界面图中查找经过界面最少的路径，逐段重放记录的操作（连续输入合并为一次设备端调用），
+    每段之后确认到达预期界面；偏离路线时丢弃该段路径并从实际所在界面重新规划。
+
+    参数:
+        state_id: 目标界面ID（见 get_screen_state、list_screen_states）
+        device_id: 设备ID（可选，如果未提供则使用第一个可用设备）
+    """
+    try:
+        device = get_device(device_id)
+        graph = state_graph.graph(device.serial)
+        if state_id not in graph.states:
+            return f"导航失败: 未知的界面 {state_id}（可用 list_screen_states 查看）"
+        start = time.perf_counter()
+        current, _ = observe_screen(device)
+        log = []
+        for _ in range(MAX_REPLANS + 1):
+            if current.id == state_id:
+                break
+            path = graph.shortest_path(current.id, state_id)
+            if path is None:
+                return "\n".join([f"导航失败: 没有从当前界面 {current.id} 到 {state_id} 的已知路径"] + log)
+            for source, target in zip(path, path[1:]):
+                edge = graph.edge(source, target)
+                if edge is None:
+                    break
+                result = ScriptRunner(device).run(compile_script("\n".join(edge.script)))
+                for line in edge.script:
+                    graph.record(line)
+                current = _wait_for_state(device, graph, target)
+                if "状态: 失败" in result or current.id != target:
+                    graph.forget_edge(source, target)
+                    graph.discard_pending()
+                    log.append(f"{source} -> {target}: 到达了 {current.id}，重新规划")
+                    break
+                log.append(f"{source} -> {target}: {' ; '.join(edge.script)}")
+        if current.id != state_id:
+            return "\n".join([f"导航失败: 重新规划 {MAX_REPLANS} 次后仍未到达 {state_id}（当前界面 {current.id}）"] + log)
+        steps = "\n".join(log) if log else "已在目标界面"
+        return f"已到达界面 {state_id}（{current.label}，{(time.perf_counter() - start) * 1000:.0f}ms）:\n{steps}"
+    except Exception as e:
+        return f"导航失败: {str(e)}"
+
+
+@mcp.tool()
+async def clear_screen_states(device_id: Optional[str] = None) -> str:
+    """清除设备的界面图（应用更新或界面布局变化后使用）
+
+    参数:
+        device_id: 设备ID（可选，如果未提供则使用第一个可用设备）
+    """
+    try:
+        device = get_device(device_id)
+        state_graph.clear(device.serial)
+        return f"已清除设备 {device.serial} 的界面图"
+    except Exception as e:
+        return f"清除界面图失败: {str(e)}"
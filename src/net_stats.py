@@ -0,0 +1,418 @@
+from typing import Callable, Dict, List, Optional, Tuple
+from array import array
+import math
+import os
+import re
+import socket
+import threading
+import time
+from .package_tools import get_package_catalog
+
+# 流量计数的来源: qtaguid（Android 9 及更早，/proc/net/xt_qtaguid/stats）或 netstats（Android 10 起，dumpsys netstats）
+SOURCES = ("auto", "qtaguid", "netstats")
+QTAGUID_PATH = "/proc/net/xt_qtaguid/stats"
+
+# 每个序列最多保留的采样点数，超出后丢弃最早的采样（累计总量不受影响）
+MAX_SAMPLES = int(os.environ.get("ADB_MCP_NET_MAX_SAMPLES", "3600"))
+
+# 最小采样间隔（秒）；netstats 每次采样都要强制系统轮询一次计数，间隔不宜过短
+MIN_INTERVAL = {"qtaguid": 0.5, "netstats": 2.0}
+
+# 连续采样失败达到该次数时停止采样
+MAX_CONSECUTIVE_ERRORS = 5
+
+# 发现未知UID时重新加载应用目录的最短间隔（秒）
+UID_REFRESH_INTERVAL = 30.0
+
+# 单次shell调用中分隔网卡计数和UID计数的标记
+_SECTION_MARKER = "__ADB_MCP_NET_UID__"
+
+# 没有对应应用的系统UID
+SYSTEM_UIDS = {
+    -5: "网络共享", -4: "已卸载的应用", 0: "root", 1000: "system", 1001: "radio", 1002: "bluetooth",
+    1013: "media", 1020: "mdnsr", 1021: "gps", 1051: "dns", 1073: "network_stack", 2000: "shell",
+}
+
+_PING_REPLY = re.compile(r"icmp_seq=(\d+).*?time=([\d.]+) ms")
+_PING_SUMMARY = re.compile(r"(\d+) packets transmitted, (\d+) (?:packets )?received")
+_PING_ERROR = re.compile(r"(unknown host|Name or service not known|Network is unreachable|"
+                         r"Destination Host Unreachable|No address associated|bad address)", re.I)
+_NETSTATS_IDENT = re.compile(r"\buid=(-?\d+) set=\S+ tag=(0x[0-9a-f]+)")
+_NETSTATS_BUCKET = re.compile(r"\brb=(\d+) rp=\d+ tb=(\d+)")
+
+Counters = Dict[object, Tuple[int, int]]
+
+
+def format_bytes(size: float) -> str:
+    if size >= 1024 * 1024:
+        return f"{size / 1024 / 1024:.1f}MB"
+    if size >= 1024:
+        return f"{size / 1024:.1f}KB"
+    return f"{size:.0f}B"
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """最近秩百分位数（values 须已排序）"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, math.ceil(fraction * len(values)) - 1))]
+
+
+def parse_proc_net_dev(text: str) -> Counters:
+    """解析 /proc/net/dev，返回 {网卡: (接收字节, 发送字节)}，不含回环网卡"""
+    counters = {}
+    for line in text.splitlines():
+        name, sep, rest = line.partition(":")
+        fields = rest.split()
+        if not sep or len(fields) < 9 or not fields[0].isdigit():
+            continue
+        name = name.strip()
+        if name != "lo":
+            counters[name] = (int(fields[0]), int(fields[8]))
+    return counters
+
+
+def parse_qtaguid(text: str) -> Counters:
+    """解析 xt_qtaguid/stats，按UID汇总所有网卡和计数集的字节数（只取 tag=0x0 的行，带标签的行是它的子集）"""
+    counters: Dict[object, List[int]] = {}
+    for line in text.splitlines():
+        fields = line.split()
+        if len(fields) < 8 or fields[2] != "0x0" or not fields[5].isdigit():
+            continue
+        totals = counters.setdefault(int(fields[3]), [0, 0])
+        totals[0] += int(fields[5])
+        totals[1] += int(fields[7])
+    return {uid: (rx, tx) for uid, (rx, tx) in counters.items()}
+
+
+def parse_netstats(text: str) -> Counters:
+    """解析 `dumpsys netstats --uid` 的 "UID stats" 部分，按UID汇总自开机以来所有记录桶的字节数"""
+    counters: Dict[object, List[int]] = {}
+    in_uid_section = False
+    current = None
+    for line in text.splitlines():
+        if not line.startswith(" "):
+            in_uid_section = line.strip() == "UID stats:"
+            current = None
+            continue
+        if not in_uid_section:
+            continue
+        ident = _NETSTATS_IDENT.search(line)
+        if ident:
+            current = counters.setdefault(int(ident.group(1)), [0, 0]) if ident.group(2) == "0x0" else None
+            continue
+        bucket = _NETSTATS_BUCKET.search(line)
+        if bucket and current is not None:
+            current[0] += int(bucket.group(1))
+            current[1] += int(bucket.group(2))
+    return {uid: (rx, tx) for uid, (rx, tx) in counters.items()}
+
+
+class CounterSeries:
+    """一组累计计数器（接收/发送字节）的逐次增量
+
+    采样时间共用一个 array，每个键的接收和发送增量各存一个 array（与时间对齐，键未出现的采样记为0），
+    超出 MAX_SAMPLES 后丢弃最早的采样；累计总量单独保存。
+    """
+
+    def __init__(self, max_samples: int = MAX_SAMPLES):
+        self.max_samples = max_samples
+        self.times = array("d")
+        self.rx: Dict[object, array] = {}
+        self.tx: Dict[object, array] = {}
+        self.totals: Dict[object, List[int]] = {}
+        self.started_at: Optional[float] = None
+        self._last: Optional[Counters] = None
+
+    def add(self, timestamp: float, counters: Counters):
+        if self._last is None:
+            # 第一次采样只作为基线
+            self._last = counters
+            self.started_at = timestamp
+            return
+        count = len(self.times)
+        self.times.append(timestamp)
+        for key, (rx, tx) in counters.items():
+            previous = self._last.get(key)
+            if previous is None:
+                delta_rx, delta_tx = rx, tx
+            else:
+                # 计数器变小说明被重置（网卡重新启用、UID被回收），按重置后的值计入
+                delta_rx = rx - previous[0] if rx >= previous[0] else rx
+                delta_tx = tx - previous[1] if tx >= previous[1] else tx
+            if key not in self.rx:
+                self.rx[key] = array("q", [0]) * count
+                self.tx[key] = array("q", [0]) * count
+            self.rx[key].append(delta_rx)
+            self.tx[key].append(delta_tx)
+            totals = self.totals.setdefault(key, [0, 0])
+            totals[0] += delta_rx
+            totals[1] += delta_tx
+        for key in self.rx:
+            if key not in counters:
+                self.rx[key].append(0)
+                self.tx[key].append(0)
+        self._last = counters
+
+        excess = len(self.times) - self.max_samples
+        if excess > 0:
+            del self.times[:excess]
+            for key in self.rx:
+                del self.rx[key][:excess]
+                del self.tx[key][:excess]
+
+    def _window_start(self, window: float) -> int:
+        if window <= 0 or not self.times:
+            return 0
+        cutoff = self.times[-1] - window
+        for index, timestamp in enumerate(self.times):
+            if timestamp > cutoff:
+                return index
+        return len(self.times)
+
+    def summarize(self, window: float = 0) -> List[dict]:
+        """每个键的统计: 窗口内的收发字节数、平均和峰值速率（字节/秒），以及自开始以来的累计总量"""
+        if not self.times:
+            return []
+        start = self._window_start(window)
+        previous = self.times[start - 1] if start > 0 else self.started_at
+        span = self.times[-1] - previous
+        intervals = [self.times[i] - (self.times[i - 1] if i > 0 else self.started_at)
+                     for i in range(start, len(self.times))]
+        rows = []
+        for key, rx_series in self.rx.items():
+            tx_series = self.tx[key]
+            rx = sum(rx_series[start:])
+            tx = sum(tx_series[start:])
+            peak = max(((rx_series[i] + tx_series[i]) / interval
+                        for i, interval in zip(range(start, len(self.times)), intervals) if interval > 0),
+                       default=0.0)
+            totals = self.totals.get(key, [0, 0])
+            rows.append({"key": key, "rx": rx, "tx": tx, "rate": (rx + tx) / span if span > 0 else 0.0,
+                         "peak": peak, "total_rx": totals[0], "total_tx": totals[1]})
+        rows.sort(key=lambda row: row["rx"] + row["tx"], reverse=True)
+        return rows
+
+
+def _command(source: str) -> str:
+    """每次采样的命令: 网卡计数和UID计数在同一次shell调用中读取"""
+    uid_part = f"cat {QTAGUID_PATH}" if source == "qtaguid" else \
+        "dumpsys netstats --poll >/dev/null 2>&1; dumpsys netstats --uid"
+    return f"cat /proc/net/dev; echo {_SECTION_MARKER}; {uid_part}"
+
+
+def detect_source(device, requested: str = "auto") -> str:
+    if requested not in SOURCES:
+        raise ValueError(f"无效的数据来源: {requested}（可选: {', '.join(SOURCES)}）")
+    if requested != "auto":
+        return requested
+    output = device.shell(f"test -r {QTAGUID_PATH} && echo qtaguid")
+    return "qtaguid" if "qtaguid" in output else "netstats"
+
+
+class NetworkSampler:
+    """后台网络采样器: 每次采样用一次shell调用读取网卡和各UID的累计流量，计算增量并保存为时间序列"""
+
+    def __init__(self, serial: str, source: str, interval: float):
+        self.serial = serial
+        self.source = source
+        self.interval = max(interval, MIN_INTERVAL[source])
+        self.uids = CounterSeries()
+        self.interfaces = CounterSeries()
+        self.samples = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.last_error: Optional[str] = None
+        self.shell_time = 0.0
+        self.uid_names: Dict[int, List[str]] = {}
+        self._uid_names_loaded = 0.0
+        self._lock = threading.Lock()
+
+    def sample(self, device):
+        start = time.perf_counter()
+        output = device.shell(_command(self.source))
+        self.shell_time += time.perf_counter() - start
+        dev_part, marker, uid_part = output.partition(_SECTION_MARKER)
+        interfaces = parse_proc_net_dev(dev_part)
+        uids = parse_qtaguid(uid_part) if self.source == "qtaguid" else parse_netstats(uid_part)
+        if not marker or (not interfaces and not uids):
+            raise RuntimeError(f"无法读取流量计数: {output.strip()[:200]}")
+        timestamp = time.monotonic()
+        with self._lock:
+            self.interfaces.add(timestamp, interfaces)
+            self.uids.add(timestamp, uids)
+            self.samples += 1
+        if any(uid >= 10000 and uid % 100000 not in self.uid_names for uid in uids):
+            self._load_uid_names(device)
+
+    def _load_uid_names(self, device, force: bool = False):
+        if not force and time.monotonic() - self._uid_names_loaded < UID_REFRESH_INTERVAL:
+            return
+        self._uid_names_loaded = time.monotonic()
+        names: Dict[int, List[str]] = {}
+        for info in get_package_catalog(device).packages.values():
+            if info.uid is not None:
+                names.setdefault(info.uid % 100000, []).append(info.name)
+        self.uid_names = names
+
+    def uid_label(self, uid: int) -> str:
+        if uid in SYSTEM_UIDS:
+            return f"{SYSTEM_UIDS[uid]}（UID {uid}）"
+        names = self.uid_names.get(uid % 100000)
+        user = f"，用户{uid // 100000}" if uid >= 100000 else ""
+        if not names:
+            return f"UID {uid}"
+        return f"{', '.join(sorted(names))}（UID {uid}{user}）"
+
+    def record_error(self, error: Exception):
+        self.errors += 1
+        self.consecutive_errors += 1
+        self.last_error = str(error)
+
+    def progress(self) -> str:
+        with self._lock:
+            rows = self.interfaces.summarize(window=self.interval * 3)
+        rx = sum(row["rx"] for row in rows)
+        tx = sum(row["tx"] for row in rows)
+        span = self.interval * 3
+        return f"已采样 {self.samples} 次，最近下行 {format_bytes(rx / span)}/s，上行 {format_bytes(tx / span)}/s"
+
+    def report(self, packages: Optional[List[str]] = None, window: float = 0, top: int = 10) -> str:
+        with self._lock:
+            interfaces = self.interfaces.summarize(window)
+            uids = self.uids.summarize(window)
+            times = self.interfaces.times
+            span = (times[-1] - self.interfaces.started_at) if times else 0.0
+        scope = f"最近{window:.0f}秒" if window > 0 else "全部"
+        lines = [f"数据来源: {self.source}，采样 {self.samples} 次，间隔 {self.interval:.1f}秒，"
+                 f"时长 {span:.0f}秒，统计范围: {scope}"]
+        if self.samples:
+            lines[0] += f"，平均每次采样 {self.shell_time / self.samples * 1000:.0f}ms"
+        if self.errors:
+            lines.append(f"采样失败 {self.errors} 次，最近一次: {self.last_error}")
+        if not interfaces and not uids:
+            lines.append("还没有足够的采样（至少需要两次）")
+            return "\n".join(lines)
+
+        lines.append("\n网卡:")
+        for row in interfaces:
+            if row["total_rx"] or row["total_tx"]:
+                lines.append(f"  {row['key']}: " + _describe_row(row))
+
+        if packages:
+            wanted = set(packages)
+            uids = [row for row in uids if wanted & set(self.uid_names.get(row["key"] % 100000, []))]
+            title = "指定应用"
+        else:
+            uids = [row for row in uids if row["rx"] or row["tx"]][:max(top, 1)]
+            title = f"流量最多的 {len(uids)} 个应用"
+        lines.append(f"\n{title}:")
+        if not uids:
+            lines.append("  （没有流量）")
+        for row in uids:
+            lines.append(f"  {self.uid_label(row['key'])}: " + _describe_row(row))
+        return "\n".join(lines)
+
+
+def _describe_row(row: dict) -> str:
+    return (f"下行 {format_bytes(row['rx'])}，上行 {format_bytes(row['tx'])}，"
+            f"平均 {format_bytes(row['rate'])}/s，峰值 {format_bytes(row['peak'])}/s"
+            f"（累计 下行 {format_bytes(row['total_rx'])} 上行 {format_bytes(row['total_tx'])}）")
+
+
+def run_sampler(job, device, sampler: NetworkSampler, duration: float) -> NetworkSampler:
+    """后台任务: 按间隔采样直到时长结束或任务被取消（duration 为0时一直采样）"""
+    sampler._load_uid_names(device, force=True)
+    deadline = time.monotonic() + duration if duration > 0 else None
+    while not job.cancel_event.is_set() and (deadline is None or time.monotonic() < deadline):
+        tick = time.monotonic()
+        try:
+            sampler.sample(device)
+            sampler.consecutive_errors = 0
+        except Exception as e:
+            sampler.record_error(e)
+            if sampler.consecutive_errors >= MAX_CONSECUTIVE_ERRORS:
+                raise RuntimeError(f"连续 {sampler.consecutive_errors} 次采样失败: {e}")
+        job.set_progress(sampler.progress())
+        job.cancel_event.wait(max(0.0, sampler.interval - (time.monotonic() - tick)))
+    return sampler
+
+
+class PingResult:
+    """一个主机的ping结果，边读取输出边解析"""
+
+    def __init__(self, host: str, count: int):
+        self.host = host
+        self.count = count
+        self.rtts: List[float] = []
+        self.sequences = set()
+        self.transmitted: Optional[int] = None
+        self.error: Optional[str] = None
+        self.stopped = False
+
+    def feed(self, line: str):
+        reply = _PING_REPLY.search(line)
+        if reply:
+            sequence = int(reply.group(1))
+            if sequence not in self.sequences:  # 忽略重复的应答（DUP!）
+                self.sequences.add(sequence)
+                self.rtts.append(float(reply.group(2)))
+            return
+        summary = _PING_SUMMARY.search(line)
+        if summary:
+            self.transmitted = int(summary.group(1))
+            return
+        error = _PING_ERROR.search(line)
+        if error and self.error is None:
+            self.error = line.strip()
+
+    def describe(self) -> str:
+        sent = self.transmitted if self.transmitted is not None else \
+            max(max(self.sequences, default=0), len(self.rtts))
+        received = len(self.rtts)
+        if not received:
+            reason = self.error or ("已中止" if self.stopped else "没有收到应答")
+            return f"{self.host}: 发送 {sent}，接收 0，{reason}"
+        loss = (sent - received) / sent * 100 if sent else 0.0
+        rtts = sorted(self.rtts)
+        mean = sum(rtts) / received
+        jitter = math.sqrt(sum((rtt - mean) ** 2 for rtt in rtts) / received)
+        text = (f"{self.host}: 发送 {sent}，接收 {received}，丢包 {loss:.0f}%，"
+                f"RTT 最小/P50/P90/P99/最大 = {rtts[0]:.1f}/{percentile(rtts, 0.5):.1f}/"
+                f"{percentile(rtts, 0.9):.1f}/{percentile(rtts, 0.99):.1f}/{rtts[-1]:.1f}ms，"
+                f"平均 {mean:.1f}ms，抖动 {jitter:.1f}ms")
+        if self.stopped:
+            text += "（已中止，只统计已收到的应答）"
+        return text
+
+
+def run_ping(device, command: str, result: PingResult, timeout: float,
+             check_cancelled: Optional[Callable[[], bool]] = None) -> PingResult:
+    """流式读取一个ping命令的输出并逐行解析；超时或调用取消时中止"""
+
+    def handle_stream(conn):
+        conn.socket.settimeout(0.2)
+        deadline = time.monotonic() + timeout
+        buffer = b""
+        try:
+            while True:
+                if time.monotonic() >= deadline or (check_cancelled and check_cancelled()):
+                    result.stopped = True
+                    break
+                try:
+                    chunk = conn.read(4096)
+                except socket.timeout:
+                    continue
+                if not chunk:
+                    break
+                buffer += chunk
+                *lines, buffer = buffer.split(b"\n")
+                for raw in lines:
+                    result.feed(raw.decode("utf-8", errors="ignore"))
+            if buffer:
+                result.feed(buffer.decode("utf-8", errors="ignore"))
+        finally:
+            conn.close()
+
+    device.shell(command, handler=handle_stream)
+    return result
@@ -1,6 +1,18 @@
-from typing import Optional
+from typing import Dict, Optional
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import contextvars
+import shlex
 from mcp.server.fastmcp import FastMCP
+from . import net_stats, scheduler
 from .adb_server import get_device, mcp
+from .jobs import get_job, list_jobs, start_job
+
+# ping 同时探测的最大主机数
+MAX_PING_HOSTS = 16
+
+# 采样器，按任务ID索引（任务记录被清理后一并删除）
+_samplers: Dict[str, net_stats.NetworkSampler] = {}
 
 @mcp.tool()
 async def toggle_wifi(enable: bool, device_id: Optional[str] = None) -> str:
@@ -67,18 +79,39 @@ async def get_wifi_info(device_id: Optional[str] = None) -> str:
         return f"获取WiFi信息失败: {str(e)}"
 
 @mcp.tool()
-async def ping(host: str, count: int = 4, device_id: Optional[str] = None) -> str:
-    """Ping网络主机
+async def ping(host: str, count: int = 4, interval: float = 1.0, device_id: Optional[str] = None) -> str:
+    """从设备Ping网络主机，统计丢包率和RTT分布（最小/P50/P90/P99/最大、平均、抖动）
+
+    多个主机同时探测，每个主机的输出边接收边解析；调用被取消或超时时返回已收到的结果。
 
     参数:
-        host: 要ping的主机地址
-        count: ping的次数，默认4次
+        host: 要ping的主机地址，多个主机用逗号分隔
+        count: 每个主机ping的次数，默认4次
+        interval: 两次ping的间隔（秒），默认1.0（非root设备最小0.2）
         device_id: 设备ID（可选，如果未提供则使用第一个可用设备）
     """
     try:
+        hosts = [item.strip() for item in host.split(",") if item.strip()]
+        if not hosts:
+            return "Ping失败: 未指定主机"
+        if len(hosts) > MAX_PING_HOSTS:
+            return f"Ping失败: 最多同时探测 {MAX_PING_HOSTS} 个主机"
+        if any(item.startswith("-") for item in hosts):
+            return f"Ping失败: 无效的主机地址: {host}"
+        if count < 1 or interval <= 0:
+            return "Ping失败: 次数必须大于0，间隔必须大于0"
         device = get_device(device_id)
-        output = device.shell(f"ping -c {count} {host}")
-        return output.strip()
+        timeout = count * interval + 10
+        results = [net_stats.PingResult(item, count) for item in hosts]
+        with ThreadPoolExecutor(max_workers=len(hosts), thread_name_prefix="adb-ping-probe") as pool:
+            # 每个探测在调用的上下文中运行，调用取消时所有探测一起中止
+            futures = [pool.submit(contextvars.copy_context().run, net_stats.run_ping, device,
+                                   f"ping -c {count} -i {interval:g} {shlex.quote(result.host)} 2>&1",
+                                   result, timeout, scheduler.cancelled)
+                       for result in results]
+            for future in futures:
+                future.result()
+        return "\n".join(result.describe() for result in results)
     except Exception as e:
         return f"Ping失败: {str(e)}"
 
@@ -94,4 +127,83 @@ async def get_ip_address(device_id: Optional[str] = None) -> str:
         output = device.shell("ip addr show wlan0 | grep 'inet ' | awk '{print $2}'")
         return f"设备IP地址: {output.strip()}"
     except Exception as e:
-        return f"获取IP地址失败: {str(e)}" 
\ No newline at end of file
+        return f"获取IP地址失败: {str(e)}" 
+
+
+def _prune_samplers():
+    alive = {job.id for job in list_jobs("network_sampler")}
+    for sampler_id in [key for key in _samplers if key not in alive]:
+        del _samplers[sampler_id]
+
+
+@mcp.tool()
+async def start_network_sampler(interval: float = 1.0, duration: int = 300, source: str = "auto",
+                                device_id: Optional[str] = None) -> str:
+    """在后台采样设备网络流量，立即返回采样器ID
+
+    每次采样用一次shell调用读取各网卡和各应用（UID）的累计收发字节数，保存增量的时间序列，
+    用 get_network_stats 查看各应用的流量、平均和峰值速率，用 stop_network_sampler 停止。
+
+    参数:
+        interval: 采样间隔（秒），默认1.0（netstats 来源最小2秒）
+        duration: 采样时长（秒），默认300，0表示一直采样直到停止
+        source: 应用流量的数据来源: auto（默认）、qtaguid（Android 9及更早）、netstats（Android 10起）
+        device_id: 设备ID（可选，如果未提供则使用第一个可用设备）
+    """
+    try:
+        device = get_device(device_id)
+        source = net_stats.detect_source(device, source)
+        sampler = net_stats.NetworkSampler(device.serial, source, interval)
+        job = start_job("network_sampler", device.serial, net_stats.run_sampler, device, sampler, duration)
+        _prune_samplers()
+        _samplers[job.id] = sampler
+        return (f"已开始采样网络流量，采样器ID: {job.id}（数据来源: {source}，间隔 {sampler.interval:.1f}秒）\n"
+                f"使用 get_network_stats 查看流量统计")
+    except Exception as e:
+        return f"启动网络采样失败: {str(e)}"
+
+
+@mcp.tool()
+async def get_network_stats(sampler_id: Optional[str] = None, packages: Optional[str] = None,
+                            window: int = 0, top: int = 10) -> str:
+    """查看网络采样器的统计: 各网卡和各应用的收发字节数、平均和峰值速率、累计总量
+
+    参数:
+        sampler_id: 采样器ID（可选，不提供时列出所有采样器）
+        packages: 只显示这些应用，多个包名用逗号分隔（可选，默认显示流量最多的应用）
+        window: 只统计最近多少秒（默认0，统计全部采样）
+        top: 不指定应用时显示的应用数，默认10
+    """
+    try:
+        if not sampler_id:
+            jobs = list_jobs("network_sampler")
+            if not jobs:
+                return "没有网络采样器"
+            return "\n\n".join(job.describe() for job in jobs)
+        job = get_job(sampler_id, kind="network_sampler")
+        sampler = _samplers.get(sampler_id)
+        if sampler is None:
+            return job.describe()
+        wanted = [name.strip() for name in packages.split(",") if name.strip()] if packages else None
+        return job.describe() + "\n\n" + sampler.report(wanted, window, top)
+    except Exception as e:
+        return f"获取网络统计失败: {str(e)}"
+
+
+@mcp.tool()
+async def stop_network_sampler(sampler_id: str) -> str:
+    """停止网络采样器并返回最终统计（统计结果保留，之后仍可用 get_network_stats 查看）
+
+    参数:
+        sampler_id: 采样器ID
+    """
+    try:
+        job = get_job(sampler_id, kind="network_sampler")
+        job.cancel()
+        while not job.finished:
+            await asyncio.sleep(0.1)
+        sampler = _samplers.get(sampler_id)
+        report = sampler.report() if sampler is not None else ""
+        return f"已停止网络采样器 {sampler_id}\n\n{report}".rstrip()
+    except Exception as e:
+        return f"停止网络采样失败: {str(e)}"
@@ -0,0 +1,283 @@
+from typing import Dict, List, Optional
+from dataclasses import dataclass
+import bisect
+import threading
+import time
+from .adb_server import get_device, mcp
+
+# 目录缓存有效期（秒），过期后下一次访问会做一次增量刷新
+CATALOG_TTL = 60.0
+
+# 单次shell调用中分隔两段pm输出的标记
+_SPLIT_MARKER = "__ADB_MCP_PKG_SPLIT__"
+
+# 一次shell调用同时取回带版本号/UID的完整列表和系统应用列表（用于区分 -3/-s）
+_LIST_COMMANDS = [
+    "pm list packages -f -U --show-versioncode 2>/dev/null",
+    # Android 9 以下不支持 --show-versioncode，Android 8 以下不支持 -U
+    "pm list packages -f -U 2>/dev/null",
+    "pm list packages -f 2>/dev/null",
+]
+
+_NO_ACTIVITY = ""
+
+
+@dataclass
+class PackageInfo:
+    """已安装应用的元数据"""
+    name: str
+    apk_path: str = ""
+    version_code: Optional[int] = None
+    uid: Optional[int] = None
+    system: bool = False
+    # 懒加载字段，版本变化时随增量刷新一起失效
+    launch_activity: Optional[str] = None
+    last_update_time: Optional[str] = None
+
+    def same_build(self, other: "PackageInfo") -> bool:
+        return self.version_code == other.version_code and self.apk_path == other.apk_path
+
+
+def parse_package_list(output: str) -> Dict[str, PackageInfo]:
+    """解析 `pm list packages -f -U --show-versioncode` 的输出
+
+    每行格式: package:/data/app/~~x==/com.foo-y==/base.apk=com.foo versionCode:12 uid:10086
+    """
+    packages = {}
+    for line in output.splitlines():
+        line = line.strip()
+        if not line.startswith("package:"):
+            continue
+        tokens = line[len("package:"):].split()
+        if not tokens:
+            continue
+        # APK路径里可能包含'='，包名总在最后一个'='之后
+        apk_path, _, name = tokens[0].rpartition("=")
+        info = PackageInfo(name=name, apk_path=apk_path)
+        for token in tokens[1:]:
+            key, _, value = token.partition(":")
+            value = value.split(",")[0]
+            if key == "versionCode" and value.isdigit():
+                info.version_code = int(value)
+            elif key == "uid" and value.isdigit():
+                info.uid = int(value)
+        packages[name] = info
+    return packages
+
+
+class PackageCatalog:
+    """单台设备的应用目录，支持前缀/子串检索与增量刷新"""
+
+    def __init__(self, serial: str):
+        self.serial = serial
+        self.packages: Dict[str, PackageInfo] = {}
+        self._names: List[str] = []
+        self._lock = threading.Lock()
+        self.loaded_at = 0.0
+        self.stale = True
+        self.last_delta = {"added": [], "removed": [], "updated": []}
+
+    def needs_refresh(self) -> bool:
+        return self.stale or time.time() - self.loaded_at > CATALOG_TTL
+
+    def refresh(self, device) -> Dict[str, List[str]]:
+        """重新拉取列表，并与现有目录做差量合并
+
+        未变化的应用保留已经查到的懒加载字段（启动Activity、更新时间），
+        只有新增或版本变化的应用需要重新查询。首次加载没有可比较的目录，变化为空。
+        """
+        fresh = {}
+        system_names = set()
+        for list_cmd in _LIST_COMMANDS:
+            output = device.shell(f"{list_cmd}; echo {_SPLIT_MARKER}; pm list packages -s 2>/dev/null")
+            listing, _, system_part = output.partition(_SPLIT_MARKER)
+            fresh = parse_package_list(listing)
+            if fresh:
+                system_names = set(parse_package_list(system_part))
+                break
+
+        with self._lock:
+            initial = not self.loaded_at
+            added, updated = [], []
+            for name, info in fresh.items():
+                info.system = name in system_names
+                old = self.packages.get(name)
+                if old is None:
+                    if not initial:
+                        added.append(name)
+                elif old.same_build(info):
+                    info.launch_activity = old.launch_activity
+                    info.last_update_time = old.last_update_time
+                else:
+                    updated.append(name)
+            removed = [name for name in self.packages if name not in fresh]
+
+            self.packages = fresh
+            self._names = sorted(fresh)
+            self.loaded_at = time.time()
+            self.stale = False
+            self.last_delta = {"added": added, "removed": removed, "updated": updated}
+            return self.last_delta
+
+    def get(self, package_name: str) -> Optional[PackageInfo]:
+        return self.packages.get(package_name)
+
+    def names(self, filter_type: str = "all") -> List[str]:
+        if filter_type == "system":
+            return [n for n in self._names if self.packages[n].system]
+        if filter_type == "third_party":
+            return [n for n in self._names if not self.packages[n].system]
+        return list(self._names)
+
+    def search(self, query: str, match: str = "substring", limit: int = 50) -> List[PackageInfo]:
+        """按前缀（二分查找）或子串检索包名"""
+        names = self._names
+        if match == "prefix":
+            start = bisect.bisect_left(names, query)
+            end = bisect.bisect_left(names, query + "\uffff")
+            hits = names[start:min(end, start + limit)]
+        else:
+            needle = query.lower()
+            hits = []
+            for name in names:
+                if needle in name.lower():
+                    hits.append(name)
+                    if len(hits) >= limit:
+                        break
+        return [self.packages[name] for name in hits]
+
+    def launch_activity(self, device, package_name: str) -> Optional[str]:
+        """解析应用的启动Activity，结果按版本缓存"""
+        info = self.packages.get(package_name)
+        if info is not None and info.launch_activity is not None:
+            return info.launch_activity or None
+
+        output = device.shell(
+            f"cmd package resolve-activity --brief -c android.intent.category.LAUNCHER {package_name} 2>/dev/null"
+        )
+        activity = _NO_ACTIVITY
+        for line in reversed(output.strip().splitlines()):
+            line = line.strip()
+            if line.startswith(package_name + "/"):
+                activity = line.split("/", 1)[1]
+                if activity.startswith("."):
+                    activity = package_name + activity
+                break
+
+        if info is not None:
+            info.launch_activity = activity
+        return activity or None
+
+    def update_time(self, device, package_name: str) -> Optional[str]:
+        info = self.packages.get(package_name)
+        if info is not None and info.last_update_time is not None:
+            return info.last_update_time or None
+
+        output = device.shell(f"dumpsys package {package_name} | grep -m 1 lastUpdateTime")
+        value = output.strip().partition("=")[2]
+        if info is not None:
+            info.last_update_time = value
+        return value or None
+
+
+_catalogs: Dict[str, PackageCatalog] = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_package_catalog(device, refresh: bool = False) -> PackageCatalog:
+    """获取设备的应用目录，必要时做增量刷新"""
+    with _catalogs_lock:
+        catalog = _catalogs.get(device.serial)
+        if catalog is None:
+            catalog = _catalogs[device.serial] = PackageCatalog(device.serial)
+    if refresh or catalog.needs_refresh():
+        catalog.refresh(device)
+    return catalog
+
+
+def invalidate_package_catalog(serial: str):
+    """标记目录过期（安装、卸载等操作后调用），下次访问时增量刷新"""
+    catalog = _catalogs.get(serial)
+    if catalog is not None:
+        catalog.stale = True
+
+
+def _format_package(info: PackageInfo) -> str:
+    version = info.version_code if info.version_code is not None else "?"
+    kind = "系统" if info.system else "第三方"
+    return f"{info.name}  versionCode={version}  uid={info.uid if info.uid is not None else '?'}  [{kind}]"
+
+
+@mcp.tool()
+async def search_packages(query: str, match: str = "substring", limit: int = 50, device_id: Optional[str] = None) -> str:
+    """在已安装应用目录中检索包名
+
+    参数:
+        query: 检索关键字
+        match: 匹配方式，substring（子串，默认）或 prefix（前缀）
+        limit: 最多返回条数，默认50
+        device_id: 设备ID（可选，如果未提供则使用第一个可用设备）
+    """
+    try:
+        device = get_device(device_id)
+        catalog = get_package_catalog(device)
+        results = catalog.search(query, match=match, limit=limit)
+        if not results:
+            return f"未找到匹配 '{query}' 的应用"
+        return "\n".join(_format_package(info) for info in results)
+    except Exception as e:
+        return f"检索应用失败: {str(e)}"
+
+
+@mcp.tool()
+async def get_package_info(package_name: str, device_id: Optional[str] = None) -> str:
+    """获取已安装应用的版本、UID、APK路径、启动Activity和最近更新时间
+
+    参数:
+        package_name: 应用包名
+        device_id: 设备ID（可选，如果未提供则使用第一个可用设备）
+    """
+    try:
+        device = get_device(device_id)
+        catalog = get_package_catalog(device)
+        info = catalog.get(package_name)
+        if info is None:
+            return f"应用未安装: {package_name}"
+
+        activity = catalog.launch_activity(device, package_name)
+        update_time = catalog.update_time(device, package_name)
+        return "\n".join([
+            f"包名: {info.name}",
+            f"版本号: {info.version_code if info.version_code is not None else '未知'}",
+            f"UID: {info.uid if info.uid is not None else '未知'}",
+            f"类型: {'系统应用' if info.system else '第三方应用'}",
+            f"APK路径: {info.apk_path or '未知'}",
+            f"启动Activity: {activity or '无'}",
+            f"最近更新时间: {update_time or '未知'}",
+        ])
+    except Exception as e:
+        return f"获取应用信息失败: {str(e)}"
+
+
+@mcp.tool()
+async def refresh_package_catalog(device_id: Optional[str] = None) -> str:
+    """立即刷新应用目录并返回与上次相比的变化
+
+    参数:
+        device_id: 设备ID（可选，如果未提供则使用第一个可用设备）
+    """
+    try:
+        device = get_device(device_id)
+        previous = _catalogs.get(device.serial)
+        first_load = previous is None or not previous.loaded_at
+        catalog = get_package_catalog(device, refresh=True)
+        if first_load:
+            return f"首次加载应用目录: 共 {len(catalog.packages)} 个应用"
+        delta = catalog.last_delta
+        lines = [f"共 {len(catalog.packages)} 个应用"]
+        for label, key in (("新增", "added"), ("移除", "removed"), ("更新", "updated")):
+            names = delta[key]
+            lines.append(f"{label}: {len(names)}" + (f" ({', '.join(names[:20])})" if names else ""))
+        return "\n".join(lines)
+    except Exception as e:
+        return f"刷新应用目录失败: {str(e)}"
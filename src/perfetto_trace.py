@@ -0,0 +1,515 @@
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import heapq
+import os
+import shlex
+import tempfile
+import time
+from .adb_server import iter_pull
+from .artifacts import store as artifact_store
+
+# 默认的 atrace 分类
+DEFAULT_CATEGORIES = "gfx,view,input,am,wm,sched,freq,binder_driver,dalvik,res"
+
+# trace在设备上的保存目录（shell用户的perfetto只能写入这个目录）
+DEVICE_TRACE_DIR = "/data/misc/perfetto-traces"
+
+# 采集结束后等待perfetto写完文件的最长时间（秒）
+FINALIZE_WAIT = 30.0
+
+# 摘要中列出的条目数
+TOP_THREADS = 15
+TOP_PROCESSES = 10
+TOP_SLICES = 20
+TOP_BINDER = 10
+
+# 按名称汇总的切片数上限（名称中带ID的切片可能有大量不同的名称）
+MAX_SLICE_NAMES = 5000
+
+# ftrace事件按CPU分组写入，不同CPU的事件没有全局排序；切片和binder事件先按时间戳排序，
+# 比已收到的最新时间戳早这么多（纳秒）的事件才处理
+REORDER_WINDOW_NS = 2_000_000_000
+
+# TracePacket / FtraceEventBundle / FtraceEvent 中用到的字段号（perfetto/protos/perfetto/trace）
+_PACKET_FTRACE_EVENTS = 1
+_PACKET_PROCESS_TREE = 2
+_BUNDLE_CPU = 1
+_BUNDLE_EVENT = 2
+_BUNDLE_LOST_EVENTS = 3
+_EVENT_TIMESTAMP = 1
+_EVENT_PID = 2
+_EVENT_PRINT = 3
+_EVENT_SCHED_SWITCH = 4
+_EVENT_CPU_FREQUENCY = 11
+_EVENT_BINDER_TRANSACTION = 64
+
+_NS = 1_000_000_000
+
+
+def build_config(duration: int, categories: str, package_name: Optional[str], buffer_mb: int) -> str:
+    """生成perfetto文本格式配置: 调度、CPU频率、binder事件、atrace分类和应用切片，以及进程列表"""
+    lines = [
+        f"buffers {{ size_kb: {buffer_mb * 1024} fill_policy: RING_BUFFER }}",
+        "buffers { size_kb: 2048 fill_policy: RING_BUFFER }",
+        "data_sources { config { name: \"linux.ftrace\" target_buffer: 0 ftrace_config {",
+        "  ftrace_events: \"sched/sched_switch\"",
+        "  ftrace_events: \"power/cpu_frequency\"",
+        "  ftrace_events: \"binder/binder_transaction\"",
+        "  ftrace_events: \"ftrace/print\"",
+    ]
+    lines += [f"  atrace_categories: \"{category.strip()}\"" for category in categories.split(",")
+              if category.strip()]
+    if package_name:
+        lines.append(f"  atrace_apps: \"{package_name}\"")
+    lines += [
+        "  compact_sched { enabled: false }",
+        "} } }",
+        "data_sources { config { name: \"linux.process_stats\" target_buffer: 1",
+        "  process_stats_config { scan_all_processes_on_start: true } } }",
+        f"duration_ms: {duration * 1000}",
+        "write_into_file: true",
+        "file_write_period_ms: 1000",
+        "flush_period_ms: 5000",
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def _varint(data: bytes, pos: int) -> Tuple[int, int]:
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _fields(data: bytes, start: int, end: int) -> Iterable[Tuple[int, int, object]]:
+    """遍历一个protobuf消息的字段，返回 (字段号, 编码类型, 值)；长度分隔字段的值为 (起始, 结束) 偏移
+
+    trace中绝大多数标签和长度只有一个字节，先按单字节处理，避免函数调用。
+    """
+    pos = start
+    while pos < end:
+        key = data[pos]
+        pos += 1
+        if key >= 0x80:
+            key, pos = _varint(data, pos - 1)
+        wire = key & 7
+        if wire == 0:
+            value = data[pos]
+            pos += 1
+            if value >= 0x80:
+                value, pos = _varint(data, pos - 1)
+        elif wire == 2:
+            length = data[pos]
+            pos += 1
+            if length >= 0x80:
+                length, pos = _varint(data, pos - 1)
+            value = (pos, pos + length)
+            pos += length
+        elif wire == 1:
+            value = int.from_bytes(data[pos:pos + 8], "little")
+            pos += 8
+        elif wire == 5:
+            value = int.from_bytes(data[pos:pos + 4], "little")
+            pos += 4
+        else:
+            raise ValueError(f"无法解析的protobuf编码类型: {wire}")
+        yield key >> 3, wire, value
+
+
+def _message(data: bytes, start: int, end: int) -> Dict[int, object]:
+    """把不含重复字段的消息解析为 {字段号: 值}（长度分隔字段的值为 (起始, 结束) 偏移）"""
+    return {field: value for field, _, value in _fields(data, start, end)}
+
+
+def _text(data: bytes, span) -> str:
+    return data[span[0]:span[1]].decode("utf-8", errors="replace")
+
+
+class TraceSummarizer:
+    """边接收边解析perfetto trace（protobuf），只保留汇总所需的状态，不在内存中保存完整的trace
+
+    统计每个线程的CPU时间、每个进程主线程最长的切片、binder同步调用的次数和耗时、每个CPU的频率驻留时间。
+    """
+
+    def __init__(self, package_name: Optional[str] = None):
+        self.package_name = package_name
+        self._buffer = bytearray()
+        self.bytes = 0
+        self.packets = 0
+        self.first_ts: Optional[int] = None
+        self.last_ts = 0
+        self.lost_events = False
+        # 进程和线程
+        self.process_names: Dict[int, str] = {}
+        self.thread_tgid: Dict[int, int] = {}
+        self.thread_names: Dict[int, str] = {}
+        # 调度
+        self._cpu_switch: Dict[int, Tuple[int, int]] = {}
+        self.cpu_time: Dict[int, int] = {}
+        self.cpu_busy: Dict[int, int] = {}
+        # 切片: 每个线程的切片栈；主线程（tid == tgid）每个进程保留最长的 TOP_SLICES 个
+        self._slice_stacks: Dict[int, List[Tuple[int, str]]] = {}
+        self.longest_slices: Dict[int, List[Tuple[int, int, str]]] = {}
+        self.slice_totals: Dict[Tuple[int, str], List[int]] = {}
+        # binder: 等待回复的同步调用（按发送线程），以及按 (发送线程, 目标进程) 汇总的次数/总耗时/最长耗时
+        self._binder_pending: Dict[int, List[Tuple[int, int]]] = {}
+        # 等待按时间戳排序处理的切片和binder事件: (时间戳, 序号, 处理函数, 参数)
+        self._ordered: List[Tuple[int, int, Callable, tuple]] = []
+        self._ordered_seq = 0
+        self.binder: Dict[Tuple[int, int], List[int]] = {}
+        self.binder_oneway = 0
+        # CPU频率
+        self._cpu_freq: Dict[int, Tuple[int, int]] = {}
+        self.freq_residency: Dict[int, Dict[int, int]] = {}
+
+    # 流式输入
+    def feed(self, chunk: bytes):
+        """追加一段trace数据，解析其中所有完整的TracePacket，不完整的尾部留到下一段"""
+        self.bytes += len(chunk)
+        self._buffer += chunk
+        data = bytes(self._buffer)
+        pos, end = 0, len(data)
+        while pos < end:
+            try:
+                key, body = _varint(data, pos)
+                length, body = _varint(data, body)
+            except IndexError:
+                break
+            if body + length > end:
+                break
+            if key == (1 << 3) | 2:  # Trace.packet
+                self.packets += 1
+                self._packet(data, body, body + length)
+            pos = body + length
+        del self._buffer[:pos]
+
+    def finish(self):
+        if self._buffer:
+            raise RuntimeError(f"trace文件不完整（末尾有 {len(self._buffer)} 字节无法解析）")
+        self._drain_ordered(None)
+        for cpu, (ts, freq) in self._cpu_freq.items():
+            self._add_residency(cpu, freq, self.last_ts - ts)
+        self._cpu_freq.clear()
+
+    # 解析
+    def _packet(self, data: bytes, start: int, end: int):
+        for field, wire, value in _fields(data, start, end):
+            if wire != 2:
+                continue
+            if field == _PACKET_FTRACE_EVENTS:
+                self._ftrace_bundle(data, *value)
+            elif field == _PACKET_PROCESS_TREE:
+                self._process_tree(data, *value)
+
+    def _process_tree(self, data: bytes, start: int, end: int):
+        for field, wire, value in _fields(data, start, end):
+            if wire != 2:
+                continue
+            if field == 1:  # Process: pid=1, cmdline=3
+                pid, cmdline = None, None
+                for sub, sub_wire, sub_value in _fields(data, *value):
+                    if sub == 1 and sub_wire == 0:
+                        pid = sub_value
+                    elif sub == 3 and sub_wire == 2 and cmdline is None:
+                        cmdline = _text(data, sub_value)
+                if pid is not None and cmdline:
+                    self.process_names[pid] = cmdline
+            elif field == 2:  # Thread: tid=1, name=2, tgid=5
+                tid, tgid, name = None, None, None
+                for sub, sub_wire, sub_value in _fields(data, *value):
+                    if sub == 1 and sub_wire == 0:
+                        tid = sub_value
+                    elif sub == 2 and sub_wire == 2:
+                        name = _text(data, sub_value)
+                    elif sub == 5 and sub_wire == 0:
+                        tgid = sub_value
+                if tid is not None:
+                    if tgid is not None:
+                        self.thread_tgid[tid] = tgid
+                    if name:
+                        self.thread_names.setdefault(tid, name)
+
+    def _ftrace_bundle(self, data: bytes, start: int, end: int):
+        cpu = 0
+        events = []
+        for field, wire, value in _fields(data, start, end):
+            if field == _BUNDLE_CPU and wire == 0:
+                cpu = value
+            elif field == _BUNDLE_EVENT and wire == 2:
+                events.append(value)
+            elif field == _BUNDLE_LOST_EVENTS and value:
+                self.lost_events = True
+        for event_start, event_end in events:
+            self._ftrace_event(data, event_start, event_end, cpu)
+        self._drain_ordered(self.last_ts - REORDER_WINDOW_NS)
+
+    def _defer(self, ts: int, handler: Callable, *args):
+        self._ordered_seq += 1
+        heapq.heappush(self._ordered, (ts, self._ordered_seq, handler, args))
+
+    def _drain_ordered(self, until: Optional[int]):
+        """按时间戳顺序处理早于 until 的事件（None 表示全部）"""
+        ordered = self._ordered
+        while ordered and (until is None or ordered[0][0] <= until):
+            ts, _, handler, args = heapq.heappop(ordered)
+            handler(ts, *args)
+
+    def _ftrace_event(self, data: bytes, start: int, end: int, cpu: int):
+        event = _message(data, start, end)
+        ts = event.get(_EVENT_TIMESTAMP, 0)
+        if ts:
+            if self.first_ts is None or ts < self.first_ts:
+                self.first_ts = ts
+            if ts > self.last_ts:
+                self.last_ts = ts
+        body = event.get(_EVENT_SCHED_SWITCH)
+        if body is not None:
+            self._sched_switch(data, body, ts, cpu)
+            return
+        body = event.get(_EVENT_PRINT)
+        if body is not None:
+            self._print(data, body, ts, event.get(_EVENT_PID, 0))
+            return
+        body = event.get(_EVENT_CPU_FREQUENCY)
+        if body is not None:
+            self._cpu_frequency(data, body, ts)
+            return
+        body = event.get(_EVENT_BINDER_TRANSACTION)
+        if body is not None:
+            self._binder_transaction(data, body, ts, event.get(_EVENT_PID, 0))
+
+    def _sched_switch(self, data: bytes, span, ts: int, cpu: int):
+        # prev_comm=1, prev_pid=2, next_comm=5, next_pid=6
+        switch = _message(data, *span)
+        prev_pid = switch.get(2, 0)
+        next_pid = switch.get(6, 0)
+        if next_pid and 5 in switch:
+            self.thread_names[next_pid] = _text(data, switch[5])
+        previous = self._cpu_switch.get(cpu)
+        if previous is not None and previous[1] == prev_pid:
+            elapsed = ts - previous[0]
+            if prev_pid:
+                self.cpu_time[prev_pid] = self.cpu_time.get(prev_pid, 0) + elapsed
+                self.cpu_busy[cpu] = self.cpu_busy.get(cpu, 0) + elapsed
+        self._cpu_switch[cpu] = (ts, next_pid)
+
+    def _print(self, data: bytes, span, ts: int, tid: int):
+        # buf=2
+        buf = _message(data, *span).get(2)
+        if buf is None:
+            return
+        buf = _text(data, buf).rstrip("\n")
+        if buf.startswith(("B|", "E")):
+            self._defer(ts, self._slice_event, tid, buf)
+
+    def _slice_event(self, ts: int, tid: int, buf: str):
+        if buf.startswith("B|"):
+            parts = buf.split("|", 2)
+            if len(parts) == 3:
+                if parts[1].isdigit():
+                    self.thread_tgid.setdefault(tid, int(parts[1]))
+                self._slice_stacks.setdefault(tid, []).append((ts, parts[2]))
+        else:
+            stack = self._slice_stacks.get(tid)
+            if stack:
+                begin, name = stack.pop()
+                self._end_slice(tid, name, ts - begin)
+
+    def _end_slice(self, tid: int, name: str, duration: int):
+        if self.thread_tgid.get(tid) != tid:
+            return  # 只统计主线程
+        heap = self.longest_slices.setdefault(tid, [])
+        entry = (duration, len(heap), name)
+        if len(heap) < TOP_SLICES:
+            heapq.heappush(heap, entry)
+        elif duration > heap[0][0]:
+            heapq.heapreplace(heap, entry)
+        key = (tid, name)
+        totals = self.slice_totals.get(key)
+        if totals is None:
+            if len(self.slice_totals) >= MAX_SLICE_NAMES:
+                return
+            totals = self.slice_totals[key] = [0, 0, 0]
+        totals[0] += 1
+        totals[1] += duration
+        totals[2] = max(totals[2], duration)
+
+    def _cpu_frequency(self, data: bytes, span, ts: int):
+        # state=1（kHz），cpu_id=2
+        frequency = _message(data, *span)
+        cpu = frequency.get(2, 0)
+        previous = self._cpu_freq.get(cpu)
+        if previous is not None:
+            self._add_residency(cpu, previous[1], ts - previous[0])
+        self._cpu_freq[cpu] = (ts, frequency.get(1, 0))
+
+    def _add_residency(self, cpu: int, freq: int, duration: int):
+        if duration > 0:
+            residency = self.freq_residency.setdefault(cpu, {})
+            residency[freq] = residency.get(freq, 0) + duration
+
+    def _binder_transaction(self, data: bytes, span, ts: int, tid: int):
+        # to_proc=3, to_thread=4, reply=5, flags=7（FLAG_ONEWAY = 1）
+        transaction = _message(data, *span)
+        self._defer(ts, self._binder_event, tid, transaction.get(3, 0), transaction.get(4, 0),
+                    transaction.get(5, 0), transaction.get(7, 0))
+
+    def _binder_event(self, ts: int, tid: int, to_proc: int, to_thread: int, reply: int, flags: int):
+        if reply:
+            pending = self._binder_pending.get(to_thread)
+            if pending:
+                begin, target = pending.pop()
+                stats = self.binder.setdefault((to_thread, target), [0, 0, 0])
+                stats[0] += 1
+                stats[1] += ts - begin
+                stats[2] = max(stats[2], ts - begin)
+        elif flags & 1:
+            self.binder_oneway += 1
+        else:
+            self._binder_pending.setdefault(tid, []).append((ts, to_proc))
+
+    # 汇总
+    def _process_of(self, tid: int) -> int:
+        return self.thread_tgid.get(tid, tid)
+
+    def process_label(self, pid: int) -> str:
+        name = self.process_names.get(pid) or self.thread_names.get(pid) or "?"
+        return f"{name}({pid})"
+
+    def thread_label(self, tid: int) -> str:
+        pid = self._process_of(tid)
+        thread = self.thread_names.get(tid) or "?"
+        if pid == tid:
+            return f"{thread}({tid}) [主线程 {self.process_label(pid)}]"
+        return f"{thread}({tid}) [{self.process_label(pid)}]"
+
+    def target_pids(self) -> List[int]:
+        if not self.package_name:
+            return []
+        return [pid for pid, name in self.process_names.items()
+                if name == self.package_name or name.startswith(self.package_name + ":")]
+
+    def describe(self) -> str:
+        span = (self.last_ts - self.first_ts) if self.first_ts is not None else 0
+        lines = [f"trace大小 {self.bytes / 1024 / 1024:.1f}MB，{self.packets} 个数据包，时长 {span / _NS:.2f}秒"]
+        if self.lost_events:
+            lines.append("注意: 部分ftrace事件丢失（缓冲区溢出），统计可能偏低，可增大 buffer_mb")
+        targets = set(self.target_pids())
+        if self.package_name:
+            lines.append(f"目标应用 {self.package_name}: " +
+                         (", ".join(self.process_label(pid) for pid in sorted(targets)) if targets else "未找到进程"))
+
+        # CPU时间
+        if self.cpu_time:
+            per_process: Dict[int, int] = {}
+            for tid, value in self.cpu_time.items():
+                per_process[self._process_of(tid)] = per_process.get(self._process_of(tid), 0) + value
+            lines.append("\nCPU时间最多的进程:")
+            for pid, value in sorted(per_process.items(), key=lambda item: -item[1])[:TOP_PROCESSES]:
+                lines.append(f"  {self.process_label(pid)}: {value / 1e6:.1f}ms")
+            threads = [(tid, value) for tid, value in self.cpu_time.items()
+                       if not targets or self._process_of(tid) in targets]
+            lines.append("\nCPU时间最多的线程" + ("（目标应用）" if targets else "") + ":")
+            for tid, value in sorted(threads, key=lambda item: -item[1])[:TOP_THREADS]:
+                lines.append(f"  {self.thread_label(tid)}: {value / 1e6:.1f}ms")
+            if span:
+                usage = ", ".join(f"CPU{cpu} {busy / span * 100:.0f}%" for cpu, busy in sorted(self.cpu_busy.items()))
+                lines.append(f"CPU占用率: {usage}")
+        else:
+            lines.append("\n没有调度事件（sched_switch），无法统计CPU时间")
+
+        # 主线程切片
+        slices = [(duration, tid, name) for tid, heap in self.longest_slices.items()
+                  if not targets or tid in targets for duration, _, name in heap]
+        if slices:
+            lines.append("\n最长的主线程切片:")
+            for duration, tid, name in sorted(slices, reverse=True)[:TOP_SLICES]:
+                lines.append(f"  {duration / 1e6:.1f}ms  {name}  [{self.process_label(tid)}]")
+            totals = [(value[1], value[0], value[2], tid, name) for (tid, name), value in self.slice_totals.items()
+                      if not targets or tid in targets]
+            lines.append("\n主线程累计耗时最多的切片:")
+            for total, count, longest, tid, name in sorted(totals, reverse=True)[:TOP_SLICES // 2]:
+                lines.append(f"  {name}: {count}次，共{total / 1e6:.1f}ms，最长{longest / 1e6:.1f}ms"
+                             f"  [{self.process_label(tid)}]")
+
+        # binder
+        binder = [(stats, tid, target) for (tid, target), stats in self.binder.items()
+                  if not targets or self._process_of(tid) in targets]
+        if binder or self.binder_oneway:
+            calls = sum(stats[0] for stats, _, _ in binder)
+            lines.append(f"\nbinder同步调用 {calls} 次，单向调用 {self.binder_oneway} 次；耗时最多的调用:")
+            for stats, tid, target in sorted(binder, key=lambda item: -item[0][1])[:TOP_BINDER]:
+                lines.append(f"  {self.thread_label(tid)} -> {self.process_label(target)}: {stats[0]}次，"
+                             f"共{stats[1] / 1e6:.1f}ms，最长{stats[2] / 1e6:.1f}ms")
+
+        # CPU频率
+        if self.freq_residency:
+            lines.append("\nCPU频率驻留（时间占比最高的频率）:")
+            for cpu, residency in sorted(self.freq_residency.items()):
+                total = sum(residency.values())
+                average = sum(freq * value for freq, value in residency.items()) / total / 1000
+                top = sorted(residency.items(), key=lambda item: -item[1])[:3]
+                top_text = "，".join(f"{freq / 1000:.0f}MHz {value / total * 100:.0f}%" for freq, value in top)
+                lines.append(f"  CPU{cpu}: 平均 {average:.0f}MHz；{top_text}")
+        return "\n".join(lines)
+
+
+def start_perfetto(device, config: str, device_path: str) -> int:
+    """在设备上后台启动perfetto，返回进程ID（配置通过标准输入传入，兼容不允许读取外部配置文件的系统版本）"""
+    output = device.shell(f"setprop persist.traced.enable 1 2>/dev/null; "
+                          f"echo {shlex.quote(config)} | perfetto --txt -c - -o {device_path} --background 2>&1")
+    pid = next((line.strip() for line in reversed(output.strip().splitlines()) if line.strip().isdigit()), None)
+    if pid is None:
+        raise RuntimeError(f"启动perfetto失败: {output.strip()[:500]}")
+    return int(pid)
+
+
+def run_capture(job, device, package_name: Optional[str], duration: int, categories: str,
+                buffer_mb: int) -> dict:
+    """后台任务: 采集trace，结束后边拉取边解析，trace文件保存到产物存储"""
+    device_path = f"{DEVICE_TRACE_DIR}/adb_mcp_{job.id}.perfetto-trace"
+    pid = start_perfetto(device, build_config(duration, categories, package_name, buffer_mb), device_path)
+    started = time.time()
+    deadline = started + duration + FINALIZE_WAIT
+    stopped = False
+    while True:
+        if job.cancel_event.is_set() and not stopped:
+            # 提前停止: perfetto收到SIGTERM后结束采集并写完文件
+            device.shell(f"kill -TERM {pid}")
+            stopped = True
+            deadline = time.time() + FINALIZE_WAIT
+        if "running" not in device.shell(f"kill -0 {pid} 2>/dev/null && echo running"):
+            break
+        if time.time() >= deadline:
+            device.shell(f"kill -TERM {pid}")
+            raise RuntimeError(f"perfetto在{duration + FINALIZE_WAIT:.0f}秒内没有结束")
+        elapsed = time.time() - started
+        job.set_progress(f"正在采集 {min(elapsed, duration):.0f}/{duration}秒" if elapsed < duration
+                         else "正在写入trace文件")
+        job.cancel_event.wait(1.0)
+
+    job.set_progress("正在拉取并解析trace")
+    summarizer = TraceSummarizer(package_name)
+    os.makedirs(artifact_store.root, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=artifact_store.root, suffix=".part", delete=False) as temp_file:
+        temp_path = temp_file.name
+    try:
+        with open(temp_path, "wb") as stream:
+            for chunk in iter_pull(device, device_path):
+                stream.write(chunk)
+                summarizer.feed(chunk)
+                job.set_progress(f"正在拉取并解析trace（已接收 {summarizer.bytes / 1024 / 1024:.1f}MB）")
+        summarizer.finish()
+        if not summarizer.packets:
+            raise RuntimeError("trace为空（设备可能不支持perfetto，或采集被系统拒绝）")
+        artifact, _ = artifact_store.put_file(temp_path, "application/octet-stream", "trace", device.serial,
+                                              "capture_trace", move=True)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        device.shell(f"rm -f {device_path}")
+    return {"summary": summarizer.describe(), "handle": artifact.handle, "size": artifact.size,
+            "path": artifact_store.path(artifact), "stopped_early": stopped}
@@ -0,0 +1,125 @@
+from typing import Any, Callable, Dict, Optional, Tuple
+import asyncio
+import functools
+import json
+import time
+from . import metrics
+
+# 只读查询工具的结果缓存时间（秒）
+CACHE_TTLS: Dict[str, float] = {
+    "get_current_activity": 1.0,
+    "get_screen_resolution": 30.0,
+    "get_battery_info": 10.0,
+    "get_wifi_info": 5.0,
+    "get_ip_address": 10.0,
+    "dump_ui_hierarchy": 1.0,
+}
+
+# 不会改变设备状态的工具，调用它们不会使缓存失效
+READ_ONLY_PREFIXES = ("get_", "list_", "search_", "query_", "fetch_", "check_", "dump_", "read_")
+READ_ONLY_TOOLS = {
+    "take_screenshot", "record_screen", "take_screen_recording", "ping", "collect_device_logs",
+    "analyze_performance", "take_bugreport", "start_bugreport", "record_input", "pull_file", "pull_directory",
+    "download_file", "configure_profiling", "delete_artifact", "find_image", "find_color", "capture_template",
+    "start_network_sampler", "stop_network_sampler", "capture_trace", "lock_device", "unlock_device",
+    "clear_screen_states", "start_condition_sampler", "stop_condition_sampler", "wait_for_device_ready",
+}
+
+
+class _Entry:
+    __slots__ = ("value", "expires", "device")
+
+    def __init__(self, value: Any, expires: float, device: Optional[str]):
+        self.value = value
+        self.expires = expires
+        self.device = device
+
+
+_entries: Dict[Tuple[str, str], _Entry] = {}
+_inflight: Dict[Tuple[str, str], asyncio.Future] = {}
+# 每次可能修改设备状态的调用开始和结束时递增，期间完成的查询结果不写入缓存
+_generation = 0
+
+
+def is_read_only(name: str) -> bool:
+    return name in CACHE_TTLS or name in READ_ONLY_TOOLS or name.startswith(READ_ONLY_PREFIXES)
+
+
+def invalidate(device: Optional[str] = None):
+    """使某个设备（None 表示全部）的缓存失效"""
+    global _generation
+    _generation += 1
+    if device is None:
+        _entries.clear()
+        return
+    for key in [key for key, entry in _entries.items() if entry.device in (device, None)]:
+        del _entries[key]
+
+
+def _call_key(name: str, args: tuple, kwargs: dict) -> Tuple[str, str]:
+    return name, json.dumps([args, kwargs], sort_keys=True, default=str)
+
+
+def _cached(fn: Callable, name: str, ttl: float) -> Callable:
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        key = _call_key(name, args, kwargs)
+        entry = _entries.get(key)
+        if entry is not None and entry.expires > time.monotonic():
+            metrics.record_cache(name, "hit")
+            if entry.device:
+                metrics.set_call_device(entry.device)
+            return entry.value
+
+        pending = _inflight.get(key)
+        if pending is not None and pending.get_loop() is asyncio.get_running_loop():
+            # 同一设备上相同的查询正在进行，直接等待它的结果
+            metrics.record_cache(name, "coalesced")
+            return await asyncio.shield(pending)
+
+        metrics.record_cache(name, "miss")
+        future = asyncio.get_running_loop().create_future()
+        _inflight[key] = future
+        generation = _generation
+        try:
+            result = await fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # 没有其他等待者时避免 "exception was never retrieved" 警告
+            raise
+        finally:
+            _inflight.pop(key, None)
+        future.set_result(result)
+
+        if generation == _generation and not metrics.is_error_result(result):
+            call = metrics.current_call()
+            device = call.device if call and call.device != "default" else None
+            _entries[key] = _Entry(result, time.monotonic() + ttl, device)
+        return result
+
+    return wrapper
+
+
+def _invalidating(fn: Callable, name: str) -> Callable:
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        global _generation
+        _generation += 1
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            call = metrics.current_call()
+            # 没有发生ADB调用的工具不可能改变设备状态
+            if call is None or call.adb_calls:
+                invalidate(call.device if call and call.device != "default" else None)
+
+    return wrapper
+
+
+def wrap_tool(fn: Callable, name: str) -> Callable:
+    """按工具类型包装: 可缓存的只读查询加上单飞和TTL缓存，可能修改设备状态的工具在调用后使缓存失效"""
+    if name in CACHE_TTLS:
+        return _cached(fn, name, CACHE_TTLS[name])
+    if is_read_only(name):
+        return fn
+    return _invalidating(fn, name)
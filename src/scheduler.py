@@ -0,0 +1,523 @@
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+from collections import deque
+from concurrent.futures import Future, InvalidStateError, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import asyncio
+import contextvars
+import functools
+import inspect
+import os
+import threading
+import time
+import uuid
+from . import metrics
+
+# 优先级类别，按调度顺序排列
+PRIORITIES = ("interactive", "normal", "background")
+
+# 交互类工具: 点击、滑动、输入和驱动交互所需的截图/界面查询，需要尽快执行
+INTERACTIVE_TOOLS = {
+    "tap_screen", "multi_tap", "swipe_up", "swipe_down", "swipe_left", "swipe_right", "input_text",
+    "press_key", "press_back", "press_home", "press_app_switch", "perform_touch_gesture", "swipe_path",
+    "pinch", "rotate_gesture", "tap_element_by_text", "check_element_exists", "take_screenshot",
+    "get_current_activity", "dump_ui_hierarchy", "find_image", "tap_image", "find_color", "get_screen_state",
+}
+# 后台类工具: 长时间占用设备的诊断、录制和采集
+BACKGROUND_TOOLS = {
+    "take_bugreport", "start_bugreport", "record_screen", "take_screen_recording", "analyze_performance",
+    "collect_device_logs", "record_input", "refresh_package_catalog", "reboot_device", "pull_directory",
+    "push_directory", "start_network_sampler", "capture_trace", "start_condition_sampler", "wait_for_device_ready",
+}
+# 不访问设备、只读写服务器内存状态的工具，直接在事件循环中执行
+INLINE_TOOLS = {
+    "get_server_metrics", "configure_profiling", "get_slow_call_profiles", "get_bugreport_status",
+    "list_input_recordings", "get_scheduler_status", "cancel_tool_calls", "configure_scheduler",
+    "reset_circuit_breaker", "get_network_stats", "stop_network_sampler",
+    "get_trace_status", "lock_device", "unlock_device", "stop_condition_sampler",
+}
+
+# 每台设备同时执行的调用数: 前台（交互和普通）与后台分开计数，后台任务不会占用交互操作的执行位置
+LANE_CONCURRENCY = {
+    "foreground": int(os.environ.get("ADB_MCP_FOREGROUND_CONCURRENCY", "1")),
+    "background": int(os.environ.get("ADB_MCP_BACKGROUND_CONCURRENCY", "1")),
+}
+# 所有设备合计的工作线程数
+MAX_WORKERS = int(os.environ.get("ADB_MCP_SCHEDULER_WORKERS", "32"))
+# 各优先级调用的默认截止时间（秒，从进入队列开始计算），超过后调用被取消并返回错误
+DEADLINES = {"interactive": 120.0, "normal": 600.0, "background": 3600.0}
+# 普通调用排队超过该时间（秒）后按交互优先级调度，避免被连续的交互操作饿死
+AGING_SECONDS = 10.0
+
+# 不属于任何设备的调用（设备列表、ADB服务器管理等）
+HOST_KEY = "(host)"
+
+# 设备锁定的默认时长（秒）；持有者每次调用该设备时自动续期
+LEASE_SECONDS = float(os.environ.get("ADB_MCP_LEASE_SECONDS", "300"))
+# 等待其他会话释放设备时检查的间隔（秒）
+LEASE_POLL_SECONDS = 0.2
+# 设备键的缓存时间（秒），避免每次调用都向ADB服务器查询设备列表
+DEVICE_KEY_TTL = 30.0
+
+_tool_priorities: Dict[str, str] = {}
+
+
+def priority_of(name: str) -> str:
+    if name in _tool_priorities:
+        return _tool_priorities[name]
+    if name in INTERACTIVE_TOOLS:
+        return "interactive"
+    if name in BACKGROUND_TOOLS:
+        return "background"
+    return "normal"
+
+
+def set_tool_priority(name: str, priority: str):
+    if priority not in PRIORITIES:
+        raise ValueError(f"无效的优先级: {priority}（可选: {', '.join(PRIORITIES)}）")
+    _tool_priorities[name] = priority
+
+
+def _lane(priority: str) -> str:
+    return "background" if priority == "background" else "foreground"
+
+
+class CallCancelled(Exception):
+    def __init__(self):
+        super().__init__("调用已取消")
+
+
+class ScheduledCall:
+    """一次排队或执行中的工具调用"""
+
+    def __init__(self, name: str, device: str, priority: str, fn: Optional[Callable], args: tuple, kwargs: dict,
+                 deadline: float, cancel_event: Optional[threading.Event] = None):
+        self.name = name
+        self.device = device
+        self.priority = priority
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.enqueued = time.monotonic()
+        self.deadline = self.enqueued + deadline
+        self.started: Optional[float] = None
+        self.future: Future = Future()
+        self.cancel_event = cancel_event or threading.Event()
+        self.context = contextvars.copy_context()
+
+    @property
+    def lane(self) -> str:
+        return _lane(self.priority)
+
+    def effective_priority(self, now: float) -> str:
+        if self.priority == "normal" and now - self.enqueued > AGING_SECONDS:
+            return "interactive"
+        return self.priority
+
+    def describe(self, now: float) -> str:
+        if self.started is None:
+            return f"{self.name} [{self.priority}] 排队 {now - self.enqueued:.1f}秒"
+        state = "取消中" if self.cancel_event.is_set() else "执行"
+        return f"{self.name} [{self.priority}] {state} {now - self.started:.1f}秒（排队 {self.started - self.enqueued:.1f}秒）"
+
+
+class _DeviceQueue:
+    def __init__(self):
+        self.queues: Dict[str, Deque[ScheduledCall]] = {priority: deque() for priority in PRIORITIES}
+        self.running: List[ScheduledCall] = []
+
+    def running_in(self, lane: str) -> int:
+        # 已取消的调用不再占用执行位置，工作线程稍后返回时才从 running 中移除
+        return sum(1 for call in self.running if call.lane == lane and not call.cancel_event.is_set())
+
+
+_active_call: contextvars.ContextVar[Optional[ScheduledCall]] = contextvars.ContextVar("adb_mcp_active_call",
+                                                                                      default=None)
+_thread_state = threading.local()
+
+
+class Scheduler:
+    """按设备排队的工具调用调度器
+
+    每台设备的调用按优先级（interactive > normal > background）出队，前台和后台分别限制并发数；
+    工作线程不足时按优先级、再按各设备最近一次被调度的先后轮流分配，保证设备之间的公平。
+    """
+
+    def __init__(self, max_workers: int = MAX_WORKERS):
+        self.max_workers = max_workers
+        self._devices: Dict[str, _DeviceQueue] = {}
+        # 设备按最近一次被调度的时间排序，越久未被调度越靠前
+        self._order: Deque[str] = deque()
+        self._running = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="adb-mcp-call")
+
+    def submit(self, call: ScheduledCall) -> Future:
+        with self._lock:
+            queue = self._devices.get(call.device)
+            if queue is None:
+                queue = self._devices[call.device] = _DeviceQueue()
+                self._order.append(call.device)
+            queue.queues[call.priority].append(call)
+            self._update_depth(call.device, call.priority)
+            self._dispatch()
+        return call.future
+
+    def cancel(self, call: ScheduledCall, event: str = "cancelled"):
+        """取消调用: 排队中的调用直接移除，执行中的调用通知其在下一个取消检查点停止并立即让出执行位置，等待方立即返回"""
+        if call.cancel_event.is_set() and call.future.done():
+            return
+        call.cancel_event.set()
+        metrics.record_scheduler_event(call.priority, event)
+        with self._lock:
+            queue = self._devices.get(call.device)
+            if queue is not None and call in queue.queues[call.priority]:
+                queue.queues[call.priority].remove(call)
+                self._update_depth(call.device, call.priority)
+                self._forget_if_idle(call.device)
+            elif queue is not None and call in queue.running:
+                self._dispatch()
+        _settle(call.future, exception=CallCancelled())
+
+    def cancel_matching(self, device: Optional[str] = None, priority: Optional[str] = None,
+                        tool: Optional[str] = None) -> List[ScheduledCall]:
+        with self._lock:
+            calls = [call for key, queue in self._devices.items() if device is None or key == device
+                     for call in list(queue.running) + [c for q in queue.queues.values() for c in q]
+                     if (priority is None or call.priority == priority) and (tool is None or call.name == tool)]
+        for call in calls:
+            self.cancel(call)
+        return calls
+
+    # 调度
+    def _capacity(self, device: str, lane: str) -> int:
+        return self.max_workers if device == HOST_KEY else LANE_CONCURRENCY[lane]
+
+    def _forget_if_idle(self, device: str):
+        # 空闲设备不再参与轮转
+        queue = self._devices[device]
+        if not queue.running and not any(queue.queues.values()):
+            del self._devices[device]
+            self._order.remove(device)
+
+    def _update_depth(self, device: str, priority: str):
+        metrics.set_queue_depth(device, priority, len(self._devices[device].queues[priority]))
+
+    def _next_call(self, now: float) -> Optional[ScheduledCall]:
+        for rank in PRIORITIES:
+            for device in self._order:
+                queue = self._devices[device]
+                for priority in PRIORITIES:
+                    pending = queue.queues[priority]
+                    while pending and pending[0].future.done():
+                        pending.popleft()
+                        self._update_depth(device, priority)
+                    if not pending or pending[0].effective_priority(now) != rank:
+                        continue
+                    call = pending[0]
+                    if queue.running_in(call.lane) >= self._capacity(device, call.lane):
+                        continue
+                    pending.popleft()
+                    self._update_depth(device, priority)
+                    if rank != call.priority:
+                        metrics.record_scheduler_event(call.priority, "promoted")
+                    # 刚被调度的设备排到最后
+                    self._order.remove(device)
+                    self._order.append(device)
+                    return call
+        return None
+
+    def _dispatch(self):
+        now = time.monotonic()
+        while self._running < self.max_workers:
+            call = self._next_call(now)
+            if call is None:
+                break
+            self._devices[call.device].running.append(call)
+            call.started = now
+            if call.fn is None:
+                # 后台任务在自己的线程中执行，只占用设备的执行位置，由 release 归还
+                _settle(call.future, result=None)
+                continue
+            self._running += 1
+            self._executor.submit(self._execute, call)
+
+    def _execute(self, call: ScheduledCall):
+        try:
+            if not call.future.done():
+                metrics.record_queue_wait(call.priority, call.started - call.enqueued)
+                try:
+                    _settle(call.future, result=call.context.run(_run_call, call))
+                except BaseException as e:
+                    _settle(call.future, exception=e)
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._devices[call.device].running.remove(call)
+                self._forget_if_idle(call.device)
+                self._dispatch()
+
+    def release(self, call: ScheduledCall):
+        """归还后台任务占用的执行位置"""
+        with self._lock:
+            queue = self._devices.get(call.device)
+            if queue is not None and call in queue.running:
+                queue.running.remove(call)
+                self._forget_if_idle(call.device)
+                self._dispatch()
+
+    def status(self, device: Optional[str] = None) -> Dict[str, List[ScheduledCall]]:
+        """返回 {设备: [执行中的调用..., 排队的调用...]}"""
+        with self._lock:
+            return {key: list(queue.running) + [call for priority in PRIORITIES for call in queue.queues[priority]]
+                    for key, queue in self._devices.items() if device is None or key == device}
+
+
+def _settle(future: Future, result: Any = None, exception: Optional[BaseException] = None):
+    # 已取消的调用，等待方已经收到结果，工作线程稍后的结果丢弃
+    if future.done():
+        return
+    try:
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+    except InvalidStateError:
+        pass
+
+
+def _run_call(call: ScheduledCall):
+    # 每个工作线程持有一个事件循环，工具协程在其中执行；工具内部阻塞的ADB调用只占用这个线程
+    loop = getattr(_thread_state, "loop", None)
+    if loop is None:
+        loop = _thread_state.loop = asyncio.new_event_loop()
+    _active_call.set(call)
+    with metrics.profiled():
+        return loop.run_until_complete(call.fn(*call.args, **call.kwargs))
+
+
+scheduler = Scheduler()
+
+
+# 供工具在长时间等待中检查取消
+def cancelled() -> bool:
+    call = _active_call.get()
+    return call is not None and call.cancel_event.is_set()
+
+
+def sleep(seconds: float):
+    """可被取消的等待；所在调用被取消或超过截止时间时抛出 CallCancelled"""
+    call = _active_call.get()
+    if call is None:
+        time.sleep(seconds)
+        return
+    if call.cancel_event.wait(seconds):
+        raise CallCancelled()
+
+
+_device_keys: Dict[Optional[str], Tuple[str, float]] = {}
+
+
+def cached_device_key(device_id: Optional[str] = None) -> Optional[str]:
+    """缓存中未过期的设备键，没有时返回 None"""
+    entry = _device_keys.get(device_id)
+    if entry is not None and time.monotonic() - entry[1] < DEVICE_KEY_TTL:
+        return entry[0]
+    return None
+
+
+def device_key(device_id: Optional[str] = None) -> str:
+    """队列和设备锁定使用的设备键: 规范化的设备ID，不带前缀的序列号和默认设备都映射到同一个键"""
+    from .adb_server import get_adb_endpoints
+    from .endpoints import resolve_device
+    key = cached_device_key(device_id)
+    if key is not None:
+        return key
+    try:
+        key = resolve_device(get_adb_endpoints(), device_id).device_id
+    except Exception:
+        return device_id or "default"
+    _device_keys[device_id] = (key, time.monotonic())
+    return key
+
+
+class Lease:
+    """客户端会话对一台设备的独占锁定；其他会话对该设备的调用等待锁定释放或过期"""
+
+    def __init__(self, device: str, owner: str, seconds: float):
+        self.device = device
+        self.owner = owner
+        self.seconds = seconds
+        self.acquired = time.monotonic()
+        self.expires = self.acquired + seconds
+
+    def renew(self):
+        self.expires = time.monotonic() + self.seconds
+
+    def remaining(self, now: Optional[float] = None) -> float:
+        return self.expires - (now if now is not None else time.monotonic())
+
+    def describe(self, now: float) -> str:
+        return f"{self.device}: 会话 {self.owner} 锁定 {now - self.acquired:.0f}秒，剩余 {max(self.remaining(now), 0):.0f}秒"
+
+
+_leases: Dict[str, Lease] = {}
+_lease_lock = threading.Lock()
+
+
+def session_key() -> str:
+    """当前请求所属的客户端会话；会话第一次调用时分配随机ID并保存在会话对象上，stdio 模式下只有一个会话"""
+    try:
+        from mcp.server.lowlevel.server import request_ctx
+        session = request_ctx.get().session
+    except (ImportError, LookupError):
+        return "local"
+    with _lease_lock:
+        key = getattr(session, "_adb_mcp_session_key", None)
+        if key is None:
+            key = uuid.uuid4().hex[:12]
+            session._adb_mcp_session_key = key
+    return key
+
+
+def active_lease(device: str) -> Optional[Lease]:
+    with _lease_lock:
+        lease = _leases.get(device)
+        if lease is not None and lease.remaining() <= 0:
+            del _leases[device]
+            lease = None
+        return lease
+
+
+def acquire_lease(device: str, owner: str, seconds: float = LEASE_SECONDS) -> Lease:
+    """锁定设备；已被其他会话锁定时抛出 RuntimeError，已由自己锁定时续期"""
+    if seconds <= 0:
+        raise ValueError("锁定时长必须大于0")
+    with _lease_lock:
+        lease = _leases.get(device)
+        if lease is not None and lease.owner != owner and lease.remaining() > 0:
+            raise RuntimeError(f"设备已被其他会话锁定: {lease.describe(time.monotonic())}")
+        if lease is not None and lease.owner == owner:
+            lease.seconds = seconds
+            lease.renew()
+        else:
+            lease = _leases[device] = Lease(device, owner, seconds)
+        return lease
+
+
+def release_lease(device: str, owner: str, force: bool = False) -> Optional[Lease]:
+    """释放锁定，返回被释放的锁定；不是自己的锁定且未指定 force 时抛出 RuntimeError"""
+    with _lease_lock:
+        lease = _leases.get(device)
+        if lease is None:
+            return None
+        if lease.owner != owner and not force and lease.remaining() > 0:
+            raise RuntimeError(f"设备由其他会话锁定: {lease.describe(time.monotonic())}（强制释放请指定 force=True）")
+        del _leases[device]
+        return lease
+
+
+def leases() -> List[Lease]:
+    now = time.monotonic()
+    with _lease_lock:
+        return [lease for lease in _leases.values() if lease.remaining(now) > 0]
+
+
+async def _wait_for_lease(device: str, owner: str, deadline: float) -> Optional[Lease]:
+    """等待其他会话对设备的锁定释放；返回 None 表示可以执行，否则返回截止时间前仍未释放的锁定"""
+    while True:
+        lease = active_lease(device)
+        if lease is None:
+            return None
+        if lease.owner == owner:
+            lease.renew()
+            return None
+        if time.monotonic() + LEASE_POLL_SECONDS > deadline:
+            return lease
+        await asyncio.sleep(LEASE_POLL_SECONDS)
+
+
+def wrap_tool(fn: Callable, name: str) -> Callable:
+    """把工具调用放入所在设备的队列，在工作线程中按优先级执行，超过截止时间或被客户端取消时取消调用"""
+    if name in INLINE_TOOLS:
+        @functools.wraps(fn)
+        async def inline(*args, **kwargs):
+            with metrics.profiled():
+                return await fn(*args, **kwargs)
+
+        return inline
+    parameters = inspect.signature(fn).parameters
+    has_device = "device_id" in parameters
+    device_index = list(parameters).index("device_id") if has_device else -1
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        if _active_call.get() is not None:
+            # 工具内部调用其他工具时已在工作线程中，直接执行，避免占用同一设备的第二个执行位置而死锁
+            with metrics.profiled():
+                return await fn(*args, **kwargs)
+        if has_device:
+            device_id = kwargs.get("device_id") or (args[device_index] if len(args) > device_index else None)
+            device = cached_device_key(device_id) or await asyncio.get_running_loop().run_in_executor(
+                None, device_key, device_id)
+        else:
+            device = HOST_KEY
+        priority = priority_of(name)
+        deadline = DEADLINES[priority]
+        remaining = deadline
+        if device != HOST_KEY and _leases:
+            # 设备被其他客户端会话锁定时，等待锁定释放（计入截止时间）再排队
+            started = time.monotonic()
+            lease = await _wait_for_lease(device, session_key(), started + deadline)
+            if lease is not None:
+                return f"调用失败: 设备 {device} 被其他会话锁定（{lease.describe(time.monotonic())}）"
+            remaining = deadline - (time.monotonic() - started)
+        call = ScheduledCall(name, device, priority, fn, args, kwargs, remaining)
+        future = asyncio.wrap_future(scheduler.submit(call))
+        # 超时或取消后不再等待结果，避免 "exception was never retrieved" 警告
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout=max(call.deadline - time.monotonic(), 0))
+        except asyncio.TimeoutError:
+            scheduler.cancel(call, "deadline")
+            return f"调用失败: {name} 超过 {deadline:g} 秒截止时间，已取消"
+        except asyncio.CancelledError:
+            scheduler.cancel(call)
+            raise
+        except CallCancelled:
+            return f"调用失败: {name} 已取消"
+
+    return wrapper
+
+
+def run_in_lane(name: str, device: str, fn: Callable[[], Any], cancel_event: threading.Event,
+                owner: Optional[str] = None) -> Any:
+    """在后台任务线程中执行 fn: 等待其他会话对设备的锁定释放，再占用设备的后台执行位置
+
+    cancel_event 与调度器共用: cancel_tool_calls 取消时任务收到取消，任务取消时排队中的位置被移除。
+    """
+    priority = "background"
+    started = time.monotonic()
+    deadline = started + DEADLINES[priority]
+    while True:
+        lease = active_lease(device)
+        if lease is None or owner is None or lease.owner == owner:
+            break
+        if time.monotonic() + LEASE_POLL_SECONDS > deadline:
+            raise RuntimeError(f"设备 {device} 被其他会话锁定（{lease.describe(time.monotonic())}）")
+        if cancel_event.wait(LEASE_POLL_SECONDS):
+            raise CallCancelled()
+    call = ScheduledCall(name, device, priority, None, (), {}, deadline - time.monotonic(), cancel_event)
+    scheduler.submit(call)
+    try:
+        while True:
+            try:
+                call.future.result(timeout=max(min(LEASE_POLL_SECONDS, call.deadline - time.monotonic()), 0))
+                break
+            except FutureTimeoutError:
+                if cancel_event.is_set():
+                    scheduler.cancel(call)
+                elif time.monotonic() >= call.deadline:
+                    scheduler.cancel(call, "deadline")
+                    raise RuntimeError(f"{name} 排队超过 {DEADLINES[priority]:g} 秒截止时间，已取消")
+        return fn()
+    finally:
+        scheduler.release(call)
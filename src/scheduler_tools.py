@@ -0,0 +1,127 @@
+from typing import Optional
+import asyncio
+import time
+from . import scheduler
+from .adb_server import mcp
+
+
+@mcp.tool()
+async def get_scheduler_status(device_id: Optional[str] = None) -> str:
+    """查看调度器状态：每台设备正在执行和排队的工具调用、优先级和等待时间
+
+    参数:
+        device_id: 设备ID（可选，默认显示所有设备）
+    """
+    if device_id:
+        device_id = await _device_key(device_id)
+    now = time.monotonic()
+    status = scheduler.scheduler.status(device_id)
+    lines = [f"设备并发: 前台 {scheduler.LANE_CONCURRENCY['foreground']}，后台 {scheduler.LANE_CONCURRENCY['background']}；"
+             f"截止时间: " + "，".join(f"{p} {int(s)}秒" for p, s in scheduler.DEADLINES.items())]
+    if not status:
+        lines.append("没有正在执行或排队的调用")
+    for device, calls in sorted(status.items()):
+        lines.append(f"\n{device}:")
+        lines.extend(f"  {call.describe(now)}" for call in calls)
+    leases = [lease for lease in scheduler.leases() if device_id is None or lease.device == device_id]
+    if leases:
+        lines.append(f"\n设备锁定（当前会话 {scheduler.session_key()}）:")
+        lines.extend(f"  {lease.describe(now)}" for lease in leases)
+    return "\n".join(lines)
+
+
+async def _device_key(device_id: Optional[str]) -> str:
+    return scheduler.cached_device_key(device_id) or await asyncio.get_running_loop().run_in_executor(
+        None, scheduler.device_key, device_id)
+
+
+@mcp.tool()
+async def lock_device(seconds: float = scheduler.LEASE_SECONDS, device_id: Optional[str] = None) -> str:
+    """锁定设备供当前客户端会话独占使用（多个客户端通过HTTP共享服务器时）
+
+    锁定期间其他会话对该设备的调用排队等待，直到锁定释放或过期；当前会话每次调用该设备时锁定自动续期。
+    已由当前会话锁定时只更新时长。
+
+    参数:
+        seconds: 锁定时长（秒），超过该时间没有调用该设备时锁定自动失效
+        device_id: 设备ID（可选）
+    """
+    try:
+        device = await _device_key(device_id)
+        lease = scheduler.acquire_lease(device, scheduler.session_key(), seconds)
+        return f"已锁定设备 {device}（会话 {lease.owner}，{lease.seconds:g}秒无调用后自动释放）"
+    except Exception as e:
+        return f"锁定设备失败: {str(e)}"
+
+
+@mcp.tool()
+async def unlock_device(force: bool = False, device_id: Optional[str] = None) -> str:
+    """释放当前会话对设备的锁定
+
+    参数:
+        force: 强制释放其他会话的锁定（例如该客户端已断开）
+        device_id: 设备ID（可选）
+    """
+    try:
+        device = await _device_key(device_id)
+        lease = scheduler.release_lease(device, scheduler.session_key(), force)
+        if lease is None:
+            return f"设备 {device} 没有被锁定"
+        return f"已释放设备 {device} 的锁定（会话 {lease.owner}）"
+    except Exception as e:
+        return f"释放设备锁定失败: {str(e)}"
+
+
+@mcp.tool()
+async def cancel_tool_calls(device_id: Optional[str] = None, priority: Optional[str] = None,
+                            tool: Optional[str] = None) -> str:
+    """取消正在执行或排队的工具调用
+
+    排队中的调用直接移除；执行中的调用立即向调用方返回"已取消"，长时间操作（录屏、日志收集、Bug报告等）
+    会在下一个检查点停止。
+
+    参数:
+        device_id: 只取消该设备上的调用（可选）
+        priority: 只取消该优先级的调用: interactive、normal 或 background（可选）
+        tool: 只取消该工具的调用（可选）
+    """
+    if priority and priority not in scheduler.PRIORITIES:
+        return f"无效的优先级: {priority}（可选: {', '.join(scheduler.PRIORITIES)}）"
+    if device_id:
+        device_id = await _device_key(device_id)
+    cancelled = scheduler.scheduler.cancel_matching(device_id, priority, tool)
+    if not cancelled:
+        return "没有匹配的调用"
+    return f"已取消 {len(cancelled)} 个调用:\n" + "\n".join(f"  {call.device}: {call.name} [{call.priority}]"
+                                                        for call in cancelled)
+
+
+@mcp.tool()
+async def configure_scheduler(tool_priorities: Optional[str] = None, deadlines: Optional[str] = None,
+                              foreground_concurrency: Optional[int] = None,
+                              background_concurrency: Optional[int] = None) -> str:
+    """调整调度器配置
+
+    参数:
+        tool_priorities: 工具优先级，例如 "install_apk=background,run_ui_test=interactive"
+        deadlines: 各优先级的截止时间（秒），例如 "interactive=60,background=1800"
+        foreground_concurrency: 每台设备同时执行的前台（交互和普通）调用数
+        background_concurrency: 每台设备同时执行的后台调用数
+    """
+    try:
+        for item in filter(None, (tool_priorities or "").split(",")):
+            name, _, priority = item.partition("=")
+            scheduler.set_tool_priority(name.strip(), priority.strip())
+        for item in filter(None, (deadlines or "").split(",")):
+            priority, _, seconds = item.partition("=")
+            if priority.strip() not in scheduler.DEADLINES:
+                raise ValueError(f"无效的优先级: {priority}")
+            scheduler.DEADLINES[priority.strip()] = float(seconds)
+        for lane, value in (("foreground", foreground_concurrency), ("background", background_concurrency)):
+            if value is not None:
+                if value < 1:
+                    raise ValueError("并发数至少为1")
+                scheduler.LANE_CONCURRENCY[lane] = value
+        return await get_scheduler_status()
+    except Exception as e:
+        return f"配置调度器失败: {str(e)}"
@@ -0,0 +1,308 @@
+from typing import Callable, Dict, List, Optional
+from collections import deque
+import functools
+import hashlib
+import inspect
+import os
+import re
+import shlex
+import threading
+import time
+import xml.etree.ElementTree as ET
+from . import metrics, text_input
+from .query_cache import is_read_only
+
+# 两个截图感知哈希的汉明距离不超过该值（共256位）且Activity相同时视为同一界面，不再重新dump界面
+PHASH_THRESHOLD = int(os.environ.get("ADB_MCP_STATE_PHASH_THRESHOLD", "12"))
+
+# 每个界面保留的感知哈希数（同一界面的内容变化、动画中的截图）
+MAX_PHASHES = 4
+
+# 两次观察之间最多累计的操作数，超过后不再记录这段路径
+MAX_PENDING_ACTIONS = 20
+
+# 每台设备最多记录的界面数，超过后丢弃最久未出现的界面
+MAX_STATES = int(os.environ.get("ADB_MCP_MAX_SCREEN_STATES", "500"))
+
+# 界面图自己的工具：它们自行维护当前界面，不作为操作记录
+GRAPH_TOOLS = {"get_screen_state", "list_screen_states", "navigate_to", "clear_screen_states"}
+
+_DIGITS = re.compile(r"\d+")
+_COMPONENT = re.compile(r"([\w.]+/[\w.$]+)")
+
+
+def _text_lines(text: str) -> str:
+    # 脚本按行解析，多行文本拆成逐行的 text 步骤，行之间按回车键（与 input text 输入换行的方式一致）
+    steps = []
+    for index, line in enumerate(text.split("\n")):
+        if index:
+            steps.append(f"press {text_input.KEYCODE_ENTER}")
+        if line:
+            steps.append(f"text {shlex.quote(line)}")
+    return "\n".join(steps)
+
+
+def _swipe_line(start_x, start_y, end_x, end_y, duration) -> str:
+    return f"swipe {start_x} {start_y} {end_x} {end_y} {duration}"
+
+
+# 可以重放的输入工具 -> 对应的UI脚本（见 ui_script）
+ACTION_SCRIPTS: Dict[str, Callable[..., str]] = {
+    "tap_screen": lambda x, y, **_: f"tap {x} {y}",
+    "swipe_up": lambda start_x, start_y, end_y, duration=300, **_: _swipe_line(start_x, start_y, start_x, end_y, duration),
+    "swipe_down": lambda start_x, start_y, end_y, duration=300, **_: _swipe_line(start_x, start_y, start_x, end_y, duration),
+    "swipe_left": lambda start_x, start_y, end_x, duration=300, **_: _swipe_line(start_x, start_y, end_x, start_y, duration),
+    "swipe_right": lambda start_x, start_y, end_x, duration=300, **_: _swipe_line(start_x, start_y, end_x, start_y, duration),
+    "input_text": lambda text, **_: _text_lines(text),
+    "press_key": lambda keycode, **_: f"press {keycode}",
+    "press_back": lambda **_: "back",
+    "press_home": lambda **_: "home",
+    "press_app_switch": lambda **_: "press 187",
+    "run_ui_test": lambda test_steps, **_: test_steps.strip(),
+}
+
+
+def parse_activity(output: str) -> str:
+    """从 dumpsys window 的 mCurrentFocus/mFocusedApp 输出中取出前台组件（包名/Activity）"""
+    for line in output.splitlines():
+        match = _COMPONENT.search(line)
+        if match:
+            return match.group(1)
+    return "unknown"
+
+
+def structure_hash(xml: str) -> str:
+    """界面层次结构的结构哈希
+
+    只使用控件类名、资源ID和列表之外的静态文本（数字归一化，输入框内容忽略）；可滚动容器中的子项按结构去重，
+    列表滚动位置、条目数量、时钟和计数变化不会产生新的界面。
+    """
+    root = ET.fromstring(xml.encode("utf-8"))
+
+    def walk(element, in_list: bool) -> str:
+        class_name = element.get("class", "")
+        text = ""
+        if not in_list and "EditText" not in class_name:
+            text = _DIGITS.sub("#", element.get("text", "") or element.get("content-desc", ""))[:40]
+        scrollable = element.get("scrollable") == "true"
+        children: List[str] = []
+        for child in element:
+            if child.tag != "node":
+                continue
+            signature = walk(child, in_list or scrollable)
+            if children and children[-1] == signature:
+                continue
+            children.append(signature)
+        if scrollable:
+            children = sorted(set(children))
+        key = f"{class_name}|{element.get('resource-id', '')}|{text}|{','.join(children)}"
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+    return walk(root, False)
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class ScreenState:
+    """一个已识别的界面: 指纹、缓存的界面快照和元素索引"""
+
+    def __init__(self, state_id: str, activity: str, ui_hash: str, snapshot):
+        self.id = state_id
+        self.activity = activity
+        self.ui_hash = ui_hash
+        self.phashes: List[int] = []
+        self.visits = 0
+        self.first_seen = self.last_seen = time.time()
+        self.snapshot = None
+        self.index: Dict[str, list] = {}
+        self.update_snapshot(snapshot)
+
+    def update_snapshot(self, snapshot):
+        """缓存界面快照，并按文本、描述和资源ID建立元素索引"""
+        self.snapshot = snapshot
+        self.index = {}
+        for node in snapshot.nodes:
+            for key in {node.text, node.content_desc, node.resource_id} - {""}:
+                self.index.setdefault(key, []).append(node)
+
+    def add_phash(self, phash: Optional[int]):
+        if phash is None or any(hamming(phash, known) == 0 for known in self.phashes):
+            return
+        self.phashes.append(phash)
+        del self.phashes[:-MAX_PHASHES]
+
+    def phash_distance(self, phash: int) -> int:
+        return min((hamming(phash, known) for known in self.phashes), default=256)
+
+    def elements(self) -> list:
+        """可交互或带文本的元素"""
+        return [node for node in self.snapshot.nodes if node.clickable or node.text or node.content_desc]
+
+    @property
+    def label(self) -> str:
+        texts = [node.text for node in self.snapshot.nodes if node.text][:3]
+        name = self.activity.rsplit("/", 1)[-1].rsplit(".", 1)[-1]
+        return f"{name} " + " / ".join(text[:20] for text in texts) if texts else name
+
+
+class Edge:
+    """两个界面之间一段已验证过的操作（UI脚本）"""
+
+    def __init__(self, script: List[str]):
+        self.script = script
+        self.count = 1
+        self.last_used = time.time()
+
+
+class DeviceGraph:
+    """一台设备上见过的界面和连接它们的操作
+
+    工具调用中的输入操作先暂存；下一次识别出界面时，把暂存的操作记为从上一个界面到当前界面的边。
+    """
+
+    def __init__(self):
+        self.states: Dict[str, ScreenState] = {}
+        self.edges: Dict[str, Dict[str, Edge]] = {}
+        self.current: Optional[str] = None
+        self.pending: List[str] = []
+        self.lock = threading.Lock()
+
+    # 匹配
+    def match_phash(self, activity: str, phash: int) -> Optional[ScreenState]:
+        best, best_distance = None, PHASH_THRESHOLD + 1
+        with self.lock:
+            for state in self.states.values():
+                if state.activity != activity:
+                    continue
+                distance = state.phash_distance(phash)
+                if distance < best_distance:
+                    best, best_distance = state, distance
+        return best
+
+    def add(self, activity: str, ui_hash: str, phash: Optional[int], snapshot) -> ScreenState:
+        """按 Activity 和结构哈希找到或新建界面，更新缓存的快照"""
+        state_id = hashlib.sha1(f"{activity}|{ui_hash}".encode("utf-8")).hexdigest()[:8]
+        with self.lock:
+            state = self.states.get(state_id)
+            if state is None:
+                state = self.states[state_id] = ScreenState(state_id, activity, ui_hash, snapshot)
+                self._evict()
+            else:
+                state.update_snapshot(snapshot)
+            state.add_phash(phash)
+        return state
+
+    def _evict(self):
+        while len(self.states) > MAX_STATES:
+            oldest = min(self.states.values(), key=lambda state: state.last_seen)
+            del self.states[oldest.id]
+            self.edges.pop(oldest.id, None)
+            for targets in self.edges.values():
+                targets.pop(oldest.id, None)
+
+    # 记录
+    def observe(self, state: ScreenState):
+        """当前界面已识别: 把上一个界面之后的操作记为一条边"""
+        with self.lock:
+            state.visits += 1
+            state.last_seen = time.time()
+            if self.current == state.id:
+                # 界面没有变化（例如输入文本），操作留到界面变化时一起记录
+                return
+            if self.current in self.states and self.pending:
+                edge = self.edges.setdefault(self.current, {}).get(state.id)
+                if edge is None:
+                    self.edges[self.current][state.id] = Edge(list(self.pending))
+                else:
+                    edge.script = list(self.pending)
+                    edge.count += 1
+                    edge.last_used = time.time()
+            self.current = state.id
+            self.pending = []
+
+    def record(self, script: Optional[str]):
+        """记录一次输入操作；None 表示无法重放的操作，之后到下一个界面的路径未知"""
+        with self.lock:
+            if script is None or self.current is None or len(self.pending) >= MAX_PENDING_ACTIONS:
+                self.current = None
+                self.pending = []
+            else:
+                self.pending.append(script)
+
+    def discard_pending(self):
+        with self.lock:
+            self.pending = []
+
+    # 查询
+    def shortest_path(self, source: str, target: str) -> Optional[List[str]]:
+        """按边数最少的已知路径返回经过的界面ID（含起点和终点）"""
+        with self.lock:
+            previous = {source: None}
+            queue = deque([source])
+            while queue:
+                node = queue.popleft()
+                if node == target:
+                    path = []
+                    while node is not None:
+                        path.append(node)
+                        node = previous[node]
+                    return path[::-1]
+                for neighbor in self.edges.get(node, {}):
+                    if neighbor not in previous:
+                        previous[neighbor] = node
+                        queue.append(neighbor)
+        return None
+
+    def edge(self, source: str, target: str) -> Optional[Edge]:
+        return self.edges.get(source, {}).get(target)
+
+    def forget_edge(self, source: str, target: str):
+        with self.lock:
+            self.edges.get(source, {}).pop(target, None)
+
+
+_graphs: Dict[str, DeviceGraph] = {}
+_graphs_lock = threading.Lock()
+
+
+def graph(device: str) -> DeviceGraph:
+    with _graphs_lock:
+        if device not in _graphs:
+            _graphs[device] = DeviceGraph()
+        return _graphs[device]
+
+
+def clear(device: Optional[str] = None):
+    with _graphs_lock:
+        if device is None:
+            _graphs.clear()
+        else:
+            _graphs.pop(device, None)
+
+
+def wrap_tool(fn: Callable, name: str) -> Callable:
+    """记录工具调用中的输入操作: 可重放的输入记为UI脚本，其他可能改变界面的调用中断当前路径"""
+    if name in GRAPH_TOOLS or (name not in ACTION_SCRIPTS and is_read_only(name)):
+        return fn
+    signature = inspect.signature(fn)
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        result = await fn(*args, **kwargs)
+        call = metrics.current_call()
+        if call is None or not call.adb_calls or call.device == "default" or call.device not in _graphs:
+            return result
+        if metrics.is_error_result(result) or (isinstance(result, str) and "状态: 失败" in result):
+            # 操作失败时无法确定界面停在哪里
+            script = None
+        elif name in ACTION_SCRIPTS:
+            bound = signature.bind_partial(*args, **kwargs)
+            script = ACTION_SCRIPTS[name](**{k: v for k, v in bound.arguments.items() if k != "device_id"})
+        else:
+            script = None
+        _graphs[call.device].record(script)
+        return result
+
+    return wrapper
@@ -0,0 +1,181 @@
+from typing import List, Optional, Tuple
+import base64
+import os
+import shlex
+from .ui_hierarchy import UiSnapshot
+
+# ADBKeyBoard 输入法（com.android.adbkeyboard）处于启用状态时，通过 ADB_INPUT_B64 广播直接提交任意Unicode文本
+ADB_KEYBOARD_IME = "com.android.adbkeyboard/.AdbIME"
+
+# Clipper（ca.zgrs.clipper）通过 clipper.set 广播设置剪贴板，之后发送粘贴键
+CLIPPER_PACKAGE = "ca.zgrs.clipper"
+
+KEYCODE_ENTER = 66
+KEYCODE_PASTE = 279
+
+# 单次shell调用的命令最大字节数（Android 7起ADB协议的单个消息上限至少256KB；Android 6及更早的设备设为4000）
+MAX_COMMAND_BYTES = int(os.environ.get("ADB_MCP_MAX_COMMAND_BYTES", "32768"))
+
+# 不超过这个长度的ASCII文本在没有ADBKeyBoard时直接用 input text（不需要检查Clipper是否安装）
+SHORT_TEXT = 64
+
+# input text 每条命令的最大字符数（逐字符注入按键，过长的命令在部分设备上会超时）
+INPUT_TEXT_CHUNK = 1000
+
+METHODS = ("auto", "adbkeyboard", "clipboard", "input")
+METHOD_NAMES = {"adbkeyboard": "ADBKeyBoard广播", "clipboard": "剪贴板粘贴", "input": "input text"}
+
+# 设备端脚本输出的标记: 实际使用的输入方式
+METHOD_MARKER = "__ADB_MCP_TEXT__="
+
+_UNSUPPORTED = ("Error: 无法输入非ASCII文本: 请安装并启用 ADBKeyBoard 输入法（com.android.adbkeyboard），"
+                "或安装 Clipper（ca.zgrs.clipper）")
+
+
+def is_plain_ascii(text: str) -> bool:
+    """input text 只能输入可打印ASCII字符（换行单独发送回车键）"""
+    return all(32 <= ord(c) < 127 or c == "\n" for c in text)
+
+
+def _split(text: str, limit: int, size=len) -> List[str]:
+    """按字符切分文本，使每段的 size(段) 不超过 limit"""
+    chunks, current, current_size = [], [], 0
+    for c in text:
+        c_size = size(c)
+        if current and current_size + c_size > limit:
+            chunks.append("".join(current))
+            current, current_size = [], 0
+        current.append(c)
+        current_size += c_size
+    if current:
+        chunks.append("".join(current))
+    return chunks
+
+
+def _payload_limit() -> int:
+    # 每段文本编码后占用的字节数上限，留出命令本身和 Base64 膨胀的余量
+    return max(MAX_COMMAND_BYTES // 2 - 256, 64)
+
+
+def adbkeyboard_commands(text: str) -> List[str]:
+    return [f"am broadcast -a ADB_INPUT_B64 --es msg {base64.b64encode(chunk.encode('utf-8')).decode('ascii')} "
+            f">/dev/null" for chunk in _split(text, _payload_limit(), lambda c: len(c.encode("utf-8")))]
+
+
+def clipboard_commands(text: str) -> List[str]:
+    return [f"am broadcast -a clipper.set -e text {shlex.quote(chunk)} >/dev/null && input keyevent {KEYCODE_PASTE}"
+            for chunk in _split(text, _payload_limit(), lambda c: len(c.encode("utf-8")))]
+
+
+def input_text_commands(text: str) -> List[str]:
+    commands = []
+    for index, line in enumerate(text.split("\n")):
+        if index:
+            commands.append(f"input keyevent {KEYCODE_ENTER}")
+        for chunk in _split(line, INPUT_TEXT_CHUNK):
+            commands.append(f"input text {shlex.quote(chunk.replace(' ', '%s'))}")
+    return commands
+
+
+def _commands(text: str, method: str) -> List[str]:
+    if method == "adbkeyboard":
+        return adbkeyboard_commands(text)
+    if method == "clipboard":
+        return clipboard_commands(text)
+    if not is_plain_ascii(text):
+        raise RuntimeError(_UNSUPPORTED[len("Error: "):])
+    return input_text_commands(text)
+
+
+def _branch(commands: List[str], method: str) -> str:
+    return " && ".join(commands + [f"echo {METHOD_MARKER}{method}"])
+
+
+def script_command(text: str) -> str:
+    """一条shell命令完成输入法检测和输入: 优先ADBKeyBoard，其次剪贴板（非ASCII或较长文本），最后 input text
+
+    文本不受支持时输出以 "Error:" 开头的说明。
+    """
+    ascii_text = is_plain_ascii(text)
+    lines = [f'if [ "$(settings get secure default_input_method 2>/dev/null)" = {ADB_KEYBOARD_IME} ]; then',
+             _branch(adbkeyboard_commands(text), "adbkeyboard")]
+    if ascii_text and len(text) <= SHORT_TEXT:
+        lines += ["else", _branch(input_text_commands(text), "input")]
+    else:
+        lines += [f"elif pm path {CLIPPER_PACKAGE} >/dev/null 2>&1; then", _branch(clipboard_commands(text), "clipboard"),
+                  "else", _branch(input_text_commands(text), "input") if ascii_text else f"echo {shlex.quote(_UNSUPPORTED)}"]
+    return "\n".join(lines + ["fi"])
+
+
+def _pack(commands: List[str]) -> List[str]:
+    """把命令合并为尽量少的shell调用，每次调用不超过 MAX_COMMAND_BYTES"""
+    calls, current = [], []
+    for command in commands:
+        candidate = " && ".join(current + [command])
+        if current and len(candidate.encode("utf-8")) > MAX_COMMAND_BYTES:
+            calls.append(" && ".join(current))
+            current = [command]
+        else:
+            current.append(command)
+    if current:
+        calls.append(" && ".join(current))
+    return calls
+
+
+def detect_method(device, text: str) -> str:
+    output = device.shell(f"settings get secure default_input_method; pm path {CLIPPER_PACKAGE} 2>/dev/null")
+    lines = output.strip().splitlines()
+    if lines and lines[0].strip() == ADB_KEYBOARD_IME:
+        return "adbkeyboard"
+    clipper = any(line.startswith("package:") for line in lines[1:])
+    if clipper and (not is_plain_ascii(text) or len(text) > SHORT_TEXT):
+        return "clipboard"
+    if is_plain_ascii(text):
+        return "input"
+    raise RuntimeError(_UNSUPPORTED[len("Error: "):])
+
+
+def enter_text(device, text: str, method: str = "auto") -> Tuple[str, int]:
+    """在当前焦点输入框中输入文本，返回 (实际使用的方式, shell调用次数)
+
+    auto 时检测和输入在同一次shell调用中完成；文本太长、一条命令放不下时先检测一次，再分段输入。
+    """
+    if method not in METHODS:
+        raise ValueError(f"无效的输入方式: {method}（可选: {', '.join(METHODS)}）")
+    if not text:
+        return "input", 0
+    calls = 0
+    if method == "auto":
+        script = script_command(text)
+        if len(script.encode("utf-8")) <= MAX_COMMAND_BYTES:
+            output = device.shell(script)
+            return _parse_output(output), 1
+        method = detect_method(device, text)
+        calls += 1
+    for command in _pack(_commands(text, method)):
+        output = device.shell(command)
+        calls += 1
+        if "Exception" in output or "Error" in output:
+            raise RuntimeError(output.strip()[:300])
+    return method, calls
+
+
+def _parse_output(output: str) -> str:
+    for line in output.splitlines():
+        if line.startswith(METHOD_MARKER):
+            return line[len(METHOD_MARKER):].strip()
+    error = next((line for line in output.splitlines() if line.startswith("Error:")), None)
+    raise RuntimeError(error[len("Error: "):] if error else f"输入命令没有完成: {output.strip()[:300]}")
+
+
+def verify_text(device, text: str) -> Optional[str]:
+    """读取当前焦点输入框的内容，确认包含输入的文本；返回 None 表示通过，否则返回说明"""
+    snapshot = UiSnapshot.capture(device)
+    focused = [node for node in snapshot.nodes if node.focused]
+    if not focused:
+        return "未找到焦点输入框"
+    node = focused[-1]
+    if text in node.text:
+        return None
+    preview = node.text if len(node.text) <= 80 else node.text[:80] + "..."
+    return f"输入框内容与输入的文本不一致（密码框无法读取内容）: {preview!r}"
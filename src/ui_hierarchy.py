@@ -0,0 +1,120 @@
+from typing import Dict, List, Optional, Tuple
+import re
+import time
+import xml.etree.ElementTree as ET
+
+# uiautomator在设备上的临时输出路径
+DUMP_PATH = "/sdcard/ui_hierarchy.xml"
+
+_BOUNDS_PATTERN = re.compile(r"\[(-?\d+),(-?\d+)\]\[(-?\d+),(-?\d+)\]")
+
+# 选择器键到节点属性的映射
+SELECTOR_KEYS = ("text", "text_contains", "id", "desc", "desc_contains", "class", "index")
+
+
+class UiNode:
+    """uiautomator层次结构中的一个节点"""
+
+    __slots__ = ("text", "resource_id", "content_desc", "class_name", "package",
+                 "bounds", "clickable", "enabled", "focused", "depth", "order")
+
+    def __init__(self, attrib: Dict[str, str], depth: int, order: int):
+        self.text = attrib.get("text", "")
+        self.resource_id = attrib.get("resource-id", "")
+        self.content_desc = attrib.get("content-desc", "")
+        self.class_name = attrib.get("class", "")
+        self.package = attrib.get("package", "")
+        self.clickable = attrib.get("clickable") == "true"
+        self.enabled = attrib.get("enabled") != "false"
+        self.focused = attrib.get("focused") == "true"
+        self.depth = depth
+        self.order = order
+        match = _BOUNDS_PATTERN.match(attrib.get("bounds", ""))
+        self.bounds = tuple(map(int, match.groups())) if match else (0, 0, 0, 0)
+
+    @property
+    def center(self) -> Tuple[int, int]:
+        x1, y1, x2, y2 = self.bounds
+        return (x1 + x2) // 2, (y1 + y2) // 2
+
+    def describe(self) -> str:
+        label = self.text or self.content_desc or self.resource_id or self.class_name
+        return f"{label} {list(self.bounds)}"
+
+
+def dump_hierarchy_xml(device) -> str:
+    """在一次shell调用中完成dump、读取和清理，返回层次结构XML"""
+    output = device.shell(f"uiautomator dump {DUMP_PATH} >/dev/null && cat {DUMP_PATH}; rm -f {DUMP_PATH}")
+    start = output.find("<?xml")
+    if start == -1:
+        start = output.find("<hierarchy")
+    if start == -1:
+        raise RuntimeError(f"获取UI层次结构失败: {output.strip()[:200]}")
+    end = output.rfind("</hierarchy>")
+    return output[start:end + len("</hierarchy>")] if end != -1 else output[start:]
+
+
+def parse_hierarchy(xml: str) -> List[UiNode]:
+    """按深度优先顺序展开所有节点"""
+    root = ET.fromstring(xml.encode("utf-8"))
+    nodes = []
+
+    def walk(element, depth):
+        for child in element:
+            if child.tag == "node":
+                nodes.append(UiNode(child.attrib, depth, len(nodes)))
+                walk(child, depth + 1)
+
+    walk(root, 0)
+    return nodes
+
+
+def match_node(node: UiNode, selector: Dict[str, str]) -> bool:
+    for key, value in selector.items():
+        if key == "text" and node.text != value:
+            return False
+        if key == "text_contains" and value not in node.text:
+            return False
+        if key == "desc" and node.content_desc != value:
+            return False
+        if key == "desc_contains" and value not in node.content_desc:
+            return False
+        if key == "class" and node.class_name != value and not node.class_name.endswith("." + value):
+            return False
+        if key == "id" and node.resource_id != value and not node.resource_id.endswith(":id/" + value):
+            return False
+    return True
+
+
+def find_nodes(nodes: List[UiNode], selector: Dict[str, str]) -> List[UiNode]:
+    """返回匹配选择器的节点；选择器中的 index=N 用于在多个匹配中取第N个（从0开始）"""
+    criteria = {k: v for k, v in selector.items() if k != "index"}
+    matches = [node for node in nodes if match_node(node, criteria)]
+    if "index" in selector:
+        i = int(selector["index"])
+        return matches[i:i + 1]
+    return matches
+
+
+def describe_selector(selector: Dict[str, str]) -> str:
+    return " ".join(f'{k}="{v}"' for k, v in selector.items())
+
+
+class UiSnapshot:
+    """一次dump得到的界面快照，用于在同一画面内复用节点查询"""
+
+    def __init__(self, xml: str):
+        self.xml = xml
+        self.nodes = parse_hierarchy(xml)
+        self.taken_at = time.time()
+
+    @classmethod
+    def capture(cls, device) -> "UiSnapshot":
+        return cls(dump_hierarchy_xml(device))
+
+    def find(self, selector: Dict[str, str]) -> List[UiNode]:
+        return find_nodes(self.nodes, selector)
+
+    def first(self, selector: Dict[str, str]) -> Optional[UiNode]:
+        found = self.find(selector)
+        return found[0] if found else None
@@ -0,0 +1,292 @@
+from typing import Dict, List, Optional
+from dataclasses import dataclass, field
+import shlex
+import time
+from . import text_input
+from .ui_hierarchy import SELECTOR_KEYS, UiSnapshot, describe_selector
+
+# 一个设备端批次最多合并的步骤数和命令长度，避免超出shell命令行长度限制
+MAX_BATCH_STEPS = 50
+MAX_BATCH_CHARS = 4000
+
+# wait_for / wait_gone 的默认超时和轮询间隔（秒）
+DEFAULT_WAIT_TIMEOUT = 10.0
+WAIT_POLL_INTERVAL = 0.5
+
+# 可以直接合并进设备端批次的原始输入步骤
+RAW_OPS = {"tap", "swipe", "text", "wait", "press", "home", "back"}
+
+
+class ScriptError(Exception):
+    """脚本解析错误"""
+
+
+class StepFailure(Exception):
+    """脚本执行中断（断言失败、元素未找到等）"""
+
+
+@dataclass
+class Step:
+    """脚本编译后的一个中间表示（IR）步骤"""
+    op: str
+    line: int
+    source: str
+    args: tuple = ()
+    selector: Optional[Dict[str, str]] = None
+    options: Dict[str, str] = field(default_factory=dict)
+    body: List["Step"] = field(default_factory=list)
+
+
+def _split_line(line: str) -> List[str]:
+    try:
+        return shlex.split(line)
+    except ValueError:
+        return line.split()
+
+
+def _parse_selector(tokens: List[str], line_no: int):
+    selector, options = {}, {}
+    for token in tokens:
+        key, sep, value = token.partition("=")
+        if not sep:
+            raise ScriptError(f"第{line_no}行: 无法解析的选择器 '{token}'，应为 key=value")
+        if key in SELECTOR_KEYS:
+            selector[key] = value
+        else:
+            options[key] = value
+    if not selector:
+        raise ScriptError(f"第{line_no}行: 缺少选择器（支持 {', '.join(SELECTOR_KEYS)}）")
+    return selector, options
+
+
+def _parse_step(tokens: List[str], line_no: int, source: str) -> Step:
+    cmd = tokens[0].lower()
+    rest = tokens[1:]
+
+    if cmd == "tap" and rest and "=" in rest[0]:
+        selector, options = _parse_selector(rest, line_no)
+        return Step("tap_selector", line_no, source, selector=selector, options=options)
+    if cmd == "tap" and len(rest) >= 2:
+        return Step("tap", line_no, source, args=(int(rest[0]), int(rest[1])))
+    if cmd == "swipe" and len(rest) >= 4:
+        duration = int(rest[4]) if len(rest) >= 5 else 300
+        return Step("swipe", line_no, source, args=tuple(int(v) for v in rest[:4]) + (duration,))
+    if cmd == "text" and rest:
+        return Step("text", line_no, source, args=(" ".join(rest),))
+    if cmd == "wait" and rest:
+        return Step("wait", line_no, source, args=(float(rest[0]),))
+    if cmd == "press" and rest:
+        return Step("press", line_no, source, args=(rest[0],))
+    if cmd in ("home", "back"):
+        return Step(cmd, line_no, source)
+    if cmd in ("wait_for", "wait_gone", "assert_exists") and rest:
+        selector, options = _parse_selector(rest, line_no)
+        return Step(cmd, line_no, source, selector=selector, options=options)
+    return Step("unknown", line_no, source)
+
+
+def compile_script(script: str) -> List[Step]:
+    """将脚本文本一次性解析为步骤列表，repeat N ... end 编译为带循环体的步骤"""
+    root: List[Step] = []
+    stack = [root]
+    for line_no, raw in enumerate(script.strip().split("\n"), start=1):
+        line = raw.strip()
+        if not line or line.startswith("#"):
+            continue
+        tokens = _split_line(line)
+        cmd = tokens[0].lower()
+
+        if cmd == "repeat":
+            if len(tokens) < 2 or not tokens[1].isdigit():
+                raise ScriptError(f"第{line_no}行: repeat 需要一个次数")
+            step = Step("repeat", line_no, line, args=(int(tokens[1]),))
+            stack[-1].append(step)
+            stack.append(step.body)
+        elif cmd == "end":
+            if len(stack) == 1:
+                raise ScriptError(f"第{line_no}行: 多余的 end")
+            stack.pop()
+        else:
+            try:
+                stack[-1].append(_parse_step(tokens, line_no, line))
+            except ValueError as e:
+                raise ScriptError(f"第{line_no}行: 参数错误 {e}")
+    if len(stack) != 1:
+        raise ScriptError("repeat 缺少对应的 end")
+    return root
+
+
+def _text_command(text: str) -> Optional[str]:
+    # 检测输入法和输入在同一条命令中完成，支持中文；一条命令放不下时返回 None，由 enter_text 分段输入
+    command = text_input.script_command(text)
+    return command if len(command.encode("utf-8")) <= text_input.MAX_COMMAND_BYTES else None
+
+
+class ScriptRunner:
+    """执行编译后的步骤
+
+    连续的原始输入步骤会合并成一条设备端命令；相邻的按键合并为一次 input keyevent；
+    选择器步骤复用缓存的界面快照，只有在输入之后快照才会失效。
+    """
+
+    def __init__(self, device, step_delay: float = 0.0):
+        self.device = device
+        self.step_delay = step_delay
+        self.snapshot: Optional[UiSnapshot] = None
+        self.pending: List[Dict] = []
+        self.results: List[str] = []
+        self.shell_calls = 0
+        self.step_count = 0
+        self.batch_count = 0
+
+    # 批处理
+    def _queue(self, label: str, cmd: str, kind: str = "input"):
+        pending_bytes = sum(len(p["cmd"].encode("utf-8")) + 2 for p in self.pending)
+        if pending_bytes + len(cmd.encode("utf-8")) + 64 > text_input.MAX_COMMAND_BYTES:
+            self.flush()
+        last = self.pending[-1] if self.pending else None
+        if kind == "key" and last is not None and last["kind"] == "key" and not self.step_delay:
+            last["cmd"] += " " + cmd
+            last["labels"].append(label)
+        else:
+            if kind == "key":
+                cmd = f"input keyevent {cmd}"
+            if self.step_delay and kind != "sleep":
+                cmd = f"{cmd}; sleep {self.step_delay}"
+            self.pending.append({"labels": [label], "cmd": cmd, "kind": kind})
+        if kind != "sleep":
+            self.snapshot = None
+        if len(self.pending) >= MAX_BATCH_STEPS or sum(len(p["cmd"]) for p in self.pending) >= MAX_BATCH_CHARS:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+        self.batch_count += 1
+        start = time.perf_counter()
+        output = self.device.shell("; ".join(item["cmd"] for item in batch))
+        elapsed = (time.perf_counter() - start) * 1000
+        self.shell_calls += 1
+
+        labels = [label for item in batch for label in item["labels"]]
+        tag = f"批次{self.batch_count}"
+        for label in labels:
+            self.results.append(f"{label}  [{tag}]")
+        self.results.append(f"  -- {tag}: {len(labels)}步, 1次设备调用, {elapsed:.0f}ms")
+        if "Exception" in output or "Error" in output:
+            self.results.append(f"  !! {tag} 输出异常: {output.strip()[:300]}")
+
+    def _enter_long_text(self, step: Step):
+        text = step.args[0]
+        self.flush()
+        self.batch_count += 1
+        start = time.perf_counter()
+        try:
+            method, calls = text_input.enter_text(self.device, text)
+        except RuntimeError as e:
+            raise StepFailure(f"第{step.line}行: 输入文本失败: {e}")
+        elapsed = (time.perf_counter() - start) * 1000
+        self.shell_calls += calls
+        self.snapshot = None
+        if self.step_delay:
+            time.sleep(self.step_delay)
+        tag = f"批次{self.batch_count}"
+        preview = text if len(text) <= 80 else text[:80] + "..."
+        self.results.append(f"输入文本: {preview}  [{tag}]")
+        self.results.append(f"  -- {tag}: 1步（{text_input.METHOD_NAMES.get(method, method)}分段输入）, "
+                            f"{calls}次设备调用, {elapsed:.0f}ms")
+
+    # 快照
+    def _current_snapshot(self) -> UiSnapshot:
+        if self.snapshot is None:
+            self.flush()
+            self.snapshot = UiSnapshot.capture(self.device)
+            self.shell_calls += 1
+        return self.snapshot
+
+    def _wait_for(self, step: Step, expect_present: bool) -> float:
+        timeout = float(step.options.get("timeout", DEFAULT_WAIT_TIMEOUT))
+        self.flush()
+        start = time.perf_counter()
+        while True:
+            self.snapshot = None
+            found = self._current_snapshot().first(step.selector) is not None
+            waited = time.perf_counter() - start
+            if found == expect_present:
+                return waited
+            if waited >= timeout:
+                state = "出现" if expect_present else "消失"
+                raise StepFailure(f"第{step.line}行: 等待 {describe_selector(step.selector)} {state}超时（{timeout}秒）")
+            time.sleep(WAIT_POLL_INTERVAL)
+
+    # 执行
+    def execute(self, step: Step):
+        op = step.op
+        if op == "repeat":
+            for _ in range(step.args[0]):
+                for child in step.body:
+                    self.execute(child)
+            return
+
+        self.step_count += 1
+        if op == "tap":
+            x, y = step.args
+            self._queue(f"点击 ({x}, {y})", f"input tap {x} {y}")
+        elif op == "swipe":
+            x1, y1, x2, y2, duration = step.args
+            self._queue(f"滑动 ({x1}, {y1}) 到 ({x2}, {y2})", f"input swipe {x1} {y1} {x2} {y2} {duration}")
+        elif op == "text":
+            command = _text_command(step.args[0])
+            if command is not None:
+                self._queue(f"输入文本: {step.args[0]}", command)
+            else:
+                self._enter_long_text(step)
+        elif op == "wait":
+            self._queue(f"等待 {step.args[0]} 秒", f"sleep {step.args[0]}", kind="sleep")
+        elif op == "press":
+            self._queue(f"按下按键 {step.args[0]}", str(step.args[0]), kind="key")
+        elif op == "home":
+            self._queue("按下Home键", "3", kind="key")
+        elif op == "back":
+            self._queue("按下返回键", "4", kind="key")
+        elif op == "tap_selector":
+            start = time.perf_counter()
+            snapshot_cached = self.snapshot is not None
+            node = self._current_snapshot().first(step.selector)
+            if node is None:
+                raise StepFailure(f"第{step.line}行: 未找到元素 {describe_selector(step.selector)}")
+            x, y = node.center
+            resolve_ms = (time.perf_counter() - start) * 1000
+            source = "缓存快照" if snapshot_cached else "新快照"
+            self._queue(f"点击 {describe_selector(step.selector)} -> ({x}, {y}) [定位 {resolve_ms:.0f}ms, {source}]",
+                        f"input tap {x} {y}")
+        elif op in ("wait_for", "wait_gone"):
+            waited = self._wait_for(step, expect_present=(op == "wait_for"))
+            state = "出现" if op == "wait_for" else "消失"
+            self.results.append(f"等待 {describe_selector(step.selector)} {state}  [{waited * 1000:.0f}ms]")
+        elif op == "assert_exists":
+            start = time.perf_counter()
+            node = self._current_snapshot().first(step.selector)
+            if node is None:
+                raise StepFailure(f"第{step.line}行: 断言失败，未找到 {describe_selector(step.selector)}")
+            self.results.append(f"断言存在 {describe_selector(step.selector)}  [{(time.perf_counter() - start) * 1000:.0f}ms]")
+        else:
+            self.step_count -= 1
+            self.results.append(f"未识别的命令: {step.source}")
+
+    def run(self, steps: List[Step]) -> str:
+        start = time.perf_counter()
+        status = "成功"
+        try:
+            for step in steps:
+                self.execute(step)
+            self.flush()
+        except StepFailure as e:
+            # 失败前已排队的输入仍然需要执行，保证设备状态与报告一致
+            self.flush()
+            status = f"失败: {e}"
+        total_ms = (time.perf_counter() - start) * 1000
+        summary = (f"状态: {status}\n共执行 {self.step_count} 步, {self.shell_calls} 次设备调用, "
+                   f"{self.batch_count} 个批次, 总耗时 {total_ms:.0f}ms")
+        return "执行结果:\n" + "\n".join(self.results) + "\n\n" + summary